@@ -5,11 +5,11 @@ from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.responses import HTMLResponse, Response, JSONResponse, StreamingResponse, FileResponse
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from starlette.responses import RedirectResponse
-from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, setup_json_logging
+from starlette.background import BackgroundTask
+from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, setup_json_logging, create_service_engine, pool_stats
 from pydantic import BaseModel
 from .events import emit_event
 from sqlalchemy import (
-    create_engine as _sa_create_engine,
     String as _sa_String,
     Integer as _sa_Integer,
     Boolean as _sa_Boolean,
@@ -730,6 +730,16 @@ def admin_stats(request: Request, limit: int = 200):
     }
 
 
+@app.get("/admin/db_pools", response_class=JSONResponse)
+def admin_db_pools(request: Request):
+    """
+    Connection pool stats (size, checked out, wait histogram) for the BFF's
+    own database engines. Kept off /health, which is unauthenticated.
+    """
+    _require_admin_v2(request)
+    return {"db_pools": pool_stats()}
+
+
 @app.get("/admin/finance_stats", response_class=JSONResponse)
 def admin_finance_stats(request: Request, from_iso: str | None = None, to_iso: str | None = None):
     """
@@ -4376,6 +4386,8 @@ try:
         list_groups as _chat_list_groups,
         send_group_message as _chat_send_group_message,
         group_inbox as _chat_group_inbox,
+        upload_blob as _chat_upload_blob,
+        get_blob as _chat_get_blob,
         group_members as _chat_group_members,
         invite_members as _chat_invite_members,
         leave_group as _chat_leave_group,
@@ -5046,6 +5058,83 @@ def chat_group_inbox(group_id: str, device_id: str, request: Request, since_iso:
         raise HTTPException(status_code=502, detail=str(e))
 
 
+@app.post("/chat/blobs/upload")
+async def chat_blob_upload(device_id: str, req: Request, mime: str = ""):
+    body = await req.body()
+    try:
+        _rate_limit_chat_edge(
+            req,
+            device_id=device_id or None,
+            scope="chat_blob_upload",
+            device_max=CHAT_SEND_MAX_PER_DEVICE,
+            ip_max=CHAT_SEND_MAX_PER_IP,
+        )
+    except HTTPException:
+        raise
+    except Exception:
+        pass
+    try:
+        if _use_chat_internal():
+            if not _CHAT_INTERNAL_AVAILABLE:
+                raise HTTPException(status_code=500, detail="chat internal not available")
+            with _chat_internal_session() as s:
+                return _chat_upload_blob(request=req, device_id=device_id, mime=mime or None, data=body, s=s)  # type: ignore[arg-type]
+        params = {"device_id": device_id}
+        if mime:
+            params["mime"] = mime
+        r = httpx.post(
+            _chat_url("/blobs/upload"),
+            params=params,
+            content=body,
+            headers={**_chat_auth_headers_from_request(req), "Content-Type": "application/octet-stream"},
+            timeout=30,
+        )
+        return r.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+@app.get("/chat/blobs/{blob_id}")
+def chat_blob_get(blob_id: str, device_id: str, request: Request):
+    if _use_chat_internal():
+        if not _CHAT_INTERNAL_AVAILABLE:
+            raise HTTPException(status_code=500, detail="chat internal not available")
+        with _chat_internal_session() as s:
+            return _chat_get_blob(blob_id=blob_id, request=request, device_id=device_id, s=s)  # type: ignore[arg-type]
+    headers = _chat_auth_headers_from_request(request)
+    rng = request.headers.get("range")
+    if rng:
+        headers["Range"] = rng
+    client = _httpx_client()
+    try:
+        r = client.send(
+            client.build_request(
+                "GET",
+                _chat_url(f"/blobs/{blob_id}"),
+                headers=headers,
+                params={"device_id": device_id},
+                timeout=30,
+            ),
+            stream=True,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if r.status_code >= 400:
+        try:
+            detail = r.read().decode(errors="replace")
+        finally:
+            r.close()
+        raise HTTPException(status_code=r.status_code, detail=detail)
+    # Pass range/caching headers through so clients can resume and cache
+    out = {k: r.headers[k] for k in ("content-length", "content-range", "accept-ranges", "etag", "cache-control") if k in r.headers}
+    media = r.headers.get("content-type", "application/octet-stream")
+    return StreamingResponse(r.iter_raw(), status_code=r.status_code, media_type=media, headers=out, background=BackgroundTask(r.close))
+
+
 @app.get("/chat/groups/{group_id}/members")
 def chat_group_members(group_id: str, device_id: str, request: Request):
     params = {"device_id": device_id}
@@ -5414,6 +5503,8 @@ async def chat_groups_ws(ws: WebSocket):
                                         "box_b64": getattr(m, "box_b64", None),
                                         "attachment_b64": getattr(m, "attachment_b64", None),
                                         "attachment_mime": getattr(m, "attachment_mime", None),
+                                        "attachment_id": getattr(m, "attachment_id", None),
+                                        "attachment_size": getattr(m, "attachment_size", None),
                                         "voice_secs": getattr(m, "voice_secs", None),
                                         "created_at": getattr(m, "created_at", None),
                                         "expire_at": getattr(m, "expire_at", None),
@@ -5677,6 +5768,7 @@ try:
         # Risk/admin
         fees_summary as _pay_fees_summary,
         admin_txns_count as _pay_admin_txns_count,
+        admin_txns_export_by_merchant as _pay_admin_txns_export_by_merchant,
         admin_risk_deny_add as _pay_admin_risk_deny_add,
         admin_risk_deny_remove as _pay_admin_risk_deny_remove,
         admin_risk_deny_list as _pay_admin_risk_deny_list,
@@ -11002,31 +11094,58 @@ def payments_admin_risk_metrics(request: Request, minutes: int = 5, top: int = 1
 
 # ---- Payments merchant export proxy ----
 @app.get("/payments/admin/export/merchant")
-def payments_admin_export_merchant(request: Request, merchant: str, from_iso: str = "", to_iso: str = ""):
+def payments_admin_export_merchant(request: Request, merchant: str, from_iso: str = "", to_iso: str = "", cursor: str = "", fmt: str = "csv"):
     _require_admin_v2(request)
     if not PAYMENTS_INTERNAL_SECRET:
         raise HTTPException(status_code=403, detail="Server not configured for admin export")
     headers = {"X-Internal-Secret": PAYMENTS_INTERNAL_SECRET}
-    params = {"merchant": merchant}
+    params = {"merchant": merchant, "fmt": fmt}
     if from_iso:
         params["from_iso"] = from_iso
     if to_iso:
         params["to_iso"] = to_iso
+    if cursor:
+        params["cursor"] = cursor
+    _audit_from_request(request, "export_merchant_txns", merchant=merchant, from_iso=from_iso or None, to_iso=to_iso or None)
+    if _use_pay_internal():
+        if not _PAY_INTERNAL_AVAILABLE:
+            raise HTTPException(status_code=500, detail="payments internal not available")
+        # The export pages through its own short sessions; this one only
+        # supplies the engine binding.
+        with _pay_internal_session() as s:
+            return _pay_admin_txns_export_by_merchant(
+                merchant=merchant,
+                from_iso=from_iso or None,
+                to_iso=to_iso or None,
+                cursor=cursor or None,
+                fmt=fmt,
+                s=s,
+                admin_ok=True,
+            )
+    client = _httpx_client()
     try:
-        _audit_from_request(request, "export_merchant_txns", merchant=merchant, from_iso=from_iso or None, to_iso=to_iso or None)
-        with httpx.stream(
-            "GET",
-            _payments_url("/admin/txns/export_by_merchant"),
-            headers=_payments_headers(headers),
-            params=params,
-            timeout=None,
-        ) as r:
-            disp = r.headers.get("content-disposition", f"attachment; filename=txns_{merchant}.csv")
-            return StreamingResponse(r.iter_bytes(), media_type="text/csv", headers={"Content-Disposition": disp})
-    except httpx.HTTPStatusError as e:
-        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+        r = client.send(
+            client.build_request(
+                "GET",
+                _payments_url("/admin/txns/export_by_merchant"),
+                headers=_payments_headers(headers),
+                params=params,
+                timeout=None,
+            ),
+            stream=True,
+        )
     except Exception as e:
         raise HTTPException(status_code=502, detail=str(e))
+    if r.status_code >= 400:
+        try:
+            detail = r.read().decode(errors="replace")
+        finally:
+            r.close()
+        raise HTTPException(status_code=r.status_code, detail=detail)
+    disp = r.headers.get("content-disposition", f"attachment; filename=txns_{merchant}.{fmt}")
+    media = r.headers.get("content-type", "text/csv")
+    # Keep the upstream response open until the client has consumed the stream
+    return StreamingResponse(r.iter_bytes(), media_type=media, headers={"Content-Disposition": disp}, background=BackgroundTask(r.close))
 
 
 @app.get("/payments/admin/risk/events")
@@ -11327,7 +11446,7 @@ class MomentTagDB(_MomentsBase):
     )
 
 
-_moments_engine = _sa_create_engine(_MOMENTS_DB_URL, future=True)
+_moments_engine = create_service_engine(_MOMENTS_DB_URL, name="moments")
 _moments_inited = False
 
 
@@ -11632,7 +11751,7 @@ class FriendRequestDB(_FriendsBase):
     )
 
 
-_friends_engine = _sa_create_engine(FRIENDS_DB_URL, future=True)
+_friends_engine = create_service_engine(FRIENDS_DB_URL, name="friends")
 _friends_inited = False
 
 
@@ -11822,7 +11941,7 @@ class NearbyPresenceDB(_NearbyBase):
     )
 
 
-_nearby_engine = _sa_create_engine(NEARBY_DB_URL, future=True)
+_nearby_engine = create_service_engine(NEARBY_DB_URL, name="nearby")
 _nearby_inited = False
 
 
@@ -11936,7 +12055,7 @@ class StickerPurchaseDB(_StickersBase):
     )
 
 
-_stickers_engine = _sa_create_engine(STICKERS_DB_URL, future=True)
+_stickers_engine = create_service_engine(STICKERS_DB_URL, name="stickers")
 
 
 def _stickers_session() -> _sa_Session:
@@ -15567,7 +15686,7 @@ class CallDB(_OfficialBase):
     )
 
 
-_officials_engine = _sa_create_engine(_OFFICIALS_DB_URL, future=True)
+_officials_engine = create_service_engine(_OFFICIALS_DB_URL, name="officials")
 _officials_inited = False
 
 
@@ -3,9 +3,9 @@ from pydantic import BaseModel, Field, ConfigDict
 from typing import Optional, List
 import os
 import re
-from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, setup_json_logging
+from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, add_pool_stats_route, setup_json_logging, create_service_engine
 from starlette.middleware.trustedhost import TrustedHostMiddleware
-from sqlalchemy import create_engine, String, Integer, BigInteger, DateTime, ForeignKey, func, select, text, inspect
+from sqlalchemy import String, Integer, BigInteger, DateTime, ForeignKey, func, select, text, inspect
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, Session
 from datetime import datetime, timezone, timedelta
 import uuid
@@ -204,10 +204,7 @@ class Idempotency(Base):
     created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
-if DB_URL.startswith("sqlite"):
-    engine = create_engine(DB_URL, pool_pre_ping=True, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DB_URL, pool_pre_ping=True)
+engine = create_service_engine(DB_URL, name="bus")
 
 
 def get_session():
@@ -273,6 +270,7 @@ def _require_internal_secret(request: Request) -> None:
 
 
 router = APIRouter(dependencies=[Depends(_require_internal_secret)])
+add_pool_stats_route(router)
 
 
 def _ensure_trips_status_column() -> None:
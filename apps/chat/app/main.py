@@ -1,21 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, APIRouter
+from fastapi import FastAPI, HTTPException, Depends, Request, APIRouter, Body
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List
 import os, time, json, threading, logging
+import asyncio
 import base64
+import binascii
 import hashlib
 import hmac
 import httpx
 import secrets
 import re
-from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, setup_json_logging
+from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, add_pool_stats_route, setup_json_logging, create_service_engine
+from shamell_shared import schema_is_current, stamp_schema_version, add_missing_columns
 from starlette.middleware.trustedhost import TrustedHostMiddleware
-from sqlalchemy import create_engine, String, Integer, DateTime, Boolean, ForeignKey, func, select, or_, text
+from sqlalchemy import String, Integer, DateTime, Boolean, ForeignKey, func, select, update, or_, and_, Index
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone, timedelta
 import uuid
-from typing import Set
+from collections import OrderedDict, deque
+from typing import Dict, Iterator, Set
 
 
 def _env_or(key: str, default: str) -> str:
@@ -58,6 +63,46 @@ INTERNAL_API_SECRET = os.getenv("INTERNAL_API_SECRET") or os.getenv("CHAT_INTERN
 FCM_SERVER_KEY = os.getenv("FCM_SERVER_KEY", "")
 FCM_ENDPOINT = "https://fcm.googleapis.com/fcm/send"
 PURGE_INTERVAL_SECONDS = int(os.getenv("CHAT_PURGE_INTERVAL_SECONDS", "600"))
+# /messages/stream wakeups: "local" (in-process only), "pg" (LISTEN/NOTIFY
+# across workers) or "auto" (pg when the database is Postgres)
+CHAT_STREAM_TRANSPORT = _env_or("CHAT_STREAM_TRANSPORT", "auto").strip().lower()
+CHAT_STREAM_CHANNEL = _env_or("CHAT_STREAM_CHANNEL", "chat_stream")
+CHAT_STREAM_KEEPALIVE_SECS = float(_env_or("CHAT_STREAM_KEEPALIVE_SECS", "15"))
+CHAT_STREAM_QUEUE_MAX = int(_env_or("CHAT_STREAM_QUEUE_MAX", "1000"))  # pending ids per subscriber
+# Push outbox worker (FCM)
+CHAT_PUSH_BATCH = int(_env_or("CHAT_PUSH_BATCH", "200"))  # jobs claimed per round
+CHAT_PUSH_CONCURRENCY = int(_env_or("CHAT_PUSH_CONCURRENCY", "20"))  # in-flight FCM requests
+CHAT_PUSH_MAX_ATTEMPTS = int(_env_or("CHAT_PUSH_MAX_ATTEMPTS", "5"))
+CHAT_PUSH_BACKOFF_SECS = float(_env_or("CHAT_PUSH_BACKOFF_SECS", "5"))  # doubled per attempt
+CHAT_PUSH_BACKOFF_MAX_SECS = float(_env_or("CHAT_PUSH_BACKOFF_MAX_SECS", "600"))
+CHAT_PUSH_LEASE_SECS = float(_env_or("CHAT_PUSH_LEASE_SECS", "60"))
+CHAT_PUSH_POLL_SECS = float(_env_or("CHAT_PUSH_POLL_SECS", "2"))
+CHAT_PUSH_RETENTION_DAYS = int(_env_or("CHAT_PUSH_RETENTION_DAYS", "7"))  # failed jobs
+CHAT_FANOUT_CACHE_MAX = int(_env_or("CHAT_FANOUT_CACHE_MAX", "2000"))  # cached group snapshots
+# Attachment blobs (content-addressed, outside the message rows)
+CHAT_BLOB_BACKEND = _env_or("CHAT_BLOB_BACKEND", "local").strip().lower()
+
+
+def _default_blob_dir() -> str:
+    # Next to the SQLite file, i.e. on the data volume; server databases
+    # have no local data dir, so CHAT_BLOB_DIR must be set explicitly
+    if DB_URL.startswith("sqlite") and ":memory:" not in DB_URL:
+        path = DB_URL.split(":///", 1)[-1]
+        if path:
+            return os.path.join(os.path.dirname(path) or ".", "chat-blobs")
+    return ""
+
+
+# Must be durable, and shared by every chat replica
+CHAT_BLOB_DIR = _env_or("CHAT_BLOB_DIR", _default_blob_dir())
+CHAT_BLOB_MAX_BYTES = int(_env_or("CHAT_BLOB_MAX_BYTES", str(10 * 1024 * 1024)))
+CHAT_BLOB_GRACE_SECS = int(_env_or("CHAT_BLOB_GRACE_SECS", "86400"))  # unreferenced uploads kept this long
+# Also return attachments inline (attachment_b64, read from the blob store)
+# until all clients fetch them via GET /blobs/{attachment_id}
+CHAT_INLINE_ATTACHMENTS = _env_or("CHAT_INLINE_ATTACHMENTS", "true").lower() == "true"
+# The backfill copies legacy attachment_b64 into the store and keeps it;
+# set this once CHAT_BLOB_DIR is known to be durable to drop the copies
+CHAT_BLOB_CLEAR_INLINE = _env_or("CHAT_BLOB_CLEAR_INLINE", "false").lower() == "true"
 logger = logging.getLogger("chat")
 _CHAT_AUTH_DEFAULT = "true" if _ENV_LOWER in ("prod", "production", "staging") else "false"
 CHAT_ENFORCE_DEVICE_AUTH = _env_or("CHAT_ENFORCE_DEVICE_AUTH", _CHAT_AUTH_DEFAULT).lower() == "true"
@@ -90,6 +135,7 @@ def _require_internal_secret(request: Request) -> None:
 
 
 router = APIRouter(dependencies=[Depends(_require_internal_secret)])
+add_pool_stats_route(router)
 
 
 class Base(DeclarativeBase):
@@ -116,7 +162,10 @@ class DeviceAuth(Base):
 
 class Message(Base):
     __tablename__ = "messages"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ux_messages_send_key", "send_key", unique=True),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     sender_id: Mapped[str] = mapped_column(String(12))
     recipient_id: Mapped[str] = mapped_column(String(12))
@@ -132,6 +181,8 @@ class Message(Base):
     sender_hint: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     prev_key_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     key_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # sha256 of (sender, recipient, idempotency key or nonce); see _send_key
+    send_key: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
 
 class Group(Base):
@@ -143,6 +194,8 @@ class Group(Base):
     key_version: Mapped[Optional[int]] = mapped_column(Integer, default=0)
     avatar_b64: Mapped[Optional[str]] = mapped_column(String(65535), nullable=True)
     avatar_mime: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    # Bumped by membership, group mute, block/hidden and push token changes
+    fanout_version: Mapped[Optional[int]] = mapped_column(Integer, default=0)
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
@@ -166,13 +219,32 @@ class GroupMessage(Base):
     kind: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
     nonce_b64: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     box_b64: Mapped[Optional[str]] = mapped_column(String(65535), nullable=True)
-    attachment_b64: Mapped[Optional[str]] = mapped_column(String(65535), nullable=True)
+    attachment_b64: Mapped[Optional[str]] = mapped_column(String(65535), nullable=True)  # legacy, inline
     attachment_mime: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    attachment_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True, index=True)  # sha256 of the blob
+    attachment_size: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     voice_secs: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
     expire_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
 
 
+class ChatBlob(Base):
+    __tablename__ = "chat_blobs"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    id: Mapped[str] = mapped_column(String(64), primary_key=True)  # sha256 hex of the content
+    size: Mapped[int] = mapped_column(Integer)
+    mime: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class ChatBlobOwner(Base):
+    """Devices that supplied a blob's bytes and may therefore attach it by id."""
+    __tablename__ = "chat_blob_owners"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    blob_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    device_id: Mapped[str] = mapped_column(String(24), primary_key=True)
+
+
 class GroupKeyEvent(Base):
     __tablename__ = "group_key_events"
     __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
@@ -206,6 +278,26 @@ class PushToken(Base):
     last_seen_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
+class PushOutbox(Base):
+    __tablename__ = "push_outbox"
+    __table_args__ = (
+        Index("ix_push_outbox_due", "status", "next_attempt_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    message_id: Mapped[str] = mapped_column(String(36))
+    recipient_id: Mapped[Optional[str]] = mapped_column(String(24), nullable=True)  # direct message
+    group_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)  # group message
+    sender_id: Mapped[Optional[str]] = mapped_column(String(24), nullable=True)
+    status: Mapped[str] = mapped_column(String(16), default="pending")  # pending|sending|failed
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # JSON list of the tokens still owed this push; NULL = all resolved targets
+    retry_tokens: Mapped[Optional[str]] = mapped_column(String(65535), nullable=True)
+    created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
 class ContactRule(Base):
     __tablename__ = "contact_rules"
     __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
@@ -233,7 +325,7 @@ class GroupPrefs(Base):
     updated_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 
-engine = create_engine(DB_URL, future=True)
+engine = create_service_engine(DB_URL, name="chat")
 
 
 def get_session() -> Session:
@@ -241,77 +333,150 @@ def get_session() -> Session:
         yield s
 
 
-def _startup():
+# Bump whenever a column/index is added to _SCHEMA_COLUMNS (or a new table)
+CHAT_SCHEMA_VERSION = 7
+# Columns added after the first release; create_all does not alter tables
+_SCHEMA_COLUMNS = [
+    ("contact_rules", "muted", "BOOLEAN DEFAULT FALSE"),
+    ("contact_rules", "starred", "BOOLEAN DEFAULT FALSE"),
+    ("contact_rules", "pinned", "BOOLEAN DEFAULT FALSE"),
+    ("group_messages", "kind", "VARCHAR(20)"),
+    ("group_messages", "nonce_b64", "VARCHAR(64)"),
+    ("group_messages", "box_b64", "VARCHAR(65535)"),
+    ("group_messages", "attachment_b64", "VARCHAR(65535)"),
+    ("group_messages", "attachment_mime", "VARCHAR(64)"),
+    ("group_messages", "voice_secs", "INTEGER"),
+    ("groups", "key_version", "INTEGER DEFAULT 0"),
+    ("groups", "avatar_b64", "VARCHAR(65535)"),
+    ("groups", "avatar_mime", "VARCHAR(64)"),
+    ("groups", "fanout_version", "INTEGER DEFAULT 0"),
+    ("devices", "key_version", "INTEGER DEFAULT 0"),
+    ("messages", "send_key", "VARCHAR(64)"),
+    ("group_messages", "attachment_id", "VARCHAR(64)"),
+    ("group_messages", "attachment_size", "INTEGER"),
+    ("push_outbox", "retry_tokens", "VARCHAR(65535)"),
+]
+_SCHEMA_INDEXES = [
+    ("group_messages", "ix_group_messages_attachment_id", "attachment_id"),
+]
+
+
+def _prepare_schema():
     Base.metadata.create_all(engine)
-    # best-effort schema migration for new ContactRule fields
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE contact_rules ADD COLUMN muted BOOLEAN DEFAULT 0"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE contact_rules ADD COLUMN starred BOOLEAN DEFAULT 0"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE contact_rules ADD COLUMN pinned BOOLEAN DEFAULT 0"))
-    except Exception:
-        pass
-    # best-effort schema migration for group message extensions
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE group_messages ADD COLUMN kind VARCHAR(20)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE groups ADD COLUMN key_version INTEGER DEFAULT 0"))
-    except Exception:
-        pass
-    # best-effort schema migration for device key rotations
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE devices ADD COLUMN key_version INTEGER DEFAULT 0"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE groups ADD COLUMN avatar_b64 VARCHAR(65535)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE groups ADD COLUMN avatar_mime VARCHAR(64)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE group_messages ADD COLUMN nonce_b64 VARCHAR(64)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE group_messages ADD COLUMN box_b64 VARCHAR(65535)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE group_messages ADD COLUMN attachment_b64 VARCHAR(65535)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE group_messages ADD COLUMN attachment_mime VARCHAR(64)"))
-    except Exception:
-        pass
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("ALTER TABLE group_messages ADD COLUMN voice_secs INTEGER"))
-    except Exception:
-        pass
+    add_missing_columns(engine, _SCHEMA_COLUMNS, _SCHEMA_INDEXES, schema=DB_SCHEMA)
+    _backfill_send_keys()
+    _backfill_attachment_blobs()
+    # Unique index only after the backfill so legacy duplicates cannot block it
+    for ix in Message.__table__.indexes:
+        ix.create(engine, checkfirst=True)
+    stamp_schema_version(engine, "chat", CHAT_SCHEMA_VERSION, DB_SCHEMA)
+
+
+def _backfill_send_keys(batch: int = 1000) -> int:
+    """
+    Fill messages.send_key for rows written before the column existed.
+
+    Walks the table by id; of several legacy rows with the same key only
+    the first one gets it, the rest stay NULL (and are never deduplicated).
+    """
+    n = 0
+    last = ""
+    while True:
+        with Session(engine) as s:
+            rows = s.execute(
+                select(Message.id, Message.sender_id, Message.recipient_id, Message.nonce_b64, Message.send_key)
+                .where(Message.id > last)
+                .order_by(Message.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                return n
+            last = rows[-1][0]
+            todo = {}
+            for mid, sender, recipient, nonce, key in rows:
+                if key is None:
+                    todo.setdefault(_send_key(sender, recipient, None, nonce), mid)
+            if todo:
+                taken = {r[0] for r in s.execute(select(Message.send_key).where(Message.send_key.in_(list(todo))))}
+                for key, mid in todo.items():
+                    if key not in taken:
+                        s.execute(update(Message).where(Message.id == mid).values(send_key=key))
+                        n += 1
+                s.commit()
+
+
+def _backfill_attachment_blobs(batch: int = 200) -> int:
+    """
+    Copy inline group attachments (attachment_b64) into the blob store.
+
+    attachment_b64 is kept, so nothing is lost if the store turns out not
+    to be durable; _clear_inline_attachments drops it later.
+    """
+    n = 0
+    last = ""
+    while True:
+        with Session(engine) as s:
+            rows = s.execute(
+                select(GroupMessage.id, GroupMessage.sender_id, GroupMessage.attachment_b64, GroupMessage.attachment_mime)
+                .where(GroupMessage.id > last, GroupMessage.attachment_b64 != None, GroupMessage.attachment_id == None)  # type: ignore[comparison-overlap]
+                .order_by(GroupMessage.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                return n
+            last = rows[-1][0]
+            for mid, sender, att_b64, mime in rows:
+                try:
+                    data = base64.b64decode(att_b64, validate=True)
+                except (binascii.Error, ValueError):
+                    continue  # not base64: leave the row as it is
+                blob = _store_blob(s, data, mime, owner_id=sender)
+                s.execute(
+                    update(GroupMessage)
+                    .where(GroupMessage.id == mid)
+                    .values(attachment_id=blob.id, attachment_size=blob.size)
+                )
+                n += 1
+            s.commit()
+
+
+def _clear_inline_attachments(batch: int = 200) -> int:
+    """
+    Drop attachment_b64 from backfilled rows whose blob is in the store
+    (CHAT_BLOB_CLEAR_INLINE). Rows with a missing blob keep their copy.
+    """
+    store = _blob_store()
+    n = 0
+    last = ""
+    while True:
+        with Session(engine) as s:
+            rows = s.execute(
+                select(GroupMessage.id, GroupMessage.attachment_id)
+                .where(GroupMessage.id > last, GroupMessage.attachment_b64 != None, GroupMessage.attachment_id != None)  # type: ignore[comparison-overlap]
+                .order_by(GroupMessage.id)
+                .limit(batch)
+            ).all()
+            if not rows:
+                return n
+            last = rows[-1][0]
+            done = [mid for mid, blob_id in rows if store.head(blob_id) is not None]
+            if done:
+                s.execute(update(GroupMessage).where(GroupMessage.id.in_(done)).values(attachment_b64=None))
+                n += len(done)
+            s.commit()
+
+
+def _startup():
+    # Fail fast on a misconfigured blob store, before any row points at it
+    _blob_store()
+    # A stamped, current schema needs no DDL at all
+    if not schema_is_current(engine, "chat", CHAT_SCHEMA_VERSION, DB_SCHEMA):
+        _prepare_schema()
+    if CHAT_BLOB_CLEAR_INLINE:
+        _clear_inline_attachments()
     _start_purge_thread()
+    _stream_hub.start()
+    _start_push_worker()
 
 app.router.on_startup.append(_startup)
 
@@ -551,6 +716,7 @@ class GroupSendReq(BaseModel):
     nonce_b64: Optional[str] = Field(default=None, max_length=64)
     box_b64: Optional[str] = Field(default=None, max_length=65535)
     attachment_b64: Optional[str] = Field(default=None, max_length=65535)
+    attachment_id: Optional[str] = Field(default=None, min_length=64, max_length=64)  # from /blobs/upload
     attachment_mime: Optional[str] = Field(default=None, max_length=64)
     voice_secs: Optional[int] = Field(default=None, ge=1, le=120)
     expire_after_seconds: Optional[int] = Field(default=None, ge=10, le=7 * 24 * 3600)
@@ -566,11 +732,19 @@ class GroupMsgOut(BaseModel):
     box_b64: Optional[str] = None
     attachment_b64: Optional[str] = None
     attachment_mime: Optional[str] = None
+    attachment_id: Optional[str] = None  # bytes via GET /blobs/{attachment_id}
+    attachment_size: Optional[int] = None
     voice_secs: Optional[int] = None
     created_at: Optional[str] = None
     expire_at: Optional[str] = None
 
 
+class BlobOut(BaseModel):
+    blob_id: str
+    size: int
+    mime: Optional[str] = None
+
+
 class GroupInviteReq(BaseModel):
     inviter_id: str = Field(min_length=4, max_length=24)
     member_ids: List[str] = Field(min_length=1, max_length=128)
@@ -619,10 +793,11 @@ def send_message(request: Request, req: SendReq, s: Session = Depends(get_sessio
         raise HTTPException(status_code=404, detail="unknown device")
     if _is_blocked(s, device_id=req.recipient_id, peer_id=req.sender_id):
         raise HTTPException(status_code=403, detail="blocked by recipient")
-    # naive idempotency: check if identical ciphertext exists recently
-    existed = s.execute(select(Message).where(Message.sender_id == req.sender_id, Message.recipient_id == req.recipient_id, Message.nonce_b64 == req.nonce_b64, Message.box_b64 == req.box_b64).limit(1)).scalars().first()
+    # Retries carry the same idempotency key (or nonce): one unique index probe
+    send_key = _send_key(req.sender_id, req.recipient_id, req.idempotency_key, req.nonce_b64)
+    existed = s.execute(select(Message).where(Message.send_key == send_key)).scalars().first()
     if existed:
-        return MsgOut(id=existed.id, sender_id=existed.sender_id, recipient_id=existed.recipient_id, sender_pubkey_b64=existed.sender_pubkey, nonce_b64=existed.nonce_b64, box_b64=existed.box_b64, created_at=existed.created_at.isoformat() if existed.created_at else None, delivered_at=existed.delivered_at.isoformat() if existed.delivered_at else None, read_at=existed.read_at.isoformat() if existed.read_at else None, expire_at=existed.expire_at.isoformat() if existed.expire_at else None)
+        return _replayed_msg_out(existed)
     mid = str(uuid.uuid4())
     exp_at = None
     if req.expire_after_seconds:
@@ -632,8 +807,20 @@ def send_message(request: Request, req: SendReq, s: Session = Depends(get_sessio
             exp_at = None
     hint = (req.sender_hint or req.sender_fingerprint) if req.sealed_sender else None
     sender_fp = req.sender_fingerprint if req.sealed_sender else None
-    m = Message(id=mid, sender_id=req.sender_id, recipient_id=req.recipient_id, sender_pubkey=req.sender_pubkey_b64, sender_dh_pub=req.sender_dh_pub_b64, nonce_b64=req.nonce_b64, box_b64=req.box_b64, expire_at=exp_at, sealed_sender=req.sealed_sender, sender_hint=hint, key_id=req.key_id, prev_key_id=req.prev_key_id)
-    s.add(m); s.commit(); s.refresh(m)
+    m = Message(id=mid, sender_id=req.sender_id, recipient_id=req.recipient_id, sender_pubkey=req.sender_pubkey_b64, sender_dh_pub=req.sender_dh_pub_b64, nonce_b64=req.nonce_b64, box_b64=req.box_b64, expire_at=exp_at, sealed_sender=req.sealed_sender, sender_hint=hint, key_id=req.key_id, prev_key_id=req.prev_key_id, send_key=send_key)
+    s.add(m)
+    _stream_hub.notify(s, [req.recipient_id], mid)
+    try:
+        s.commit()
+    except IntegrityError:
+        # A concurrent retry won the insert: answer with its message
+        s.rollback()
+        existed = s.execute(select(Message).where(Message.send_key == send_key)).scalars().first()
+        if existed is None:
+            raise
+        return _replayed_msg_out(existed)
+    s.refresh(m)
+    _stream_hub.publish([req.recipient_id], mid)
     _notify_recipient(recipient_id=req.recipient_id, message_id=mid, s=s)
     return MsgOut(id=m.id, sender_id=None if m.sealed_sender else m.sender_id, recipient_id=m.recipient_id, sender_pubkey_b64=None if m.sealed_sender else m.sender_pubkey, sender_dh_pub_b64=None if m.sealed_sender else m.sender_dh_pub, nonce_b64=m.nonce_b64, box_b64=m.box_b64, created_at=m.created_at.isoformat() if m.created_at else None, delivered_at=m.delivered_at.isoformat() if m.delivered_at else None, read_at=m.read_at.isoformat() if m.read_at else None, expire_at=m.expire_at.isoformat() if m.expire_at else None, sealed_sender=m.sealed_sender, sender_hint=m.sender_hint or sender_fp, sender_fingerprint=sender_fp or m.sender_hint, key_id=m.key_id, prev_key_id=m.prev_key_id)
 
@@ -847,18 +1034,34 @@ def send_group_message(group_id: str, request: Request, req: GroupSendReq, s: Se
     kind = (req.kind or "").strip().lower() or None
     text_val = (req.text or "").strip()
     att_b64 = (req.attachment_b64 or "").strip() or None
+    att_id = (req.attachment_id or "").strip().lower() or None
     att_mime = (req.attachment_mime or "").strip() or None
     voice_secs = req.voice_secs
     if sealed:
         kind = "sealed"
         text_val = ""
         att_b64 = None
+        att_id = None
         att_mime = None
         voice_secs = None
-    if not sealed and not text_val and not att_b64 and not kind:
+    # Attachments live in the blob store; the row keeps id and size only
+    blob: Optional[ChatBlob] = None
+    if att_b64:
+        try:
+            data = base64.b64decode(att_b64, validate=True)
+        except (binascii.Error, ValueError):
+            raise HTTPException(status_code=400, detail="invalid attachment")
+        blob = _store_blob(s, data, att_mime, owner_id=sender_id)
+    elif att_id:
+        # Knowing a hash is not enough: the sender must have uploaded or be able to read it
+        blob = s.get(ChatBlob, att_id) if _can_read_blob(s, att_id, sender_id) else None
+        if blob is None:
+            raise HTTPException(status_code=404, detail="unknown attachment")
+        att_mime = att_mime or blob.mime
+    if not sealed and not text_val and blob is None and not kind:
         raise HTTPException(status_code=400, detail="empty message")
     if kind == "voice":
-        if not att_b64:
+        if blob is None:
             raise HTTPException(status_code=400, detail="missing voice attachment")
         if voice_secs is None:
             voice_secs = 1
@@ -876,16 +1079,24 @@ def send_group_message(group_id: str, request: Request, req: GroupSendReq, s: Se
         kind=kind,
         nonce_b64=nonce_val,
         box_b64=box_val,
-        attachment_b64=att_b64,
         attachment_mime=att_mime,
+        attachment_id=blob.id if blob else None,
+        attachment_size=blob.size if blob else None,
         voice_secs=voice_secs,
         expire_at=exp_at,
     )
-    s.add(m); s.commit()
+    s.add(m)
+    stream_to: List[str] = []
+    if _stream_hub.pg or _stream_hub.has_subscribers():
+        _, snap = _group_fanout(s, group_id)
+        stream_to = [did for did in (snap.members if snap else []) if did != sender_id]
+        _stream_hub.notify(s, stream_to, mid, group_id=group_id)
+    s.commit()
     try:
         s.refresh(m)
     except Exception:
         pass
+    _stream_hub.publish(stream_to, mid, group_id=group_id)
     _notify_group(group_id=group_id, sender_id=sender_id, message_id=mid, s=s)
     return GroupMsgOut(
         id=m.id,
@@ -895,8 +1106,10 @@ def send_group_message(group_id: str, request: Request, req: GroupSendReq, s: Se
         kind=m.kind,
         nonce_b64=m.nonce_b64,
         box_b64=m.box_b64,
-        attachment_b64=m.attachment_b64,
+        attachment_b64=_inline_attachment(m),
         attachment_mime=m.attachment_mime,
+        attachment_id=m.attachment_id,
+        attachment_size=m.attachment_size,
         voice_secs=m.voice_secs,
         created_at=m.created_at.isoformat() if m.created_at else None,
         expire_at=m.expire_at.isoformat() if m.expire_at else None,
@@ -937,8 +1150,10 @@ def group_inbox(group_id: str, request: Request, device_id: str, since_iso: Opti
                 kind=r.kind,
                 nonce_b64=r.nonce_b64,
                 box_b64=r.box_b64,
-                attachment_b64=r.attachment_b64,
+                attachment_b64=_inline_attachment(r),
                 attachment_mime=r.attachment_mime,
+                attachment_id=r.attachment_id,
+                attachment_size=r.attachment_size,
                 voice_secs=r.voice_secs,
                 created_at=r.created_at.isoformat() if r.created_at else None,
                 expire_at=r.expire_at.isoformat() if r.expire_at else None,
@@ -947,6 +1162,60 @@ def group_inbox(group_id: str, request: Request, device_id: str, since_iso: Opti
     return out
 
 
+@router.post("/blobs/upload", response_model=BlobOut)
+def upload_blob(
+    request: Request,
+    device_id: str,
+    mime: Optional[str] = None,
+    data: bytes = Body(..., media_type="application/octet-stream"),
+    s: Session = Depends(get_session),
+):
+    did = device_id.strip()
+    _enforce_device_actor(request, s, did)
+    if not s.get(Device, did):
+        raise HTTPException(status_code=404, detail="unknown device")
+    if not data:
+        raise HTTPException(status_code=400, detail="empty blob")
+    if len(data) > CHAT_BLOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="blob too large")
+    blob = _store_blob(s, data, (mime or "").strip()[:64] or None, owner_id=did)
+    s.commit()
+    return BlobOut(blob_id=blob.id, size=blob.size, mime=blob.mime)
+
+
+@router.get("/blobs/{blob_id}")
+def get_blob(blob_id: str, request: Request, device_id: str, s: Session = Depends(get_session)):
+    did = device_id.strip()
+    _enforce_device_actor(request, s, did)
+    if not s.get(Device, did):
+        raise HTTPException(status_code=404, detail="unknown device")
+    blob_id = blob_id.strip().lower()
+    blob = s.get(ChatBlob, blob_id) if _BLOB_ID_RE.fullmatch(blob_id) else None
+    # 404 whether it is missing or not readable
+    if blob is None or not _can_read_blob(s, blob_id, did):
+        raise HTTPException(status_code=404, detail="unknown blob")
+    size = int(blob.size)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{blob.id}"',
+        "Cache-Control": "private, max-age=31536000, immutable",
+    }
+    rng = _parse_range(request.headers.get("range"), size)
+    if rng is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        start, end = rng
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        _blob_store().get(blob.id, start, end),
+        status_code=status,
+        media_type=blob.mime or "application/octet-stream",
+        headers=headers,
+    )
+
+
 @router.get("/groups/{group_id}/members", response_model=List[GroupMemberOut])
 def group_members(group_id: str, request: Request, device_id: str, s: Session = Depends(get_session)):
     did = device_id.strip()
@@ -998,6 +1267,7 @@ def invite_members(group_id: str, request: Request, req: GroupInviteReq, s: Sess
         added_ids.append(mid)
         added = True
     if added:
+        _bump_group_fanout(s, group_ids=[group_id])
         try:
             sys_mid = str(uuid.uuid4())
             ev = {"event": "invite", "actor_id": inviter_id, "member_ids": added_ids}
@@ -1044,6 +1314,7 @@ def leave_group(group_id: str, request: Request, req: GroupLeaveReq, s: Session
     if not _is_group_member(s, group_id, did):
         raise HTTPException(status_code=403, detail="not a member")
     s.query(GroupMember).filter(GroupMember.group_id == group_id, GroupMember.device_id == did).delete()
+    _bump_group_fanout(s, group_ids=[group_id])
     s.commit()
     remaining = s.query(GroupMember).filter(GroupMember.group_id == group_id).all()
     if not remaining:
@@ -1282,53 +1553,13 @@ def inbox(request: Request, device_id: str, since_iso: Optional[str] = None, lim
 
 
 @router.get("/messages/stream")
-def stream(request: Request, device_id: str, sealed_view: bool = True, s: Session = Depends(get_session)):
-    _enforce_device_actor(request, s, device_id)
-    # Basic SSE that polls every second for new messages
-    if not s.get(Device, device_id):
-        raise HTTPException(status_code=404, detail="unknown device")
-    def _gen():
-        last = datetime.now(timezone.utc)
-        while True:
-            time.sleep(1)
-            _purge_expired(s)
-            now = datetime.now(timezone.utc)
-            blocked = _blocked_peers(s, device_id)
-            hidden = _hidden_peers(s, device_id)
-            rows = s.execute(select(Message).where(Message.recipient_id == device_id, Message.created_at >= last, or_(Message.expire_at == None, Message.expire_at >= now)).order_by(Message.created_at.asc()).limit(100)).scalars().all()  # type: ignore[comparison-overlap]
-            rows = [r for r in rows if r.sender_id not in blocked and r.sender_id not in hidden]
-            if rows:
-                now = datetime.now(timezone.utc)
-                changed = False
-                for r in rows:
-                    if r.delivered_at is None:
-                        r.delivered_at = now
-                        s.add(r)
-                        changed = True
-                if changed:
-                    s.commit()
-                last = rows[-1].created_at or last
-                for r in rows:
-                    payload = {
-                        "id": r.id,
-                        "sender_id": None if (r.sealed_sender or sealed_view) else r.sender_id,
-                        "recipient_id": r.recipient_id,
-                        "nonce_b64": r.nonce_b64,
-                        "box_b64": r.box_b64,
-                        "sender_pubkey_b64": None if (r.sealed_sender or sealed_view) else r.sender_pubkey,
-                        "sender_dh_pub_b64": r.sender_dh_pub,
-                        "created_at": r.created_at.isoformat() if r.created_at else None,
-                        "delivered_at": r.delivered_at.isoformat() if r.delivered_at else None,
-                        "read_at": r.read_at.isoformat() if r.read_at else None,
-                        "expire_at": r.expire_at.isoformat() if r.expire_at else None,
-                        "sealed_sender": r.sealed_sender or sealed_view,
-                        "sender_hint": r.sender_hint,
-                        "sender_fingerprint": r.sender_hint,
-                        "key_id": r.key_id,
-                        "prev_key_id": r.prev_key_id,
-                    }
-                    yield f"data: {json.dumps(payload)}\n\n"
-    return StreamingResponse(_gen(), media_type="text/event-stream")
+def stream(request: Request, device_id: str, sealed_view: bool = True):
+    # SSE pushed by _stream_hub; no DB session is held while the stream idles
+    with Session(engine) as s:
+        _enforce_device_actor(request, s, device_id)
+        if not s.get(Device, device_id):
+            raise HTTPException(status_code=404, detail="unknown device")
+    return StreamingResponse(_stream_events(device_id, sealed_view), media_type="text/event-stream")
 
 
 class ReadReq(BaseModel):
@@ -1364,9 +1595,11 @@ def register_push_token(device_id: str, request: Request, req: PushTokenReq, s:
     if not s.get(Device, device_id):
         raise HTTPException(status_code=404, detail="unknown device")
     # Dedup by token to avoid bloat
+    owners = {r[0] for r in s.query(PushToken.device_id).filter(PushToken.token == req.token)}
     s.query(PushToken).filter(PushToken.token == req.token).delete()
     rec = PushToken(device_id=device_id, token=req.token, platform=req.platform)
     s.add(rec)
+    _bump_group_fanout(s, device_ids=sorted(owners | {device_id}))
     s.commit()
     return {"ok": True, "token": req.token, "platform": req.platform or "unknown"}
 
@@ -1384,7 +1617,9 @@ def set_block(device_id: str, request: Request, req: ContactRuleReq, s: Session
     else:
         r.blocked = req.blocked
         r.hidden = req.hidden
-    s.add(r); s.commit(); s.refresh(r)
+    s.add(r)
+    _bump_group_fanout(s, device_ids=[device_id])
+    s.commit(); s.refresh(r)
     return {"ok": True, "peer_id": req.peer_id, "blocked": r.blocked, "hidden": r.hidden}
 
 
@@ -1456,6 +1691,7 @@ def set_group_prefs(device_id: str, request: Request, req: GroupPrefsReq, s: Ses
         r = GroupPrefs(device_id=device_id, group_id=gid)
     if req.muted is not None:
         r.muted = bool(req.muted)
+        _bump_group_fanout(s, group_ids=[gid])
     if req.pinned is not None:
         r.pinned = bool(req.pinned)
     s.add(r)
@@ -1498,58 +1734,41 @@ app.include_router(router)
 
 
 # --- Helpers ---
-def _notify_recipient(
-    recipient_id: str,
-    message_id: str,
+def _notify_recipient(recipient_id: str, message_id: str, s: Session):
+    _enqueue_push(s, message_id, recipient_id=recipient_id)
+
+
+def _enqueue_push(
     s: Session,
+    message_id: str,
+    recipient_id: Optional[str] = None,
     group_id: Optional[str] = None,
     sender_id: Optional[str] = None,
-    group_name: Optional[str] = None,
 ):
+    """
+    Queue a push job in push_outbox and return; _push_worker resolves the
+    recipients and tokens and talks to FCM off the request path.
+    """
     if not FCM_SERVER_KEY:
         return
     try:
-        msg = s.get(Message, message_id)
-    except Exception:
-        msg = None
-    sender_hint = None
-    if msg is not None:
-        try:
-            if _is_muted(s, device_id=recipient_id, peer_id=msg.sender_id):
-                return
-        except Exception:
-            pass
-        try:
-            sender_hint = (msg.sender_hint or "").strip() or None
-        except Exception:
-            sender_hint = None
-    if _has_hidden(s, device_id=recipient_id):
-        return
-    tokens = s.query(PushToken).filter(PushToken.device_id == recipient_id).all()
-    if not tokens:
+        s.add(
+            PushOutbox(
+                message_id=message_id,
+                recipient_id=recipient_id,
+                group_id=group_id,
+                sender_id=sender_id,
+                status="pending",
+                attempts=0,
+                next_attempt_at=datetime.now(timezone.utc),
+            )
+        )
+        s.commit()
+    except Exception as e:
+        s.rollback()
+        logger.warning("push enqueue failed: %s", e)
         return
-    headers = {
-        "Authorization": f"key={FCM_SERVER_KEY}",
-        "Content-Type": "application/json",
-    }
-    for tok in tokens:
-        payload = {
-            "to": tok.token,
-            "priority": "high",
-            "data": {
-                "type": "chat",
-                "device_id": recipient_id,
-                "mid": message_id,
-                **({"sender_hint": sender_hint} if sender_hint else {}),
-                **({"sender_id": sender_id} if sender_id else {}),
-                **({"group_id": group_id} if group_id else {}),
-                **({"group_name": group_name} if group_name else {}),
-            },
-        }
-        try:
-            httpx.post(FCM_ENDPOINT, headers=headers, json=payload, timeout=5)
-        except Exception:
-            continue
+    _push_wakeup.set()
 
 
 def _is_group_member(s: Session, group_id: str, device_id: str) -> bool:
@@ -1586,47 +1805,257 @@ def _group_members(s: Session, group_id: str) -> List[str]:
 
 
 def _notify_group(group_id: str, sender_id: str, message_id: str, s: Session):
-    if not FCM_SERVER_KEY:
+    _enqueue_push(s, message_id, group_id=group_id, sender_id=sender_id)
+
+
+class _GroupFanout:
+    """Who a group message reaches: members, their push tokens and filters."""
+
+    __slots__ = ("version", "members", "tokens", "muted", "hidden", "blocked")
+
+    def __init__(self, version: int):
+        self.version = version
+        self.members: List[str] = []
+        self.tokens: Dict[str, List[str]] = {}
+        self.muted: Set[str] = set()  # group muted
+        self.hidden: Set[str] = set()  # has hidden chats: no pushes at all
+        self.blocked: Dict[str, Set[str]] = {}  # member -> blocked peers
+
+    def targets(self, sender_id: Optional[str]) -> List[str]:
+        return [
+            d
+            for d in self.members
+            if d != sender_id and d not in self.muted and d not in self.hidden and sender_id not in self.blocked.get(d, ())
+        ]
+
+
+_fanout_lock = threading.Lock()
+_fanout_cache: "OrderedDict[str, _GroupFanout]" = OrderedDict()
+
+
+def _bump_group_fanout(s: Session, group_ids: Optional[List[str]] = None, device_ids: Optional[List[str]] = None):
+    """Invalidate cached fan-out snapshots of groups (or of the groups of devices); caller commits."""
+    q = update(Group).values(fanout_version=func.coalesce(Group.fanout_version, 0) + 1)
+    if group_ids:
+        q = q.where(Group.id.in_(group_ids))
+    elif device_ids:
+        q = q.where(Group.id.in_(select(GroupMember.group_id).where(GroupMember.device_id.in_(device_ids))))
+    else:
         return
-    group_name = None
-    try:
-        g = s.get(Group, group_id)
-        if g is not None:
-            group_name = (getattr(g, "name", "") or "").strip() or None
-    except Exception:
-        group_name = None
-    members = _group_members(s, group_id)
-    for did in members:
-        if did == sender_id:
-            continue
-        # Respect group mute for recipient (WeChat-like).
-        try:
-            if (
-                s.query(GroupPrefs)
-                .filter(
-                    GroupPrefs.device_id == did,
-                    GroupPrefs.group_id == group_id,
-                    GroupPrefs.muted == True,
-                )
-                .first()
-            ):
-                continue
-        except Exception:
-            pass
-        # Best-effort: respect blocks against sender
-        try:
-            if _is_blocked(s, device_id=did, peer_id=sender_id):
-                continue
-        except Exception:
-            pass
-        _notify_recipient(
-            recipient_id=did,
-            message_id=message_id,
-            s=s,
-            group_id=group_id,
-            sender_id=sender_id,
-            group_name=group_name,
+    s.execute(q.execution_options(synchronize_session=False))
+
+
+def _group_fanout(s: Session, group_id: str) -> tuple[Optional[str], Optional[_GroupFanout]]:
+    """
+    (group name, fan-out snapshot) for group_id, or (None, None) if unknown.
+
+    A cached snapshot is reused while groups.fanout_version is unchanged, so
+    a send costs one primary-key read; otherwise members, group mutes,
+    blocks/hidden flags and push tokens come from one joined query.
+    """
+    row = s.execute(select(Group.fanout_version, Group.name).where(Group.id == group_id)).first()
+    if row is None:
+        return None, None
+    version = int(row[0] or 0)
+    name = (row[1] or "").strip() or None
+    with _fanout_lock:
+        snap = _fanout_cache.get(group_id)
+        if snap is not None and snap.version == version:
+            _fanout_cache.move_to_end(group_id)
+            return name, snap
+    rows = s.execute(
+        select(GroupMember.device_id, GroupPrefs.muted, PushToken.token, ContactRule.peer_id, ContactRule.blocked, ContactRule.hidden)
+        .select_from(GroupMember)
+        .outerjoin(GroupPrefs, and_(GroupPrefs.group_id == GroupMember.group_id, GroupPrefs.device_id == GroupMember.device_id))
+        .outerjoin(PushToken, PushToken.device_id == GroupMember.device_id)
+        .outerjoin(
+            ContactRule,
+            and_(ContactRule.device_id == GroupMember.device_id, or_(ContactRule.blocked == True, ContactRule.hidden == True)),
+        )
+        .where(GroupMember.group_id == group_id)
+    ).all()
+    snap = _GroupFanout(version)
+    seen: Set[str] = set()
+    for did, muted, token, peer, blocked, hidden in rows:
+        if did not in seen:
+            seen.add(did)
+            snap.members.append(did)
+        if muted:
+            snap.muted.add(did)
+        if token and token not in snap.tokens.setdefault(did, []):
+            snap.tokens[did].append(token)
+        if hidden:
+            snap.hidden.add(did)
+        if blocked and peer:
+            snap.blocked.setdefault(did, set()).add(peer)
+    if CHAT_FANOUT_CACHE_MAX > 0:
+        with _fanout_lock:
+            cur = _fanout_cache.get(group_id)
+            if cur is None or cur.version <= version:
+                _fanout_cache[group_id] = snap
+                _fanout_cache.move_to_end(group_id)
+            while len(_fanout_cache) > CHAT_FANOUT_CACHE_MAX:
+                _fanout_cache.popitem(last=False)
+    return name, snap
+
+
+_push_wakeup = threading.Event()
+
+
+def _push_targets(s: Session, job: PushOutbox) -> List[tuple[str, dict]]:
+    """(token, FCM data) for every device that should be woken by job."""
+    data = {"type": "chat", "mid": job.message_id}
+    if job.group_id:
+        group_name, snap = _group_fanout(s, job.group_id)
+        if snap is None:
+            return []
+        sender = job.sender_id
+        data.update({"group_id": job.group_id, **({"sender_id": sender} if sender else {}), **({"group_name": group_name} if group_name else {})})
+        return [
+            (tok, dict(data, device_id=did))
+            for did in snap.targets(sender)
+            for tok in snap.tokens.get(did, ())
+        ]
+    if not job.recipient_id:
+        return []
+    msg = s.get(Message, job.message_id)
+    if msg is not None:
+        if _is_muted(s, device_id=job.recipient_id, peer_id=msg.sender_id):
+            return []
+        hint = (msg.sender_hint or "").strip() or None
+        if hint:
+            data["sender_hint"] = hint
+    # Devices with hidden chats never get content-bearing pushes
+    if _has_hidden(s, device_id=job.recipient_id):
+        return []
+    rows = s.query(PushToken.token).filter(PushToken.device_id == job.recipient_id).all()
+    return [(r[0], dict(data, device_id=job.recipient_id)) for r in rows]
+
+
+async def _fcm_send_all(pushes: List[tuple[str, dict]]) -> List[Optional[str]]:
+    """POST each (token, data) to FCM with bounded concurrency; None or an error per push."""
+    sem = asyncio.Semaphore(max(1, CHAT_PUSH_CONCURRENCY))
+    headers = {
+        "Authorization": f"key={FCM_SERVER_KEY}",
+        "Content-Type": "application/json",
+    }
+    async with httpx.AsyncClient(timeout=5) as client:
+
+        async def _one(token: str, data: dict) -> Optional[str]:
+            async with sem:
+                try:
+                    r = await client.post(FCM_ENDPOINT, headers=headers, json={"to": token, "priority": "high", "data": data})
+                except Exception as e:
+                    return f"retry:{type(e).__name__}"
+            if r.status_code == 429 or r.status_code >= 500:
+                return f"retry:http_{r.status_code}"
+            if r.status_code >= 400:
+                # Bad token/payload: retrying will not help
+                return f"drop:http_{r.status_code}"
+            return None
+
+        return list(await asyncio.gather(*(_one(t, d) for t, d in pushes)))
+
+
+def _dispatch_push_batch(limit: Optional[int] = None) -> dict:
+    """
+    Claim due outbox jobs, coalesce them per push token and send.
+
+    Several messages for the same token become one push carrying the newest
+    message and a count. Jobs whose pushes hit a transient error are retried
+    with exponential backoff, up to CHAT_PUSH_MAX_ATTEMPTS, for the failed
+    tokens only, so devices that got the push are not pushed again; the
+    rest are deleted. Claimed jobs are leased for CHAT_PUSH_LEASE_SECS, so a worker
+    that dies mid-batch only delays them.
+    """
+    limit = limit or CHAT_PUSH_BATCH
+    now = datetime.now(timezone.utc)
+    out = {"jobs": 0, "pushes": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0}
+    with Session(engine) as s:
+        q = (
+            select(PushOutbox)
+            .where(PushOutbox.status.in_(("pending", "sending")), PushOutbox.next_attempt_at <= now)
+            .order_by(PushOutbox.next_attempt_at, PushOutbox.id)
+            .limit(limit)
         )
+        if engine.dialect.name == "postgresql":
+            q = q.with_for_update(skip_locked=True)
+        jobs = s.execute(q).scalars().all()
+        if not jobs:
+            return out
+        lease = now + timedelta(seconds=CHAT_PUSH_LEASE_SECS)
+        for j in jobs:
+            j.status = "sending"
+            j.next_attempt_at = lease
+        s.commit()
+        out["jobs"] = len(jobs)
+
+        # token -> (data of the newest message, contributing job ids)
+        by_token: Dict[str, tuple[dict, List[int]]] = {}
+        for j in jobs:
+            try:
+                targets = _push_targets(s, j)
+            except Exception as e:
+                logger.warning("push target resolution failed for %s: %s", j.message_id, e)
+                targets = []
+            if j.retry_tokens:
+                owed = set(json.loads(j.retry_tokens))
+                targets = [t for t in targets if t[0] in owed]
+            for token, data in targets:
+                prev = by_token.get(token)
+                by_token[token] = (data, (prev[1] if prev else []) + [j.id])
+        pushes: List[tuple[str, dict]] = []
+        for token, (data, job_ids) in by_token.items():
+            if len(job_ids) > 1:
+                data = dict(data, count=str(len(job_ids)))
+            pushes.append((token, data))
+        results = asyncio.run(_fcm_send_all(pushes)) if pushes else []
+        out["pushes"] = len(pushes)
+
+        # job id -> (last error, tokens to retry)
+        retry: Dict[int, tuple[str, List[str]]] = {}
+        for (token, _), err in zip(pushes, results):
+            if err is None:
+                out["sent"] += 1
+            elif err.startswith("drop:"):
+                out["dropped"] += 1
+            else:
+                for jid in by_token[token][1]:
+                    retry[jid] = (err, retry.get(jid, ("", []))[1] + [token])
+        for j in jobs:
+            if j.id not in retry:
+                s.delete(j)
+                continue
+            err, tokens = retry[j.id]
+            j.attempts = (j.attempts or 0) + 1
+            j.last_error = err[:255]
+            j.retry_tokens = json.dumps(tokens)
+            if j.attempts >= CHAT_PUSH_MAX_ATTEMPTS:
+                j.status = "failed"
+                out["failed"] += 1
+            else:
+                delay = min(CHAT_PUSH_BACKOFF_MAX_SECS, CHAT_PUSH_BACKOFF_SECS * (2 ** (j.attempts - 1)))
+                j.status = "pending"
+                j.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                out["retried"] += 1
+        s.commit()
+    return out
+
+
+def _start_push_worker():
+    if not FCM_SERVER_KEY:
+        return
+    def _loop():
+        while True:
+            _push_wakeup.clear()
+            try:
+                if _dispatch_push_batch()["jobs"] >= CHAT_PUSH_BATCH:
+                    continue
+            except Exception as e:
+                logger.warning("push dispatch error: %s", e)
+            _push_wakeup.wait(CHAT_PUSH_POLL_SECS)
+    t = threading.Thread(target=_loop, name="chat-push", daemon=True)
+    t.start()
 
 
 def _purge_expired(s: Session):
@@ -1634,6 +2063,7 @@ def _purge_expired(s: Session):
     try:
         s.query(Message).filter(Message.expire_at != None, Message.expire_at < now).delete()  # type: ignore[comparison-overlap]
         s.query(GroupMessage).filter(GroupMessage.expire_at != None, GroupMessage.expire_at < now).delete()  # type: ignore[comparison-overlap]
+        s.query(PushOutbox).filter(PushOutbox.status == "failed", PushOutbox.created_at < now - timedelta(days=CHAT_PUSH_RETENTION_DAYS)).delete()
         s.commit()
     except Exception:
         s.rollback()
@@ -1655,6 +2085,183 @@ def _hidden_peers(s: Session, device_id: str) -> Set[str]:
         return set()
 
 
+class _LocalBlobStore:
+    """
+    Content-addressed blobs in a local directory, sharded as ab/cd/<sha256>.
+
+    The methods mirror S3 object calls (put / head / ranged get / delete)
+    keyed by the hash, so an S3-compatible backend can be dropped in behind
+    CHAT_BLOB_BACKEND without touching the endpoints.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        if os.path.exists(path):
+            return  # same hash, same bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def head(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self._path(key))
+        except OSError:
+            return None
+
+    def get(self, key: str, start: int = 0, end: Optional[int] = None, chunk: int = 64 * 1024) -> Iterator[bytes]:
+        """Bytes start..end (inclusive) in chunks."""
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            left = None if end is None else end - start + 1
+            while left is None or left > 0:
+                buf = f.read(chunk if left is None else min(chunk, left))
+                if not buf:
+                    return
+                if left is not None:
+                    left -= len(buf)
+                yield buf
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+_BLOB_ID_RE = re.compile(r"[0-9a-f]{64}")
+_blob_store_inst: Optional[_LocalBlobStore] = None
+
+
+def _blob_store() -> _LocalBlobStore:
+    global _blob_store_inst
+    if _blob_store_inst is None:
+        if CHAT_BLOB_BACKEND != "local":
+            raise RuntimeError(f"unsupported CHAT_BLOB_BACKEND: {CHAT_BLOB_BACKEND}")
+        if not CHAT_BLOB_DIR:
+            raise RuntimeError("CHAT_BLOB_DIR must be set to a durable directory shared by all chat replicas")
+        _blob_store_inst = _LocalBlobStore(CHAT_BLOB_DIR)
+    return _blob_store_inst
+
+
+def _store_blob(s: Session, data: bytes, mime: Optional[str], owner_id: Optional[str] = None) -> ChatBlob:
+    """
+    Write data to the blob store (once per content) and return its row;
+    owner_id, who supplied the bytes, may attach the blob by id later.
+    Caller commits.
+    """
+    key = hashlib.sha256(data).hexdigest()
+    # Always put: a no-op when the file exists, a repair if a purge raced us
+    _blob_store().put(key, data)
+    blob = s.get(ChatBlob, key)
+    if blob is None:
+        blob = ChatBlob(id=key, size=len(data), mime=mime)
+        try:
+            with s.begin_nested():
+                s.add(blob)
+        except IntegrityError:
+            # Same content uploaded concurrently
+            blob = s.get(ChatBlob, key)
+    if owner_id and s.get(ChatBlobOwner, (key, owner_id)) is None:
+        try:
+            with s.begin_nested():
+                s.add(ChatBlobOwner(blob_id=key, device_id=owner_id))
+        except IntegrityError:
+            pass
+    return blob
+
+
+def _can_read_blob(s: Session, blob_id: str, device_id: str) -> bool:
+    """Uploaders, and members of a group the blob was sent to."""
+    if s.get(ChatBlobOwner, (blob_id, device_id)) is not None:
+        return True
+    return s.execute(
+        select(GroupMessage.id)
+        .join(GroupMember, and_(GroupMember.group_id == GroupMessage.group_id, GroupMember.device_id == device_id))
+        .where(GroupMessage.attachment_id == blob_id)
+        .limit(1)
+    ).first() is not None
+
+
+def _inline_attachment(m: GroupMessage) -> Optional[str]:
+    """attachment_b64 for clients that do not fetch /blobs yet (CHAT_INLINE_ATTACHMENTS)."""
+    if m.attachment_b64 or not m.attachment_id or not CHAT_INLINE_ATTACHMENTS:
+        return m.attachment_b64
+    try:
+        return base64.b64encode(b"".join(_blob_store().get(m.attachment_id))).decode()
+    except OSError:
+        logger.warning("blob %s missing from the store", m.attachment_id)
+        return None
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    (start, end) of a single "bytes=" range, or None to serve everything.
+    Unsatisfiable ranges raise 416.
+    """
+    if not header:
+        return None
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header)
+    if not m or (not m.group(1) and not m.group(2)):
+        return None  # multi-range or malformed: full body
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        start = max(size - int(m.group(2)), 0)
+        end = size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+def _purge_orphan_blobs(s: Session, batch: int = 500) -> int:
+    """Delete blobs that no message references any more (after a grace period for fresh uploads)."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=CHAT_BLOB_GRACE_SECS)
+    try:
+        ids = [
+            r[0]
+            for r in s.execute(
+                select(ChatBlob.id)
+                .where(
+                    ChatBlob.created_at < cutoff,
+                    ~select(GroupMessage.id).where(GroupMessage.attachment_id == ChatBlob.id).exists(),
+                )
+                .limit(batch)
+            )
+        ]
+        if not ids:
+            return 0
+        s.query(ChatBlob).filter(ChatBlob.id.in_(ids)).delete(synchronize_session=False)
+        s.query(ChatBlobOwner).filter(ChatBlobOwner.blob_id.in_(ids)).delete(synchronize_session=False)
+        s.commit()
+    except Exception:
+        s.rollback()
+        return 0
+    for key in ids:
+        if s.get(ChatBlob, key) is None:  # not re-uploaded meanwhile
+            _blob_store().delete(key)
+    return len(ids)
+
+
+def _replayed_msg_out(m: Message) -> MsgOut:
+    return MsgOut(id=m.id, sender_id=m.sender_id, recipient_id=m.recipient_id, sender_pubkey_b64=m.sender_pubkey, nonce_b64=m.nonce_b64, box_b64=m.box_b64, created_at=m.created_at.isoformat() if m.created_at else None, delivered_at=m.delivered_at.isoformat() if m.delivered_at else None, read_at=m.read_at.isoformat() if m.read_at else None, expire_at=m.expire_at.isoformat() if m.expire_at else None)
+
+
+def _send_key(sender_id: str, recipient_id: str, idempotency_key: Optional[str], nonce_b64: str) -> str:
+    """Fixed-width dedup key of a direct message send."""
+    ikey = (idempotency_key or "").strip()
+    part = f"k:{ikey}" if ikey else f"n:{nonce_b64}"
+    return hashlib.sha256(f"{sender_id}\x00{recipient_id}\x00{part}".encode()).hexdigest()
+
+
 def _has_hidden(s: Session, device_id: str) -> bool:
     try:
         return bool(s.query(ContactRule).filter(ContactRule.device_id == device_id, ContactRule.hidden == True).first())
@@ -1691,6 +2298,248 @@ def _is_muted(s: Session, device_id: str, peer_id: Optional[str]) -> bool:
     )
 
 
+class _StreamSub:
+    __slots__ = ("device_id", "event", "items", "lagged", "since")
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.event = threading.Event()
+        # (message_id, group_id) announced for this device, oldest first
+        self.items: deque = deque()
+        self.lagged = False
+        # SQLite keeps created_at at second precision
+        self.since = datetime.now(timezone.utc) - timedelta(seconds=1)
+
+
+class _StreamHub:
+    """
+    Wakes /messages/stream subscribers of this process when a message for
+    their device is sent.
+
+    Senders call notify(s, ...) before commit and publish(...) after it. With
+    the pg transport notify() adds a pg_notify to the sending transaction,
+    so the listener of every worker (this one included) hears about the
+    message exactly when it commits, and publish() does nothing. With the
+    local transport (SQLite, single worker) publish() delivers directly.
+    Subscribers that missed announcements (full queue, listener reconnect)
+    are marked lagged and catch up from the undelivered messages.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.subs: dict[str, Set[_StreamSub]] = {}
+        self.pg = False
+        self.published = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def subscribe(self, device_id: str) -> _StreamSub:
+        sub = _StreamSub(device_id)
+        with self.lock:
+            self.subs.setdefault(device_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: _StreamSub) -> None:
+        with self.lock:
+            subs = self.subs.get(sub.device_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self.subs[sub.device_id]
+
+    def has_subscribers(self) -> bool:
+        return bool(self.subs)
+
+    def take(self, sub: _StreamSub) -> tuple[list, bool]:
+        """Pending (message_id, group_id) items and the lagged flag; resets both."""
+        with self.lock:
+            sub.event.clear()
+            items = list(sub.items)
+            sub.items.clear()
+            lagged, sub.lagged = sub.lagged, False
+        return items, lagged
+
+    def deliver(self, device_ids: List[str], message_id: str, group_id: Optional[str] = None) -> None:
+        with self.lock:
+            self.published += 1
+            for did in device_ids:
+                for sub in self.subs.get(did, ()):
+                    if len(sub.items) >= CHAT_STREAM_QUEUE_MAX:
+                        sub.lagged = True
+                        self.dropped += 1
+                    else:
+                        sub.items.append((message_id, group_id))
+                    sub.event.set()
+
+    def wake_all(self) -> None:
+        with self.lock:
+            for subs in self.subs.values():
+                for sub in subs:
+                    sub.lagged = True
+                    sub.event.set()
+
+    def notify(self, s: Session, device_ids: List[str], message_id: str, group_id: Optional[str] = None) -> None:
+        if not self.pg or not device_ids:
+            return
+        # NOTIFY payloads are capped at 8000 bytes
+        for i in range(0, len(device_ids), 200):
+            payload = json.dumps({"d": device_ids[i:i + 200], "m": message_id, "g": group_id}, separators=(",", ":"))
+            s.execute(select(func.pg_notify(CHAT_STREAM_CHANNEL, payload)))
+
+    def publish(self, device_ids: List[str], message_id: str, group_id: Optional[str] = None) -> None:
+        if self.pg or not device_ids:
+            return
+        self.deliver(device_ids, message_id, group_id)
+
+    def start(self) -> None:
+        transport = CHAT_STREAM_TRANSPORT
+        if transport == "auto":
+            transport = "pg" if engine.dialect.name == "postgresql" else "local"
+        if transport != "pg" or self._thread is not None:
+            return
+        if engine.dialect.name != "postgresql" or engine.dialect.driver != "psycopg2":
+            logger.warning("chat stream: pg transport needs psycopg2, using in-process wakeups")
+            return
+        self.pg = True
+        self._thread = threading.Thread(target=self._listen_loop, name="chat-stream-listen", daemon=True)
+        self._thread.start()
+
+    def _on_notify(self, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            self.deliver(list(data.get("d") or []), str(data["m"]), data.get("g"))
+        except Exception as e:
+            logger.warning("chat stream: bad notify payload: %s", e)
+
+    def _listen_loop(self) -> None:
+        import select as _select
+
+        first = True
+        while True:
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                conn = raw.driver_connection
+                conn.autocommit = True
+                conn.cursor().execute(f'LISTEN "{CHAT_STREAM_CHANNEL}"')
+                if not first:
+                    # Announcements sent while we were away are lost
+                    self.reconnects += 1
+                    self.wake_all()
+                first = False
+                while True:
+                    if _select.select([conn], [], [], 30)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self._on_notify(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning("chat stream listener error: %s", e)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.invalidate()
+                    except Exception:
+                        pass
+            time.sleep(1)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "transport": "pg" if self.pg else "local",
+                "devices": len(self.subs),
+                "subscribers": sum(len(v) for v in self.subs.values()),
+                "published": self.published,
+                "dropped": self.dropped,
+                "reconnects": self.reconnects,
+            }
+
+
+_stream_hub = _StreamHub()
+
+
+def _stream_payload(r: Message, sealed_view: bool) -> dict:
+    return {
+        "id": r.id,
+        "sender_id": None if (r.sealed_sender or sealed_view) else r.sender_id,
+        "recipient_id": r.recipient_id,
+        "nonce_b64": r.nonce_b64,
+        "box_b64": r.box_b64,
+        "sender_pubkey_b64": None if (r.sealed_sender or sealed_view) else r.sender_pubkey,
+        "sender_dh_pub_b64": r.sender_dh_pub,
+        "created_at": r.created_at.isoformat() if r.created_at else None,
+        "delivered_at": r.delivered_at.isoformat() if r.delivered_at else None,
+        "read_at": r.read_at.isoformat() if r.read_at else None,
+        "expire_at": r.expire_at.isoformat() if r.expire_at else None,
+        "sealed_sender": r.sealed_sender or sealed_view,
+        "sender_hint": r.sender_hint,
+        "sender_fingerprint": r.sender_hint,
+        "key_id": r.key_id,
+        "prev_key_id": r.prev_key_id,
+    }
+
+
+def _stream_fetch(sub: _StreamSub, message_ids: List[str], lagged: bool, sealed_view: bool, page: int = 100) -> List[str]:
+    """
+    Load announced (or, when lagged, undelivered) messages and mark them delivered.
+
+    The ids were already taken off the subscriber queue, so every one of
+    them is loaded, page by page; a lagged subscriber then also drains its
+    undelivered backlog.
+    """
+    now = datetime.now(timezone.utc)
+    out: List[str] = []
+    with Session(engine) as s:
+        skip = {
+            r[0]
+            for r in s.query(ContactRule.peer_id).filter(
+                ContactRule.device_id == sub.device_id, or_(ContactRule.blocked == True, ContactRule.hidden == True)
+            )
+        }
+        base = select(Message).where(Message.recipient_id == sub.device_id, or_(Message.expire_at == None, Message.expire_at >= now))  # type: ignore[comparison-overlap]
+        if skip:
+            base = base.where(Message.sender_id.not_in(skip))
+
+        def _emit(rows) -> None:
+            for r in rows:
+                if r.delivered_at is None:
+                    r.delivered_at = now
+            out.extend(f"data: {json.dumps(_stream_payload(r, sealed_view))}\n\n" for r in rows)
+            s.commit()
+
+        for i in range(0, len(message_ids), page):
+            _emit(s.execute(base.where(Message.id.in_(message_ids[i:i + page])).order_by(Message.created_at.asc())).scalars().all())
+        if lagged:
+            # Each page is marked delivered, so the same query moves on
+            backlog = base.where(Message.delivered_at == None, Message.created_at >= sub.since).order_by(Message.created_at.asc()).limit(page)  # type: ignore[comparison-overlap]
+            while True:
+                rows = s.execute(backlog).scalars().all()
+                _emit(rows)
+                if len(rows) < page:
+                    break
+    return out
+
+
+def _stream_events(device_id: str, sealed_view: bool):
+    sub = _stream_hub.subscribe(device_id)
+    try:
+        while True:
+            if not sub.event.wait(CHAT_STREAM_KEEPALIVE_SECS):
+                # Lets the server notice disconnected clients
+                yield ": keepalive\n\n"
+                continue
+            items, lagged = _stream_hub.take(sub)
+            direct = [mid for mid, gid in items if gid is None]
+            for mid, gid in items:
+                if gid is not None:
+                    yield f"event: group\ndata: {json.dumps({'id': mid, 'group_id': gid})}\n\n"
+            if direct or lagged:
+                for chunk in _stream_fetch(sub, direct, lagged, sealed_view):
+                    yield chunk
+    finally:
+        _stream_hub.unsubscribe(sub)
+
+
 def _start_purge_thread():
     if PURGE_INTERVAL_SECONDS <= 0:
         return
@@ -1699,6 +2548,7 @@ def _start_purge_thread():
             try:
                 with Session(engine) as s:
                     _purge_expired(s)
+                    _purge_orphan_blobs(s)
             except Exception as e:
                 logger.warning("purge loop error: %s", e)
             time.sleep(PURGE_INTERVAL_SECONDS)
@@ -0,0 +1,32 @@
+"""
+Backfill payments velocity counters from existing txns / alias device events.
+
+Usage (uses the same PAYMENTS_DB_URL / DB_SCHEMA env as the payments service):
+
+    python -m apps.ops.rebuild_velocity_counters --since-days 1
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+
+from sqlalchemy.orm import Session
+
+
+def main(argv: list[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--since-days", type=int, default=1, help="UTC days to rebuild, today included (default: 1)")
+    args = ap.parse_args(argv)
+
+    import apps.payments.app.main as pay  # type: ignore[import]
+
+    pay.VelocityCounter.__table__.create(pay.engine, checkfirst=True)
+    with Session(pay.engine) as s:
+        stats = pay.rebuild_velocity_counters(s, since_days=max(1, args.since_days))
+    print(json.dumps(stats), flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, HTTPException
 from fastapi import Depends, APIRouter
-from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, setup_json_logging
+from shamell_shared import RequestIDMiddleware, configure_cors, add_standard_health, add_pool_stats_route, setup_json_logging, create_service_engine, create_async_service_engine
+from shamell_shared import schema_is_current, stamp_schema_version, add_missing_columns
 from starlette.requests import Request
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import StreamingResponse
@@ -10,17 +11,28 @@ import re
 import os
 import uuid
 
-from sqlalchemy import create_engine, String, BigInteger, ForeignKey, Integer, DateTime, func, UniqueConstraint
+from sqlalchemy import String, BigInteger, ForeignKey, Integer, DateTime, Boolean, func, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship, Session
 from sqlalchemy import select, func as sa_func
 from sqlalchemy import text as sa_text
+from sqlalchemy import delete as sa_delete, insert as sa_insert, update as sa_update
+from sqlalchemy import and_, or_, case, tuple_ as sa_tuple, cast as sa_cast, literal as sa_literal, type_coerce, union_all as sa_union_all, Index
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as _pg_insert
+from sqlalchemy.dialects.sqlite import insert as _sqlite_insert
 from datetime import datetime, timezone, timedelta
 import base64 as _b64
 import json as _json
 import secrets as _secrets
 import hashlib as _hashlib
 import hmac as _hmac
+import ipaddress as _ipaddress
+import threading as _threading
+import time as _time
+import socket as _socket
 from typing import Dict
+from collections import OrderedDict
+from types import MappingProxyType
 
 
 def _env_or(key: str, default: str) -> str:
@@ -31,6 +43,8 @@ def _env_or(key: str, default: str) -> str:
 DB_URL = _env_or("PAYMENTS_DB_URL", _env_or("DB_URL", "sqlite+pysqlite:////tmp/payments.db"))
 DB_SCHEMA = os.getenv("DB_SCHEMA") if not DB_URL.startswith("sqlite") else None
 AUTO_CREATE = _env_or("AUTO_CREATE_SCHEMA", "true").lower() == "true"
+# Bump together with every new Alembic revision (stamped by the latest one)
+PAYMENTS_SCHEMA_VERSION = 18
 DEFAULT_CURRENCY = _env_or("DEFAULT_CURRENCY", "SYP")
 DEV_ENABLE_TOPUP = _env_or("DEV_ENABLE_TOPUP", "false").lower() == "true"
 ALLOW_INSECURE_DEV_ADMIN_BYPASS = _env_or("ALLOW_INSECURE_DEV_ADMIN_BYPASS", "false").lower() == "true"
@@ -38,6 +52,10 @@ ENV_NAME = _env_or("ENV", "dev").lower()
 ALIAS_EXPOSE_CODE = _env_or("ALIAS_EXPOSE_CODE", "").lower() == "true" or ENV_NAME in ("dev", "test")
 SONIC_SECRET = os.getenv("SONIC_SECRET", "change-me-sonic")
 SONIC_TTL_SECS = int(_env_or("SONIC_TTL_SECS", "120"))
+# In-process replay filter for redeemed sonic tokens, bucketed by token exp
+SONIC_REPLAY_WINDOW_SECS = max(1, int(_env_or("SONIC_REPLAY_WINDOW_SECS", "60")))
+SONIC_REPLAY_BLOOM_BITS = max(64, int(_env_or("SONIC_REPLAY_BLOOM_BITS", str(1 << 16))))  # per window
+SONIC_REPLAY_MAX_PER_WINDOW = int(_env_or("SONIC_REPLAY_MAX_PER_WINDOW", "50000"))  # exact ids per window
 TOPUP_SECRET = os.getenv("TOPUP_SECRET", "change-me-topup")
 ALIAS_CODE_PEPPER = os.getenv("ALIAS_CODE_PEPPER", "")
 CASH_SECRET_PEPPER = os.getenv("CASH_SECRET_PEPPER", "")
@@ -85,6 +103,16 @@ if ENV_NAME in _PROD_ENVS:
 # Fees & KYC
 FEE_WALLET_PHONE = _env_or("FEE_WALLET_PHONE", "+963999999999")
 MERCHANT_FEE_BPS = int(_env_or("MERCHANT_FEE_BPS", "150"))
+# System accounts: phones used to seed the registry on startup ("" = not provisioned)
+TREASURY_WALLET_PHONE = _env_or("TREASURY_WALLET_PHONE", "")
+REDPACKET_ESCROW_WALLET_PHONE = _env_or("REDPACKET_ESCROW_WALLET_PHONE", "")
+SAVINGS_WALLET_PHONE = _env_or("SAVINGS_WALLET_PHONE", "")
+SYSTEM_ACCOUNTS_REFRESH_SECS = float(_env_or("SYSTEM_ACCOUNTS_REFRESH_SECS", "30"))
+# Fee accrual: credit the fee wallet per transfer (default) or queue per-txn
+# fee_accruals rows that a background flush folds into its balance
+FEE_ACCRUAL_BATCHED = _env_or("FEE_ACCRUAL_BATCHED", "false").lower() == "true"
+FEE_ACCRUAL_FLUSH_SECS = int(_env_or("FEE_ACCRUAL_FLUSH_SECS", "5"))
+FEE_ACCRUAL_FLUSH_BATCH = int(_env_or("FEE_ACCRUAL_FLUSH_BATCH", "1000"))
 
 def _env_int(key: str, default: int) -> int:
     try:
@@ -110,6 +138,35 @@ KYC_LIMITS = {
 # Red-packet defaults (WeChat-style hongbao)
 REDPACKET_DEFAULT_TTL_SECS = _env_int("REDPACKET_TTL_SECS", 24 * 3600)
 REDPACKET_MAX_COUNT = _env_int("REDPACKET_MAX_COUNT", 128)
+# Background expiry sweeper (0 disables the thread; /admin/sweeper/run still works)
+EXPIRY_SWEEP_INTERVAL_SECS = _env_int("EXPIRY_SWEEP_INTERVAL_SECS", 60)
+EXPIRY_SWEEP_BATCH = _env_int("EXPIRY_SWEEP_BATCH", 500)
+EXPIRY_SWEEP_MAX_BATCHES = _env_int("EXPIRY_SWEEP_MAX_BATCHES", 20)  # per kind and run
+EXPIRY_SWEEP_RETENTION_DAYS = _env_int("EXPIRY_SWEEP_RETENTION_DAYS", 30)  # terminal sonic/cash rows
+IDEMPOTENCY_RETENTION_DAYS = _env_int("IDEMPOTENCY_RETENTION_DAYS", 7)
+IDEMPOTENCY_TTL_SECS = _env_int("IDEMPOTENCY_TTL_SECS", 24 * 3600)  # idempotency_keys (transfers)
+# Leased background jobs (savings interest, scheduled bills); 0 disables the runner thread
+JOB_RUNNER_INTERVAL_SECS = _env_int("JOB_RUNNER_INTERVAL_SECS", 60)
+JOB_LEASE_SECS = _env_int("JOB_LEASE_SECS", 300)  # extended with every committed batch
+JOB_BATCH = _env_int("JOB_BATCH", 500)
+SAVINGS_INTEREST_BPS = _env_int("SAVINGS_INTEREST_BPS", 0)  # annual rate, credited monthly; 0 = off
+# Packets with at least this many shares are pre-split at issue time (0 = only on request)
+REDPACKET_PRESPLIT_MIN_COUNT = _env_int("REDPACKET_PRESPLIT_MIN_COUNT", 0)
+
+# Batched transfers: upper bound of items per /transfers/batch call
+TRANSFER_BATCH_MAX_ITEMS = _env_int("TRANSFER_BATCH_MAX_ITEMS", 5000)
+# Velocity counters: width of the short-window buckets and how long they are kept
+VELOCITY_BUCKET_SECS = max(1, _env_int("VELOCITY_BUCKET_SECS", 10))
+VELOCITY_WINDOW_RETENTION_SECS = _env_int("VELOCITY_WINDOW_RETENTION_SECS", 3600)
+VELOCITY_DAY_RETENTION_DAYS = _env_int("VELOCITY_DAY_RETENTION_DAYS", 35)
+# Streaming exports: rows fetched per keyset page
+EXPORT_PAGE_SIZE = max(1, _env_int("EXPORT_PAGE_SIZE", 1000))
+# Ledger checkpoints only fold entries older than this, so transactions still
+# in flight (Postgres stamps created_at at transaction start) are never skipped
+LEDGER_CHECKPOINT_LAG_SECS = _env_int("LEDGER_CHECKPOINT_LAG_SECS", 300)
+# Analytics rollups: folded up to floor_hour(now - lag) every interval (0 = no thread)
+ROLLUP_LAG_SECS = _env_int("ROLLUP_LAG_SECS", 300)
+ROLLUP_INTERVAL_SECS = _env_int("ROLLUP_INTERVAL_SECS", 300)
 
 ALLOWED_ROLES = {
     # Core payment roles
@@ -153,7 +210,11 @@ class Wallet(Base):
 
 class Txn(Base):
     __tablename__ = "txns"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_txns_created_id", "created_at", "id"),
+        Index("ix_txns_merchant_created", "merchant_id", "created_at", "id"),
+        ({"schema": DB_SCHEMA} if DB_SCHEMA else {}),
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     from_wallet_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
     to_wallet_id: Mapped[str] = mapped_column(String(36))
@@ -161,22 +222,53 @@ class Txn(Base):
     kind: Mapped[str] = mapped_column(String(16))  # topup|transfer
     fee_cents: Mapped[int] = mapped_column(BigInteger, default=0)
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    merchant_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # lowercased X-Merchant
+    ref: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
 
 class LedgerEntry(Base):
     __tablename__ = "ledger_entries"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_ledger_txn", "txn_id"),
+        Index("ix_ledger_created", "created_at"),
+        Index("ix_ledger_merchant_created", "merchant_id", "created_at"),
+        ({"schema": DB_SCHEMA} if DB_SCHEMA else {}),
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     wallet_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
     amount_cents: Mapped[int] = mapped_column(BigInteger)
     txn_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
     description: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    merchant_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    ref: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
+class LedgerCheckpoint(Base):
+    """Per-wallet ledger sum folded up to the global reconcile watermark."""
+    __tablename__ = "ledger_checkpoints"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    wallet_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    ledger_sum_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+    entry_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    last_entry_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class ReconcileState(Base):
+    __tablename__ = "reconcile_state"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    watermark: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)  # entries created before this are folded
+    runs: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
 class Idempotency(Base):
     __tablename__ = "idempotency"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_idempotency_created", "created_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     ikey: Mapped[str] = mapped_column(String(128), unique=True, index=True)
     endpoint: Mapped[str] = mapped_column(String(32))
@@ -188,6 +280,72 @@ class Idempotency(Base):
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
+class IdempotencyKey(Base):
+    """
+    TTL-bounded idempotency store for the transfer endpoints.
+
+    key_hash is sha256(route, wallet, Idempotency-Key) so the primary key is
+    fixed-width whatever clients send; response is the compact JSON body that
+    a retry gets back verbatim. Expired rows are purged by the sweeper.
+    """
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires", "expires_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
+    key_hash: Mapped[str] = mapped_column(String(64), primary_key=True)
+    route: Mapped[str] = mapped_column(String(32))
+    txn_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
+    response: Mapped[str] = mapped_column(String(512))
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+
+
+class ScheduledJob(Base):
+    """
+    Lease and progress of one background job (see run_job()).
+
+    A worker owns the job while lease_until is in the future; cursor is the
+    keyset position of the run for period, committed with every batch so a
+    run that lost its lease resumes where it stopped.
+    """
+    __tablename__ = "scheduled_jobs"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    lease_owner: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    period: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    last_period: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)  # last completed period
+    cursor: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+    processed: Mapped[int] = mapped_column(BigInteger, default=0)
+    batches: Mapped[int] = mapped_column(Integer, default=0)
+    runs: Mapped[int] = mapped_column(BigInteger, default=0)
+    last_status: Mapped[Optional[str]] = mapped_column(String(16), nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class SystemAccount(Base):
+    """Role (fee|treasury|redpacket_escrow|savings) -> wallet of a system account."""
+    __tablename__ = "system_accounts"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    role: Mapped[str] = mapped_column(String(32), primary_key=True)
+    wallet_id: Mapped[str] = mapped_column(String(36))
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class FeeAccrual(Base):
+    """One fee owed to a system wallet, pending flush_fee_accruals() (FEE_ACCRUAL_BATCHED)."""
+    __tablename__ = "fee_accruals"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    txn_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    wallet_id: Mapped[str] = mapped_column(String(36))
+    fee_cents: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
 class Alias(Base):
     __tablename__ = "aliases"
     __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
@@ -204,7 +362,10 @@ class Alias(Base):
 
 class AliasDeviceEvent(Base):
     __tablename__ = "alias_device_events"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_alias_device_events_created", "created_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     handle: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
     to_wallet_id: Mapped[str] = mapped_column(String(36))
@@ -232,9 +393,76 @@ class RiskBackoff(Base):
     strikes: Mapped[int] = mapped_column(Integer, default=0)
     last_strike: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
 
+
+class CacheGeneration(Base):
+    """Monotonic per-cache generation so workers can drop in-process caches lazily."""
+    __tablename__ = "cache_generations"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    generation: Mapped[int] = mapped_column(BigInteger, default=0)
+    updated_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class VelocityCounter(Base):
+    """
+    Bucketed activity counters maintained in the same transaction as the
+    Txn / alias device event they describe, so risk checks read a handful
+    of primary-key rows instead of scanning history.
+    """
+    __tablename__ = "velocity_counters"
+    __table_args__ = (
+        Index("ix_velocity_counters_bucket", "bucket_secs", "bucket_start"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
+    scope: Mapped[str] = mapped_column(String(16), primary_key=True)  # wallet_out|wallet_in|device|ip|device_wallet
+    subject: Mapped[str] = mapped_column(String(128), primary_key=True)
+    bucket_secs: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)  # 86400 (UTC day) or VELOCITY_BUCKET_SECS
+    bucket_start: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)  # epoch seconds
+    txn_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    amount_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+
+class WalletActivity(Base):
+    """
+    One row per (wallet, txn) the wallet takes part in, written with the Txn,
+    so a wallet's history is a single (wallet_id, created_at) range scan.
+    """
+    __tablename__ = "wallet_activity"
+    __table_args__ = (
+        Index("ix_wallet_activity_wallet_created", "wallet_id", "created_at", "txn_id"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
+    wallet_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    txn_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True))
+    direction: Mapped[str] = mapped_column(String(4))  # out|in|self
+    amount_cents: Mapped[int] = mapped_column(BigInteger)
+    fee_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+    counterparty_wallet_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
+    kind: Mapped[str] = mapped_column(String(32))
+
+
+class AnalyticsRollup(Base):
+    """
+    Hourly (3600) and daily (86400) aggregates of txns, red packets and risk
+    events, folded in by fold_rollups() up to its watermark.
+    """
+    __tablename__ = "analytics_rollups"
+    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    metric: Mapped[str] = mapped_column(String(16), primary_key=True)  # txn|rp_issued|rp_claimed|risk_device|risk_ip|risk_receiver
+    dim: Mapped[str] = mapped_column(String(128), primary_key=True)  # kind / campaign group_id / device / ip / wallet ('' = none)
+    bucket_secs: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    bucket_start: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False)  # epoch seconds
+    event_count: Mapped[int] = mapped_column(BigInteger, default=0)
+    amount_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+    fee_cents: Mapped[int] = mapped_column(BigInteger, default=0)
+
+
 class SonicToken(Base):
     __tablename__ = "sonic_tokens"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_sonic_status_expires", "status", "expires_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     token_hash: Mapped[str] = mapped_column(String(64), unique=True, index=True)
     from_wallet_id: Mapped[str] = mapped_column(String(36))
@@ -250,7 +478,10 @@ class SonicToken(Base):
 
 class CashMandate(Base):
     __tablename__ = "cash_mandates"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_cash_status_expires", "status", "expires_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     code: Mapped[str] = mapped_column(String(8), unique=True, index=True)
     secret_hash: Mapped[str] = mapped_column(String(64))  # sha256 hex
@@ -268,7 +499,10 @@ class CashMandate(Base):
 # --- Topup Voucher (kiosk) ---
 class TopupVoucher(Base):
     __tablename__ = "topup_vouchers"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_topup_status_expires", "status", "expires_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     code: Mapped[str] = mapped_column(String(24), unique=True, index=True)
     amount_cents: Mapped[int] = mapped_column(BigInteger)
@@ -298,7 +532,10 @@ class Favorite(Base):
 
 class PaymentRequest(Base):
     __tablename__ = "payment_requests"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_payreq_status_expires", "status", "expires_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     from_wallet_id: Mapped[str] = mapped_column(String(36))  # requester (payee)
     to_wallet_id: Mapped[str] = mapped_column(String(36))    # recipient (payer)
@@ -317,9 +554,17 @@ class RedPacket(Base):
     Funds are reserved from creator_wallet_id on issue and moved into a
     global liability bucket (wallet_id=None). Individual claims then draw
     down from remaining_amount_cents and credit claimant wallets.
+
+    Presplit packets store every share in red_packet_shares at issue time;
+    claims take a free share without touching this row, so for them the
+    shares are authoritative for claimed_count/remaining_amount_cents.
     """
     __tablename__ = "red_packets"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_red_packets_group_created", "group_id", "created_at"),
+        Index("ix_red_packets_created", "created_at"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     creator_wallet_id: Mapped[str] = mapped_column(String(36))
     group_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # optional Mirsaal/group binding
@@ -333,6 +578,25 @@ class RedPacket(Base):
     currency: Mapped[str] = mapped_column(String(3), default=DEFAULT_CURRENCY)
     expires_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    presplit: Mapped[bool] = mapped_column(Boolean, default=False)
+
+
+class RedPacketShare(Base):
+    """
+    One pre-computed share of a presplit red packet; claimed by setting wallet_id.
+    """
+    __tablename__ = "red_packet_shares"
+    __table_args__ = (
+        UniqueConstraint("redpacket_id", "slot", name="uq_redpacket_share_slot"),
+        Index("ix_redpacket_share_free", "redpacket_id", "wallet_id"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
+    id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    redpacket_id: Mapped[str] = mapped_column(String(36))
+    slot: Mapped[int] = mapped_column(Integer)  # 1-based, doubles as claim_index
+    amount_cents: Mapped[int] = mapped_column(BigInteger)
+    wallet_id: Mapped[Optional[str]] = mapped_column(String(36), nullable=True)
+    claimed_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), nullable=True)
 
 
 class RedPacketClaim(Base):
@@ -342,6 +606,7 @@ class RedPacketClaim(Base):
     __tablename__ = "red_packet_claims"
     __table_args__ = (
         UniqueConstraint("redpacket_id", "wallet_id", name="uq_redpacket_wallet"),
+        Index("ix_red_packet_claims_claimed", "claimed_at"),
         {"schema": DB_SCHEMA} if DB_SCHEMA else {},
     )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
@@ -365,7 +630,10 @@ class SavingsAccount(Base):
 
 class BillPayment(Base):
     __tablename__ = "bill_payments"
-    __table_args__ = ({"schema": DB_SCHEMA} if DB_SCHEMA else {})
+    __table_args__ = (
+        Index("ix_bill_payments_status_sched", "status", "scheduled_for"),
+        {"schema": DB_SCHEMA} if DB_SCHEMA else {},
+    )
     id: Mapped[str] = mapped_column(String(36), primary_key=True)
     from_wallet_id: Mapped[str] = mapped_column(String(36))
     to_wallet_id: Mapped[str] = mapped_column(String(36))
@@ -373,9 +641,11 @@ class BillPayment(Base):
     reference: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     amount_cents: Mapped[int] = mapped_column(BigInteger)
     currency: Mapped[str] = mapped_column(String(3), default=DEFAULT_CURRENCY)
-    status: Mapped[str] = mapped_column(String(16), default="posted")  # posted|failed
-    txn_id: Mapped[str] = mapped_column(String(36))
+    status: Mapped[str] = mapped_column(String(16), default="posted")  # posted|failed|scheduled|cancelled
+    txn_id: Mapped[str] = mapped_column(String(36))  # assigned up front for scheduled bills
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    scheduled_for: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
 
 
 # --- Roles/Directory (for BFF gating) ---
@@ -388,10 +658,7 @@ class Role(Base):
     created_at: Mapped[Optional[str]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
-if DB_URL.startswith("sqlite"):
-    engine = create_engine(DB_URL, pool_pre_ping=True, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DB_URL, pool_pre_ping=True)
+engine = create_service_engine(DB_URL, name="payments")
 
 
 def get_session():
@@ -399,6 +666,38 @@ def get_session():
         yield s
 
 
+# Opt-in async mode: the hot endpoints run on an AsyncSession (asyncpg /
+# aiosqlite) instead of pinning a threadpool worker each. Off by default so
+# both paths can be compared side by side.
+PAYMENTS_DB_ASYNC = _env_or("PAYMENTS_DB_ASYNC", "false").lower() == "true"
+_async_engine = None
+
+
+def _async_db_url(url: str) -> str:
+    """Map the sync DB_URL onto the matching async driver."""
+    scheme, sep, rest = url.partition("://")
+    base = scheme.split("+", 1)[0]
+    if base in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg{sep}{rest}"
+    if base == "sqlite":
+        return f"sqlite+aiosqlite{sep}{rest}"
+    return url
+
+
+def _get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = create_async_service_engine(_async_db_url(DB_URL), name="payments_async")
+    return _async_engine
+
+
+async def get_async_session():
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    async with AsyncSession(_get_async_engine()) as s:
+        yield s
+
+
 # Never expose interactive API docs by default in prod.
 _ENABLE_DOCS = ENV_NAME in ("dev", "test") or os.getenv("ENABLE_API_DOCS_IN_PROD", "").lower() in (
     "1",
@@ -451,6 +750,7 @@ def _require_internal_secret(request: Request) -> None:
 
 
 router = APIRouter(dependencies=[Depends(_require_internal_secret)])
+add_pool_stats_route(router)
 
 
 def require_admin(request: Request) -> bool:
@@ -501,10 +801,60 @@ def _mark_request_expired(req: PaymentRequest, s: Session) -> bool:
 
 
 def on_startup():
+    # A stamped, current schema needs no DDL at all: one SELECT and go
+    if not schema_is_current(engine, "payments", PAYMENTS_SCHEMA_VERSION, DB_SCHEMA):
+        _prepare_schema()
+    if AUTO_CREATE:
+        _ensure_fee_wallet()
+    try:
+        with Session(engine) as s:
+            seed_system_accounts(s)
+    except Exception:
+        pass
+    _start_expiry_sweeper()
+    _start_periodic("rollup-fold", ROLLUP_INTERVAL_SECS, _run_rollup_fold)
+    if FEE_ACCRUAL_BATCHED:
+        _start_periodic("fee-accrual-flush", FEE_ACCRUAL_FLUSH_SECS, _run_fee_accrual_flush)
+    _start_periodic("job-runner", JOB_RUNNER_INTERVAL_SECS, _run_due_jobs)
+
+
+app.router.on_startup.append(on_startup)
+
+
+def _prepare_schema():
+    """
+    Create/upgrade the schema of a database below PAYMENTS_SCHEMA_VERSION.
+
+    The dev auto-create path stamps the version when done, but only once
+    every one-off backfill has recorded its generation flag: a failed
+    backfill leaves the database unstamped, so the next startup retries it.
+    Alembic-managed databases are stamped by the latest revision instead.
+    """
+    backfills_done = True
     if AUTO_CREATE:
         Base.metadata.create_all(engine)
         _run_simple_migrations()
-        _ensure_fee_wallet()
+        for flag, backfill in (
+            # created_at on legacy txns (keyset paging key); before the
+            # wallet_activity backfill, which copies it
+            ("backfill_txn_created_at", backfill_txn_created_at),
+            # parse merchant/ref tags of pre-existing ledger rows
+            ("backfill_merchant_refs", backfill_merchant_refs),
+            # wallet_activity rows for pre-existing txns
+            ("backfill_wallet_activity", backfill_wallet_activity),
+            # carry unexpired transfer keys over from the legacy table
+            ("backfill_idempotency_keys", backfill_idempotency_keys),
+        ):
+            try:
+                with Session(engine) as s:
+                    if not _read_generation(s, flag):
+                        backfill(s)
+                        _bump_generation(s, flag)
+                        s.commit()
+            except Exception as e:
+                import logging as _lg
+                _lg.getLogger(__name__).error(f"{flag} failed, schema left unstamped: {e}")
+                backfills_done = False
     # Ensure auxiliary tables exist (idempotent)
     try:
         _ensure_idempotency_table()
@@ -522,6 +872,42 @@ def on_startup():
         _ensure_risk_tables()
     except Exception:
         pass
+    try:
+        _ensure_velocity_counters_table()
+    except Exception:
+        pass
+    try:
+        _ensure_cache_generations_table()
+    except Exception:
+        pass
+    try:
+        _ensure_ledger_checkpoint_tables()
+    except Exception:
+        pass
+    try:
+        _ensure_redpacket_shares_table()
+    except Exception:
+        pass
+    try:
+        _ensure_wallet_activity_table()
+    except Exception:
+        pass
+    try:
+        _ensure_analytics_rollups_table()
+    except Exception:
+        pass
+    try:
+        _ensure_idempotency_keys_table()
+    except Exception:
+        pass
+    try:
+        _ensure_scheduled_jobs_table()
+    except Exception:
+        pass
+    try:
+        _ensure_system_account_tables()
+    except Exception:
+        pass
     try:
         _ensure_topup_vouchers_table()
     except Exception:
@@ -590,39 +976,60 @@ def on_startup():
             """)
     except Exception:
         pass
+    if AUTO_CREATE and backfills_done:
+        try:
+            stamp_schema_version(engine, "payments", PAYMENTS_SCHEMA_VERSION, DB_SCHEMA)
+        except Exception:
+            pass
 
 
-app.router.on_startup.append(on_startup)
+# Columns/indexes added after the initial schema, mirroring the Alembic chain
+# for dev databases that are kept up to date by create_all.
+_TS_COLUMN = "TIMESTAMPTZ" if DB_URL.startswith("sqlite") else "TIMESTAMPTZ DEFAULT NOW()"
+_SIMPLE_MIGRATION_COLUMNS = [
+    ("users", "kyc_level", "INTEGER DEFAULT 0"),
+    ("txns", "fee_cents", "BIGINT DEFAULT 0"),
+    ("txns", "created_at", _TS_COLUMN),
+    ("txns", "merchant_id", "VARCHAR(64)"),
+    ("txns", "ref", "VARCHAR(64)"),
+    ("ledger_entries", "merchant_id", "VARCHAR(64)"),
+    ("ledger_entries", "ref", "VARCHAR(64)"),
+    ("bill_payments", "scheduled_for", "TIMESTAMPTZ"),
+    ("bill_payments", "error", "VARCHAR(64)"),
+    ("red_packets", "presplit", "BOOLEAN DEFAULT FALSE"),
+    ("idempotency", "amount_cents", "BIGINT"),
+    ("idempotency", "currency", "VARCHAR(3)"),
+    ("idempotency", "wallet_id", "VARCHAR(36)"),
+    ("idempotency", "balance_cents", "BIGINT"),
+]
+_SIMPLE_MIGRATION_INDEXES = [
+    ("txns", "ix_txns_created_id", "created_at, id"),
+    ("txns", "ix_txns_merchant_created", "merchant_id, created_at, id"),
+    ("ledger_entries", "ix_ledger_txn", "txn_id"),
+    ("ledger_entries", "ix_ledger_merchant_created", "merchant_id, created_at"),
+    ("ledger_entries", "ix_ledger_created", "created_at"),
+    # expiry sweeper: (status, expires_at) / created_at indexes
+    ("idempotency", "ix_idempotency_created", "created_at"),
+    ("sonic_tokens", "ix_sonic_status_expires", "status, expires_at"),
+    ("cash_mandates", "ix_cash_status_expires", "status, expires_at"),
+    ("topup_vouchers", "ix_topup_status_expires", "status, expires_at"),
+    ("payment_requests", "ix_payreq_status_expires", "status, expires_at"),
+    # analytics rollup source indexes (fold + raw tail read by created_at)
+    ("red_packets", "ix_red_packets_group_created", "group_id, created_at"),
+    ("red_packets", "ix_red_packets_created", "created_at"),
+    ("red_packet_claims", "ix_red_packet_claims_claimed", "claimed_at"),
+    ("alias_device_events", "ix_alias_device_events_created", "created_at"),
+    # scheduled bill payments
+    ("bill_payments", "ix_bill_payments_status_sched", "status, scheduled_for"),
+    # velocity counter pruning in the expiry sweep
+    ("velocity_counters", "ix_velocity_counters_bucket", "bucket_secs, bucket_start"),
+]
+
 
 def _run_simple_migrations():
-    # Best-effort add columns if missing (for dev/demo only)
-    with engine.begin() as conn:
-        # users.kyc_level
-        try:
-            conn.exec_driver_sql("ALTER TABLE users ADD COLUMN kyc_level INTEGER DEFAULT 0")
-        except Exception:
-            pass
-        # txns.fee_cents
-        try:
-            conn.exec_driver_sql("ALTER TABLE txns ADD COLUMN fee_cents BIGINT DEFAULT 0")
-        except Exception:
-            pass
-        # txns.created_at
-        try:
-            conn.exec_driver_sql("ALTER TABLE txns ADD COLUMN created_at TIMESTAMPTZ DEFAULT NOW()")
-        except Exception:
-            pass
-        # idempotency.amount_cents / currency / wallet_id / balance_cents
-        for col_sql in [
-            "ALTER TABLE idempotency ADD COLUMN amount_cents BIGINT",
-            "ALTER TABLE idempotency ADD COLUMN currency VARCHAR(3)",
-            "ALTER TABLE idempotency ADD COLUMN wallet_id VARCHAR(36)",
-            "ALTER TABLE idempotency ADD COLUMN balance_cents BIGINT",
-        ]:
-            try:
-                conn.exec_driver_sql(col_sql)
-            except Exception:
-                pass
+    # Add columns/indexes that are missing (for dev/demo only); one inspector
+    # pass instead of issuing every ALTER and swallowing the failures
+    add_missing_columns(engine, _SIMPLE_MIGRATION_COLUMNS, _SIMPLE_MIGRATION_INDEXES, DB_SCHEMA)
 
 
 def _ensure_fee_wallet():
@@ -744,6 +1151,62 @@ def _ensure_risk_tables():
         conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS ix_{schema}_risk_backoff ON {schema}.risk_backoff (key_type, key_value);")
 
 
+def _ensure_velocity_counters_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    VelocityCounter.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_cache_generations_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    CacheGeneration.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_ledger_checkpoint_tables():
+    if DB_URL.startswith("sqlite"):
+        return
+    LedgerCheckpoint.__table__.create(engine, checkfirst=True)
+    ReconcileState.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_wallet_activity_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    WalletActivity.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_analytics_rollups_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    AnalyticsRollup.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_idempotency_keys_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    IdempotencyKey.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_system_account_tables():
+    if DB_URL.startswith("sqlite"):
+        return
+    SystemAccount.__table__.create(engine, checkfirst=True)
+    FeeAccrual.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_scheduled_jobs_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    ScheduledJob.__table__.create(engine, checkfirst=True)
+
+
+def _ensure_redpacket_shares_table():
+    if DB_URL.startswith("sqlite"):
+        return
+    RedPacketShare.__table__.create(engine, checkfirst=True)
+
+
 def _ensure_sonic_tokens_table():
     if DB_URL.startswith("sqlite"):
         return
@@ -948,7 +1411,7 @@ def topup(wallet_id: str, req: TopupReq, request: Request, s: Session = Depends(
     # transactional unit: dual-write (ledger + balance)
     w.balance_cents += req.amount_cents
     txn_id = str(uuid.uuid4())
-    s.add(Txn(id=txn_id, from_wallet_id=None, to_wallet_id=wallet_id, amount_cents=req.amount_cents, kind="topup", fee_cents=0))
+    _record_txn(s, Txn(id=txn_id, from_wallet_id=None, to_wallet_id=wallet_id, amount_cents=req.amount_cents, kind="topup", fee_cents=0))
     # Ledger: credit wallet, debit external (wallet_id=None)
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=wallet_id, amount_cents=+req.amount_cents, txn_id=txn_id, description="topup"))
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=-req.amount_cents, txn_id=txn_id, description="topup_external"))
@@ -1094,9 +1557,10 @@ def _accept_request_core(rid: str, ikey: str | None, s: Session, to_wallet_id: O
         raise HTTPException(status_code=400, detail="not pending")
     if to_wallet_id and to_wallet_id != r.to_wallet_id:
         raise HTTPException(status_code=400, detail="wallet mismatch for request")
-    # lock payer and payee
-    payer = s.execute(select(Wallet).where(Wallet.id == r.to_wallet_id).with_for_update()).scalars().first()
-    payee = s.execute(select(Wallet).where(Wallet.id == r.from_wallet_id).with_for_update()).scalars().first()
+    # lock payer and payee (canonical order)
+    locked = _lock_wallets(s, [r.to_wallet_id, r.from_wallet_id])
+    payer = locked.get(r.to_wallet_id)
+    payee = locked.get(r.from_wallet_id)
     if not payer or not payee:
         raise HTTPException(status_code=404, detail="wallet missing")
     if payer.balance_cents < r.amount_cents:
@@ -1104,7 +1568,7 @@ def _accept_request_core(rid: str, ikey: str | None, s: Session, to_wallet_id: O
     payer.balance_cents -= r.amount_cents
     payee.balance_cents += r.amount_cents
     txn_id = str(uuid.uuid4())
-    s.add(Txn(id=txn_id, from_wallet_id=payer.id, to_wallet_id=payee.id, amount_cents=r.amount_cents, kind="transfer", fee_cents=0))
+    _record_txn(s, Txn(id=txn_id, from_wallet_id=payer.id, to_wallet_id=payee.id, amount_cents=r.amount_cents, kind="transfer", fee_cents=0))
     meta = f"request:{r.id}"
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=payer.id, amount_cents=-r.amount_cents, txn_id=txn_id, description="transfer_debit;"+meta))
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=payee.id, amount_cents=+r.amount_cents, txn_id=txn_id, description="transfer_credit;"+meta))
@@ -1136,6 +1600,7 @@ class RedPacketIssueReq(BaseModel):
     group_id: Optional[str] = Field(default=None, description="Optional Mirsaal/group identifier")
     message: Optional[str] = Field(default=None, max_length=255)
     expires_in_secs: Optional[int] = Field(default=None, ge=60, le=7 * 24 * 3600)
+    presplit: Optional[bool] = Field(default=None, description="Pre-compute all shares at issue (parallel claims)")
 
 
 class RedPacketIssueResp(BaseModel):
@@ -1177,6 +1642,11 @@ def redpacket_issue(req: RedPacketIssueReq, s: Session = Depends(get_session)):
     lim = KYC_LIMITS.get(level, KYC_LIMITS[0])
     if amt > lim["tx_max"]:
         raise HTTPException(status_code=400, detail="Exceeds per-transaction limit for KYC level")
+    presplit = req.presplit if req.presplit is not None else (
+        REDPACKET_PRESPLIT_MIN_COUNT > 0 and req.count >= REDPACKET_PRESPLIT_MIN_COUNT
+    )
+    if presplit and amt < req.count:
+        raise HTTPException(status_code=400, detail="amount too small for split")
     if from_w.balance_cents < amt:
         raise HTTPException(status_code=400, detail="Insufficient funds")
     from_w.balance_cents -= amt
@@ -1199,8 +1669,21 @@ def redpacket_issue(req: RedPacketIssueReq, s: Session = Depends(get_session)):
         status="active",
         currency=from_w.currency,
         expires_at=expires_at,
+        presplit=bool(presplit),
     )
     s.add(rp)
+    if presplit:
+        s.flush()
+        s.execute(
+            sa_insert(RedPacketShare),
+            [
+                {"id": str(uuid.uuid4()), "redpacket_id": rp_id, "slot": i + 1, "amount_cents": share}
+                for i, share in enumerate(_redpacket_split(amt, req.count, mode))
+            ],
+        )
+        # Count the whole packet against the creator now; claims skip the
+        # sender counter so they never contend on it.
+        _bump_velocity(s, "wallet_out", from_w.id, amt)
     # Reserve funds into pool (wallet_id=None liability)
     s.add(
         LedgerEntry(
@@ -1252,27 +1735,197 @@ class RedPacketClaimOut(BaseModel):
     status: str
 
 
-@router.post("/redpacket/claim", response_model=RedPacketClaimOut)
-def redpacket_claim(req: RedPacketClaimReq, s: Session = Depends(get_session)):
-    rp = (
-        s.execute(
-            select(RedPacket)
-            .where(RedPacket.id == req.redpacket_id)
-            .with_for_update()
+def _redpacket_split(amount_cents: int, count: int, mode: str) -> List[int]:
+    """
+    All shares of a packet, in claim order, using the same rules as the
+    sequential claim path (every share >= 1 cent, last share takes the rest).
+    """
+    if mode == "fixed":
+        base = amount_cents // count
+        return [base] * (count - 1) + [amount_cents - base * (count - 1)]
+    shares: List[int] = []
+    remaining = amount_cents
+    for slots in range(count, 1, -1):
+        share = 1 + _secrets.randbelow(remaining - (slots - 1))
+        shares.append(share)
+        remaining -= share
+    shares.append(remaining)
+    return shares
+
+
+def _redpacket_share_totals(s: Session, rid: str) -> tuple[int, int]:
+    """(claimed_count, remaining_amount_cents) of a presplit packet."""
+    claimed, remaining = s.execute(
+        select(
+            sa_func.count(RedPacketShare.wallet_id),
+            sa_func.coalesce(sa_func.sum(case((RedPacketShare.wallet_id.is_(None), RedPacketShare.amount_cents), else_=0)), 0),
+        ).where(RedPacketShare.redpacket_id == rid)
+    ).one()
+    return int(claimed or 0), int(remaining or 0)
+
+
+def _take_redpacket_share(s: Session, rid: str, wallet_id: str, now: datetime) -> Optional[RedPacketShare]:
+    """
+    Atomically assign one free share to wallet_id.
+
+    Postgres: FOR UPDATE SKIP LOCKED, so concurrent claimers each lock a
+    different share. Elsewhere: compare-and-set on wallet_id IS NULL with a
+    few retries (SQLite serialises writers anyway).
+
+    Returns None only when no free share is left; shares that are merely
+    locked by in-flight claims (which may still roll back) raise 409.
+    """
+    free = (
+        select(RedPacketShare)
+        .where(RedPacketShare.redpacket_id == rid, RedPacketShare.wallet_id.is_(None))
+        .order_by(RedPacketShare.slot)
+        .limit(1)
+    )
+    if s.get_bind().dialect.name == "postgresql":
+        share = s.execute(free.with_for_update(skip_locked=True)).scalars().first()
+        if share is None:
+            # Nothing unlocked; without SKIP LOCKED, see whether free shares
+            # are only held by other claimers
+            if s.execute(free.with_only_columns(RedPacketShare.id)).first() is not None:
+                raise HTTPException(status_code=409, detail="red packet busy, retry")
+            return None
+        share.wallet_id = wallet_id
+        share.claimed_at = now
+        s.flush()
+        return share
+    for _ in range(8):
+        share_id = s.execute(free.with_only_columns(RedPacketShare.id)).scalar()
+        if share_id is None:
+            return None
+        res = s.execute(
+            sa_update(RedPacketShare)
+            .where(RedPacketShare.id == share_id, RedPacketShare.wallet_id.is_(None))
+            .values(wallet_id=wallet_id, claimed_at=now)
+            .execution_options(synchronize_session=False)
         )
-        .scalars()
-        .first()
+        if res.rowcount == 1:
+            return s.get(RedPacketShare, share_id, populate_existing=True)
+    raise HTTPException(status_code=409, detail="red packet busy, retry")
+
+
+def _mark_redpacket_exhausted(s: Session, rid: str) -> None:
+    s.execute(
+        sa_update(RedPacket)
+        .where(RedPacket.id == rid, RedPacket.status == "active")
+        .values(status="exhausted")
+        .execution_options(synchronize_session=False)
     )
-    if not rp:
-        raise HTTPException(status_code=404, detail="red packet not found")
-    # Expiry handling (best-effort)
+
+
+def _redpacket_claim_presplit(rp: RedPacket, req: RedPacketClaimReq, s: Session) -> RedPacketClaimOut:
+    """
+    Claim path for presplit packets: the packet row is only read, never
+    locked, so claimers only serialise on their own wallet and share rows.
+    """
+    def _out(claim: RedPacketClaim, status: str) -> RedPacketClaimOut:
+        claimed, _remaining = _redpacket_share_totals(s, rp.id)
+        return RedPacketClaimOut(
+            redpacket_id=claim.redpacket_id,
+            wallet_id=claim.wallet_id,
+            amount_cents=claim.amount_cents,
+            claim_index=claim.claim_index,
+            total_count=rp.total_count,
+            claimed_count=claimed,
+            message=rp.message,
+            currency=rp.currency,
+            status=("exhausted" if status == "active" and claimed >= rp.total_count else status),
+        )
+
+    def _existing() -> Optional[RedPacketClaim]:
+        return s.execute(
+            select(RedPacketClaim).where(
+                RedPacketClaim.redpacket_id == rp.id,
+                RedPacketClaim.wallet_id == req.wallet_id,
+            )
+        ).scalars().first()
+
     now = datetime.now(timezone.utc)
     exp = rp.expires_at
-    if isinstance(exp, str):
-        try:
-            exp = datetime.fromisoformat(exp)
-        except Exception:
-            exp = None
+    if isinstance(exp, datetime) and exp.tzinfo is None:
+        exp = exp.replace(tzinfo=timezone.utc)
+    if isinstance(exp, datetime) and exp < now and rp.status == "active":
+        s.execute(
+            sa_update(RedPacket)
+            .where(RedPacket.id == rp.id, RedPacket.status == "active")
+            .values(status="expired")
+            .execution_options(synchronize_session=False)
+        )
+        s.commit()
+        raise HTTPException(status_code=400, detail="red packet expired")
+    existing = _existing()
+    if existing:
+        return _out(existing, rp.status)
+    if rp.status != "active":
+        raise HTTPException(status_code=400, detail="red packet not active")
+    to_w = s.execute(select(Wallet).where(Wallet.id == req.wallet_id).with_for_update()).scalars().first()
+    if not to_w:
+        raise HTTPException(status_code=404, detail="wallet not found")
+    share = _take_redpacket_share(s, rp.id, to_w.id, now)
+    if share is None:
+        _mark_redpacket_exhausted(s, rp.id)
+        s.commit()
+        raise HTTPException(status_code=400, detail="red packet empty")
+    amount = int(share.amount_cents)
+    to_w.balance_cents += amount
+    txn_id = str(uuid.uuid4())
+    group_tag = f"; group={rp.group_id}" if rp.group_id else ""
+    _record_txn(
+        s,
+        Txn(id=txn_id, from_wallet_id=rp.creator_wallet_id, to_wallet_id=to_w.id, amount_cents=amount, kind="redpacket", fee_cents=0),
+        count_sender=False,
+    )
+    s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=-amount, txn_id=txn_id, description=f"redpacket_release:{rp.id}" + group_tag))
+    s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=to_w.id, amount_cents=amount, txn_id=txn_id, description=f"redpacket_claim:{rp.id}" + group_tag))
+    claim = RedPacketClaim(id=str(uuid.uuid4()), redpacket_id=rp.id, wallet_id=to_w.id, amount_cents=amount, claim_index=share.slot)
+    s.add(claim)
+    try:
+        s.flush()
+    except IntegrityError:
+        # Same wallet won a concurrent claim; our share goes back to the pool
+        s.rollback()
+        existing = _existing()
+        if not existing:
+            raise HTTPException(status_code=409, detail="red packet busy, retry")
+        return _out(existing, rp.status)
+    if s.execute(
+        select(RedPacketShare.id).where(RedPacketShare.redpacket_id == rp.id, RedPacketShare.wallet_id.is_(None)).limit(1)
+    ).first() is None:
+        _mark_redpacket_exhausted(s, rp.id)
+    s.commit()
+    s.refresh(claim)
+    return _out(claim, "active")
+
+
+@router.post("/redpacket/claim", response_model=RedPacketClaimOut)
+def redpacket_claim(req: RedPacketClaimReq, s: Session = Depends(get_session)):
+    rp0 = s.get(RedPacket, req.redpacket_id)
+    if rp0 is not None and rp0.presplit:
+        return _redpacket_claim_presplit(rp0, req, s)
+    rp = (
+        s.execute(
+            select(RedPacket)
+            .where(RedPacket.id == req.redpacket_id)
+            .with_for_update()
+            .execution_options(populate_existing=True)
+        )
+        .scalars()
+        .first()
+    )
+    if not rp:
+        raise HTTPException(status_code=404, detail="red packet not found")
+    # Expiry handling (best-effort)
+    now = datetime.now(timezone.utc)
+    exp = rp.expires_at
+    if isinstance(exp, str):
+        try:
+            exp = datetime.fromisoformat(exp)
+        except Exception:
+            exp = None
     if exp is not None:
         if exp.tzinfo is None:
             exp = exp.replace(tzinfo=timezone.utc)
@@ -1360,7 +2013,8 @@ def redpacket_claim(req: RedPacketClaimReq, s: Session = Depends(get_session)):
     claim_index = rp.claimed_count
     to_w.balance_cents += amount
     txn_id = str(uuid.uuid4())
-    s.add(
+    _record_txn(
+        s,
         Txn(
             id=txn_id,
             from_wallet_id=rp.creator_wallet_id,
@@ -1466,17 +2120,23 @@ def redpacket_status(rid: str, s: Session = Depends(get_session)):
         .scalars()
         .all()
     )
+    claimed_count, remaining = rp.claimed_count, rp.remaining_amount_cents
+    status = rp.status
+    if rp.presplit:
+        claimed_count, remaining = _redpacket_share_totals(s, rp.id)
+        if status == "active" and claimed_count >= rp.total_count:
+            status = "exhausted"
     return RedPacketStatusOut(
         id=rp.id,
         creator_wallet_id=rp.creator_wallet_id,
         group_id=rp.group_id,
         total_amount_cents=rp.total_amount_cents,
-        remaining_amount_cents=rp.remaining_amount_cents,
+        remaining_amount_cents=remaining,
         total_count=rp.total_count,
-        claimed_count=rp.claimed_count,
+        claimed_count=claimed_count,
         mode=rp.mode,
         message=rp.message,
-        status=rp.status,
+        status=status,
         currency=rp.currency,
         expires_at=rp.expires_at.isoformat() if rp.expires_at else None,
         claims=[
@@ -1562,7 +2222,8 @@ def savings_deposit(req: SavingsDepositReq, s: Session = Depends(get_session)):
         )
     )
     # Txn record for history (does not affect KYC/velocity; filtered by kind)
-    s.add(
+    _record_txn(
+        s,
         Txn(
             id=str(uuid.uuid4()),
             from_wallet_id=w.id,
@@ -1620,7 +2281,8 @@ def savings_withdraw(req: SavingsWithdrawReq, s: Session = Depends(get_session))
         )
     )
     # Txn record for history (does not affect KYC/velocity; filtered by kind)
-    s.add(
+    _record_txn(
+        s,
         Txn(
             id=str(uuid.uuid4()),
             from_wallet_id=w.id,
@@ -1665,90 +2327,81 @@ class BillPayReq(BaseModel):
     reference: Optional[str] = None
 
 
-@router.post("/bills/pay", response_model=WalletResp)
-def bills_pay(req: BillPayReq, request: Request, s: Session = Depends(get_session)):
-    if req.from_wallet_id == req.to_wallet_id:
-        raise HTTPException(status_code=400, detail="Cannot pay bill to same wallet")
-    # Lock wallets
-    from_w = (
-        s.execute(
-            select(Wallet).where(Wallet.id == req.from_wallet_id).with_for_update()
-        )
-        .scalars()
-        .first()
-    )
-    to_w = (
-        s.execute(select(Wallet).where(Wallet.id == req.to_wallet_id).with_for_update())
-        .scalars()
-        .first()
-    )
-    if not from_w or not to_w:
-        raise HTTPException(status_code=404, detail="Wallet not found")
-    if req.amount_cents <= 0:
-        raise HTTPException(status_code=400, detail="amount_cents must be > 0")
+def _check_bill_limits(s: Session, from_w: Wallet, amount_cents: int, spent_today: Optional[int] = None) -> None:
     # Simple KYC per-transaction check (reuse transfer limits)
-    u = s.get(User, from_w.user_id)
-    level = u.kyc_level if u else 0
-    lim = KYC_LIMITS.get(level, KYC_LIMITS[0])
-    if req.amount_cents > lim["tx_max"]:
+    lim = _kyc_limits_for(s, from_w)
+    if amount_cents > lim["tx_max"]:
         raise HTTPException(
             status_code=400, detail="Exceeds per-transaction limit for KYC level"
         )
     # Daily total (best-effort)
-    today = datetime.now(timezone.utc).date()
-    start = datetime.combine(today, datetime.min.time(), tzinfo=timezone.utc)
-    end = start + timedelta(days=1)
-    total_today = 0
-    for row in s.execute(
-        select(Txn.amount_cents).where(
-            Txn.from_wallet_id == from_w.id,
-            Txn.created_at >= start,
-            Txn.created_at < end,
-            ~Txn.kind.like("savings%"),
-        )
-    ):
-        total_today += int(row[0])
-    if total_today + req.amount_cents > lim["daily_max"]:
+    total_today = spent_today if spent_today is not None else _daily_spent_cents(s, [from_w.id]).get(from_w.id, 0)
+    if total_today + amount_cents > lim["daily_max"]:
         raise HTTPException(
             status_code=400, detail="Exceeds daily limit for KYC level"
         )
-    if from_w.balance_cents < req.amount_cents:
+    if from_w.balance_cents < amount_cents:
         raise HTTPException(status_code=400, detail="Insufficient funds")
-    # Settle balances
-    from_w.balance_cents -= req.amount_cents
-    to_w.balance_cents += req.amount_cents
-    txn_id = str(uuid.uuid4())
-    s.add(
+
+
+def _post_bill(s: Session, from_w: Wallet, to_w: Wallet, biller_code: str, reference: Optional[str], amount_cents: int, txn_id: Optional[str] = None) -> str:
+    """Move the money of one validated bill between locked wallets (Txn + ledger); callers own the commit."""
+    from_w.balance_cents -= amount_cents
+    to_w.balance_cents += amount_cents
+    txn_id = txn_id or str(uuid.uuid4())
+    bill_ref = (reference or "").strip()[:64] or None
+    _record_txn(
+        s,
         Txn(
             id=txn_id,
             from_wallet_id=from_w.id,
             to_wallet_id=to_w.id,
-            amount_cents=req.amount_cents,
+            amount_cents=amount_cents,
             kind="bill",
             fee_cents=0,
+            ref=bill_ref,
         )
     )
-    desc_meta = f"bill:{req.biller_code}"
-    if req.reference:
-        desc_meta += f" ref={req.reference}"
+    desc_meta = f"bill:{biller_code}"
+    if reference:
+        desc_meta += f" ref={reference}"
     s.add(
         LedgerEntry(
             id=str(uuid.uuid4()),
             wallet_id=from_w.id,
-            amount_cents=-req.amount_cents,
+            amount_cents=-amount_cents,
             txn_id=txn_id,
             description="bill_debit;" + desc_meta,
+            ref=bill_ref,
         )
     )
     s.add(
         LedgerEntry(
             id=str(uuid.uuid4()),
             wallet_id=to_w.id,
-            amount_cents=req.amount_cents,
+            amount_cents=amount_cents,
             txn_id=txn_id,
             description="bill_credit;" + desc_meta,
+            ref=bill_ref,
         )
     )
+    return txn_id
+
+
+@router.post("/bills/pay", response_model=WalletResp)
+def bills_pay(req: BillPayReq, request: Request, s: Session = Depends(get_session)):
+    if req.from_wallet_id == req.to_wallet_id:
+        raise HTTPException(status_code=400, detail="Cannot pay bill to same wallet")
+    # Lock wallets (canonical order)
+    locked = _lock_wallets(s, [req.from_wallet_id, req.to_wallet_id])
+    from_w = locked.get(req.from_wallet_id)
+    to_w = locked.get(req.to_wallet_id)
+    if not from_w or not to_w:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    if req.amount_cents <= 0:
+        raise HTTPException(status_code=400, detail="amount_cents must be > 0")
+    _check_bill_limits(s, from_w, req.amount_cents)
+    txn_id = _post_bill(s, from_w, to_w, req.biller_code, req.reference, req.amount_cents)
     bp = BillPayment(
         id=str(uuid.uuid4()),
         from_wallet_id=from_w.id,
@@ -1769,249 +2422,1069 @@ def bills_pay(req: BillPayReq, request: Request, s: Session = Depends(get_sessio
         currency=from_w.currency,
     )
 
-class TransferReq(BaseModel):
-    from_wallet_id: str
-    to_wallet_id: Optional[str] = None
-    to_alias: Optional[str] = None
-    amount_cents: int = Field(..., gt=0)
 
+class BillScheduleReq(BillPayReq):
+    scheduled_for: datetime
 
-@router.post("/transfer", response_model=WalletResp)
-def transfer(req: TransferReq, request: Request, s: Session = Depends(get_session)):
+
+class BillScheduleResp(BaseModel):
+    id: str
+    status: str
+    scheduled_for: datetime
+
+
+@router.post("/bills/schedule", response_model=BillScheduleResp)
+def bills_schedule(req: BillScheduleReq, s: Session = Depends(get_session)):
+    """Queue a bill for settlement by the bill_settlement job at scheduled_for."""
     if req.from_wallet_id == req.to_wallet_id:
-        raise HTTPException(status_code=400, detail="Cannot transfer to same wallet")
-    # Idempotency
-    ikey = request.headers.get("Idempotency-Key")
-    if ikey:
-        existed = s.scalar(select(Idempotency).where(Idempotency.ikey == ikey))
-        if existed:
-            w_id = existed.wallet_id or req.to_wallet_id
-            to_w0 = s.get(Wallet, w_id) if w_id else None
-            if not to_w0:
-                raise HTTPException(status_code=404, detail="Wallet not found")
-            bal = existed.balance_cents if existed.balance_cents is not None else to_w0.balance_cents
-            cur = existed.currency or to_w0.currency
-            return WalletResp(wallet_id=to_w0.id, balance_cents=bal, currency=cur)
-    # Resolve alias if provided
-    to_wallet_id = req.to_wallet_id
-    if not to_wallet_id and req.to_alias:
-        handle = req.to_alias.lstrip("@").strip().lower()
-        al = s.scalar(select(Alias).where(Alias.handle == handle, Alias.status == "active"))
-        if not al:
-            raise HTTPException(status_code=404, detail="Alias not found")
-        to_wallet_id = al.wallet_id
-    if not to_wallet_id:
-        raise HTTPException(status_code=400, detail="Missing destination wallet or alias")
-    # Lock both rows to avoid race
-    from_w = s.execute(select(Wallet).where(Wallet.id == req.from_wallet_id).with_for_update()).scalars().first()
-    to_w = s.execute(select(Wallet).where(Wallet.id == to_wallet_id).with_for_update()).scalars().first()
+        raise HTTPException(status_code=400, detail="Cannot pay bill to same wallet")
+    from_w = s.get(Wallet, req.from_wallet_id)
+    to_w = s.get(Wallet, req.to_wallet_id)
     if not from_w or not to_w:
         raise HTTPException(status_code=404, detail="Wallet not found")
-    # KYC checks on sender
-    u = s.get(User, from_w.user_id)
-    level = u.kyc_level if u else 0
-    lim = KYC_LIMITS.get(level, KYC_LIMITS[0])
-    if req.amount_cents > lim["tx_max"]:
-        raise HTTPException(status_code=400, detail="Exceeds per-transaction limit for KYC level")
-    # daily total
-    today = datetime.now(timezone.utc).date()
-    start = datetime.combine(today, datetime.min.time(), tzinfo=timezone.utc)
-    end = start + timedelta(days=1)
-    total_today = 0
-    for row in s.execute(
-        select(Txn.amount_cents).where(
-            Txn.from_wallet_id == from_w.id,
-            Txn.created_at >= start,
-            Txn.created_at < end,
-            ~Txn.kind.like("savings%"),
-        )
-    ):
-        total_today += int(row[0])
-    if total_today + req.amount_cents > lim["daily_max"]:
-        raise HTTPException(status_code=400, detail="Exceeds daily limit for KYC level")
+    when = _utc(req.scheduled_for)
+    bp = BillPayment(
+        id=str(uuid.uuid4()),
+        from_wallet_id=from_w.id,
+        to_wallet_id=to_w.id,
+        biller_code=req.biller_code,
+        reference=(req.reference or None),
+        amount_cents=req.amount_cents,
+        currency=from_w.currency,
+        status="scheduled",
+        txn_id=str(uuid.uuid4()),
+        scheduled_for=when,
+    )
+    s.add(bp)
+    s.commit()
+    return BillScheduleResp(id=bp.id, status=bp.status, scheduled_for=when)
 
-    if from_w.balance_cents < req.amount_cents:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
-    # Velocity limits (per-minute) for alias payments (sender-side)
-    if req.to_alias:
-        start_min = datetime.now(timezone.utc) - timedelta(seconds=60)
-        cnt = s.execute(
-            select(sa_func.count(Txn.id)).where(
-                Txn.from_wallet_id == from_w.id,
-                Txn.created_at >= start_min,
-                ~Txn.kind.like("savings%"),
-            )
-        ).scalar() or 0
-        if int(cnt) >= ALIAS_VELOCITY_MAX_TX:
-            raise HTTPException(status_code=429, detail="Too many transfers (alias velocity)")
-        sum_min = s.execute(
-            select(sa_func.coalesce(sa_func.sum(Txn.amount_cents), 0)).where(
-                Txn.from_wallet_id == from_w.id,
-                Txn.created_at >= start_min,
-                ~Txn.kind.like("savings%"),
-            )
-        ).scalar() or 0
-        if int(sum_min) + req.amount_cents > ALIAS_VELOCITY_MAX_CENTS:
-            raise HTTPException(status_code=429, detail="Amount velocity exceeded (alias)")
-        # Inbound alias velocity (receiver-side)
-        rx_cnt = s.execute(
-            select(sa_func.count(Txn.id)).where(
-                Txn.to_wallet_id == to_w.id,
-                Txn.created_at >= start_min,
-                ~Txn.kind.like("savings%"),
-            )
-        ).scalar() or 0
-        if int(rx_cnt) >= ALIAS_RX_VELOCITY_MAX_TX:
-            raise HTTPException(status_code=429, detail="Receiver busy (alias inbound velocity)")
-        rx_sum = s.execute(
-            select(sa_func.coalesce(sa_func.sum(Txn.amount_cents), 0)).where(
-                Txn.to_wallet_id == to_w.id,
-                Txn.created_at >= start_min,
-                ~Txn.kind.like("savings%"),
-            )
-        ).scalar() or 0
-        if int(rx_sum) + req.amount_cents > ALIAS_RX_VELOCITY_MAX_CENTS:
-            raise HTTPException(status_code=429, detail="Receiver amount velocity exceeded (alias)")
-        # Device/IP heuristic + risk score
-        try:
-            device_id = request.headers.get("X-Device-ID")
-            ip = request.client.host if request.client else None
-        except Exception:
-            device_id = None; ip = None
 
-        # Denylists (hard block)
-        reasons: list[str] = []
-        # Config denylists
-        if device_id and device_id in RISK_DENY_DEVICE_IDS:
-            retry_ms = _risk_backoff_ms(s, "device", device_id)
-            raise HTTPException(status_code=429, detail={"error":"device_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["device_denylist"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
-        if ip and any(_match_cidr_24(ip, pref) for pref in RISK_DENY_IP_PREFIXES):
-            retry_ms = _risk_backoff_ms(s, "ip", ip)
-            raise HTTPException(status_code=429, detail={"error":"ip_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["ip_denylist"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+@router.post("/bills/{bill_id}/cancel")
+def bills_cancel(bill_id: str, s: Session = Depends(get_session)):
+    res = s.execute(
+        sa_update(BillPayment)
+        .where(BillPayment.id == bill_id, BillPayment.status == "scheduled")
+        .values(status="cancelled")
+    )
+    s.commit()
+    if not res.rowcount:
+        raise HTTPException(status_code=409, detail="bill is not scheduled")
+    return {"ok": True, "id": bill_id, "status": "cancelled"}
 
-        # DB denylists
-        if device_id:
-            if s.scalar(select(RiskDeny).where(RiskDeny.kind=="device", RiskDeny.value==device_id)):
-                retry_ms = _risk_backoff_ms(s, "device", device_id)
-                raise HTTPException(status_code=429, detail={"error":"device_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["device_denylist_db"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
-        if ip:
-            # brute check any row; for /24 values we use matcher; otherwise exact equal
-            for row in s.execute(select(RiskDeny).where(RiskDeny.kind=="ip")).scalars().all():
-                if ("/24" in row.value and _match_cidr_24(ip, row.value)) or ("/24" not in row.value and ip == row.value):
-                    retry_ms = _risk_backoff_ms(s, "ip", ip)
-                    raise HTTPException(status_code=429, detail={"error":"ip_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["ip_denylist_db"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
 
-        # record event
-        s.add(AliasDeviceEvent(id=str(uuid.uuid4()), handle=(req.to_alias.lstrip("@") if req.to_alias else None), to_wallet_id=to_w.id, device_id=device_id, ip=ip))
+def _lock_wallets(s: Session, wallet_ids) -> Dict[str, Wallet]:
+    """
+    Lock a set of wallet rows in canonical order (sorted wallet id).
 
-        wnd5 = datetime.now(timezone.utc) - timedelta(minutes=5)
-        dev_cnt5 = 0
-        ip_cnt5 = 0
-        if device_id:
-            dev_cnt5 = int(s.execute(select(sa_func.count(AliasDeviceEvent.id)).where(AliasDeviceEvent.device_id == device_id, AliasDeviceEvent.created_at >= wnd5)).scalar() or 0)
-        if ip:
-            ip_cnt5 = int(s.execute(select(sa_func.count(AliasDeviceEvent.id)).where(AliasDeviceEvent.ip == ip, AliasDeviceEvent.created_at >= wnd5)).scalar() or 0)
+    All multi-wallet write paths go through here so that concurrent
+    A->B and B->A transfers always queue on the same row first and can
+    never deadlock each other under Postgres.
+    """
+    ids = sorted({wid for wid in wallet_ids if wid})
+    if not ids:
+        return {}
+    rows = s.execute(
+        select(Wallet)
+        .where(Wallet.id.in_(ids))
+        .order_by(Wallet.id)
+        .with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalars().all()
+    return {w.id: w for w in rows}
 
-        # per-minute device velocity (hard cap)
-        dev_cnt1 = 0
-        if device_id:
-            dev_cnt1 = int(s.execute(select(sa_func.count(AliasDeviceEvent.id)).where(AliasDeviceEvent.to_wallet_id == to_w.id, AliasDeviceEvent.device_id == device_id, AliasDeviceEvent.created_at >= start_min)).scalar() or 0)
-            if dev_cnt1 > ALIAS_DEVICE_MAX_TX_PER_MIN:
-                retry_ms = _risk_backoff_ms(s, "device", device_id)
-                raise HTTPException(status_code=429, detail={"error":"device_velocity","retry_after_ms": retry_ms, "score": None, "reasons":["device_per_min_cap"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
 
-        # risk score (5-min window)
-        score = 0
-        if not device_id:
-            score += 1
-        if not ip:
-            score += 1
-        # UA parsing (basic)
-        try:
-            ua = request.headers.get("User-Agent", "")
-        except Exception:
-            ua = ""
-        if not ua:
-            score += 1; reasons.append("ua_missing")
+SYSTEM_ACCOUNT_ROLES = ("fee", "treasury", "redpacket_escrow", "savings")
+_SYSTEM_ACCOUNTS_GENERATION = "system_accounts"
+
+
+def _system_account_phones() -> Dict[str, str]:
+    return {
+        "fee": FEE_WALLET_PHONE,
+        "treasury": TREASURY_WALLET_PHONE,
+        "redpacket_escrow": REDPACKET_ESCROW_WALLET_PHONE,
+        "savings": SAVINGS_WALLET_PHONE,
+    }
+
+
+class _SystemAccounts:
+    def __init__(self, bind, generation: Optional[int], ids: Dict[str, str], complete: bool):
+        self.bind = bind
+        self.generation = generation
+        self.ids = MappingProxyType(dict(ids))
+        # False while a configured role has no wallet yet: keep re-resolving
+        self.complete = complete
+        self.checked_at = _time.monotonic()
+
+
+_system_accounts: Optional[_SystemAccounts] = None
+_system_accounts_lock = _threading.Lock()
+
+
+def _phone_wallet_id(s: Session, phone: str) -> Optional[str]:
+    return s.scalar(select(Wallet.id).join(User, User.id == Wallet.user_id).where(User.phone == phone).limit(1))
+
+
+def _load_system_accounts(s: Session) -> tuple[Dict[str, str], bool]:
+    ids: Dict[str, str] = {}
+    try:
+        for role, wallet_id in s.execute(select(SystemAccount.role, SystemAccount.wallet_id)).all():
+            ids[role] = wallet_id
+    except Exception:
+        # Table not there yet (e.g. before migrations): phones only
+        s.rollback()
+    complete = True
+    for role, phone in _system_account_phones().items():
+        if role in ids or not phone:
+            continue
+        wid = _phone_wallet_id(s, phone)
+        if wid:
+            ids[role] = wid
         else:
-            final_ua = ua.lower()
-            if any(b in final_ua for b in ["curl","python-requests","bot","crawler"]):
-                score += 2; reasons.append("ua_suspect")
+            complete = False
+    return ids, complete
 
-        score += dev_cnt5 // 3
-        score += ip_cnt5 // 10
 
-        if score >= RISK_SCORE_THRESHOLD:
-            retry_ms = _risk_backoff_ms(s, "device", device_id) if device_id else _risk_backoff_ms(s, "ip", ip)
-            raise HTTPException(status_code=429, detail={"error":"risk_score","retry_after_ms": retry_ms, "score": score, "reasons": reasons}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
-    # fees
-    fee_cents = (req.amount_cents * MERCHANT_FEE_BPS) // 10_000 if MERCHANT_FEE_BPS > 0 else 0
-    net = req.amount_cents - fee_cents
-    if net < 0:
-        raise HTTPException(status_code=400, detail="Amount too small for fees")
-    # settle (balances)
-    from_w.balance_cents -= req.amount_cents
-    to_w.balance_cents += net
-    # fee wallet
-    fee_w = None
-    if FEE_WALLET_PHONE and fee_cents > 0:
-        fu = s.scalar(select(User).where(User.phone == FEE_WALLET_PHONE))
-        fee_w = s.scalar(select(Wallet).where(Wallet.user_id == fu.id)) if fu else None
-        if fee_w:
-            fee_w.balance_cents += fee_cents
-    txn_id = str(uuid.uuid4())
-    s.add(Txn(id=txn_id, from_wallet_id=from_w.id, to_wallet_id=to_w.id, amount_cents=req.amount_cents, kind="transfer", fee_cents=fee_cents))
-    # ledger dual-write
-    merch = request.headers.get("X-Merchant")
-    ref = request.headers.get("X-Ref")
-    meta = []
-    if merch:
-        meta.append(f"m={merch}")
-    if ref:
-        meta.append(f"ref={ref}")
-    meta_str = (" "+" ".join(meta)) if meta else ""
-    s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=from_w.id, amount_cents=-req.amount_cents, txn_id=txn_id, description=("transfer_debit"+meta_str)))
-    s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=to_w.id, amount_cents=+net, txn_id=txn_id, description=("transfer_credit"+meta_str)))
-    if fee_w and fee_cents > 0:
-        s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=fee_w.id, amount_cents=+fee_cents, txn_id=txn_id, description="fee_credit"))
-    if ikey:
-        s.add(Idempotency(id=str(uuid.uuid4()), ikey=ikey, endpoint="transfer", txn_id=txn_id, amount_cents=req.amount_cents, currency=from_w.currency, wallet_id=to_w.id, balance_cents=to_w.balance_cents))
-    s.commit()
-    s.refresh(to_w)
-    return WalletResp(wallet_id=to_w.id, balance_cents=to_w.balance_cents, currency=to_w.currency)
+def _system_wallets(s: Session) -> MappingProxyType:
+    """
+    Immutable role -> wallet_id map of the system accounts for this process.
 
+    Resolved once from system_accounts (falling back to the configured
+    phones) and only reloaded after an admin change bumped the
+    "system_accounts" generation, which is re-read at most every
+    SYSTEM_ACCOUNTS_REFRESH_SECS.
+    """
+    global _system_accounts
+    bind = s.get_bind()
+    cur = _system_accounts
+    if cur is not None and cur.bind is bind and _time.monotonic() - cur.checked_at < SYSTEM_ACCOUNTS_REFRESH_SECS:
+        return cur.ids
+    gen = _read_generation(s, _SYSTEM_ACCOUNTS_GENERATION)
+    if cur is not None and cur.bind is bind and cur.complete and gen is not None and gen == cur.generation:
+        cur.checked_at = _time.monotonic()
+        return cur.ids
+    with _system_accounts_lock:
+        ids, complete = _load_system_accounts(s)
+        _system_accounts = _SystemAccounts(bind, gen, ids, complete)
+    return _system_accounts.ids
 
-@router.get("/wallets/{wallet_id}", response_model=WalletResp)
-def get_wallet(wallet_id: str, s: Session = Depends(get_session)):
-    w = s.get(Wallet, wallet_id)
-    if not w:
-        raise HTTPException(status_code=404, detail="Wallet not found")
-    return WalletResp(wallet_id=w.id, balance_cents=w.balance_cents, currency=w.currency)
 
+def _invalidate_system_accounts() -> None:
+    global _system_accounts
+    _system_accounts = None
 
-class TxnItem(BaseModel):
-    id: str
-    from_wallet_id: Optional[str]
-    to_wallet_id: str
-    amount_cents: int
-    fee_cents: int
-    kind: str
-    created_at: Optional[datetime]
-    meta: Optional[str] = None
 
+def _system_wallet_id(s: Session, role: str) -> Optional[str]:
+    return _system_wallets(s).get(role)
 
-@router.get("/txns", response_model=List[TxnItem])
-def list_txns(wallet_id: str, limit: int = 50, s: Session = Depends(get_session)):
-    if limit < 1 or limit > 200:
-        limit = 50
+
+def _fee_wallet_id(s: Session) -> Optional[str]:
+    return _system_wallet_id(s, "fee")
+
+
+def seed_system_accounts(s: Session) -> Dict[str, str]:
+    """Record configured system wallets that have no registry row yet (admin changes win)."""
+    existing = set(s.execute(select(SystemAccount.role)).scalars().all())
+    now = datetime.now(timezone.utc)
+    added: Dict[str, str] = {}
+    for role, phone in _system_account_phones().items():
+        if role in existing or not phone:
+            continue
+        wid = _phone_wallet_id(s, phone)
+        if wid:
+            s.add(SystemAccount(role=role, wallet_id=wid, updated_at=now))
+            added[role] = wid
+    if added:
+        _bump_generation(s, _SYSTEM_ACCOUNTS_GENERATION)
+    s.commit()
+    _invalidate_system_accounts()
+    return added
+
+
+def _fee_wallet_locks(s: Session, amounts) -> tuple[Optional[str], Optional[str]]:
+    """
+    (fee wallet id, id to lock) for a transfer of amounts: with
+    FEE_ACCRUAL_BATCHED the fee wallet row is not locked, fees are queued.
+    """
+    if not any(_fee_for(a) > 0 for a in amounts):
+        return None, None
+    fee_wallet_id = _fee_wallet_id(s)
+    return fee_wallet_id, (None if FEE_ACCRUAL_BATCHED else fee_wallet_id)
+
+
+def flush_fee_accruals(s: Session, batch: Optional[int] = None, max_batches: Optional[int] = None) -> dict:
+    """
+    Fold queued fee_accruals rows into their wallets' balances, one locked
+    update per wallet and chunk. The fee_credit ledger rows were already
+    written with each transfer.
+    """
+    batch = max(1, int(batch or FEE_ACCRUAL_FLUSH_BATCH))
+    max_batches = max(1, int(max_batches or EXPIRY_SWEEP_MAX_BATCHES))
+    credited = {"cents": 0}
+
+    def apply(ids: List[str]) -> int:
+        sums = s.execute(
+            select(FeeAccrual.wallet_id, sa_func.sum(FeeAccrual.fee_cents), sa_func.count())
+            .where(FeeAccrual.txn_id.in_(ids))
+            .group_by(FeeAccrual.wallet_id)
+        ).all()
+        locked = _lock_wallets(s, [r[0] for r in sums])
+        n = 0
+        for wallet_id, cents, cnt in sums:
+            w = locked.get(wallet_id)
+            if w is None:
+                continue
+            w.balance_cents += int(cents or 0)
+            credited["cents"] += int(cents or 0)
+            n += int(cnt or 0)
+        s.execute(sa_delete(FeeAccrual).where(FeeAccrual.txn_id.in_(ids), FeeAccrual.wallet_id.in_(list(locked))).execution_options(synchronize_session=False))
+        return n
+
+    rows = _sweep_chunks(s, select(FeeAccrual.txn_id).order_by(FeeAccrual.txn_id), apply, batch, max_batches)
+    return {"accruals": rows, "cents": credited["cents"]}
+
+
+def _run_fee_accrual_flush() -> dict:
+    with Session(engine) as s:
+        return flush_fee_accruals(s)
+
+
+class SystemAccountSetReq(BaseModel):
+    role: str
+    wallet_id: str
+
+
+@router.get("/admin/system_accounts")
+def admin_system_accounts(s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    pending = s.execute(select(sa_func.count(), sa_func.coalesce(sa_func.sum(FeeAccrual.fee_cents), 0))).one()
+    return {
+        "accounts": dict(_system_wallets(s)),
+        "fee_accrual_batched": FEE_ACCRUAL_BATCHED,
+        "pending_fee_accruals": int(pending[0] or 0),
+        "pending_fee_cents": int(pending[1] or 0),
+    }
+
+
+@router.post("/admin/system_accounts")
+def admin_system_accounts_set(req: SystemAccountSetReq, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    role = req.role.strip().lower()
+    if role not in SYSTEM_ACCOUNT_ROLES:
+        raise HTTPException(status_code=400, detail="unknown role")
+    if not s.get(Wallet, req.wallet_id):
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    row = s.get(SystemAccount, role, with_for_update=True)
+    now = datetime.now(timezone.utc)
+    if row is None:
+        s.add(SystemAccount(role=role, wallet_id=req.wallet_id, updated_at=now))
+    else:
+        row.wallet_id = req.wallet_id
+        row.updated_at = now
+    _bump_generation(s, _SYSTEM_ACCOUNTS_GENERATION)
+    s.commit()
+    _invalidate_system_accounts()
+    return {"ok": True, "role": role, "wallet_id": req.wallet_id}
+
+
+@router.post("/admin/fees/flush")
+def admin_fees_flush(s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    return flush_fee_accruals(s)
+
+
+def _fee_for(amount_cents: int) -> int:
+    return (amount_cents * MERCHANT_FEE_BPS) // 10_000 if MERCHANT_FEE_BPS > 0 else 0
+
+
+def _kyc_limits_for(s: Session, w: Wallet) -> dict:
+    u = s.get(User, w.user_id)
+    level = u.kyc_level if u else 0
+    return KYC_LIMITS.get(level, KYC_LIMITS[0])
+
+
+def _utc_day_bounds(now: Optional[datetime] = None) -> tuple[datetime, datetime]:
+    today = (now or datetime.now(timezone.utc)).date()
+    start = datetime.combine(today, datetime.min.time(), tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+_DAY_SECS = 86400
+
+
+def _velocity_bucket(ts: datetime, secs: int) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    epoch = int(ts.timestamp())
+    return epoch - (epoch % secs)
+
+
+def _bump_velocity(s: Session, scope: str, subject: Optional[str], amount_cents: int = 0, at: Optional[datetime] = None) -> None:
+    """
+    Add one event to the day bucket and the short-window bucket of (scope, subject).
+
+    Runs in the caller's transaction; Postgres/SQLite use a single upsert per
+    bucket, other dialects fall back to a locked read-modify-write.
+    """
+    if not subject:
+        return
+    now = at or datetime.now(timezone.utc)
+    tbl = VelocityCounter.__table__
+    dialect = s.get_bind().dialect.name
+    for secs in (_DAY_SECS, VELOCITY_BUCKET_SECS):
+        key = {"scope": scope, "subject": subject, "bucket_secs": secs, "bucket_start": _velocity_bucket(now, secs)}
+        if dialect in ("postgresql", "sqlite"):
+            ins = (_pg_insert if dialect == "postgresql" else _sqlite_insert)(tbl).values(**key, txn_count=1, amount_cents=amount_cents)
+            s.execute(
+                ins.on_conflict_do_update(
+                    index_elements=[tbl.c.scope, tbl.c.subject, tbl.c.bucket_secs, tbl.c.bucket_start],
+                    set_={
+                        "txn_count": tbl.c.txn_count + ins.excluded.txn_count,
+                        "amount_cents": tbl.c.amount_cents + ins.excluded.amount_cents,
+                    },
+                )
+            )
+            continue
+        row = s.get(VelocityCounter, tuple(key.values()), with_for_update=True)
+        if row is None:
+            s.add(VelocityCounter(**key, txn_count=1, amount_cents=amount_cents))
+        else:
+            row.txn_count += 1
+            row.amount_cents += amount_cents
+        s.flush()
+
+
+def _velocity_window(s: Session, scope: str, subjects, window_secs: int) -> Dict[str, tuple[int, int]]:
+    """
+    (count, amount_cents) per subject over roughly the last window_secs.
+
+    The oldest bucket is included whole, so the window errs on the strict side
+    by at most VELOCITY_BUCKET_SECS.
+    """
+    ids = list({sub for sub in subjects if sub})
+    if not ids:
+        return {}
+    since = _velocity_bucket(datetime.now(timezone.utc) - timedelta(seconds=window_secs), VELOCITY_BUCKET_SECS)
     rows = s.execute(
-        select(Txn).where(
-            (Txn.from_wallet_id == wallet_id) | (Txn.to_wallet_id == wallet_id)
-        ).order_by(Txn.created_at.desc()).limit(limit)
-    ).scalars().all()
+        select(
+            VelocityCounter.subject,
+            sa_func.coalesce(sa_func.sum(VelocityCounter.txn_count), 0),
+            sa_func.coalesce(sa_func.sum(VelocityCounter.amount_cents), 0),
+        )
+        .where(
+            VelocityCounter.scope == scope,
+            VelocityCounter.subject.in_(ids),
+            VelocityCounter.bucket_secs == VELOCITY_BUCKET_SECS,
+            VelocityCounter.bucket_start >= since,
+        )
+        .group_by(VelocityCounter.subject)
+    ).all()
+    out = {sub: (0, 0) for sub in ids}
+    for sub, cnt, total in rows:
+        out[str(sub)] = (int(cnt or 0), int(total or 0))
+    return out
+
+
+def _record_txn(s: Session, txn: Txn, count_sender: bool = True) -> Txn:
+    """
+    Add a Txn with its wallet_activity rows and bump the sender/receiver
+    velocity counters with it.
+
+    Savings moves are internal to a user and never count towards limits.
+    count_sender=False is for payouts whose sender was already counted
+    up front (presplit red packets are counted in full at issue).
+    """
+    if txn.created_at is None:
+        txn.created_at = datetime.now(timezone.utc)
+    s.add(txn)
+    s.add_all(_wallet_activity_rows(txn))
+    if not (txn.kind or "").startswith("savings"):
+        if count_sender:
+            _bump_velocity(s, "wallet_out", txn.from_wallet_id, txn.amount_cents)
+        _bump_velocity(s, "wallet_in", txn.to_wallet_id, txn.amount_cents)
+    return txn
+
+
+def _wallet_activity_rows(txn: Txn) -> List[WalletActivity]:
+    common = dict(
+        txn_id=txn.id,
+        created_at=txn.created_at,
+        amount_cents=txn.amount_cents,
+        fee_cents=txn.fee_cents or 0,
+        kind=txn.kind,
+    )
+    if txn.from_wallet_id and txn.from_wallet_id == txn.to_wallet_id:
+        return [WalletActivity(wallet_id=txn.to_wallet_id, direction="self", counterparty_wallet_id=txn.to_wallet_id, **common)]
+    rows = []
+    if txn.from_wallet_id:
+        rows.append(WalletActivity(wallet_id=txn.from_wallet_id, direction="out", counterparty_wallet_id=txn.to_wallet_id, **common))
+    if txn.to_wallet_id:
+        rows.append(WalletActivity(wallet_id=txn.to_wallet_id, direction="in", counterparty_wallet_id=txn.from_wallet_id, **common))
+    return rows
+
+
+# Stands in for a missing created_at, so legacy rows sort oldest
+_CREATED_AT_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def backfill_txn_created_at(s: Session) -> dict:
+    """
+    Set created_at on legacy txns / wallet_activity rows that have none.
+
+    Both tables are keyset-paged on created_at (exports, list_txns), and a
+    NULL key never compares true against a cursor, which ended the paging
+    early. Set-based and safe to re-run.
+    """
+    out = {}
+    for name, model in (("txns", Txn), ("wallet_activity", WalletActivity)):
+        res = s.execute(
+            sa_update(model)
+            .where(model.created_at.is_(None))
+            .values(created_at=_CREATED_AT_EPOCH)
+            .execution_options(synchronize_session=False)
+        )
+        out[name] = int(res.rowcount or 0)
+    s.commit()
+    return out
+
+
+def backfill_wallet_activity(s: Session) -> int:
+    """
+    Derive wallet_activity rows for txns written before the table existed.
+    Set-based (one INSERT ... SELECT per direction) and safe to re-run.
+    """
+    cols = ["wallet_id", "txn_id", "created_at", "direction", "amount_cents", "fee_cents", "counterparty_wallet_id", "kind"]
+    wa = WalletActivity.__table__.alias("wa")
+    total = 0
+    for direction, own, other, cond in (
+        ("out", Txn.from_wallet_id, Txn.to_wallet_id, and_(Txn.from_wallet_id.is_not(None), Txn.from_wallet_id != Txn.to_wallet_id)),
+        ("in", Txn.to_wallet_id, Txn.from_wallet_id, or_(Txn.from_wallet_id.is_(None), Txn.from_wallet_id != Txn.to_wallet_id)),
+        ("self", Txn.to_wallet_id, Txn.to_wallet_id, Txn.from_wallet_id == Txn.to_wallet_id),
+    ):
+        src = select(
+            own,
+            Txn.id,
+            Txn.created_at,
+            sa_literal(direction),
+            Txn.amount_cents,
+            sa_func.coalesce(Txn.fee_cents, 0),
+            other,
+            Txn.kind,
+        ).where(
+            cond,
+            own.is_not(None),
+            ~select(wa.c.txn_id).where(wa.c.wallet_id == own, wa.c.txn_id == Txn.id).exists(),
+        )
+        res = s.execute(sa_insert(WalletActivity).from_select(cols, src))
+        total += int(res.rowcount or 0)
+    s.commit()
+    return total
+
+
+def _record_alias_device_event(s: Session, ev: AliasDeviceEvent) -> None:
+    s.add(ev)
+    _bump_velocity(s, "device", ev.device_id)
+    _bump_velocity(s, "ip", ev.ip)
+    if ev.device_id:
+        _bump_velocity(s, "device_wallet", f"{ev.to_wallet_id}|{ev.device_id}")
+
+
+def _daily_spent_cents(s: Session, wallet_ids) -> Dict[str, int]:
+    """
+    Outgoing volume per wallet for the current UTC day (savings moves excluded).
+    """
+    ids = list({wid for wid in wallet_ids if wid})
+    if not ids:
+        return {}
+    rows = s.execute(
+        select(VelocityCounter.subject, VelocityCounter.amount_cents).where(
+            VelocityCounter.scope == "wallet_out",
+            VelocityCounter.subject.in_(ids),
+            VelocityCounter.bucket_secs == _DAY_SECS,
+            VelocityCounter.bucket_start == _velocity_bucket(datetime.now(timezone.utc), _DAY_SECS),
+        )
+    ).all()
+    out = {wid: 0 for wid in ids}
+    for wid, total in rows:
+        out[str(wid)] = int(total or 0)
+    return out
+
+
+def _prune_velocity_counters(
+    s: Session,
+    now: Optional[datetime] = None,
+    batch: Optional[int] = None,
+    max_batches: int = 1,
+) -> int:
+    """
+    Drop expired window/day buckets. Returns the number of rows removed.
+
+    Without batch each kind goes in one DELETE (inside the caller's
+    transaction). With batch, up to max_batches chunks of batch rows are
+    deleted per kind via ix_velocity_counters_bucket, committing per chunk.
+    """
+    now = now or datetime.now(timezone.utc)
+    win_cut = int(now.timestamp()) - VELOCITY_WINDOW_RETENTION_SECS
+    day_cut = _velocity_bucket(now - timedelta(days=VELOCITY_DAY_RETENTION_DAYS), _DAY_SECS)
+    expired = (
+        (VelocityCounter.bucket_secs != _DAY_SECS, VelocityCounter.bucket_start < win_cut),
+        (VelocityCounter.bucket_secs == _DAY_SECS, VelocityCounter.bucket_start < day_cut),
+    )
+    if not batch:
+        removed = 0
+        for cond in expired:
+            res = s.execute(sa_delete(VelocityCounter).where(*cond))
+            removed += int(res.rowcount or 0)
+        return removed
+    pk = (VelocityCounter.scope, VelocityCounter.subject, VelocityCounter.bucket_secs, VelocityCounter.bucket_start)
+    removed = 0
+    for cond in expired:
+        for _ in range(max(1, max_batches)):
+            keys = [tuple(r) for r in s.execute(
+                select(*pk).where(*cond).order_by(VelocityCounter.bucket_secs, VelocityCounter.bucket_start).limit(batch)
+            ).all()]
+            if not keys:
+                break
+            res = s.execute(
+                sa_delete(VelocityCounter)
+                .where(sa_tuple(*pk).in_(keys))
+                .execution_options(synchronize_session=False)
+            )
+            removed += int(res.rowcount or 0)
+            s.commit()
+            if len(keys) < batch:
+                break
+    return removed
+
+
+def rebuild_velocity_counters(s: Session, since_days: int = 1) -> dict:
+    """
+    Recompute velocity counters from txns and alias_device_events.
+
+    Day buckets are rebuilt for the last since_days UTC days (today included),
+    short-window buckets only for the retention window. Existing counters in
+    that range are replaced in one transaction.
+
+    The rebuild is serialised against _bump_velocity: it takes the counter
+    table's write lock before scanning (LOCK TABLE on Postgres; elsewhere
+    the leading DELETE takes the database write lock), so a transfer either
+    committed before the scan or bumps its counters after the rebuild
+    commits. Transfers wait for it meanwhile.
+    """
+    now = datetime.now(timezone.utc)
+    day0 = _velocity_bucket(now - timedelta(days=max(0, since_days - 1)), _DAY_SECS)
+    if s.get_bind().dialect.name == "postgresql":
+        # EXCLUSIVE conflicts with the upserts' ROW EXCLUSIVE but not with reads
+        s.execute(sa_text(f"LOCK TABLE {VelocityCounter.__table__.fullname} IN EXCLUSIVE MODE"))
+    s.execute(sa_delete(VelocityCounter).where(VelocityCounter.bucket_start >= day0))
+    cutoff = datetime.fromtimestamp(day0, tz=timezone.utc)
+    win0 = int(now.timestamp()) - VELOCITY_WINDOW_RETENTION_SECS
+    acc: Dict[tuple, list] = {}
+
+    def _add(scope: str, subject: Optional[str], ts, amount: int) -> None:
+        if not subject or ts is None:
+            return
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        buckets = [_DAY_SECS]
+        if ts.timestamp() >= win0:
+            buckets.append(VELOCITY_BUCKET_SECS)
+        for secs in buckets:
+            c = acc.setdefault((scope, subject, secs, _velocity_bucket(ts, secs)), [0, 0])
+            c[0] += 1
+            c[1] += amount
+
+    n_txns = 0
+    q = (
+        select(Txn.from_wallet_id, Txn.to_wallet_id, Txn.amount_cents, Txn.created_at)
+        .where(Txn.created_at >= cutoff, ~Txn.kind.like("savings%"))
+        .execution_options(yield_per=1000)
+    )
+    for from_id, to_id, amount, ts in s.execute(q):
+        n_txns += 1
+        _add("wallet_out", from_id, ts, int(amount or 0))
+        _add("wallet_in", to_id, ts, int(amount or 0))
+    n_events = 0
+    q = (
+        select(AliasDeviceEvent.to_wallet_id, AliasDeviceEvent.device_id, AliasDeviceEvent.ip, AliasDeviceEvent.created_at)
+        .where(AliasDeviceEvent.created_at >= cutoff)
+        .execution_options(yield_per=1000)
+    )
+    for to_id, device_id, ip, ts in s.execute(q):
+        n_events += 1
+        _add("device", device_id, ts, 0)
+        _add("ip", ip, ts, 0)
+        if device_id:
+            _add("device_wallet", f"{to_id}|{device_id}", ts, 0)
+
+    pruned = _prune_velocity_counters(s, now)
+    rows = [
+        {"scope": k[0], "subject": k[1], "bucket_secs": k[2], "bucket_start": k[3], "txn_count": v[0], "amount_cents": v[1]}
+        for k, v in acc.items()
+    ]
+    for i in range(0, len(rows), 1000):
+        s.execute(sa_insert(VelocityCounter), rows[i : i + 1000])
+    s.commit()
+    return {
+        "since": cutoff.isoformat(),
+        "txns": n_txns,
+        "device_events": n_events,
+        "counters": len(rows),
+        "pruned": pruned,
+    }
+
+
+def _norm_merchant_id(merchant: Optional[str]) -> Optional[str]:
+    m = (merchant or "").strip().lower()
+    return m[:64] or None
+
+
+_META_MERCHANT_RE = re.compile(r"(?:^|[\s;])m=([^\s;]+)")
+_META_REF_RE = re.compile(r"(?:^|[\s;])ref=([^\s;]+)")
+
+
+def _parse_ledger_meta(description: Optional[str]) -> tuple[Optional[str], Optional[str]]:
+    """(merchant_id, ref) from a legacy "... m=<merchant> ref=<ref>" description."""
+    desc = description or ""
+    m = _META_MERCHANT_RE.search(desc)
+    r = _META_REF_RE.search(desc)
+    return (_norm_merchant_id(m.group(1)) if m else None), ((r.group(1)[:64] or None) if r else None)
+
+
+def backfill_merchant_refs(s: Session, batch: int = 1000) -> dict:
+    """
+    Fill merchant_id/ref on legacy ledger entries and their txns by parsing
+    the description tags. Walks ledger ids in order so every candidate row is
+    parsed once; safe to re-run.
+    """
+    last = ""
+    n_ledger = n_txns = 0
+    while True:
+        rows = s.execute(
+            select(LedgerEntry.id, LedgerEntry.txn_id, LedgerEntry.amount_cents, LedgerEntry.description)
+            .where(
+                LedgerEntry.id > last,
+                LedgerEntry.merchant_id.is_(None),
+                LedgerEntry.ref.is_(None),
+                or_(LedgerEntry.description.like("%m=%"), LedgerEntry.description.like("%ref=%")),
+            )
+            .order_by(LedgerEntry.id)
+            .limit(batch)
+        ).all()
+        if not rows:
+            break
+        last = rows[-1][0]
+        le_updates = []
+        per_txn: Dict[str, dict] = {}
+        for le_id, txn_id, amount, desc in rows:
+            mid, ref = _parse_ledger_meta(desc)
+            if not (mid or ref):
+                continue
+            le_updates.append({"id": le_id, "merchant_id": mid, "ref": ref})
+            # The debit leg wins; any tagged leg is better than none
+            if txn_id and ((amount or 0) < 0 or txn_id not in per_txn):
+                per_txn[txn_id] = {"id": txn_id, "merchant_id": mid, "ref": ref}
+        if le_updates:
+            s.execute(sa_update(LedgerEntry), le_updates)
+        if per_txn:
+            existing = s.execute(
+                select(Txn.id).where(Txn.id.in_(list(per_txn)), Txn.merchant_id.is_(None), Txn.ref.is_(None))
+            ).scalars().all()
+            if existing:
+                s.execute(sa_update(Txn), [per_txn[tid] for tid in existing])
+            n_txns += len(existing)
+        n_ledger += len(le_updates)
+        s.commit()
+    return {"ledger_entries": n_ledger, "txns": n_txns}
+
+
+def _transfer_meta(merchant: Optional[str], ref: Optional[str], extra: Optional[str] = None) -> str:
+    meta = []
+    if merchant:
+        meta.append(f"m={merchant}")
+    if ref:
+        meta.append(f"ref={ref}")
+    if extra:
+        meta.append(extra)
+    return (" " + " ".join(meta)) if meta else ""
+
+
+def _post_transfer(
+    s: Session,
+    from_w: Wallet,
+    to_w: Wallet,
+    amount_cents: int,
+    fee_w: Optional[Wallet] = None,
+    meta_str: str = "",
+    merchant: Optional[str] = None,
+    ref: Optional[str] = None,
+    fee_wallet_id: Optional[str] = None,
+) -> tuple[str, int, int]:
+    """
+    Settle one already-validated transfer between locked wallets.
+
+    Moves balances, writes the Txn and the ledger dual-write and returns
+    (txn_id, fee_cents, net_cents). Callers own the commit. The fee goes to
+    the locked fee_w, or is queued as a FeeAccrual for fee_wallet_id.
+    """
+    merchant_id = _norm_merchant_id(merchant)
+    ref = (ref or "").strip()[:64] or None
+    fee_cents = _fee_for(amount_cents)
+    net = amount_cents - fee_cents
+    if net < 0:
+        raise HTTPException(status_code=400, detail="Amount too small for fees")
+    from_w.balance_cents -= amount_cents
+    to_w.balance_cents += net
+    if fee_w and fee_cents > 0:
+        fee_w.balance_cents += fee_cents
+    txn_id = str(uuid.uuid4())
+    _record_txn(s, Txn(id=txn_id, from_wallet_id=from_w.id, to_wallet_id=to_w.id, amount_cents=amount_cents, kind="transfer", fee_cents=fee_cents, merchant_id=merchant_id, ref=ref))
+    s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=from_w.id, amount_cents=-amount_cents, txn_id=txn_id, description=("transfer_debit"+meta_str), merchant_id=merchant_id, ref=ref))
+    s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=to_w.id, amount_cents=+net, txn_id=txn_id, description=("transfer_credit"+meta_str), merchant_id=merchant_id, ref=ref))
+    if fee_w and fee_cents > 0:
+        s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=fee_w.id, amount_cents=+fee_cents, txn_id=txn_id, description="fee_credit"))
+    elif fee_wallet_id and fee_cents > 0 and FEE_ACCRUAL_BATCHED:
+        s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=fee_wallet_id, amount_cents=+fee_cents, txn_id=txn_id, description="fee_credit"))
+        s.add(FeeAccrual(txn_id=txn_id, wallet_id=fee_wallet_id, fee_cents=fee_cents, created_at=datetime.now(timezone.utc)))
+    return txn_id, fee_cents, net
+
+
+class TransferReq(BaseModel):
+    from_wallet_id: str
+    to_wallet_id: Optional[str] = None
+    to_alias: Optional[str] = None
+    amount_cents: int = Field(..., gt=0)
+
+
+@router.post("/transfer", response_model=WalletResp)
+def transfer(req: TransferReq, request: Request, s: Session = Depends(get_session)):
+    if req.from_wallet_id == req.to_wallet_id:
+        raise HTTPException(status_code=400, detail="Cannot transfer to same wallet")
+    # Idempotency: replay the stored body without touching wallets
+    ikey = request.headers.get("Idempotency-Key")
+    if ikey:
+        existed = _idem_lookup(s, ikey, "transfer", req.from_wallet_id)
+        if existed is not None:
+            return WalletResp(**_json.loads(existed.response))
+    # Resolve alias if provided
+    to_wallet_id = req.to_wallet_id
+    if not to_wallet_id and req.to_alias:
+        handle = req.to_alias.lstrip("@").strip().lower()
+        hit = _resolve_alias(s, handle)
+        if hit is None:
+            raise HTTPException(status_code=404, detail="Alias not found")
+        to_wallet_id = hit[0]
+    if not to_wallet_id:
+        raise HTTPException(status_code=400, detail="Missing destination wallet or alias")
+    # Lock sender, receiver and fee wallet in canonical order to avoid races and deadlocks
+    fee_wallet_id, fee_lock_id = _fee_wallet_locks(s, [req.amount_cents])
+    locked = _lock_wallets(s, [req.from_wallet_id, to_wallet_id, fee_lock_id])
+    # A concurrent duplicate may have committed while we waited for the sender lock
+    if ikey:
+        existed = _idem_lookup(s, ikey, "transfer", req.from_wallet_id)
+        if existed is not None:
+            s.rollback()
+            return WalletResp(**_json.loads(existed.response))
+    from_w = locked.get(req.from_wallet_id)
+    to_w = locked.get(to_wallet_id)
+    if not from_w or not to_w:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    # KYC checks on sender
+    lim = _kyc_limits_for(s, from_w)
+    if req.amount_cents > lim["tx_max"]:
+        raise HTTPException(status_code=400, detail="Exceeds per-transaction limit for KYC level")
+    # daily total
+    total_today = _daily_spent_cents(s, [from_w.id]).get(from_w.id, 0)
+    if total_today + req.amount_cents > lim["daily_max"]:
+        raise HTTPException(status_code=400, detail="Exceeds daily limit for KYC level")
+
+    if from_w.balance_cents < req.amount_cents:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
+    # Velocity limits (per-minute) for alias payments (sender-side)
+    if req.to_alias:
+        cnt, sum_min = _velocity_window(s, "wallet_out", [from_w.id], 60).get(from_w.id, (0, 0))
+        if cnt >= ALIAS_VELOCITY_MAX_TX:
+            raise HTTPException(status_code=429, detail="Too many transfers (alias velocity)")
+        if sum_min + req.amount_cents > ALIAS_VELOCITY_MAX_CENTS:
+            raise HTTPException(status_code=429, detail="Amount velocity exceeded (alias)")
+        # Inbound alias velocity (receiver-side)
+        rx_cnt, rx_sum = _velocity_window(s, "wallet_in", [to_w.id], 60).get(to_w.id, (0, 0))
+        if rx_cnt >= ALIAS_RX_VELOCITY_MAX_TX:
+            raise HTTPException(status_code=429, detail="Receiver busy (alias inbound velocity)")
+        if rx_sum + req.amount_cents > ALIAS_RX_VELOCITY_MAX_CENTS:
+            raise HTTPException(status_code=429, detail="Receiver amount velocity exceeded (alias)")
+        # Device/IP heuristic + risk score
+        try:
+            device_id = request.headers.get("X-Device-ID")
+            ip = request.client.host if request.client else None
+        except Exception:
+            device_id = None; ip = None
+
+        # Denylists (hard block)
+        reasons: list[str] = []
+        # Config denylists
+        if device_id and device_id in RISK_DENY_DEVICE_IDS:
+            retry_ms = _risk_backoff_ms(s, "device", device_id)
+            raise HTTPException(status_code=429, detail={"error":"device_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["device_denylist"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+        if ip and _config_ip_denied(ip):
+            retry_ms = _risk_backoff_ms(s, "ip", ip)
+            raise HTTPException(status_code=429, detail={"error":"ip_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["ip_denylist"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+
+        # DB denylists (compiled per worker, refreshed via generation counter)
+        deny = _risk_denylist(s) if (device_id or ip) else None
+        if device_id and device_id in deny.devices:
+            retry_ms = _risk_backoff_ms(s, "device", device_id)
+            raise HTTPException(status_code=429, detail={"error":"device_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["device_denylist_db"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+        if ip and deny.ip_blocked(ip):
+            retry_ms = _risk_backoff_ms(s, "ip", ip)
+            raise HTTPException(status_code=429, detail={"error":"ip_blocked","retry_after_ms": retry_ms, "score": None, "reasons":["ip_denylist_db"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+
+        # record event
+        _record_alias_device_event(s, AliasDeviceEvent(id=str(uuid.uuid4()), handle=(req.to_alias.lstrip("@") if req.to_alias else None), to_wallet_id=to_w.id, device_id=device_id, ip=ip))
+
+        dev_cnt5 = _velocity_window(s, "device", [device_id], 300).get(device_id, (0, 0))[0] if device_id else 0
+        ip_cnt5 = _velocity_window(s, "ip", [ip], 300).get(ip, (0, 0))[0] if ip else 0
+
+        # per-minute device velocity (hard cap)
+        dev_cnt1 = 0
+        if device_id:
+            dw_key = f"{to_w.id}|{device_id}"
+            dev_cnt1 = _velocity_window(s, "device_wallet", [dw_key], 60).get(dw_key, (0, 0))[0]
+            if dev_cnt1 > ALIAS_DEVICE_MAX_TX_PER_MIN:
+                retry_ms = _risk_backoff_ms(s, "device", device_id)
+                raise HTTPException(status_code=429, detail={"error":"device_velocity","retry_after_ms": retry_ms, "score": None, "reasons":["device_per_min_cap"]}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+
+        # risk score (5-min window)
+        score = 0
+        if not device_id:
+            score += 1
+        if not ip:
+            score += 1
+        # UA parsing (basic)
+        try:
+            ua = request.headers.get("User-Agent", "")
+        except Exception:
+            ua = ""
+        if not ua:
+            score += 1; reasons.append("ua_missing")
+        else:
+            final_ua = ua.lower()
+            if any(b in final_ua for b in ["curl","python-requests","bot","crawler"]):
+                score += 2; reasons.append("ua_suspect")
+
+        score += dev_cnt5 // 3
+        score += ip_cnt5 // 10
+
+        if score >= RISK_SCORE_THRESHOLD:
+            retry_ms = _risk_backoff_ms(s, "device", device_id) if device_id else _risk_backoff_ms(s, "ip", ip)
+            raise HTTPException(status_code=429, detail={"error":"risk_score","retry_after_ms": retry_ms, "score": score, "reasons": reasons}, headers={"Retry-After": str(max(1, retry_ms // 1000))})
+    # settle (balances + ledger dual-write, fees included)
+    merch = request.headers.get("X-Merchant")
+    ref = request.headers.get("X-Ref")
+    fee_w = locked.get(fee_lock_id) if fee_lock_id else None
+    txn_id, _fee, _net = _post_transfer(s, from_w, to_w, req.amount_cents, fee_w=fee_w, meta_str=_transfer_meta(merch, ref), merchant=merch, ref=ref, fee_wallet_id=fee_wallet_id)
+    resp = WalletResp(wallet_id=to_w.id, balance_cents=to_w.balance_cents, currency=to_w.currency)
+    try:
+        if ikey:
+            _idem_remember(s, ikey, "transfer", req.from_wallet_id, txn_id, resp.model_dump())
+        s.commit()
+    except IntegrityError:
+        # Lost the race for the key: our booking is rolled back, replay the winner
+        s.rollback()
+        existed = _idem_lookup(s, ikey, "transfer", req.from_wallet_id) if ikey else None
+        if existed is None:
+            raise
+        return WalletResp(**_json.loads(existed.response))
+    return resp
+
+
+# --- Batched transfers (payroll / merchant settlement fan-out) ---
+class TransferBatchItem(BaseModel):
+    from_wallet_id: str
+    to_wallet_id: str
+    amount_cents: int = Field(..., gt=0)
+    idempotency_key: Optional[str] = Field(default=None, max_length=128)
+    reference: Optional[str] = Field(default=None, max_length=64)
+
+
+class TransferBatchReq(BaseModel):
+    items: List[TransferBatchItem] = Field(..., min_length=1)
+    merchant: Optional[str] = Field(default=None, max_length=64)
+    atomic: bool = Field(default=False, description="Reject the whole batch if any item fails")
+
+
+class TransferBatchItemResult(BaseModel):
+    index: int
+    status: str  # ok|replayed|error
+    from_wallet_id: str
+    to_wallet_id: str
+    amount_cents: int
+    fee_cents: int = 0
+    txn_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class TransferBatchResp(BaseModel):
+    batch_id: str
+    ok: int
+    replayed: int
+    failed: int
+    items: List[TransferBatchItemResult]
+
+
+@router.post("/transfers/batch", response_model=TransferBatchResp)
+def transfer_batch(req: TransferBatchReq, s: Session = Depends(get_session)):
+    """
+    Run many wallet-to-wallet transfers in one transaction.
+
+    All involved wallets are locked once, in canonical order, and the
+    batch is committed once. Items fail individually (insufficient funds,
+    KYC limits, unknown wallets) unless atomic=true, in which case any
+    failure rolls the whole batch back. Per-item idempotency keys make
+    retried batches safe: items already booked are reported as replayed.
+    """
+    if len(req.items) > TRANSFER_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail="too many items in batch")
+    batch_id = str(uuid.uuid4())
+    results: List[TransferBatchItemResult] = [
+        TransferBatchItemResult(
+            index=i,
+            status="pending",
+            from_wallet_id=it.from_wallet_id,
+            to_wallet_id=it.to_wallet_id,
+            amount_cents=it.amount_cents,
+        )
+        for i, it in enumerate(req.items)
+    ]
+
+    def _fail(i: int, msg: str) -> None:
+        results[i].status = "error"
+        results[i].error = msg
+
+    # Idempotency: one lookup for all keys of the batch
+    hashes = {i: _idem_hash(it.idempotency_key, "transfer_batch", it.from_wallet_id) for i, it in enumerate(req.items) if it.idempotency_key}
+    known = _idem_lookup_many(s, hashes.values())
+    seen_keys: set[str] = set()
+    todo: List[int] = []
+    for i, it in enumerate(req.items):
+        k = it.idempotency_key
+        if k and hashes[i] in known:
+            results[i].status = "replayed"
+            results[i].txn_id = known[hashes[i]].txn_id
+            continue
+        if k and k in seen_keys:
+            _fail(i, "duplicate idempotency_key in batch")
+            continue
+        if k:
+            seen_keys.add(k)
+        if it.from_wallet_id == it.to_wallet_id:
+            _fail(i, "Cannot transfer to same wallet")
+            continue
+        todo.append(i)
+
+    fee_wallet_id, fee_lock_id = _fee_wallet_locks(s, [req.items[i].amount_cents for i in todo])
+    wallet_ids = {req.items[i].from_wallet_id for i in todo} | {req.items[i].to_wallet_id for i in todo}
+    locked = _lock_wallets(s, list(wallet_ids) + [fee_lock_id])
+    # Keys booked by a concurrent batch while we waited for the locks
+    late = _idem_lookup_many(s, [hashes[i] for i in todo if i in hashes])
+    for i in [i for i in todo if hashes.get(i) in late]:
+        results[i].status = "replayed"
+        results[i].txn_id = late[hashes[i]].txn_id
+        todo.remove(i)
+    fee_w = locked.get(fee_lock_id) if fee_lock_id else None
+    senders = {req.items[i].from_wallet_id for i in todo if req.items[i].from_wallet_id in locked}
+    spent = _daily_spent_cents(s, senders)
+    limits: Dict[str, dict] = {}
+    for i in todo:
+        it = req.items[i]
+        from_w = locked.get(it.from_wallet_id)
+        to_w = locked.get(it.to_wallet_id)
+        if not from_w or not to_w:
+            _fail(i, "Wallet not found")
+            continue
+        if from_w.id not in limits:
+            limits[from_w.id] = _kyc_limits_for(s, from_w)
+        lim = limits[from_w.id]
+        if it.amount_cents > lim["tx_max"]:
+            _fail(i, "Exceeds per-transaction limit for KYC level")
+            continue
+        if spent.get(from_w.id, 0) + it.amount_cents > lim["daily_max"]:
+            _fail(i, "Exceeds daily limit for KYC level")
+            continue
+        if from_w.balance_cents < it.amount_cents:
+            _fail(i, "Insufficient funds")
+            continue
+        if it.amount_cents - _fee_for(it.amount_cents) < 0:
+            _fail(i, "Amount too small for fees")
+            continue
+        meta_str = _transfer_meta(req.merchant, it.reference, f"batch={batch_id}")
+        txn_id, fee_cents, _net = _post_transfer(s, from_w, to_w, it.amount_cents, fee_w=fee_w, meta_str=meta_str, merchant=req.merchant, ref=it.reference, fee_wallet_id=fee_wallet_id)
+        spent[from_w.id] = spent.get(from_w.id, 0) + it.amount_cents
+        if it.idempotency_key:
+            try:
+                _idem_remember(s, it.idempotency_key, "transfer_batch", from_w.id, txn_id, {"txn_id": txn_id})
+            except IntegrityError:
+                # A concurrent batch booked this key first; nothing of this one is kept
+                s.rollback()
+                raise HTTPException(status_code=409, detail="idempotency_key in use by a concurrent request; retry")
+        results[i].status = "ok"
+        results[i].txn_id = txn_id
+        results[i].fee_cents = fee_cents
+
+    failed = sum(1 for r in results if r.status == "error")
+    if req.atomic and failed:
+        s.rollback()
+        raise HTTPException(status_code=400, detail={"error": "batch_failed", "items": [r.model_dump() for r in results if r.status == "error"]})
+    s.commit()
+    return TransferBatchResp(
+        batch_id=batch_id,
+        ok=sum(1 for r in results if r.status == "ok"),
+        replayed=sum(1 for r in results if r.status == "replayed"),
+        failed=failed,
+        items=results,
+    )
+
+
+@router.get("/wallets/{wallet_id}", response_model=WalletResp)
+def get_wallet(wallet_id: str, s: Session = Depends(get_session)):
+    w = s.get(Wallet, wallet_id)
+    if not w:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    return WalletResp(wallet_id=w.id, balance_cents=w.balance_cents, currency=w.currency)
+
+
+class TxnItem(BaseModel):
+    id: str
+    from_wallet_id: Optional[str]
+    to_wallet_id: str
+    amount_cents: int
+    fee_cents: int
+    kind: str
+    created_at: Optional[datetime]
+    meta: Optional[str] = None
+    cursor: Optional[str] = None  # pass as cursor= to continue after this item
+
+
+@router.get("/txns", response_model=List[TxnItem])
+def list_txns(wallet_id: str, limit: int = 50, cursor: Optional[str] = None, s: Session = Depends(get_session)):
+    """
+    Newest-first history of a wallet from wallet_activity: one range scan on
+    (wallet_id, created_at, txn_id), continued with the last item's cursor.
+    """
+    if limit < 1 or limit > 200:
+        limit = 50
+    bind = s.get_bind()
+    keys = [WalletActivity.created_at, WalletActivity.txn_id]
+    after = _export_cursor_decode(bind, "txns", keys, cursor)
+    q = select(WalletActivity, *_export_cursor_cols(bind, keys)).where(WalletActivity.wallet_id == wallet_id)
+    if after is not None:
+        q = q.where(
+            or_(
+                WalletActivity.created_at < after[0],
+                and_(WalletActivity.created_at == after[0], WalletActivity.txn_id < after[1]),
+            )
+        )
+    rows = s.execute(q.order_by(WalletActivity.created_at.desc(), WalletActivity.txn_id.desc()).limit(limit)).all()
     meta_map: Dict[str, str] = {}
     if rows:
-        ids = [t.id for t in rows]
+        ids = [r[0].txn_id for r in rows]
         le_rows = s.execute(
             select(LedgerEntry.txn_id, LedgerEntry.description).where(
                 LedgerEntry.txn_id.in_(ids)
@@ -2024,29 +3497,247 @@ def list_txns(wallet_id: str, limit: int = 50, s: Session = Depends(get_session)
                 continue
             if desc:
                 meta_map[str(tid)] = str(desc)
-    return [
-        TxnItem(
-            id=t.id,
-            from_wallet_id=t.from_wallet_id,
-            to_wallet_id=t.to_wallet_id,
-            amount_cents=t.amount_cents,
-            fee_cents=t.fee_cents or 0,
-            kind=t.kind,
-            created_at=t.created_at,
-            meta=meta_map.get(t.id),
+    out: List[TxnItem] = []
+    for a, ck_created, ck_id in rows:
+        if a.direction == "out":
+            from_id, to_id = a.wallet_id, a.counterparty_wallet_id
+        elif a.direction == "in":
+            from_id, to_id = a.counterparty_wallet_id, a.wallet_id
+        else:
+            from_id = to_id = a.wallet_id
+        out.append(
+            TxnItem(
+                id=a.txn_id,
+                from_wallet_id=from_id,
+                to_wallet_id=to_id,
+                amount_cents=a.amount_cents,
+                fee_cents=a.fee_cents or 0,
+                kind=a.kind,
+                created_at=a.created_at,
+                meta=meta_map.get(a.txn_id),
+                cursor=_export_cursor_encode("txns", [ck_created, ck_id]),
+            )
         )
-        for t in rows
-    ]
+    return out
 
 
-class FeesSummary(BaseModel):
-    total_fee_cents: int
-    from_ts: Optional[str] = None
-    to_ts: Optional[str] = None
+# --- Analytics rollups ---
+_HOUR_SECS = 3600
+_ROLLUP_STATE = "rollups"
 
 
-@router.get("/admin/fees/summary", response_model=FeesSummary)
-def fees_summary(from_iso: Optional[str] = None, to_iso: Optional[str] = None, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+def _rollup_sources() -> dict:
+    """metric -> (time column, dim, amount, fee, join or None)"""
+    zero = sa_literal(0)
+    rp_join = RedPacketClaim.__table__.join(RedPacket.__table__, RedPacket.id == RedPacketClaim.redpacket_id)
+    return {
+        "txn": (Txn.created_at, sa_func.coalesce(Txn.kind, ""), Txn.amount_cents, sa_func.coalesce(Txn.fee_cents, 0), None),
+        "rp_issued": (RedPacket.created_at, sa_func.coalesce(RedPacket.group_id, ""), RedPacket.total_amount_cents, zero, None),
+        "rp_claimed": (RedPacketClaim.claimed_at, sa_func.coalesce(RedPacket.group_id, ""), RedPacketClaim.amount_cents, zero, rp_join),
+        "risk_device": (AliasDeviceEvent.created_at, sa_func.coalesce(AliasDeviceEvent.device_id, ""), zero, zero, None),
+        "risk_ip": (AliasDeviceEvent.created_at, sa_func.coalesce(AliasDeviceEvent.ip, ""), zero, zero, None),
+        "risk_receiver": (AliasDeviceEvent.created_at, sa_func.coalesce(AliasDeviceEvent.to_wallet_id, ""), zero, zero, None),
+    }
+
+
+def _epoch_bucket_expr(bind, col, secs: int):
+    if bind.dialect.name == "sqlite":
+        epoch = sa_cast(sa_func.strftime("%s", col), BigInteger)
+    else:
+        epoch = sa_cast(sa_func.floor(sa_func.extract("epoch", col)), BigInteger)
+    return (epoch // secs) * secs
+
+
+def _utc(ts: Optional[datetime]) -> Optional[datetime]:
+    if ts is not None and ts.tzinfo is None:
+        return ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+def _floor_ts(ts: datetime, secs: int) -> datetime:
+    return datetime.fromtimestamp(_velocity_bucket(ts, secs), tz=timezone.utc)
+
+
+def _ceil_ts(ts: datetime, secs: int) -> datetime:
+    f = _floor_ts(ts, secs)
+    return f if f == ts else f + timedelta(seconds=secs)
+
+
+def _rollup_raw(metric: str, lo: Optional[datetime], hi: Optional[datetime], hi_inclusive: bool, dims):
+    """(dim, cnt, amt, fee) straight from the source table for [lo, hi)."""
+    col, dim, amount, fee, join = _rollup_sources()[metric]
+    q = select(
+        dim.label("dim"),
+        sa_func.count().label("cnt"),
+        sa_func.coalesce(sa_func.sum(amount), 0).label("amt"),
+        sa_func.coalesce(sa_func.sum(fee), 0).label("fee"),
+    )
+    if join is not None:
+        q = q.select_from(join)
+    if lo is not None:
+        q = q.where(col >= lo)
+    if hi is not None:
+        q = q.where(col <= hi if hi_inclusive else col < hi)
+    if dims is not None:
+        q = q.where(dim.in_(list(dims)))
+    return q.group_by(dim)
+
+
+def _rollup_buckets(metric: str, secs: int, lo: Optional[datetime], hi: datetime, dims):
+    """(dim, cnt, amt, fee) from analytics_rollups for whole buckets in [lo, hi)."""
+    q = select(
+        AnalyticsRollup.dim.label("dim"),
+        sa_func.sum(AnalyticsRollup.event_count).label("cnt"),
+        sa_func.sum(AnalyticsRollup.amount_cents).label("amt"),
+        sa_func.sum(AnalyticsRollup.fee_cents).label("fee"),
+    ).where(
+        AnalyticsRollup.metric == metric,
+        AnalyticsRollup.bucket_secs == secs,
+        AnalyticsRollup.bucket_start < int(hi.timestamp()),
+    )
+    if lo is not None:
+        q = q.where(AnalyticsRollup.bucket_start >= int(lo.timestamp()))
+    if dims is not None:
+        q = q.where(AnalyticsRollup.dim.in_(list(dims)))
+    return q.group_by(AnalyticsRollup.dim)
+
+
+def _rollup_watermark(s: Session) -> Optional[datetime]:
+    st = s.get(ReconcileState, _ROLLUP_STATE)
+    return _utc(st.watermark) if st is not None else None
+
+
+def _rollup_query(s: Session, metric: str, start: Optional[datetime], end: Optional[datetime], dims=None, top: Optional[int] = None):
+    """
+    Select (dim, cnt, amt, fee) per dim for events in [start, end].
+
+    Whole days and hours below the fold watermark are read from
+    analytics_rollups; only the sub-hour edges of the range and the
+    not-yet-folded tail (about an hour) touch the source table, through its
+    time index.
+    """
+    start, end = _utc(start), _utc(end)
+    wm = _rollup_watermark(s)
+    parts = []
+    if wm is None or (start is not None and start >= wm):
+        parts.append(_rollup_raw(metric, start, end, True, dims))
+    else:
+        hi = wm if end is None or end >= wm else _floor_ts(end, _HOUR_SECS)
+        h0 = _ceil_ts(start, _HOUR_SECS) if start is not None else None
+        if h0 is not None and h0 >= hi:
+            parts.append(_rollup_raw(metric, start, end, True, dims))
+        else:
+            if start is not None and start < h0:
+                parts.append(_rollup_raw(metric, start, h0, False, dims))
+            parts.append(_rollup_raw(metric, hi, end, True, dims))
+            d0 = _ceil_ts(h0, _DAY_SECS) if h0 is not None else None
+            d1 = _floor_ts(hi, _DAY_SECS)
+            if d0 is not None and d0 >= d1:
+                parts.append(_rollup_buckets(metric, _HOUR_SECS, h0, hi, dims))
+            else:
+                if h0 is not None and h0 < d0:
+                    parts.append(_rollup_buckets(metric, _HOUR_SECS, h0, d0, dims))
+                parts.append(_rollup_buckets(metric, _DAY_SECS, d0, d1, dims))
+                if d1 < hi:
+                    parts.append(_rollup_buckets(metric, _HOUR_SECS, d1, hi, dims))
+    u = sa_union_all(*parts).subquery()
+    cnt = sa_func.sum(u.c.cnt)
+    q = select(u.c.dim, cnt.label("cnt"), sa_func.sum(u.c.amt).label("amt"), sa_func.sum(u.c.fee).label("fee")).group_by(u.c.dim)
+    if top is not None:
+        q = q.order_by(cnt.desc(), u.c.dim).limit(top)
+    return q
+
+
+def _upsert_rollups(s: Session, agg) -> int:
+    """Add (metric, dim, bucket_secs, bucket_start, cnt, amt, fee) rows of agg onto analytics_rollups."""
+    tbl = AnalyticsRollup.__table__
+    dialect = s.get_bind().dialect.name
+    cols = [tbl.c.metric, tbl.c.dim, tbl.c.bucket_secs, tbl.c.bucket_start, tbl.c.event_count, tbl.c.amount_cents, tbl.c.fee_cents]
+    if dialect in ("postgresql", "sqlite"):
+        ins = (_pg_insert if dialect == "postgresql" else _sqlite_insert)(tbl).from_select(cols, agg)
+        res = s.execute(
+            ins.on_conflict_do_update(
+                index_elements=[tbl.c.metric, tbl.c.dim, tbl.c.bucket_secs, tbl.c.bucket_start],
+                set_={
+                    "event_count": tbl.c.event_count + ins.excluded.event_count,
+                    "amount_cents": tbl.c.amount_cents + ins.excluded.amount_cents,
+                    "fee_cents": tbl.c.fee_cents + ins.excluded.fee_cents,
+                },
+            )
+        )
+        return int(res.rowcount or 0)
+    rows = s.execute(agg).all()
+    for metric, dim, secs, start, cnt, amt, fee in rows:
+        row = s.get(AnalyticsRollup, (metric, dim, secs, start), with_for_update=True)
+        if row is None:
+            s.add(AnalyticsRollup(metric=metric, dim=dim, bucket_secs=secs, bucket_start=start, event_count=int(cnt or 0), amount_cents=int(amt or 0), fee_cents=int(fee or 0)))
+        else:
+            row.event_count += int(cnt or 0)
+            row.amount_cents += int(amt or 0)
+            row.fee_cents += int(fee or 0)
+    s.flush()
+    return len(rows)
+
+
+def fold_rollups(s: Session, full: bool = False) -> dict:
+    """
+    Advance analytics_rollups to floor_hour(now - ROLLUP_LAG_SECS).
+
+    Like the ledger checkpoints, each run aggregates only the source rows
+    between the previous and the new watermark, one GROUP BY per metric and
+    bucket size. full=True rebuilds from scratch.
+    """
+    st = s.get(ReconcileState, _ROLLUP_STATE, with_for_update=True)
+    if st is None:
+        st = ReconcileState(name=_ROLLUP_STATE, watermark=None, runs=0)
+        s.add(st)
+        s.flush()
+    if full:
+        s.execute(sa_delete(AnalyticsRollup))
+        st.watermark = None
+    old_wm = _utc(st.watermark)
+    new_wm = _floor_ts(datetime.now(timezone.utc) - timedelta(seconds=ROLLUP_LAG_SECS), _HOUR_SECS)
+    if old_wm is not None and new_wm <= old_wm:
+        s.commit()
+        return {"watermark": old_wm.isoformat(), "rows": 0, "advanced": False}
+    bind = s.get_bind()
+    touched = 0
+    for metric, (col, dim, amount, fee, join) in _rollup_sources().items():
+        for secs in (_HOUR_SECS, _DAY_SECS):
+            bucket = _epoch_bucket_expr(bind, col, secs)
+            agg = select(
+                sa_literal(metric),
+                dim,
+                sa_literal(secs),
+                bucket,
+                sa_func.count(),
+                sa_func.coalesce(sa_func.sum(amount), 0),
+                sa_func.coalesce(sa_func.sum(fee), 0),
+            )
+            if join is not None:
+                agg = agg.select_from(join)
+            agg = agg.where(col < new_wm)
+            if old_wm is not None:
+                agg = agg.where(col >= old_wm)
+            touched += _upsert_rollups(s, agg.group_by(dim, bucket))
+    st.watermark = new_wm
+    st.runs = int(st.runs or 0) + 1
+    st.updated_at = datetime.now(timezone.utc)
+    s.commit()
+    return {"watermark": new_wm.isoformat(), "rows": touched, "advanced": True}
+
+
+def _run_rollup_fold() -> dict:
+    with Session(engine) as s:
+        return fold_rollups(s)
+
+
+@router.post("/admin/analytics/rollups/fold")
+def admin_rollups_fold(full: bool = False, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    return fold_rollups(s, full=full)
+
+
+def _parse_range(from_iso: Optional[str], to_iso: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
     start = None
     end = None
     if from_iso:
@@ -2059,19 +3750,40 @@ def fees_summary(from_iso: Optional[str] = None, to_iso: Optional[str] = None, s
             end = datetime.fromisoformat(to_iso.replace("Z", "+00:00"))
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid to_iso")
-    conds = []
-    if start:
-        conds.append(Txn.created_at >= start)
-    if end:
-        conds.append(Txn.created_at <= end)
-    q = select(sa_func.coalesce(sa_func.sum(Txn.fee_cents), 0))
-    if conds:
-        from sqlalchemy import and_  # local import to keep top tidy
-        q = q.where(and_(*conds))
-    total = s.execute(q).scalar() or 0
+    return start, end
+
+
+class FeesSummary(BaseModel):
+    total_fee_cents: int
+    from_ts: Optional[str] = None
+    to_ts: Optional[str] = None
+
+
+@router.get("/admin/fees/summary", response_model=FeesSummary)
+def fees_summary(from_iso: Optional[str] = None, to_iso: Optional[str] = None, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    start, end = _parse_range(from_iso, to_iso)
+    rows = s.execute(_rollup_query(s, "txn", start, end)).all()
+    total = sum(int(r.fee or 0) for r in rows)
     return FeesSummary(total_fee_cents=int(total), from_ts=(start.isoformat() if start else None), to_ts=(end.isoformat() if end else None))
 
 
+class TxnVolumeItem(BaseModel):
+    kind: str
+    count: int
+    amount_cents: int
+    fee_cents: int
+
+
+@router.get("/admin/txns/volume", response_model=List[TxnVolumeItem])
+def admin_txns_volume(from_iso: Optional[str] = None, to_iso: Optional[str] = None, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    start, end = _parse_range(from_iso, to_iso)
+    rows = s.execute(_rollup_query(s, "txn", start, end)).all()
+    return sorted(
+        (TxnVolumeItem(kind=r.dim, count=int(r.cnt or 0), amount_cents=int(r.amt or 0), fee_cents=int(r.fee or 0)) for r in rows),
+        key=lambda it: (-it.amount_cents, it.kind),
+    )
+
+
 class RedPacketCampaignPaymentsStats(BaseModel):
     campaign_id: str
     total_packets_issued: int
@@ -2104,62 +3816,35 @@ def redpacket_campaign_payments_analytics(
     cid = (campaign_id or "").strip()
     if not cid:
         raise HTTPException(status_code=400, detail="campaign_id required")
-    start = None
-    end = None
-    if from_iso:
-        try:
-            start = datetime.fromisoformat(from_iso.replace("Z", "+00:00"))
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid from_iso")
-    if to_iso:
-        try:
-            end = datetime.fromisoformat(to_iso.replace("Z", "+00:00"))
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid to_iso")
-    from sqlalchemy import and_, or_  # type: ignore
-
-    conds = [
-        or_(RedPacket.group_id == cid, RedPacket.group_id == f"campaign:{cid}")
-    ]
+    start, end = _parse_range(from_iso, to_iso)
+    dims = [cid, f"campaign:{cid}"]
+
+    def _totals(metric: str) -> tuple[int, int]:
+        rows = s.execute(_rollup_query(s, metric, start, end, dims=dims)).all()
+        return sum(int(r.cnt or 0) for r in rows), sum(int(r.amt or 0) for r in rows)
+
+    total_packets_issued, total_amount_cents = _totals("rp_issued")
+    total_packets_claimed, claimed_amount_cents = _totals("rp_claimed")
+    # Distinct counts are not additive across buckets; they stay campaign-
+    # scoped aggregates on the (group_id, created_at) index.
+    pconds = [RedPacket.group_id.in_(dims)]
     if start:
-        conds.append(RedPacket.created_at >= start)
+        pconds.append(RedPacket.created_at >= start)
     if end:
-        conds.append(RedPacket.created_at <= end)
-    q = select(RedPacket).where(and_(*conds))
-    packets = s.execute(q).scalars().all()
-    total_packets_issued = len(packets)
-    total_amount_cents = 0
-    creators = set()
-    for p in packets:
-        try:
-            total_amount_cents += int(p.total_amount_cents or 0)
-        except Exception:
-            pass
-        if getattr(p, "creator_wallet_id", None):
-            creators.add(p.creator_wallet_id)
-    unique_creators = len(creators)
-
-    total_packets_claimed = 0
-    claimed_amount_cents = 0
-    unique_claimants = 0
-    if packets:
-        rp_ids = [p.id for p in packets]
-        cq = select(RedPacketClaim).where(RedPacketClaim.redpacket_id.in_(rp_ids))
-        if start:
-            cq = cq.where(RedPacketClaim.claimed_at >= start)
-        if end:
-            cq = cq.where(RedPacketClaim.claimed_at <= end)
-        claims = s.execute(cq).scalars().all()
-        total_packets_claimed = len(claims)
-        claimants = set()
-        for c in claims:
-            try:
-                claimed_amount_cents += int(c.amount_cents or 0)
-            except Exception:
-                pass
-            if getattr(c, "wallet_id", None):
-                claimants.add(c.wallet_id)
-        unique_claimants = len(claimants)
+        pconds.append(RedPacket.created_at <= end)
+    unique_creators = s.execute(
+        select(sa_func.count(sa_func.distinct(RedPacket.creator_wallet_id))).where(*pconds)
+    ).scalar() or 0
+    cconds = [RedPacket.group_id.in_(dims)]
+    if start:
+        cconds.append(RedPacketClaim.claimed_at >= start)
+    if end:
+        cconds.append(RedPacketClaim.claimed_at <= end)
+    unique_claimants = s.execute(
+        select(sa_func.count(sa_func.distinct(RedPacketClaim.wallet_id)))
+        .select_from(RedPacketClaim.__table__.join(RedPacket.__table__, RedPacket.id == RedPacketClaim.redpacket_id))
+        .where(*cconds)
+    ).scalar() or 0
 
     return RedPacketCampaignPaymentsStats(
         campaign_id=cid,
@@ -2321,20 +4006,140 @@ def resolve_phone(phone: str, s: Session = Depends(get_session)):
     return ResolvePhoneOut(user_id=u.id, wallet_id=w.id, phone=u.phone)
 
 
-@router.get("/admin/txns/export")
-def admin_txns_export(
-    wallet_id: Optional[str] = None,
-    from_iso: Optional[str] = None,
-    to_iso: Optional[str] = None,
-    limit: int = 1000,
-    offset: int = 0,
-    s: Session = Depends(get_session),
-    admin_ok: bool = Depends(require_admin),
+# --- Streaming exports (keyset pagination) ---
+_EXPORT_MEDIA = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _export_cursor_encode(kind: str, values) -> str:
+    raw = _json.dumps(
+        {"k": kind, "v": [v.isoformat() if isinstance(v, datetime) else v for v in values]},
+        separators=(",", ":"),
+    )
+    return _b64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _export_cursor_decode(bind, kind: str, keys, token: Optional[str]) -> Optional[list]:
+    """
+    Turn a cursor token into bind values for keys. DateTime keys are compared
+    as raw text on SQLite (so server-default and Python timestamps round-trip
+    exactly) and as real timestamps elsewhere.
+    """
+    if not token:
+        return None
+    try:
+        data = _json.loads(_b64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if data.get("k") != kind or len(data.get("v") or []) != len(keys):
+            raise ValueError("cursor kind mismatch")
+        out = []
+        for key, v in zip(keys, data["v"]):
+            if isinstance(key.type, DateTime):
+                if bind.dialect.name == "sqlite":
+                    v = type_coerce(str(v), String())
+                else:
+                    v = datetime.fromisoformat(str(v))
+            out.append(v)
+        return out
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _export_cursor_cols(bind, keys) -> list:
+    if bind.dialect.name != "sqlite":
+        return list(keys)
+    return [
+        sa_cast(k, String).label(f"_cursor_{i}") if isinstance(k.type, DateTime) else k
+        for i, k in enumerate(keys)
+    ]
+
+
+def _keyset_export(
+    bind,
+    q,
+    keys,
+    kind: str,
+    columns: List[str],
+    render,
+    fmt: str = "csv",
+    after: Optional[list] = None,
+    limit: Optional[int] = None,
+    skip: int = 0,
 ):
-    q = select(Txn)
+    """
+    Yield an export of q as CSV or NDJSON chunks, newest first.
+
+    Pages of EXPORT_PAGE_SIZE rows are fetched with a keyset predicate on
+    keys (never OFFSET), each in its own short session, so memory and
+    connection hold time stay constant however large the export. q must
+    select _export_cursor_cols(bind, keys) as its trailing columns. Every
+    row carries a cursor token; passing the last one received as
+    ?cursor= resumes the export right after that row.
+    """
+    import io, csv
+    nkeys = len(keys)
+
+    def _before(vals):
+        # (k1, k2, ...) < (v1, v2, ...) spelled out for portability
+        cond = keys[-1] < vals[-1]
+        for i in range(nkeys - 2, -1, -1):
+            cond = or_(keys[i] < vals[i], and_(keys[i] == vals[i], cond))
+        return cond
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if fmt == "csv" and after is None:
+        writer.writerow(columns + ["cursor"])
+        yield buf.getvalue(); buf.seek(0); buf.truncate(0)
+    emitted = 0
+    first = True
+    while True:
+        n = EXPORT_PAGE_SIZE if limit is None else min(EXPORT_PAGE_SIZE, limit - emitted)
+        if n <= 0:
+            break
+        page_q = q if after is None else q.where(_before(after))
+        page_q = page_q.order_by(*[k.desc() for k in keys]).limit(n)
+        if first and skip > 0:
+            page_q = page_q.offset(skip)
+        first = False
+        with Session(bind) as ps:
+            rows = ps.execute(page_q.execution_options(yield_per=n)).all()
+        if not rows:
+            break
+        for row in rows:
+            cur_vals = list(row[-nkeys:])
+            token = _export_cursor_encode(kind, cur_vals)
+            values = render(row)
+            if fmt == "ndjson":
+                rec = dict(zip(columns, values)); rec["cursor"] = token
+                buf.write(_json.dumps(rec, separators=(",", ":")) + "\n")
+            else:
+                writer.writerow(list(values) + [token])
+        after = [type_coerce(v, String()) if isinstance(v, str) and isinstance(k.type, DateTime) else v for k, v in zip(keys, cur_vals)]
+        emitted += len(rows)
+        yield buf.getvalue(); buf.seek(0); buf.truncate(0)
+        if len(rows) < n:
+            break
+
+
+def _export_response(gen, fmt: str, stem: str) -> StreamingResponse:
+    import datetime as _dt
+    filename = f"{stem}_{_dt.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
+    return StreamingResponse(gen, media_type=_EXPORT_MEDIA[fmt], headers=headers)
+
+
+def _export_args(fmt: str, limit: Optional[int], offset: int) -> str:
+    f = (fmt or "csv").strip().lower()
+    if f not in _EXPORT_MEDIA:
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid offset")
+    return f
+
+
+def _txn_time_conds(from_iso: Optional[str], to_iso: Optional[str]) -> list:
     conds = []
-    if wallet_id:
-        conds.append((Txn.from_wallet_id == wallet_id) | (Txn.to_wallet_id == wallet_id))
     if from_iso:
         try:
             start = datetime.fromisoformat(from_iso.replace("Z", "+00:00"))
@@ -2347,26 +4152,44 @@ def admin_txns_export(
             conds.append(Txn.created_at <= end)
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid to_iso")
+    return conds
+
+
+_TXN_EXPORT_COLUMNS = ["id", "from_wallet_id", "to_wallet_id", "amount_cents", "fee_cents", "kind", "created_at"]
+
+
+def _txn_export_values(t: Txn) -> list:
+    return [t.id, t.from_wallet_id or "", t.to_wallet_id, t.amount_cents, t.fee_cents or 0, t.kind, (t.created_at.isoformat() if t.created_at else "")]
+
+
+@router.get("/admin/txns/export")
+def admin_txns_export(
+    wallet_id: Optional[str] = None,
+    from_iso: Optional[str] = None,
+    to_iso: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+    fmt: str = "csv",
+    s: Session = Depends(get_session),
+    admin_ok: bool = Depends(require_admin),
+):
+    fmt = _export_args(fmt, limit, offset)
+    bind = s.get_bind()
+    keys = [Txn.created_at, Txn.id]
+    conds = _txn_time_conds(from_iso, to_iso)
+    if wallet_id:
+        conds.append((Txn.from_wallet_id == wallet_id) | (Txn.to_wallet_id == wallet_id))
+    q = select(Txn, *_export_cursor_cols(bind, keys))
     if conds:
-        from sqlalchemy import and_  # type: ignore
         q = q.where(and_(*conds))
-    if limit < 1 or limit > 5000:
-        limit = 1000
-    q = q.order_by(Txn.created_at.desc()).limit(limit).offset(max(offset, 0))
-    rows = s.execute(q).scalars().all()
-    # Streaming CSV
-    import io, csv, datetime as _dt
-    def _iter():
-        buf = io.StringIO()
-        writer = csv.writer(buf)
-        writer.writerow(["id", "from_wallet_id", "to_wallet_id", "amount_cents", "fee_cents", "kind", "created_at"])
-        yield buf.getvalue(); buf.seek(0); buf.truncate(0)
-        for t in rows:
-            writer.writerow([t.id, t.from_wallet_id or "", t.to_wallet_id, t.amount_cents, t.fee_cents or 0, t.kind, (t.created_at.isoformat() if t.created_at else "")])
-            yield buf.getvalue(); buf.seek(0); buf.truncate(0)
-    filename = f"txns_{_dt.datetime.utcnow().strftime('%Y%m%d_%H%M%S')} .csv".replace(' ', '')
-    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    return StreamingResponse(_iter(), media_type="text/csv", headers=headers)
+    after = _export_cursor_decode(bind, "txns", keys, cursor)
+    gen = _keyset_export(
+        bind, q, keys, "txns", _TXN_EXPORT_COLUMNS,
+        lambda row: _txn_export_values(row[0]),
+        fmt=fmt, after=after, limit=limit, skip=offset,
+    )
+    return _export_response(gen, fmt, "txns")
 
 
 @router.get("/admin/txns/export_by_merchant")
@@ -2375,18 +4198,32 @@ def admin_txns_export_by_merchant(
     campaign_id: Optional[str] = None,
     from_iso: Optional[str] = None,
     to_iso: Optional[str] = None,
-    limit: int = 1000,
+    limit: Optional[int] = None,
     offset: int = 0,
+    cursor: Optional[str] = None,
+    fmt: str = "csv",
     s: Session = Depends(get_session),
     admin_ok: bool = Depends(require_admin),
 ):
-    # Export transactions whose ledger entries contain merchant tag m=<merchant>
-    mtag = f"m={merchant.strip().lower()}"
-    from sqlalchemy import and_  # type: ignore
+    # Export merchant transactions: Txn.merchant_id drives the keyset scan and
+    # the debit ledger leg (one per txn) is joined by txn_id for the meta column.
+    fmt = _export_args(fmt, limit, offset)
+    mid = _norm_merchant_id(merchant)
+    if not mid:
+        raise HTTPException(status_code=400, detail="merchant required")
+    bind = s.get_bind()
+    keys = [Txn.created_at, Txn.id]
     q = (
-        select(Txn)
-        .join(LedgerEntry, LedgerEntry.txn_id == Txn.id)
-        .where(sa_func.lower(LedgerEntry.description).like(f"%{mtag}%"))
+        select(Txn, LedgerEntry.description, *_export_cursor_cols(bind, keys))
+        .join(
+            LedgerEntry,
+            and_(
+                LedgerEntry.txn_id == Txn.id,
+                LedgerEntry.merchant_id == Txn.merchant_id,
+                LedgerEntry.amount_cents < 0,
+            ),
+        )
+        .where(Txn.merchant_id == mid, *_txn_time_conds(from_iso, to_iso))
     )
     # Optional Kampagnen-Filter: group=campaign:<id> oder group=<id>
     cid = (campaign_id or "").strip()
@@ -2397,70 +4234,36 @@ def admin_txns_export_by_merchant(
             sa_func.lower(LedgerEntry.description).like(f"%{ctag1}%")
             | sa_func.lower(LedgerEntry.description).like(f"%{ctag2}%")
         )
-    if from_iso:
-        try:
-            start = datetime.fromisoformat(from_iso.replace("Z", "+00:00"))
-            q = q.where(Txn.created_at >= start)
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid from_iso")
-    if to_iso:
-        try:
-            end = datetime.fromisoformat(to_iso.replace("Z", "+00:00"))
-            q = q.where(Txn.created_at <= end)
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid to_iso")
-    if limit < 1 or limit > 5000:
-        limit = 1000
-    q = q.order_by(Txn.created_at.desc()).limit(limit).offset(max(offset, 0))
-    rows = s.execute(q).scalars().all()
-    # For each txn, fetch the first matching ledger meta string (optional)
-    meta_map = {}
-    for t in rows:
-        le_q = select(LedgerEntry).where(
-            LedgerEntry.txn_id == t.id,
-            sa_func.lower(LedgerEntry.description).like(f"%{mtag}%"),
-        )
-        if cid:
-            ctag1 = f"group=campaign:{cid.lower()}"
-            ctag2 = f"group={cid.lower()}"
-            le_q = le_q.where(
-                sa_func.lower(LedgerEntry.description).like(f"%{ctag1}%")
-                | sa_func.lower(LedgerEntry.description).like(f"%{ctag2}%")
-            )
-        le = s.execute(le_q.limit(1)).scalars().first()
-        meta_map[t.id] = le.description if le and le.description else ""
-    import io, csv, datetime as _dt
-    def _iter():
-        buf = io.StringIO(); w = csv.writer(buf)
-        w.writerow(["id", "from_wallet_id", "to_wallet_id", "amount_cents", "fee_cents", "kind", "created_at", "meta"])
-        yield buf.getvalue(); buf.seek(0); buf.truncate(0)
-        for t in rows:
-            w.writerow([t.id, t.from_wallet_id or "", t.to_wallet_id, t.amount_cents, t.fee_cents or 0, t.kind, (t.created_at.isoformat() if t.created_at else ""), meta_map.get(t.id, "")])
-            yield buf.getvalue(); buf.seek(0); buf.truncate(0)
-    filename = f"txns_{merchant}_{_dt.datetime.utcnow().strftime('%Y%m%d_%H%M%S')} .csv".replace(' ', '')
-    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    return StreamingResponse(_iter(), media_type="text/csv", headers=headers)
+    after = _export_cursor_decode(bind, "txns", keys, cursor)
+    gen = _keyset_export(
+        bind, q, keys, "txns", _TXN_EXPORT_COLUMNS + ["meta"],
+        lambda row: _txn_export_values(row[0]) + [row[1] or ""],
+        fmt=fmt, after=after, limit=limit, skip=offset,
+    )
+    return _export_response(gen, fmt, f"txns_{merchant}")
 
 
 @router.get("/admin/wallets/export")
 def admin_wallets_export(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fmt: str = "csv",
     s: Session = Depends(get_session),
     admin_ok: bool = Depends(require_admin),
 ):
-    # Export wallets with associated phone and balances
-    q = select(User, Wallet).where(Wallet.user_id == User.id)
-    rows = s.execute(q).all()
-    import io, csv, datetime as _dt
-    def _iter():
-        buf = io.StringIO(); writer = csv.writer(buf)
-        writer.writerow(["wallet_id", "phone", "balance_cents", "currency"])
-        yield buf.getvalue(); buf.seek(0); buf.truncate(0)
-        for u, w in rows:
-            writer.writerow([w.id, u.phone, w.balance_cents, w.currency])
-            yield buf.getvalue(); buf.seek(0); buf.truncate(0)
-    filename = f"wallets_{_dt.datetime.utcnow().strftime('%Y%m%d_%H%M%S')} .csv".replace(' ', '')
-    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\""}
-    return StreamingResponse(_iter(), media_type="text/csv", headers=headers)
+    # Export wallets with associated phone and balances (wallets have no
+    # created_at, so the keyset is the primary key alone)
+    fmt = _export_args(fmt, limit, 0)
+    bind = s.get_bind()
+    keys = [Wallet.id]
+    q = select(User.phone, Wallet.balance_cents, Wallet.currency, Wallet.id).where(Wallet.user_id == User.id)
+    after = _export_cursor_decode(bind, "wallets", keys, cursor)
+    gen = _keyset_export(
+        bind, q, keys, "wallets", ["wallet_id", "phone", "balance_cents", "currency"],
+        lambda row: [row[3], row[0], row[1], row[2]],
+        fmt=fmt, after=after, limit=limit,
+    )
+    return _export_response(gen, fmt, "wallets")
 
 
 @router.get("/admin/txns/count")
@@ -2494,32 +4297,154 @@ def admin_txns_count(
     return {"count": int(total)}
 
 
+# --- Ledger reconciliation (checkpoint + tail, one grouped pass) ---
+_LEDGER_STATE = "ledger"
+
+
+def _ledger_watermark(s: Session) -> Optional[datetime]:
+    st = s.get(ReconcileState, _LEDGER_STATE)
+    wm = st.watermark if st else None
+    if isinstance(wm, datetime) and wm.tzinfo is None:
+        wm = wm.replace(tzinfo=timezone.utc)
+    return wm
+
+
+def _upsert_ledger_checkpoints(s: Session, agg) -> int:
+    """Fold (wallet_id, sum, count, max_created_at) rows of agg into ledger_checkpoints; returns wallets touched."""
+    tbl = LedgerCheckpoint.__table__
+    dialect = s.get_bind().dialect.name
+    cols = [tbl.c.wallet_id, tbl.c.ledger_sum_cents, tbl.c.entry_count, tbl.c.last_entry_at]
+    if dialect in ("postgresql", "sqlite"):
+        ins = (_pg_insert if dialect == "postgresql" else _sqlite_insert)(tbl).from_select(cols, agg)
+        res = s.execute(
+            ins.on_conflict_do_update(
+                index_elements=[tbl.c.wallet_id],
+                set_={
+                    "ledger_sum_cents": tbl.c.ledger_sum_cents + ins.excluded.ledger_sum_cents,
+                    "entry_count": tbl.c.entry_count + ins.excluded.entry_count,
+                    "last_entry_at": ins.excluded.last_entry_at,
+                },
+            )
+        )
+        return int(res.rowcount or 0)
+    rows = s.execute(agg).all()
+    for wid, total, cnt, last_at in rows:
+        row = s.get(LedgerCheckpoint, wid, with_for_update=True)
+        if row is None:
+            s.add(LedgerCheckpoint(wallet_id=wid, ledger_sum_cents=int(total or 0), entry_count=int(cnt or 0), last_entry_at=last_at))
+        else:
+            row.ledger_sum_cents += int(total or 0)
+            row.entry_count += int(cnt or 0)
+            row.last_entry_at = last_at
+    s.flush()
+    return len(rows)
+
+
+def fold_ledger_checkpoints(s: Session, full: bool = False) -> dict:
+    """
+    Advance the ledger checkpoints to now - LEDGER_CHECKPOINT_LAG_SECS.
+
+    Only entries between the previous and the new watermark are aggregated
+    (one GROUP BY over the created_at index), so an hourly run costs the
+    volume of the last hour, not of the whole ledger. full=True drops the
+    checkpoints and rebuilds them from the beginning.
+    """
+    st = s.get(ReconcileState, _LEDGER_STATE, with_for_update=True)
+    if st is None:
+        st = ReconcileState(name=_LEDGER_STATE, watermark=None, runs=0)
+        s.add(st)
+        s.flush()
+    if full:
+        s.execute(sa_delete(LedgerCheckpoint))
+        st.watermark = None
+    old_wm = st.watermark
+    if isinstance(old_wm, datetime) and old_wm.tzinfo is None:
+        old_wm = old_wm.replace(tzinfo=timezone.utc)
+    new_wm = datetime.now(timezone.utc) - timedelta(seconds=LEDGER_CHECKPOINT_LAG_SECS)
+    if old_wm is not None and new_wm <= old_wm:
+        s.commit()
+        return {"watermark": old_wm.isoformat(), "wallets": 0, "advanced": False}
+    conds = [LedgerEntry.wallet_id.is_not(None), LedgerEntry.created_at < new_wm]
+    if old_wm is not None:
+        conds.append(LedgerEntry.created_at >= old_wm)
+    else:
+        # First build also takes legacy rows without a timestamp
+        conds[1] = or_(LedgerEntry.created_at < new_wm, LedgerEntry.created_at.is_(None))
+    agg = (
+        select(
+            LedgerEntry.wallet_id,
+            sa_func.coalesce(sa_func.sum(LedgerEntry.amount_cents), 0),
+            sa_func.count(LedgerEntry.id),
+            sa_func.max(LedgerEntry.created_at),
+        )
+        .where(*conds)
+        .group_by(LedgerEntry.wallet_id)
+    )
+    wallets = _upsert_ledger_checkpoints(s, agg)
+    st.watermark = new_wm
+    st.runs = int(st.runs or 0) + 1
+    st.updated_at = datetime.now(timezone.utc)
+    s.commit()
+    return {"watermark": new_wm.isoformat(), "wallets": wallets, "advanced": True}
+
+
+def _ledger_balances_query(s: Session):
+    """
+    Select (wallet_id, phone, ledger_sum_cents, balance_cents) for every wallet:
+    checkpoint sum plus one grouped aggregate over entries past the watermark.
+    Without checkpoints the tail is the whole ledger, still in a single pass.
+    """
+    wm = _ledger_watermark(s)
+    tail_q = select(
+        LedgerEntry.wallet_id.label("wallet_id"),
+        sa_func.sum(LedgerEntry.amount_cents).label("tail_cents"),
+    ).where(LedgerEntry.wallet_id.is_not(None))
+    if wm is not None:
+        tail_q = tail_q.where(LedgerEntry.created_at >= wm)
+    tail = tail_q.group_by(LedgerEntry.wallet_id).subquery()
+    ledger_sum = (
+        sa_func.coalesce(LedgerCheckpoint.ledger_sum_cents, 0) + sa_func.coalesce(tail.c.tail_cents, 0)
+    ).label("ledger_sum_cents")
+    return (
+        select(Wallet.id, User.phone, ledger_sum, Wallet.balance_cents)
+        .join(User, Wallet.user_id == User.id)
+        .outerjoin(LedgerCheckpoint, LedgerCheckpoint.wallet_id == Wallet.id)
+        .outerjoin(tail, tail.c.wallet_id == Wallet.id)
+    ), ledger_sum
+
+
+@router.post("/admin/ledger/checkpoint")
+def admin_ledger_checkpoint(full: bool = False, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    return fold_ledger_checkpoints(s, full=full)
+
+
 @router.get("/admin/ledger/reconcile/all")
 def admin_ledger_reconcile_all(
     only_nonzero: bool = False,
     limit: int = 1000,
+    after: Optional[str] = None,
     s: Session = Depends(get_session),
     admin_ok: bool = Depends(require_admin),
 ):
-    # Build reconciliation for all wallets (limited)
+    # Build reconciliation for all wallets (limited; page with after=<last wallet_id>)
     if limit < 1 or limit > 5000:
         limit = 1000
-    pairs = s.execute(select(User, Wallet).where(Wallet.user_id == User.id).limit(limit)).all()
-    # Precompute ledger sums
-    results = []
-    for u, w in pairs:
-        total = s.execute(select(sa_func.coalesce(sa_func.sum(LedgerEntry.amount_cents), 0)).where(LedgerEntry.wallet_id == w.id)).scalar() or 0
-        delta = int(total) - int(w.balance_cents)
-        if only_nonzero and delta == 0:
-            continue
-        results.append({
-            "wallet_id": w.id,
-            "phone": u.phone,
-            "ledger_sum_cents": int(total),
-            "balance_cents": int(w.balance_cents),
-            "delta_cents": delta,
-        })
-    return results
+    q, ledger_sum = _ledger_balances_query(s)
+    if only_nonzero:
+        q = q.where(ledger_sum != Wallet.balance_cents)
+    if after:
+        q = q.where(Wallet.id > after)
+    rows = s.execute(q.order_by(Wallet.id).limit(limit)).all()
+    return [
+        {
+            "wallet_id": wid,
+            "phone": phone,
+            "ledger_sum_cents": int(total or 0),
+            "balance_cents": int(bal or 0),
+            "delta_cents": int(total or 0) - int(bal or 0),
+        }
+        for wid, phone, total, bal in rows
+    ]
 
 
 @router.post("/admin/ledger/seed")
@@ -2532,12 +4457,11 @@ def admin_ledger_seed(
     # Seed ledger entries for wallets that have no ledger sum (sum==0) but positive/nonzero balance
     if limit < 1 or limit > 10000:
         limit = 1000
-    pairs = s.execute(select(User, Wallet).where(Wallet.user_id == User.id).limit(limit)).all()
-    to_seed = []
-    for u, w in pairs:
-        total = s.execute(select(sa_func.coalesce(sa_func.sum(LedgerEntry.amount_cents), 0)).where(LedgerEntry.wallet_id == w.id)).scalar() or 0
-        if total == 0 and w.balance_cents != 0:
-            to_seed.append({"wallet_id": w.id, "amount_cents": int(w.balance_cents), "phone": u.phone})
+    q, ledger_sum = _ledger_balances_query(s)
+    rows = s.execute(
+        q.where(ledger_sum == 0, Wallet.balance_cents != 0).order_by(Wallet.id).limit(limit)
+    ).all()
+    to_seed = [{"wallet_id": wid, "amount_cents": int(bal), "phone": phone} for wid, phone, _total, bal in rows]
     if dry_run:
         return {"dry_run": True, "will_seed": to_seed, "count": len(to_seed)}
     for item in to_seed:
@@ -2549,11 +4473,16 @@ def admin_ledger_seed(
 
 @router.get("/admin/ledger/reconcile/{wallet_id}")
 def admin_ledger_reconcile(wallet_id: str, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
-    # Sum ledger entries for this wallet and compare with wallet.balance_cents
+    # Checkpoint + tail for this wallet compared with wallet.balance_cents
     w = s.get(Wallet, wallet_id)
     if not w:
         raise HTTPException(status_code=404, detail="Wallet not found")
-    total = s.execute(select(sa_func.coalesce(sa_func.sum(LedgerEntry.amount_cents), 0)).where(LedgerEntry.wallet_id == wallet_id)).scalar() or 0
+    wm = _ledger_watermark(s)
+    ck = s.get(LedgerCheckpoint, wallet_id) if wm is not None else None
+    tail_q = select(sa_func.coalesce(sa_func.sum(LedgerEntry.amount_cents), 0)).where(LedgerEntry.wallet_id == wallet_id)
+    if wm is not None:
+        tail_q = tail_q.where(LedgerEntry.created_at >= wm)
+    total = int(s.execute(tail_q).scalar() or 0) + (int(ck.ledger_sum_cents or 0) if ck else 0)
     return {
         "wallet_id": wallet_id,
         "ledger_sum_cents": int(total),
@@ -2562,8 +4491,101 @@ def admin_ledger_reconcile(wallet_id: str, s: Session = Depends(get_session), ad
     }
 
 
+def _idem_hash(ikey: str, route: str, wallet_id: Optional[str]) -> str:
+    return _hashlib.sha256(f"{route}\x00{wallet_id or ''}\x00{ikey}".encode("utf-8")).hexdigest()
+
+
+def _idem_lookup(s: Session, ikey: str, route: str, wallet_id: Optional[str]) -> Optional[IdempotencyKey]:
+    """Unexpired stored response for (key, route, wallet), or None."""
+    rec = s.get(IdempotencyKey, _idem_hash(ikey, route, wallet_id), populate_existing=True)
+    if rec is None or _utc(rec.expires_at) <= datetime.now(timezone.utc):
+        return None
+    return rec
+
+
+def _idem_lookup_many(s: Session, hashes) -> Dict[str, IdempotencyKey]:
+    hashes = list(hashes)
+    now = datetime.now(timezone.utc)
+    out: Dict[str, IdempotencyKey] = {}
+    for i in range(0, len(hashes), 500):
+        chunk = hashes[i:i + 500]
+        q = select(IdempotencyKey).where(IdempotencyKey.key_hash.in_(chunk)).execution_options(populate_existing=True)
+        for rec in s.execute(q).scalars().all():
+            if _utc(rec.expires_at) > now:
+                out[rec.key_hash] = rec
+    return out
+
+
+def _idem_remember(s: Session, ikey: str, route: str, wallet_id: Optional[str], txn_id: Optional[str], body: dict) -> None:
+    """
+    Store body for replays in the caller's transaction.
+
+    A plain INSERT: an expired, unpurged row is deleted first, while a live
+    row written by a concurrent duplicate raises IntegrityError instead of
+    being overwritten.
+    """
+    now = datetime.now(timezone.utc)
+    key_hash = _idem_hash(ikey, route, wallet_id)
+    s.execute(
+        sa_delete(IdempotencyKey)
+        .where(IdempotencyKey.key_hash == key_hash, IdempotencyKey.expires_at <= now)
+        .execution_options(synchronize_session=False)
+    )
+    s.execute(sa_insert(IdempotencyKey).values(
+        key_hash=key_hash,
+        route=route,
+        txn_id=txn_id,
+        response=_json.dumps(body, separators=(",", ":")),
+        created_at=now,
+        expires_at=now + timedelta(seconds=IDEMPOTENCY_TTL_SECS),
+    ))
+
+
+def backfill_idempotency_keys(s: Session) -> int:
+    """
+    Copy transfer keys younger than IDEMPOTENCY_TTL_SECS from the legacy
+    idempotency table, so retries spanning the upgrade still replay.
+    """
+    since = datetime.now(timezone.utc) - timedelta(seconds=IDEMPOTENCY_TTL_SECS)
+    rows = s.execute(
+        select(Idempotency, Txn.from_wallet_id, Wallet.balance_cents, Wallet.currency)
+        .join(Txn, Txn.id == Idempotency.txn_id)
+        .outerjoin(Wallet, Wallet.id == Idempotency.wallet_id)
+        .where(Idempotency.endpoint.in_(("transfer", "transfer_batch")), Idempotency.created_at >= since)
+    ).all()
+    n = 0
+    for rec, from_wallet_id, cur_balance, cur_currency in rows:
+        if rec.endpoint == "transfer":
+            if not rec.wallet_id:
+                continue
+            body = {
+                "wallet_id": rec.wallet_id,
+                "balance_cents": rec.balance_cents if rec.balance_cents is not None else cur_balance,
+                "currency": rec.currency or cur_currency,
+            }
+        else:
+            body = {"txn_id": rec.txn_id}
+        created = _utc(rec.created_at) or datetime.now(timezone.utc)
+        s.merge(IdempotencyKey(
+            key_hash=_idem_hash(rec.ikey, rec.endpoint, from_wallet_id),
+            route=rec.endpoint,
+            txn_id=rec.txn_id,
+            response=_json.dumps(body, separators=(",", ":")),
+            created_at=created,
+            expires_at=created + timedelta(seconds=IDEMPOTENCY_TTL_SECS),
+        ))
+        n += 1
+    s.commit()
+    return n
+
+
 @router.get("/idempotency/{ikey}")
-def idempotency_status(ikey: str, s: Session = Depends(get_session)):
+def idempotency_status(ikey: str, route: Optional[str] = None, wallet_id: Optional[str] = None, s: Session = Depends(get_session)):
+    # Transfer keys are scoped: pass route=transfer|transfer_batch and the sender wallet_id
+    if route:
+        hit = _idem_lookup(s, ikey, route, wallet_id)
+        if hit is not None:
+            return {"exists": True, "txn_id": hit.txn_id, "endpoint": hit.route, "created_at": hit.created_at}
     rec = s.scalar(select(Idempotency).where(Idempotency.ikey == ikey))
     if not rec:
         return {"exists": False}
@@ -2602,29 +4624,180 @@ def _alias_code_hash(code: str) -> str:
     return _hmac.new(ALIAS_CODE_PEPPER.encode(), code.encode(), _hashlib.sha256).hexdigest()
 
 
-def _ipv4_to_tuple(ip: str) -> Optional[tuple[int,int,int,int]]:
-    try:
-        parts = ip.split('.')
-        if len(parts) != 4:
+class _IpPrefixTrie:
+    """
+    Binary prefix trie over IPv4/IPv6 networks of any prefix length.
+
+    match() walks at most 32 (v4) or 128 (v6) nodes regardless of how many
+    networks were inserted and returns the first (shortest) matching network.
+    """
+
+    __slots__ = ("_roots", "size")
+
+    def __init__(self) -> None:
+        self._roots: dict[int, list] = {4: [None, None, None], 6: [None, None, None]}
+        self.size = 0
+
+    def insert(self, net: "_ipaddress.IPv4Network | _ipaddress.IPv6Network") -> None:
+        node = self._roots[net.version]
+        bits = int(net.network_address)
+        width = net.max_prefixlen
+        for i in range(net.prefixlen):
+            b = (bits >> (width - 1 - i)) & 1
+            nxt = node[b]
+            if nxt is None:
+                nxt = node[b] = [None, None, None]
+            node = nxt
+        if node[2] is None:
+            self.size += 1
+        node[2] = str(net)
+
+    def match(self, ip: Optional[str]) -> Optional[str]:
+        if not ip:
+            return None
+        try:
+            addr = _ipaddress.ip_address(ip.strip())
+        except ValueError:
             return None
-        return tuple(int(p) for p in parts)  # type: ignore
+        node = self._roots[addr.version]
+        bits = int(addr)
+        width = addr.max_prefixlen
+        for i in range(width + 1):
+            if node[2] is not None:
+                return node[2]
+            if i == width:
+                break
+            node = node[(bits >> (width - 1 - i)) & 1]
+            if node is None:
+                return None
+        return None
+
+
+def _parse_ip_network(value: str):
+    try:
+        return _ipaddress.ip_network(value.strip(), strict=False)
+    except ValueError:
+        return None
+
+
+class _CompiledDenylist:
+    def __init__(self, bind, generation: Optional[int], rows) -> None:
+        self.bind = bind
+        self.generation = generation
+        self.checked_at = _time.monotonic()
+        self.ip = _IpPrefixTrie()
+        self.ip_exact: set[str] = set()  # legacy values that are not valid networks
+        self.devices: set[str] = set()
+        for kind, value in rows:
+            value = (value or "").strip()
+            if not value:
+                continue
+            if kind == "device":
+                self.devices.add(value)
+            elif kind == "ip":
+                net = _parse_ip_network(value)
+                if net is None:
+                    self.ip_exact.add(value)
+                else:
+                    self.ip.insert(net)
+
+    def ip_blocked(self, ip: Optional[str]) -> bool:
+        return bool(ip) and (ip in self.ip_exact or self.ip.match(ip) is not None)
+
+
+_RISK_DENY_GENERATION = "risk_denylists"
+RISK_DENY_REFRESH_SECS = float(_env_or("RISK_DENY_REFRESH_SECS", "2"))
+_risk_deny_compiled: Optional[_CompiledDenylist] = None
+_risk_deny_lock = _threading.Lock()
+_config_ip_deny: Optional[tuple[_IpPrefixTrie, list[str]]] = None
+
+
+def _bump_generation(s: Session, name: str) -> None:
+    """
+    Increment a named cache generation in the caller's transaction.
+
+    Postgres/SQLite use one upsert, so two writers creating the row at the
+    same time both count; other dialects fall back to a locked read-modify-write.
+    """
+    now = datetime.now(timezone.utc)
+    tbl = CacheGeneration.__table__
+    dialect = s.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        ins = (_pg_insert if dialect == "postgresql" else _sqlite_insert)(tbl).values(name=name, generation=1, updated_at=now)
+        s.execute(
+            ins.on_conflict_do_update(
+                index_elements=[tbl.c.name],
+                set_={"generation": tbl.c.generation + 1, "updated_at": ins.excluded.updated_at},
+            )
+        )
+        return
+    row = s.get(CacheGeneration, name, with_for_update=True)
+    if row is None:
+        s.add(CacheGeneration(name=name, generation=1, updated_at=now))
+    else:
+        row.generation = int(row.generation or 0) + 1
+        row.updated_at = now
+
+
+def _read_generation(s: Session, name: str) -> Optional[int]:
+    """
+    Current generation of name, or None when it cannot be read (e.g. the
+    table does not exist yet). The read runs in a savepoint so a failure
+    does not leave the caller's Postgres transaction aborted.
+    """
+    try:
+        with s.begin_nested():
+            gen = s.scalar(select(CacheGeneration.generation).where(CacheGeneration.name == name))
     except Exception:
         return None
+    return int(gen or 0)
 
 
-def _match_cidr_24(ip: Optional[str], cidr: str) -> bool:
-    # cidr format: a.b.c.0/24
+def _risk_denylist(s: Session) -> _CompiledDenylist:
+    """
+    Compiled view of risk_denylists for this process.
+
+    The generation row is re-read at most every RISK_DENY_REFRESH_SECS; the
+    table is only reloaded when another worker (or this one) bumped it.
+    """
+    global _risk_deny_compiled
+    bind = s.get_bind()
+    cur = _risk_deny_compiled
+    if cur is not None and cur.bind is bind and _time.monotonic() - cur.checked_at < RISK_DENY_REFRESH_SECS:
+        return cur
+    gen = _read_generation(s, _RISK_DENY_GENERATION)
+    if cur is not None and cur.bind is bind and gen is not None and gen == cur.generation:
+        cur.checked_at = _time.monotonic()
+        return cur
+    with _risk_deny_lock:
+        rows = s.execute(select(RiskDeny.kind, RiskDeny.value)).all()
+        compiled = _CompiledDenylist(bind, gen, rows)
+        _risk_deny_compiled = compiled
+    return compiled
+
+
+def _invalidate_risk_denylist() -> None:
+    global _risk_deny_compiled
+    _risk_deny_compiled = None
+
+
+def _config_ip_denied(ip: Optional[str]) -> bool:
+    """RISK_DENY_IP_PREFIXES: networks go into a trie, anything else keeps the legacy string-prefix match."""
+    global _config_ip_deny
     if not ip:
         return False
-    if "/24" not in cidr:
-        # fallback simple prefix match
-        return ip.startswith(cidr)
-    net, _ = cidr.split('/24', 1)
-    ipt = _ipv4_to_tuple(ip)
-    nett = _ipv4_to_tuple(net.rstrip('.0'))
-    if not ipt or not nett:
-        return False
-    return ipt[0] == nett[0] and ipt[1] == nett[1] and ipt[2] == nett[2]
+    if _config_ip_deny is None:
+        trie = _IpPrefixTrie()
+        legacy: list[str] = []
+        for pref in RISK_DENY_IP_PREFIXES:
+            net = _parse_ip_network(pref)
+            if net is None:
+                legacy.append(pref)
+            else:
+                trie.insert(net)
+        _config_ip_deny = (trie, legacy)
+    trie, legacy = _config_ip_deny
+    return trie.match(ip) is not None or any(ip.startswith(p) for p in legacy)
 
 
 def _risk_backoff_ms(s: Session, key_type: str, key_value: Optional[str]) -> int:
@@ -2647,6 +4820,130 @@ def _risk_backoff_ms(s: Session, key_type: str, key_value: Optional[str]) -> int
     return RISK_RETRY_BASE_MS * (2 ** max(0, rec.strikes - 1))
 
 
+_ALIAS_GENERATION = "aliases"
+
+
+class _AliasCache:
+    """
+    Per-process LRU of handle -> (wallet_id, user_id) for active aliases.
+
+    Unknown or inactive handles are cached as None with the shorter
+    ALIAS_CACHE_NEG_TTL_SECS. The "aliases" generation row is re-read at most
+    every ALIAS_CACHE_REFRESH_SECS; a bump from any worker drops the whole
+    cache. Local writers additionally invalidate their handles after commit.
+    """
+
+    def __init__(self) -> None:
+        self.lock = _threading.Lock()
+        self.entries: "OrderedDict[str, tuple[float, Optional[tuple[str, str]]]]" = OrderedDict()
+        self.bind = None
+        self.generation: Optional[int] = None
+        self.checked_at = 0.0
+        # Bumped on every invalidation so a lookup that raced a write does not
+        # store the value it read before the write.
+        self.epoch = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _sync(self, s: Session) -> None:
+        bind = s.get_bind()
+        now = _time.monotonic()
+        if self.bind is bind and now - self.checked_at < ALIAS_CACHE_REFRESH_SECS:
+            return
+        gen = _read_generation(s, _ALIAS_GENERATION)
+        with self.lock:
+            if self.bind is not bind or gen is None or gen != self.generation:
+                self.entries.clear()
+                self.epoch += 1
+                self.bind = bind
+                self.generation = gen
+            self.checked_at = now
+
+    def get(self, s: Session, handle: str) -> tuple[bool, Optional[tuple[str, str]], int]:
+        """(found, value, epoch); pass epoch back to put() after a miss."""
+        self._sync(s)
+        now = _time.monotonic()
+        with self.lock:
+            ent = self.entries.get(handle)
+            if ent is not None and ent[0] > now:
+                self.entries.move_to_end(handle)
+                if ent[1] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return True, ent[1], self.epoch
+            if ent is not None:
+                del self.entries[handle]
+            self.misses += 1
+            return False, None, self.epoch
+
+    def put(self, handle: str, value: Optional[tuple[str, str]], epoch: int) -> None:
+        if ALIAS_CACHE_MAX <= 0:
+            return
+        ttl = ALIAS_CACHE_TTL_SECS if value is not None else ALIAS_CACHE_NEG_TTL_SECS
+        with self.lock:
+            if epoch != self.epoch:
+                return
+            self.entries[handle] = (_time.monotonic() + ttl, value)
+            self.entries.move_to_end(handle)
+            while len(self.entries) > ALIAS_CACHE_MAX:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *handles: str) -> None:
+        with self.lock:
+            self.epoch += 1
+            self.invalidations += 1
+            if not handles:
+                self.entries.clear()
+            for h in handles:
+                self.entries.pop(h, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": ALIAS_CACHE_MAX,
+                "ttl_secs": ALIAS_CACHE_TTL_SECS,
+                "negative_ttl_secs": ALIAS_CACHE_NEG_TTL_SECS,
+                "generation": self.generation,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_alias_cache = _AliasCache()
+
+
+def _resolve_alias(s: Session, handle: str) -> Optional[tuple[str, str]]:
+    """(wallet_id, user_id) of an active alias, or None."""
+    found, value, epoch = _alias_cache.get(s, handle)
+    if found:
+        return value
+    row = s.execute(
+        select(Alias.wallet_id, Alias.user_id).where(Alias.handle == handle, Alias.status == "active")
+    ).first()
+    value = (row[0], row[1]) if row is not None else None
+    _alias_cache.put(handle, value, epoch)
+    return value
+
+
+def _bump_alias_generation(s: Session) -> None:
+    """Call before committing a binding change; other workers drop their caches."""
+    try:
+        _bump_generation(s, _ALIAS_GENERATION)
+    except Exception:
+        pass
+
+
 @router.post("/alias/request")
 def alias_request(req: AliasRequest, s: Session = Depends(get_session)):
     handle = _normalize_handle(req.handle)
@@ -2685,7 +4982,9 @@ def alias_request(req: AliasRequest, s: Session = Depends(get_session)):
         existing.code_expires_at = expires
     else:
         s.add(Alias(id=str(uuid.uuid4()), handle=handle, display=req.handle.strip(), user_id=u.id, wallet_id=w.id, status="pending", code_hash=h, code_expires_at=expires))
+    _bump_alias_generation(s)
     s.commit()
+    _alias_cache.invalidate(handle)
     # Return verification code only in explicitly non-production contexts.
     response = {"ok": True, "handle": f"@{handle}", "expires_at": expires.isoformat()}
     if ALIAS_EXPOSE_CODE:
@@ -2699,24 +4998,26 @@ def alias_verify(req: AliasVerifyReq, s: Session = Depends(get_session)):
     al = s.scalar(select(Alias).where(Alias.handle == handle))
     if not al:
         raise HTTPException(status_code=404, detail="Handle not found")
-    if not al.code_expires_at or al.code_expires_at < datetime.now(timezone.utc):
+    if not al.code_expires_at or _utc(al.code_expires_at) < datetime.now(timezone.utc):
         raise HTTPException(status_code=400, detail="Code expired")
     if _alias_code_hash(req.code) != (al.code_hash or ""):
         raise HTTPException(status_code=400, detail="Invalid code")
     al.status = "active"
     al.code_hash = None
     al.code_expires_at = None
+    _bump_alias_generation(s)
     s.commit()
+    _alias_cache.invalidate(handle)
     return {"ok": True, "handle": f"@{handle}", "wallet_id": al.wallet_id, "user_id": al.user_id}
 
 
 @router.get("/alias/resolve/{handle}", response_model=AliasResolve)
 def alias_resolve(handle: str, s: Session = Depends(get_session)):
     h = _normalize_handle(handle)
-    al = s.scalar(select(Alias).where(Alias.handle == h))
-    if not al or al.status != "active":
+    hit = _resolve_alias(s, h)
+    if hit is None:
         raise HTTPException(status_code=404, detail="Alias not found")
-    return AliasResolve(handle=f"@{h}", wallet_id=al.wallet_id, user_id=al.user_id, status=al.status)
+    return AliasResolve(handle=f"@{h}", wallet_id=hit[0], user_id=hit[1], status="active")
 
 
 # --- Admin: Alias moderation ---
@@ -2737,7 +5038,9 @@ def admin_alias_block(req: AliasBlockReq, s: Session = Depends(get_session), adm
     if not al:
         raise HTTPException(status_code=404, detail="Handle not found")
     al.status = "blocked"
+    _bump_alias_generation(s)
     s.commit()
+    _alias_cache.invalidate(h)
     return {"ok": True, "handle": f"@{h}", "status": al.status}
 
 
@@ -2756,10 +5059,17 @@ def admin_alias_rename(req: AliasRenameReq, s: Session = Depends(get_session), a
     # rename (keep same user/wallet), reset to pending for fresh verification (optional); here we keep active
     a_src.handle = dst
     a_src.display = req.to_handle.strip()
+    _bump_alias_generation(s)
     s.commit()
+    _alias_cache.invalidate(src, dst)
     return {"ok": True, "from": f"@{src}", "to": f"@{dst}"}
 
 
+@router.get("/admin/alias/cache/stats")
+def admin_alias_cache_stats(admin_ok: bool = Depends(require_admin)):
+    return _alias_cache.stats()
+
+
 @router.get("/admin/alias/search")
 def admin_alias_search(handle: Optional[str] = None, status: Optional[str] = None, user_id: Optional[str] = None, limit: int = 50, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
     q = select(Alias)
@@ -2790,7 +5100,9 @@ def admin_risk_deny_add(req: RiskDenyReq, s: Session = Depends(get_session), adm
     if existed:
         return {"ok": True, "exists": True}
     s.add(RiskDeny(id=str(uuid.uuid4()), kind=k, value=req.value.strip(), note=(req.note or None)))
+    _bump_generation(s, _RISK_DENY_GENERATION)
     s.commit()
+    _invalidate_risk_denylist()
     return {"ok": True}
 
 
@@ -2801,7 +5113,9 @@ def admin_risk_deny_remove(req: RiskDenyReq, s: Session = Depends(get_session),
     if not row:
         return {"ok": True, "removed": 0}
     s.delete(row)
+    _bump_generation(s, _RISK_DENY_GENERATION)
     s.commit()
+    _invalidate_risk_denylist()
     return {"ok": True, "removed": 1}
 
 
@@ -2837,51 +5151,41 @@ def admin_risk_events(minutes: int = 5, to_wallet_id: Optional[str] = None, devi
 
 
 @router.get("/admin/risk/metrics")
-def admin_risk_metrics(minutes: int = 5, top: int = 10, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+def admin_risk_metrics(
+    minutes: int = 5,
+    top: int = 10,
+    from_iso: Optional[str] = None,
+    to_iso: Optional[str] = None,
+    s: Session = Depends(get_session),
+    admin_ok: bool = Depends(require_admin),
+):
     if minutes < 1 or minutes > 1440:
         minutes = 5
-    since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
-    # Top devices
-    dev_rows = s.execute(sa_text(
-        """
-        select coalesce(device_id,'') as device_id, count(*) as cnt
-        from {schema}.alias_device_events
-        where created_at >= :since
-        group by device_id
-        order by cnt desc
-        limit :top
-        """.format(schema=DB_SCHEMA or 'public')
-    ), {"since": since, "top": top}).all()
-    # Top IPs
-    ip_rows = s.execute(sa_text(
-        """
-        select coalesce(ip,'') as ip, count(*) as cnt
-        from {schema}.alias_device_events
-        where created_at >= :since
-        group by ip
-        order by cnt desc
-        limit :top
-        """.format(schema=DB_SCHEMA or 'public')
-    ), {"since": since, "top": top}).all()
-    # Top receivers
-    rx_rows = s.execute(sa_text(
-        """
-        select to_wallet_id, count(*) as cnt
-        from {schema}.alias_device_events
-        where created_at >= :since
-        group by to_wallet_id
-        order by cnt desc
-        limit :top
-        """.format(schema=DB_SCHEMA or 'public')
-    ), {"since": since, "top": top}).all()
+    top = max(1, min(top, 1000))
+    start, end = _parse_range(from_iso, to_iso)
+    if start is None:
+        start = (end or datetime.now(timezone.utc)) - timedelta(minutes=minutes)
+
+    def _top(metric: str):
+        return s.execute(_rollup_query(s, metric, start, end, top=top)).all()
+
     return {
         "window_minutes": minutes,
-        "top_devices": [{"device_id": r[0] or None, "count": int(r[1])} for r in dev_rows],
-        "top_ips": [{"ip": r[0] or None, "count": int(r[1])} for r in ip_rows],
-        "top_receivers": [{"to_wallet_id": r[0], "count": int(r[1])} for r in rx_rows]
+        "from_ts": start.isoformat(),
+        "to_ts": end.isoformat() if end else None,
+        "top_devices": [{"device_id": r.dim or None, "count": int(r.cnt)} for r in _top("risk_device")],
+        "top_ips": [{"ip": r.dim or None, "count": int(r.cnt)} for r in _top("risk_ip")],
+        "top_receivers": [{"to_wallet_id": r.dim, "count": int(r.cnt)} for r in _top("risk_receiver")],
     }
 
 
+@router.post("/admin/risk/velocity/rebuild")
+def admin_risk_velocity_rebuild(since_days: int = 1, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    if since_days < 1 or since_days > VELOCITY_DAY_RETENTION_DAYS:
+        raise HTTPException(status_code=400, detail="since_days out of range")
+    return rebuild_velocity_counters(s, since_days=since_days)
+
+
 @router.post("/admin/aliases/ensure")
 def admin_aliases_ensure(s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
     _ensure_aliases_table()
@@ -2904,7 +5208,7 @@ def _sonic_decode(token: str) -> dict:
         raw_b64, sig = token.split(".", 1)
         pad = '=' * (-len(raw_b64) % 4)
         raw = _b64.urlsafe_b64decode((raw_b64 + pad).encode())
-        if _sonic_hmac(raw) != sig:
+        if not _hmac.compare_digest(_sonic_hmac(raw), sig):
             raise HTTPException(status_code=400, detail="Invalid signature")
         payload = _json.loads(raw.decode())
         return payload
@@ -2916,6 +5220,108 @@ def _sonic_hash(token: str) -> str:
     return _hashlib.sha256(token.encode()).hexdigest()
 
 
+_SONIC_BLOOM_HASHES = 4
+
+
+class _SonicReplayFilter:
+    """
+    Per-process record of sonic token hashes known to be spent.
+
+    Tokens are bucketed by the window of their signed exp; a bucket is
+    dropped once its window has passed, because the exp check rejects those
+    tokens anyway. Each bucket is a Bloom filter over an exact set: a Bloom
+    miss skips the set lookup, and only an exact hit rejects, so a false
+    positive never blocks a valid token. Past SONIC_REPLAY_MAX_PER_WINDOW the
+    exact set stops growing and further tokens just fall through to the DB,
+    which stays authoritative.
+    """
+
+    def __init__(self) -> None:
+        self.lock = _threading.Lock()
+        self.buckets: dict[int, tuple[bytearray, set[str]]] = {}
+        self.hits = 0
+        self.bloom_false_positives = 0
+        self.misses = 0
+        self.expired = 0
+        self.overflow = 0
+
+    @staticmethod
+    def _bits(token_hash: str) -> list[int]:
+        # token_hash is sha256 hex; slice it into independent bit positions
+        return [int(token_hash[i * 8:(i + 1) * 8], 16) % SONIC_REPLAY_BLOOM_BITS for i in range(_SONIC_BLOOM_HASHES)]
+
+    def _prune(self, now: int) -> None:
+        cur = now // SONIC_REPLAY_WINDOW_SECS
+        for w in [w for w in self.buckets if w < cur]:
+            del self.buckets[w]
+
+    def seen(self, token_hash: str, exp: int) -> bool:
+        w = exp // SONIC_REPLAY_WINDOW_SECS
+        with self.lock:
+            b = self.buckets.get(w)
+            if b is None or not all(b[0][i >> 3] & (1 << (i & 7)) for i in self._bits(token_hash)):
+                self.misses += 1
+                return False
+            if token_hash in b[1]:
+                self.hits += 1
+                return True
+            self.bloom_false_positives += 1
+            return False
+
+    def add(self, token_hash: str, exp: int, now: int) -> None:
+        if exp < now:
+            return
+        w = exp // SONIC_REPLAY_WINDOW_SECS
+        with self.lock:
+            self._prune(now)
+            b = self.buckets.get(w)
+            if b is None:
+                b = self.buckets[w] = (bytearray((SONIC_REPLAY_BLOOM_BITS + 7) // 8), set())
+            if len(b[1]) >= SONIC_REPLAY_MAX_PER_WINDOW:
+                self.overflow += 1
+                return
+            b[1].add(token_hash)
+            for i in self._bits(token_hash):
+                b[0][i >> 3] |= 1 << (i & 7)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "windows": len(self.buckets),
+                "window_secs": SONIC_REPLAY_WINDOW_SECS,
+                "size": sum(len(b[1]) for b in self.buckets.values()),
+                "bloom_bits": SONIC_REPLAY_BLOOM_BITS,
+                "hits": self.hits,
+                "bloom_false_positives": self.bloom_false_positives,
+                "misses": self.misses,
+                "expired": self.expired,
+                "overflow": self.overflow,
+            }
+
+
+_sonic_replay = _SonicReplayFilter()
+
+
+def _sonic_verify(token: str) -> tuple[dict, str]:
+    """
+    Stateless checks of a sonic token: signature, exp and the replay filter.
+    Returns (payload, token_hash); everything rejected here costs no query.
+    """
+    payload = _sonic_decode(token)
+    try:
+        exp = int(payload.get("exp", 0))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid token format")
+    if exp < int(datetime.now(timezone.utc).timestamp()):
+        with _sonic_replay.lock:
+            _sonic_replay.expired += 1
+        raise HTTPException(status_code=400, detail="Token expired")
+    th = _sonic_hash(token)
+    if _sonic_replay.seen(th, exp):
+        raise HTTPException(status_code=400, detail="Invalid or used token")
+    return payload, th
+
+
 class SonicIssueReq(BaseModel):
     from_wallet_id: str
     amount_cents: int = Field(..., gt=0)
@@ -2972,18 +5378,18 @@ def sonic_redeem(req: SonicRedeemReq, request: Request, s: Session = Depends(get
             if tx:
                 to_w = s.get(Wallet, req.to_wallet_id)
                 return WalletResp(wallet_id=to_w.id, balance_cents=to_w.balance_cents, currency=to_w.currency)
-    # Validate token
-    payload = _sonic_decode(req.token)
-    now = int(datetime.now(timezone.utc).timestamp())
-    if int(payload.get("exp", 0)) < now:
-        raise HTTPException(status_code=400, detail="Token expired")
+    # Validate token (signature, exp and recently spent tokens: no DB access)
+    payload, th = _sonic_verify(req.token)
+    exp = int(payload["exp"])
     amt = int(payload.get("amt", 0))
     if amt <= 0:
         raise HTTPException(status_code=400, detail="Invalid amount")
     from_id = payload.get("from")
-    th = _sonic_hash(req.token)
     st = s.execute(select(SonicToken).where(SonicToken.token_hash == th).with_for_update()).scalars().first()
     if not st or st.status != "reserved" or st.from_wallet_id != from_id:
+        if st is not None and st.status != "reserved":
+            # Spent elsewhere (another worker, expired, cancelled): remember it
+            _sonic_replay.add(th, exp, int(_time.time()))
         raise HTTPException(status_code=400, detail="Invalid or used token")
     # Transfer reserved funds to receiver; release external reserve
     to_w = s.execute(select(Wallet).where(Wallet.id == req.to_wallet_id).with_for_update()).scalars().first()
@@ -2992,7 +5398,7 @@ def sonic_redeem(req: SonicRedeemReq, request: Request, s: Session = Depends(get
     to_w.balance_cents += amt
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=-amt, txn_id=None, description="sonic_reserve_release"))
     txn_id = str(uuid.uuid4())
-    s.add(Txn(id=txn_id, from_wallet_id=from_id, to_wallet_id=to_w.id, amount_cents=amt, kind="transfer", fee_cents=0))
+    _record_txn(s, Txn(id=txn_id, from_wallet_id=from_id, to_wallet_id=to_w.id, amount_cents=amt, kind="transfer", fee_cents=0))
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=to_w.id, amount_cents=+amt, txn_id=txn_id, description="sonic_credit"))
     st.status = "redeemed"
     st.to_wallet_id = to_w.id
@@ -3000,10 +5406,16 @@ def sonic_redeem(req: SonicRedeemReq, request: Request, s: Session = Depends(get
     if ikey:
         s.add(Idempotency(id=str(uuid.uuid4()), ikey=ikey, endpoint="sonic_redeem", txn_id=txn_id))
     s.commit()
+    _sonic_replay.add(th, exp, int(_time.time()))
     s.refresh(to_w)
     return WalletResp(wallet_id=to_w.id, balance_cents=to_w.balance_cents, currency=to_w.currency)
 
 
+@router.get("/admin/sonic/replay/stats")
+def admin_sonic_replay_stats(admin_ok: bool = Depends(require_admin)):
+    return _sonic_replay.stats()
+
+
 # --- Cash Mandate (code-based cash send) ---
 class CashCreateReq(BaseModel):
     from_wallet_id: str
@@ -3158,19 +5570,33 @@ def _gen_voucher_code(n: int = 10) -> str:
     return "".join(_secrets.choice(alphabet) for _ in range(max(6, min(24, n))))
 
 
-def _gen_unique_voucher_code(s: Session, seen: set[str], n: int = 10, attempts: int = 5) -> str:
+TOPUP_BATCH_MAX_COUNT = _env_int("TOPUP_BATCH_MAX_COUNT", 50_000)
+TOPUP_BATCH_CHUNK = 1000  # rows per IN-check / multi-row INSERT
+
+
+def _gen_unique_voucher_codes(s: Session, count: int, n: int = 10, attempts: int = 5) -> List[str]:
     """
-    Generate a voucher code that does not collide with existing or in-batch codes.
+    Generate count voucher codes that collide neither with each other nor
+    with existing vouchers.
+
+    Candidates are drawn in memory and checked with one IN query per chunk;
+    only the collisions are redrawn on the next attempt.
     """
+    codes: set[str] = set()
     for _ in range(max(1, attempts)):
-        code = _gen_voucher_code(n)
-        if code in seen:
-            continue
-        # Fast existence check to avoid unique constraint violations on commit
-        exists = s.scalar(select(sa_func.count(TopupVoucher.id)).where(TopupVoucher.code == code))
-        if exists and int(exists) > 0:
-            continue
-        return code
+        fresh: set[str] = set()
+        while len(codes) + len(fresh) < count:
+            code = _gen_voucher_code(n)
+            if code not in codes:
+                fresh.add(code)
+        pending = list(fresh)
+        for i in range(0, len(pending), TOPUP_BATCH_CHUNK):
+            chunk = pending[i:i + TOPUP_BATCH_CHUNK]
+            taken = s.execute(select(TopupVoucher.code).where(TopupVoucher.code.in_(chunk))).scalars().all()
+            fresh.difference_update(taken)
+        codes |= fresh
+        if len(codes) >= count:
+            return list(codes)
     raise HTTPException(status_code=500, detail="Failed to generate unique voucher code")
 
 
@@ -3179,9 +5605,22 @@ def _voucher_sig(code: str, amount_cents: int) -> str:
     return _hmac.new(TOPUP_SECRET.encode(), raw, _hashlib.sha256).hexdigest()
 
 
+def _voucher_sigs(codes: List[str], amount_cents: int) -> List[str]:
+    """_voucher_sig for many codes of one amount, reusing the keyed HMAC state."""
+    base = _hmac.new(TOPUP_SECRET.encode(), digestmod=_hashlib.sha256)
+    suffix = f"|{amount_cents}".encode()
+    out: List[str] = []
+    for code in codes:
+        h = base.copy()
+        h.update(code.encode())
+        h.update(suffix)
+        out.append(h.hexdigest())
+    return out
+
+
 class TopupBatchCreateReq(BaseModel):
     amount_cents: int = Field(..., gt=0)
-    count: int = Field(..., ge=1, le=1000)
+    count: int = Field(..., ge=1, le=TOPUP_BATCH_MAX_COUNT)
     seller_id: Optional[str] = None
     expires_in_days: Optional[int] = Field(default=None, ge=1, le=365)
     note: Optional[str] = None
@@ -3210,27 +5649,26 @@ def topup_batch_create(req: TopupBatchCreateReq, s: Session = Depends(get_sessio
         # Track liability movement: move funds to external reserve account (wallet=None)
         s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=funding_w.id, amount_cents=-total_value, txn_id=None, description="voucher_batch_reserve"))
         s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=+total_value, txn_id=None, description="voucher_batch_external"))
-    seen_codes: set[str] = set()
-    for _ in range(req.count):
-        code = _gen_unique_voucher_code(s, seen_codes, 10)
-        seen_codes.add(code)
-        tv = TopupVoucher(
-            id=str(uuid.uuid4()),
-            code=code,
-            amount_cents=req.amount_cents,
-            currency=DEFAULT_CURRENCY,
-            status="reserved",
-            batch_id=batch_id,
-            seller_id=(req.seller_id or None),
-            note=(req.note or None),
-            funding_wallet_id=funding_w.id if funding_w else None,
-            created_at=now,
-            expires_at=exp,
-            # Link the funding source so redeem can reverse liability if needed.
-            # Stored via seller_id / note if needed; kept simple for now.
+    codes = _gen_unique_voucher_codes(s, req.count, 10)
+    sigs = _voucher_sigs(codes, req.amount_cents)
+    row = {
+        "amount_cents": req.amount_cents,
+        "currency": DEFAULT_CURRENCY,
+        "status": "reserved",
+        "batch_id": batch_id,
+        "seller_id": (req.seller_id or None),
+        "note": (req.note or None),
+        # Link the funding source so redeem can reverse liability if needed.
+        "funding_wallet_id": funding_w.id if funding_w else None,
+        "created_at": now,
+        "expires_at": exp,
+    }
+    for i in range(0, len(codes), TOPUP_BATCH_CHUNK):
+        s.execute(
+            sa_insert(TopupVoucher),
+            [dict(row, id=str(uuid.uuid4()), code=code) for code in codes[i:i + TOPUP_BATCH_CHUNK]],
         )
-        s.add(tv)
-        sig = _voucher_sig(code, req.amount_cents)
+    for code, sig in zip(codes, sigs):
         payload = f"TOPUP|code={code}|amount={req.amount_cents}|sig={sig}"
         items.append({"code": code, "amount_cents": req.amount_cents, "currency": DEFAULT_CURRENCY, "sig": sig, "payload": payload})
     s.commit()
@@ -3368,7 +5806,8 @@ def topup_redeem(req: TopupRedeemReq, request: Request, s: Session = Depends(get
         raise HTTPException(status_code=404, detail="Code not found")
     # Expiry and status checks
     now = datetime.now(timezone.utc)
-    if tv.expires_at and tv.expires_at < now:
+    # Only a still-reserved voucher is refunded; the sweeper may have done it already
+    if tv.status == "reserved" and tv.expires_at and tv.expires_at < now:
         tv.status = "expired"
         # Refund funding wallet if present
         if tv.funding_wallet_id:
@@ -3395,7 +5834,7 @@ def topup_redeem(req: TopupRedeemReq, request: Request, s: Session = Depends(get
         s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=-tv.amount_cents, txn_id=None, description="voucher_redeem_external_release"))
     w.balance_cents += tv.amount_cents
     txn_id = str(uuid.uuid4())
-    s.add(Txn(id=txn_id, from_wallet_id=None, to_wallet_id=w.id, amount_cents=tv.amount_cents, kind="topup", fee_cents=0))
+    _record_txn(s, Txn(id=txn_id, from_wallet_id=None, to_wallet_id=w.id, amount_cents=tv.amount_cents, kind="topup", fee_cents=0))
     s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=w.id, amount_cents=+tv.amount_cents, txn_id=txn_id, description="voucher_redeem"))
     if not tv.funding_wallet_id:
         s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=-tv.amount_cents, txn_id=txn_id, description="voucher_external"))
@@ -3408,6 +5847,491 @@ def topup_redeem(req: TopupRedeemReq, request: Request, s: Session = Depends(get
 
 
 # --- Debug/Admin: DB Introspection ---
+# --- Expiry sweeper ---
+_SWEEP_KINDS = (
+    "payment_requests_expired",
+    "sonic_tokens_expired",
+    "cash_mandates_expired",
+    "vouchers_expired",
+    "sonic_tokens_deleted",
+    "cash_mandates_deleted",
+    "idempotency_deleted",
+    "velocity_counters_pruned",
+)
+_sweep_lock = _threading.Lock()
+_sweep_stats: dict = {
+    "runs": 0,
+    "errors": 0,
+    "last_run_at": None,
+    "last_duration_ms": 0,
+    "last_swept": {k: 0 for k in _SWEEP_KINDS},
+    "total_swept": {k: 0 for k in _SWEEP_KINDS},
+}
+
+
+def _sweep_chunks(s: Session, ids_query, apply, batch: int, max_batches: int) -> int:
+    """
+    Run ids_query (already ordered by its index, without LIMIT) in chunks of
+    batch ids, call apply(ids) on each and commit, until a short chunk or
+    max_batches. Returns the number of rows handled.
+    """
+    done = 0
+    for _ in range(max(1, max_batches)):
+        ids = list(s.execute(ids_query.limit(batch)).scalars().all())
+        if not ids:
+            break
+        done += apply(ids)
+        s.commit()
+        if len(ids) < batch:
+            break
+    return done
+
+
+def _expire_ids(s: Session, model, from_status: str):
+    def apply(ids: List[str]) -> int:
+        res = s.execute(
+            sa_update(model)
+            .where(model.id.in_(ids), model.status == from_status)
+            .values(status="expired")
+            .execution_options(synchronize_session=False)
+        )
+        return int(res.rowcount or 0)
+    return apply
+
+
+def _delete_ids(s: Session, model):
+    def apply(ids: List[str]) -> int:
+        res = s.execute(sa_delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+        return int(res.rowcount or 0)
+    return apply
+
+
+def _delete_idempotency_keys(s: Session):
+    def apply(hashes: List[str]) -> int:
+        res = s.execute(sa_delete(IdempotencyKey).where(IdempotencyKey.key_hash.in_(hashes)).execution_options(synchronize_session=False))
+        return int(res.rowcount or 0)
+    return apply
+
+
+def _expire_voucher_ids(s: Session):
+    """Expire reserved vouchers and refund funded ones, one ledger pair per funding wallet."""
+    def apply(ids: List[str]) -> int:
+        rows = s.execute(
+            select(TopupVoucher)
+            .where(TopupVoucher.id.in_(ids), TopupVoucher.status == "reserved")
+            .with_for_update()
+        ).scalars().all()
+        refunds: dict[str, int] = {}
+        for tv in rows:
+            tv.status = "expired"
+            if tv.funding_wallet_id:
+                refunds[tv.funding_wallet_id] = refunds.get(tv.funding_wallet_id, 0) + int(tv.amount_cents)
+        wallets = _lock_wallets(s, list(refunds))
+        for wid, amount in refunds.items():
+            fw = wallets.get(wid)
+            if fw:
+                fw.balance_cents += amount
+            s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=-amount, txn_id=None, description="voucher_batch_external_release"))
+            s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=fw.id if fw else None, amount_cents=+amount, txn_id=None, description="voucher_expire_refund"))
+        return len(rows)
+    return apply
+
+
+def sweep_expired(s: Session, batch: Optional[int] = None, max_batches: Optional[int] = None) -> dict:
+    """
+    Expire past-due pending/reserved rows and delete stale terminal rows.
+
+    Every step walks a (status, expires_at) or created_at index in bounded
+    chunks and commits per chunk, so a large backlog is worked off over a
+    few runs without long-held locks. Expiry mirrors the lazy paths:
+    requests, sonic tokens and cash mandates only change status; vouchers
+    also refund their funding wallet.
+    """
+    batch = max(1, int(batch or EXPIRY_SWEEP_BATCH))
+    max_batches = max(1, int(max_batches or EXPIRY_SWEEP_MAX_BATCHES))
+    now = datetime.now(timezone.utc)
+    keep = now - timedelta(days=EXPIRY_SWEEP_RETENTION_DAYS)
+    out: dict[str, int] = {}
+
+    def _due(model, status: str):
+        return (
+            select(model.id)
+            .where(model.status == status, model.expires_at.is_not(None), model.expires_at < now)
+            .order_by(model.expires_at)
+        )
+
+    out["payment_requests_expired"] = _sweep_chunks(s, _due(PaymentRequest, "pending"), _expire_ids(s, PaymentRequest, "pending"), batch, max_batches)
+    out["sonic_tokens_expired"] = _sweep_chunks(s, _due(SonicToken, "reserved"), _expire_ids(s, SonicToken, "reserved"), batch, max_batches)
+    out["cash_mandates_expired"] = _sweep_chunks(s, _due(CashMandate, "reserved"), _expire_ids(s, CashMandate, "reserved"), batch, max_batches)
+    out["vouchers_expired"] = _sweep_chunks(s, _due(TopupVoucher, "reserved"), _expire_voucher_ids(s), batch, max_batches)
+    # Sonic tokens carry a signed exp, so their rows are not needed for replay
+    # protection once past it; cash codes are only looked up while reserved.
+    out["sonic_tokens_deleted"] = _sweep_chunks(
+        s,
+        select(SonicToken.id)
+        .where(SonicToken.status.in_(("expired", "redeemed", "cancelled")), SonicToken.expires_at < keep)
+        .order_by(SonicToken.status, SonicToken.expires_at),
+        _delete_ids(s, SonicToken),
+        batch,
+        max_batches,
+    )
+    out["cash_mandates_deleted"] = _sweep_chunks(
+        s,
+        select(CashMandate.id)
+        .where(CashMandate.status.in_(("expired", "redeemed", "cancelled")), CashMandate.expires_at < keep)
+        .order_by(CashMandate.status, CashMandate.expires_at),
+        _delete_ids(s, CashMandate),
+        batch,
+        max_batches,
+    )
+    out["idempotency_deleted"] = _sweep_chunks(
+        s,
+        select(Idempotency.id)
+        .where(Idempotency.created_at < now - timedelta(days=IDEMPOTENCY_RETENTION_DAYS))
+        .order_by(Idempotency.created_at),
+        _delete_ids(s, Idempotency),
+        batch,
+        max_batches,
+    )
+    out["idempotency_keys_deleted"] = _sweep_chunks(
+        s,
+        select(IdempotencyKey.key_hash)
+        .where(IdempotencyKey.expires_at < now)
+        .order_by(IdempotencyKey.expires_at),
+        _delete_idempotency_keys(s),
+        batch,
+        max_batches,
+    )
+    # Transfers add counter rows continuously; trim them on the same cadence
+    out["velocity_counters_pruned"] = _prune_velocity_counters(s, now, batch=batch, max_batches=max_batches)
+    return out
+
+
+def _run_expiry_sweep(batch: Optional[int] = None, max_batches: Optional[int] = None) -> dict:
+    t0 = _time.perf_counter()
+    try:
+        with Session(engine) as s:
+            swept = sweep_expired(s, batch=batch, max_batches=max_batches)
+    except Exception:
+        with _sweep_lock:
+            _sweep_stats["errors"] += 1
+        raise
+    duration_ms = int((_time.perf_counter() - t0) * 1000)
+    with _sweep_lock:
+        _sweep_stats["runs"] += 1
+        _sweep_stats["last_run_at"] = datetime.now(timezone.utc).isoformat()
+        _sweep_stats["last_duration_ms"] = duration_ms
+        _sweep_stats["last_swept"] = dict(swept)
+        for k, v in swept.items():
+            _sweep_stats["total_swept"][k] = _sweep_stats["total_swept"].get(k, 0) + v
+    return {"swept": swept, "duration_ms": duration_ms}
+
+
+_periodic_started: set[str] = set()
+
+
+def _start_periodic(name: str, interval_secs: int, fn) -> None:
+    """Run fn every interval_secs on a daemon thread (once per process and name)."""
+    if interval_secs <= 0 or name in _periodic_started:
+        return
+    _periodic_started.add(name)
+    import logging as _lg
+
+    def _loop():
+        while True:
+            _time.sleep(interval_secs)
+            try:
+                fn()
+            except Exception as e:
+                _lg.getLogger(__name__).warning("%s error: %s", name, e)
+    t = _threading.Thread(target=_loop, name=f"payments-{name}", daemon=True)
+    t.start()
+
+
+def _start_expiry_sweeper():
+    _start_periodic("expiry-sweeper", EXPIRY_SWEEP_INTERVAL_SECS, _run_expiry_sweep)
+
+
+@router.get("/admin/sweeper/stats")
+def admin_sweeper_stats(admin_ok: bool = Depends(require_admin)):
+    with _sweep_lock:
+        return {
+            **{k: v for k, v in _sweep_stats.items() if not isinstance(v, dict)},
+            "last_swept": dict(_sweep_stats["last_swept"]),
+            "total_swept": dict(_sweep_stats["total_swept"]),
+            "interval_secs": EXPIRY_SWEEP_INTERVAL_SECS,
+            "batch": EXPIRY_SWEEP_BATCH,
+        }
+
+
+@router.post("/admin/sweeper/run")
+def admin_sweeper_run(batch: Optional[int] = None, admin_ok: bool = Depends(require_admin)):
+    return _run_expiry_sweep(batch=batch)
+
+
+# --- Leased background jobs ---
+_JOB_OWNER = f"{_socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class _JobLeaseLost(Exception):
+    pass
+
+
+def _acquire_job_lease(s: Session, name: str, owner: str, now: datetime) -> bool:
+    """
+    Take (or renew) the lease of job name. Postgres skips a row another
+    worker is locking right now; elsewhere the row is claimed by a
+    compare-and-set UPDATE.
+    """
+    if s.get(ScheduledJob, name) is None:
+        try:
+            s.add(ScheduledJob(name=name, processed=0, batches=0, runs=0))
+            s.commit()
+        except IntegrityError:
+            s.rollback()
+    until = now + timedelta(seconds=JOB_LEASE_SECS)
+    if s.get_bind().dialect.name == "postgresql":
+        job = s.execute(
+            select(ScheduledJob).where(ScheduledJob.name == name).with_for_update(skip_locked=True)
+        ).scalars().first()
+        if job is None or (job.lease_owner not in (None, owner) and job.lease_until is not None and _utc(job.lease_until) > now):
+            s.rollback()
+            return False
+        job.lease_owner = owner
+        job.lease_until = until
+        s.commit()
+        return True
+    res = s.execute(
+        sa_update(ScheduledJob)
+        .where(
+            ScheduledJob.name == name,
+            or_(ScheduledJob.lease_owner.is_(None), ScheduledJob.lease_owner == owner, ScheduledJob.lease_until.is_(None), ScheduledJob.lease_until < now),
+        )
+        .values(lease_owner=owner, lease_until=until)
+        .execution_options(synchronize_session=False)
+    )
+    s.commit()
+    return res.rowcount == 1
+
+
+def _job_checkpoint(s: Session, name: str, owner: str, cursor: Optional[str], n: int) -> None:
+    """Commit one batch together with its progress; the lease is extended on the way."""
+    now = datetime.now(timezone.utc)
+    res = s.execute(
+        sa_update(ScheduledJob)
+        .where(ScheduledJob.name == name, ScheduledJob.lease_owner == owner)
+        .values(
+            cursor=cursor,
+            processed=ScheduledJob.processed + n,
+            batches=ScheduledJob.batches + 1,
+            lease_until=now + timedelta(seconds=JOB_LEASE_SECS),
+            updated_at=now,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount != 1:
+        s.rollback()
+        raise _JobLeaseLost(name)
+    s.commit()
+
+
+def _job_savings_interest(s: Session, name: str, owner: str, cursor: Optional[str]) -> int:
+    """
+    Credit one month of SAVINGS_INTEREST_BPS (annual) to every savings
+    account, walking savings_accounts by id. Interest is paid by the
+    treasury system wallet if one is registered, else booked as external.
+    """
+    if SAVINGS_INTEREST_BPS <= 0:
+        return 0
+    treasury_id = _system_wallet_id(s, "treasury")
+    is_pg = s.get_bind().dialect.name == "postgresql"
+    done = 0
+    while True:
+        q = select(SavingsAccount).where(SavingsAccount.balance_cents > 0)
+        if cursor:
+            q = q.where(SavingsAccount.id > cursor)
+        q = q.order_by(SavingsAccount.id).limit(JOB_BATCH)
+        if is_pg:
+            q = q.with_for_update()
+        accounts = s.execute(q).scalars().all()
+        if not accounts:
+            break
+        now = datetime.now(timezone.utc)
+        total = 0
+        for acct in accounts:
+            interest = acct.balance_cents * SAVINGS_INTEREST_BPS // (10_000 * 12)
+            if interest <= 0:
+                continue
+            acct.balance_cents += interest
+            acct.updated_at = now
+            txn_id = str(uuid.uuid4())
+            _record_txn(s, Txn(id=txn_id, from_wallet_id=treasury_id, to_wallet_id=acct.wallet_id, amount_cents=interest, kind="savings_interest", fee_cents=0))
+            s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=None, amount_cents=+interest, txn_id=txn_id, description="savings_interest_reserve_credit"))
+            total += interest
+        if total:
+            treasury = _lock_wallets(s, [treasury_id]).get(treasury_id) if treasury_id else None
+            if treasury is not None:
+                treasury.balance_cents -= total
+            s.add(LedgerEntry(id=str(uuid.uuid4()), wallet_id=(treasury.id if treasury is not None else None), amount_cents=-total, txn_id=None, description="savings_interest_debit" if treasury is not None else "savings_interest_external"))
+        cursor = accounts[-1].id
+        _job_checkpoint(s, name, owner, cursor, len(accounts))
+        done += len(accounts)
+        if len(accounts) < JOB_BATCH:
+            break
+    return done
+
+
+def _job_bill_settlement(s: Session, name: str, owner: str, cursor: Optional[str]) -> int:
+    """Settle scheduled bills that are due, oldest first; a bill that cannot be paid is marked failed."""
+    is_pg = s.get_bind().dialect.name == "postgresql"
+    done = 0
+    while True:
+        now = datetime.now(timezone.utc)
+        q = (
+            select(BillPayment)
+            .where(BillPayment.status == "scheduled", BillPayment.scheduled_for <= now)
+            .order_by(BillPayment.scheduled_for, BillPayment.id)
+            .limit(JOB_BATCH)
+        )
+        if is_pg:
+            q = q.with_for_update(skip_locked=True)
+        bills = s.execute(q).scalars().all()
+        if not bills:
+            break
+        locked = _lock_wallets(s, [b.from_wallet_id for b in bills] + [b.to_wallet_id for b in bills])
+        spent = _daily_spent_cents(s, {b.from_wallet_id for b in bills if b.from_wallet_id in locked})
+        for bp in bills:
+            from_w = locked.get(bp.from_wallet_id)
+            to_w = locked.get(bp.to_wallet_id)
+            try:
+                if not from_w or not to_w:
+                    raise HTTPException(status_code=404, detail="Wallet not found")
+                _check_bill_limits(s, from_w, bp.amount_cents, spent_today=spent.get(from_w.id, 0))
+            except HTTPException as e:
+                bp.status = "failed"
+                bp.error = str(e.detail)[:64]
+                continue
+            _post_bill(s, from_w, to_w, bp.biller_code, bp.reference, bp.amount_cents, txn_id=bp.txn_id)
+            spent[from_w.id] = spent.get(from_w.id, 0) + bp.amount_cents
+            bp.status = "posted"
+        _job_checkpoint(s, name, owner, bills[-1].id, len(bills))
+        done += len(bills)
+        if len(bills) < JOB_BATCH:
+            break
+    return done
+
+
+def _month_period(now: datetime) -> str:
+    return now.strftime("%Y-%m")
+
+
+# name -> (run(s, name, owner, cursor) -> rows, period(now) or None for "every tick")
+_JOBS = {
+    "savings_interest": (_job_savings_interest, _month_period),
+    "bill_settlement": (_job_bill_settlement, None),
+}
+_job_lock = _threading.Lock()
+_job_last: Dict[str, dict] = {}
+
+
+def run_job(s: Session, name: str, force: bool = False, owner: Optional[str] = None) -> dict:
+    """
+    Run job name if this worker gets its lease and the job is due (a
+    periodic job is due once per period; force re-runs a completed one).
+    """
+    fn, period_of = _JOBS[name]
+    owner = owner or _JOB_OWNER
+    now = datetime.now(timezone.utc)
+    if not _acquire_job_lease(s, name, owner, now):
+        return {"job": name, "status": "busy"}
+    job = s.get(ScheduledJob, name, populate_existing=True)
+    period = period_of(now) if period_of else None
+    if period is not None and job.last_period == period and not force:
+        job.lease_owner = None
+        job.lease_until = None
+        s.commit()
+        return {"job": name, "status": "idle", "period": period}
+    if period is None or job.period != period or job.last_period == period:
+        # New run: start over (a run of the same period resumes from its cursor)
+        job.cursor = None
+        job.processed = 0
+        job.batches = 0
+    job.period = period
+    job.started_at = now
+    job.last_status = "running"
+    s.commit()
+    cursor = job.cursor
+    t0 = _time.perf_counter()
+    status, error, rows = "ok", None, 0
+    try:
+        rows = fn(s, name, owner, cursor)
+    except _JobLeaseLost:
+        status = "lease_lost"
+    except Exception as e:
+        s.rollback()
+        status, error = "error", str(e)[:255]
+    duration_ms = int((_time.perf_counter() - t0) * 1000)
+    if status != "lease_lost":
+        values = dict(lease_owner=None, lease_until=None, last_status=status, last_error=error, finished_at=datetime.now(timezone.utc), runs=ScheduledJob.runs + 1)
+        if status == "ok":
+            values.update(cursor=None, last_period=period)
+        s.execute(
+            sa_update(ScheduledJob)
+            .where(ScheduledJob.name == name, ScheduledJob.lease_owner == owner)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        s.commit()
+    out = {"job": name, "status": status, "period": period, "rows": rows, "duration_ms": duration_ms}
+    if error:
+        out["error"] = error
+    with _job_lock:
+        _job_last[name] = dict(out, finished_at=datetime.now(timezone.utc).isoformat())
+    return out
+
+
+def _run_due_jobs() -> dict:
+    out = {}
+    for name in _JOBS:
+        with Session(engine) as s:
+            out[name] = run_job(s, name)
+    return out
+
+
+@router.get("/admin/jobs")
+def admin_jobs(s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    rows = {j.name: j for j in s.execute(select(ScheduledJob)).scalars().all()}
+    with _job_lock:
+        last = {k: dict(v) for k, v in _job_last.items()}
+    items = []
+    for name in _JOBS:
+        j = rows.get(name)
+        items.append({
+            "job": name,
+            "lease_owner": j.lease_owner if j else None,
+            "lease_until": j.lease_until if j else None,
+            "period": j.period if j else None,
+            "last_period": j.last_period if j else None,
+            "cursor": j.cursor if j else None,
+            "processed": int(j.processed or 0) if j else 0,
+            "batches": int(j.batches or 0) if j else 0,
+            "runs": int(j.runs or 0) if j else 0,
+            "last_status": j.last_status if j else None,
+            "last_error": j.last_error if j else None,
+            "started_at": j.started_at if j else None,
+            "finished_at": j.finished_at if j else None,
+            "last_local_run": last.get(name),
+        })
+    return {"worker": _JOB_OWNER, "interval_secs": JOB_RUNNER_INTERVAL_SECS, "batch": JOB_BATCH, "jobs": items}
+
+
+@router.post("/admin/jobs/{name}/run")
+def admin_jobs_run(name: str, force: bool = False, s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
+    if name not in _JOBS:
+        raise HTTPException(status_code=404, detail="unknown job")
+    return run_job(s, name, force=force)
+
+
 @router.get("/admin/debug/tables")
 def admin_debug_tables(s: Session = Depends(get_session), admin_ok: bool = Depends(require_admin)):
     schema = DB_SCHEMA or "public"
@@ -3428,6 +6352,10 @@ ALIAS_VELOCITY_MAX_CENTS = int(_env_or("ALIAS_VELOCITY_MAX_CENTS", "500000"))
 ALIAS_RX_VELOCITY_MAX_TX = int(_env_or("ALIAS_RX_VELOCITY_MAX_TX", "20"))  # per receiver/min
 ALIAS_RX_VELOCITY_MAX_CENTS = int(_env_or("ALIAS_RX_VELOCITY_MAX_CENTS", "1000000"))
 ALIAS_DEVICE_MAX_TX_PER_MIN = int(_env_or("ALIAS_DEVICE_MAX_TX_PER_MIN", "5"))
+ALIAS_CACHE_MAX = int(_env_or("ALIAS_CACHE_MAX", "10000"))  # 0 disables the resolve cache
+ALIAS_CACHE_TTL_SECS = float(_env_or("ALIAS_CACHE_TTL_SECS", "300"))
+ALIAS_CACHE_NEG_TTL_SECS = float(_env_or("ALIAS_CACHE_NEG_TTL_SECS", "30"))
+ALIAS_CACHE_REFRESH_SECS = float(_env_or("ALIAS_CACHE_REFRESH_SECS", "2"))
 RESERVED_ALIASES = set(a.strip() for a in _env_or("RESERVED_ALIASES", "admin,root,support,help,sys,ops").split(","))
 
 # Risk controls
@@ -3508,4 +6436,56 @@ def roles_check(phone: str, role: str, s: Session = Depends(get_session), admin_
     return {"ok": True, "has": has}
 
 
+# --- Async variants of the hot endpoints (PAYMENTS_DB_ASYNC=true) ---
+# Simple reads are native async queries. transfer / list_txns / topup_redeem
+# keep one implementation of their money logic: the sync handler runs via
+# AsyncSession.run_sync, i.e. in a greenlet on the event loop over the async
+# driver, so it no longer occupies a threadpool worker while waiting on IO.
+async def get_wallet_async(wallet_id: str, s=Depends(get_async_session)):
+    w = await s.get(Wallet, wallet_id)
+    if not w:
+        raise HTTPException(status_code=404, detail="Wallet not found")
+    return WalletResp(wallet_id=w.id, balance_cents=w.balance_cents, currency=w.currency)
+
+
+async def idempotency_status_async(ikey: str, route: Optional[str] = None, wallet_id: Optional[str] = None, s=Depends(get_async_session)):
+    return await s.run_sync(lambda ss: idempotency_status(ikey, route=route, wallet_id=wallet_id, s=ss))
+
+
+async def transfer_async(req: TransferReq, request: Request, s=Depends(get_async_session)):
+    return await s.run_sync(lambda ss: transfer(req, request, s=ss))
+
+
+async def list_txns_async(wallet_id: str, limit: int = 50, cursor: Optional[str] = None, s=Depends(get_async_session)):
+    return await s.run_sync(lambda ss: list_txns(wallet_id, limit=limit, cursor=cursor, s=ss))
+
+
+async def topup_redeem_async(req: TopupRedeemReq, request: Request, s=Depends(get_async_session)):
+    return await s.run_sync(lambda ss: topup_redeem(req, request, s=ss))
+
+
+_ASYNC_ROUTES = {
+    ("/transfer", "POST"): transfer_async,
+    ("/wallets/{wallet_id}", "GET"): get_wallet_async,
+    ("/txns", "GET"): list_txns_async,
+    ("/topup/redeem", "POST"): topup_redeem_async,
+    ("/idempotency/{ikey}", "GET"): idempotency_status_async,
+}
+
+
+def _use_async_routes(r: APIRouter) -> None:
+    """Swap the hot routes' endpoints for their async variants, in place."""
+    for i, route in enumerate(list(r.routes)):
+        methods = getattr(route, "methods", None) or set()
+        endpoint = next((fn for (path, m), fn in _ASYNC_ROUTES.items() if route.path == path and m in methods), None)
+        if endpoint is None:
+            continue
+        r.add_api_route(route.path, endpoint, methods=list(methods), response_model=route.response_model)
+        r.routes.pop(i)
+        r.routes.insert(i, r.routes.pop())
+
+
+if PAYMENTS_DB_ASYNC:
+    _use_async_routes(router)
+
 app.include_router(router)
@@ -0,0 +1,47 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0004_velocity_counters'
+down_revision = '0003_idempotency_funding_columns'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'velocity_counters', schema):
+        return
+    op.create_table(
+        'velocity_counters',
+        sa.Column('scope', sa.String(length=16), nullable=False),
+        sa.Column('subject', sa.String(length=128), nullable=False),
+        sa.Column('bucket_secs', sa.Integer(), nullable=False),
+        sa.Column('bucket_start', sa.BigInteger(), nullable=False),
+        sa.Column('txn_count', sa.BigInteger(), nullable=True),
+        sa.Column('amount_cents', sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint('scope', 'subject', 'bucket_secs', 'bucket_start'),
+        schema=schema
+    )
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'velocity_counters', schema):
+        op.drop_table('velocity_counters', schema=schema)
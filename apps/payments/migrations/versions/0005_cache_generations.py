@@ -0,0 +1,43 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0005_cache_generations'
+down_revision = '0004_velocity_counters'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'cache_generations', schema):
+        return
+    op.create_table(
+        'cache_generations',
+        sa.Column('name', sa.String(length=64), primary_key=True),
+        sa.Column('generation', sa.BigInteger(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        schema=schema
+    )
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'cache_generations', schema):
+        op.drop_table('cache_generations', schema=schema)
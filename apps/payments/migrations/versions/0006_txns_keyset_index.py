@@ -0,0 +1,36 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0006_txns_keyset_index'
+down_revision = '0005_cache_generations'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_index(bind, 'txns', 'ix_txns_created_id', schema):
+        op.create_index('ix_txns_created_id', 'txns', ['created_at', 'id'], unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_index(bind, 'txns', 'ix_txns_created_id', schema):
+        op.drop_index('ix_txns_created_id', table_name='txns', schema=schema)
@@ -0,0 +1,130 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+import re
+
+# revision identifiers, used by Alembic.
+revision = '0007_merchant_ref_columns'
+down_revision = '0006_txns_keyset_index'
+branch_labels = None
+depends_on = None
+
+
+_MERCHANT_RE = re.compile(r"(?:^|[\s;])m=([^\s;]+)")
+_REF_RE = re.compile(r"(?:^|[\s;])ref=([^\s;]+)")
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_column(bind, table: str, column: str, schema: str | None) -> bool:
+    insp = sa.inspect(bind)
+    cols = [col['name'] for col in insp.get_columns(table, schema=schema)]
+    return column in cols
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _parse(desc):
+    m = _MERCHANT_RE.search(desc or "")
+    r = _REF_RE.search(desc or "")
+    mid = (m.group(1).strip().lower()[:64] or None) if m else None
+    ref = (r.group(1)[:64] or None) if r else None
+    return mid, ref
+
+
+def _backfill(bind, schema: str | None, batch: int = 1000) -> None:
+    ledger = sa.table(
+        'ledger_entries',
+        sa.column('id', sa.String), sa.column('txn_id', sa.String), sa.column('amount_cents', sa.BigInteger),
+        sa.column('description', sa.String), sa.column('merchant_id', sa.String), sa.column('ref', sa.String),
+        schema=schema,
+    )
+    txns = sa.table(
+        'txns', sa.column('id', sa.String), sa.column('merchant_id', sa.String), sa.column('ref', sa.String),
+        schema=schema,
+    )
+    last = ""
+    while True:
+        rows = bind.execute(
+            sa.select(ledger.c.id, ledger.c.txn_id, ledger.c.amount_cents, ledger.c.description)
+            .where(
+                ledger.c.id > last,
+                ledger.c.merchant_id.is_(None),
+                ledger.c.ref.is_(None),
+                sa.or_(ledger.c.description.like('%m=%'), ledger.c.description.like('%ref=%')),
+            )
+            .order_by(ledger.c.id)
+            .limit(batch)
+        ).all()
+        if not rows:
+            break
+        last = rows[-1][0]
+        per_txn = {}
+        for le_id, txn_id, amount, desc in rows:
+            mid, ref = _parse(desc)
+            if not (mid or ref):
+                continue
+            bind.execute(ledger.update().where(ledger.c.id == le_id).values(merchant_id=mid, ref=ref))
+            if txn_id and ((amount or 0) < 0 or txn_id not in per_txn):
+                per_txn[txn_id] = (mid, ref)
+        for txn_id, (mid, ref) in per_txn.items():
+            bind.execute(
+                txns.update()
+                .where(txns.c.id == txn_id, txns.c.merchant_id.is_(None), txns.c.ref.is_(None))
+                .values(merchant_id=mid, ref=ref)
+            )
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table in ('txns', 'ledger_entries'):
+        if not _has_table(bind, table, schema):
+            continue
+        for col in ('merchant_id', 'ref'):
+            if not _has_column(bind, table, col, schema):
+                op.add_column(table, sa.Column(col, sa.String(length=64), nullable=True), schema=schema)
+    if _has_table(bind, 'txns', schema) and not _has_index(bind, 'txns', 'ix_txns_merchant_created', schema):
+        op.create_index('ix_txns_merchant_created', 'txns', ['merchant_id', 'created_at', 'id'], unique=False, schema=schema)
+    if _has_table(bind, 'ledger_entries', schema):
+        if not _has_index(bind, 'ledger_entries', 'ix_ledger_txn', schema):
+            op.create_index('ix_ledger_txn', 'ledger_entries', ['txn_id'], unique=False, schema=schema)
+        if not _has_index(bind, 'ledger_entries', 'ix_ledger_merchant_created', schema):
+            op.create_index('ix_ledger_merchant_created', 'ledger_entries', ['merchant_id', 'created_at'], unique=False, schema=schema)
+        if _has_table(bind, 'txns', schema):
+            _backfill(bind, schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table, name in (
+        ('ledger_entries', 'ix_ledger_merchant_created'),
+        ('ledger_entries', 'ix_ledger_txn'),
+        ('txns', 'ix_txns_merchant_created'),
+    ):
+        if _has_table(bind, table, schema) and _has_index(bind, table, name, schema):
+            op.drop_index(name, table_name=table, schema=schema)
+    for table in ('ledger_entries', 'txns'):
+        if not _has_table(bind, table, schema):
+            continue
+        for col in ('ref', 'merchant_id'):
+            if _has_column(bind, table, col, schema):
+                op.drop_column(table, col, schema=schema)
@@ -0,0 +1,65 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0008_ledger_checkpoints'
+down_revision = '0007_merchant_ref_columns'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'ledger_checkpoints', schema):
+        op.create_table(
+            'ledger_checkpoints',
+            sa.Column('wallet_id', sa.String(length=36), primary_key=True),
+            sa.Column('ledger_sum_cents', sa.BigInteger(), nullable=True),
+            sa.Column('entry_count', sa.BigInteger(), nullable=True),
+            sa.Column('last_entry_at', sa.DateTime(timezone=True), nullable=True),
+            schema=schema
+        )
+    if not _has_table(bind, 'reconcile_state', schema):
+        op.create_table(
+            'reconcile_state',
+            sa.Column('name', sa.String(length=32), primary_key=True),
+            sa.Column('watermark', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('runs', sa.BigInteger(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+            schema=schema
+        )
+    if _has_table(bind, 'ledger_entries', schema) and not _has_index(bind, 'ledger_entries', 'ix_ledger_created', schema):
+        op.create_index('ix_ledger_created', 'ledger_entries', ['created_at'], unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'ledger_entries', schema) and _has_index(bind, 'ledger_entries', 'ix_ledger_created', schema):
+        op.drop_index('ix_ledger_created', table_name='ledger_entries', schema=schema)
+    for table in ('reconcile_state', 'ledger_checkpoints'):
+        if _has_table(bind, table, schema):
+            op.drop_table(table, schema=schema)
@@ -0,0 +1,60 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0009_redpacket_shares'
+down_revision = '0008_ledger_checkpoints'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_column(bind, table: str, column: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(c.get('name') == column for c in insp.get_columns(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'red_packets', schema) and not _has_column(bind, 'red_packets', 'presplit', schema):
+        op.add_column('red_packets', sa.Column('presplit', sa.Boolean(), nullable=True, server_default=sa.false()), schema=schema)
+    if not _has_table(bind, 'red_packet_shares', schema):
+        op.create_table(
+            'red_packet_shares',
+            sa.Column('id', sa.String(length=36), primary_key=True),
+            sa.Column('redpacket_id', sa.String(length=36), nullable=False),
+            sa.Column('slot', sa.Integer(), nullable=False),
+            sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+            sa.Column('wallet_id', sa.String(length=36), nullable=True),
+            sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True),
+            sa.UniqueConstraint('redpacket_id', 'slot', name='uq_redpacket_share_slot'),
+            schema=schema
+        )
+        op.create_index('ix_redpacket_share_free', 'red_packet_shares', ['redpacket_id', 'wallet_id'], unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'red_packet_shares', schema):
+        op.drop_index('ix_redpacket_share_free', table_name='red_packet_shares', schema=schema)
+        op.drop_table('red_packet_shares', schema=schema)
+    if _has_column(bind, 'red_packets', 'presplit', schema):
+        op.drop_column('red_packets', 'presplit', schema=schema)
@@ -0,0 +1,55 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0010_expiry_sweep_indexes'
+down_revision = '0009_redpacket_shares'
+branch_labels = None
+depends_on = None
+
+
+_INDEXES = [
+    ('idempotency', 'ix_idempotency_created', ['created_at']),
+    ('sonic_tokens', 'ix_sonic_status_expires', ['status', 'expires_at']),
+    ('cash_mandates', 'ix_cash_status_expires', ['status', 'expires_at']),
+    ('topup_vouchers', 'ix_topup_status_expires', ['status', 'expires_at']),
+    ('payment_requests', 'ix_payreq_status_expires', ['status', 'expires_at']),
+]
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table, name, cols in _INDEXES:
+        if _has_table(bind, table, schema) and not _has_index(bind, table, name, schema):
+            op.create_index(name, table, cols, unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table, name, _cols in _INDEXES:
+        if _has_index(bind, table, name, schema):
+            op.drop_index(name, table_name=table, schema=schema)
@@ -0,0 +1,65 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0011_wallet_activity'
+down_revision = '0010_expiry_sweep_indexes'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'wallet_activity', schema):
+        op.create_table(
+            'wallet_activity',
+            sa.Column('wallet_id', sa.String(length=36), primary_key=True),
+            sa.Column('txn_id', sa.String(length=36), primary_key=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('direction', sa.String(length=4), nullable=False),
+            sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+            sa.Column('fee_cents', sa.BigInteger(), nullable=True),
+            sa.Column('counterparty_wallet_id', sa.String(length=36), nullable=True),
+            sa.Column('kind', sa.String(length=32), nullable=True),
+            schema=schema
+        )
+        op.create_index('ix_wallet_activity_wallet_created', 'wallet_activity', ['wallet_id', 'created_at', 'txn_id'], unique=False, schema=schema)
+    if not _has_table(bind, 'txns', schema):
+        return
+    # Backfill from existing txns (one row per participating wallet)
+    prefix = f"{schema}." if schema else ""
+    wa, tx = f"{prefix}wallet_activity", f"{prefix}txns"
+    for direction, own, other, cond in (
+        ('out', 'from_wallet_id', 'to_wallet_id', "t.from_wallet_id IS NOT NULL AND t.from_wallet_id <> t.to_wallet_id"),
+        ('in', 'to_wallet_id', 'from_wallet_id', "(t.from_wallet_id IS NULL OR t.from_wallet_id <> t.to_wallet_id)"),
+        ('self', 'to_wallet_id', 'to_wallet_id', "t.from_wallet_id = t.to_wallet_id"),
+    ):
+        op.execute(
+            f"INSERT INTO {wa} (wallet_id, txn_id, created_at, direction, amount_cents, fee_cents, counterparty_wallet_id, kind) "
+            f"SELECT t.{own}, t.id, t.created_at, '{direction}', t.amount_cents, COALESCE(t.fee_cents, 0), t.{other}, t.kind "
+            f"FROM {tx} t WHERE {cond} AND t.{own} IS NOT NULL "
+            f"AND NOT EXISTS (SELECT 1 FROM {wa} a WHERE a.wallet_id = t.{own} AND a.txn_id = t.id)"
+        )
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'wallet_activity', schema):
+        op.drop_index('ix_wallet_activity_wallet_created', table_name='wallet_activity', schema=schema)
+        op.drop_table('wallet_activity', schema=schema)
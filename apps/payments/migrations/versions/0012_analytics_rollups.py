@@ -0,0 +1,68 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0012_analytics_rollups'
+down_revision = '0011_wallet_activity'
+branch_labels = None
+depends_on = None
+
+
+_INDEXES = [
+    ('red_packets', 'ix_red_packets_group_created', ['group_id', 'created_at']),
+    ('red_packets', 'ix_red_packets_created', ['created_at']),
+    ('red_packet_claims', 'ix_red_packet_claims_claimed', ['claimed_at']),
+    ('alias_device_events', 'ix_alias_device_events_created', ['created_at']),
+]
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'analytics_rollups', schema):
+        op.create_table(
+            'analytics_rollups',
+            sa.Column('metric', sa.String(length=16), primary_key=True),
+            sa.Column('dim', sa.String(length=128), primary_key=True),
+            sa.Column('bucket_secs', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('bucket_start', sa.BigInteger(), primary_key=True, autoincrement=False),
+            sa.Column('event_count', sa.BigInteger(), nullable=True),
+            sa.Column('amount_cents', sa.BigInteger(), nullable=True),
+            sa.Column('fee_cents', sa.BigInteger(), nullable=True),
+            schema=schema
+        )
+    for table, name, cols in _INDEXES:
+        if _has_table(bind, table, schema) and not _has_index(bind, table, name, schema):
+            op.create_index(name, table, cols, unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table, name, _cols in _INDEXES:
+        if _has_index(bind, table, name, schema):
+            op.drop_index(name, table_name=table, schema=schema)
+    if _has_table(bind, 'analytics_rollups', schema):
+        op.drop_table('analytics_rollups', schema=schema)
@@ -0,0 +1,51 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0013_idempotency_keys'
+down_revision = '0012_analytics_rollups'
+branch_labels = None
+depends_on = None
+
+# Unexpired transfer keys are copied over from the legacy idempotency table
+# by the service itself (backfill_idempotency_keys), since the key hash is
+# computed in Python.
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'idempotency_keys', schema):
+        op.create_table(
+            'idempotency_keys',
+            sa.Column('key_hash', sa.String(length=64), primary_key=True),
+            sa.Column('route', sa.String(length=32), nullable=False),
+            sa.Column('txn_id', sa.String(length=36), nullable=True),
+            sa.Column('response', sa.String(length=512), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+            schema=schema
+        )
+        op.create_index('ix_idempotency_keys_expires', 'idempotency_keys', ['expires_at'], unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'idempotency_keys', schema):
+        op.drop_index('ix_idempotency_keys_expires', table_name='idempotency_keys', schema=schema)
+        op.drop_table('idempotency_keys', schema=schema)
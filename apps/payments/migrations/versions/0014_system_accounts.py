@@ -0,0 +1,55 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0014_system_accounts'
+down_revision = '0013_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+# Registry rows are seeded by the service from the configured phones
+# (seed_system_accounts), so no data step here.
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'system_accounts', schema):
+        op.create_table(
+            'system_accounts',
+            sa.Column('role', sa.String(length=32), primary_key=True),
+            sa.Column('wallet_id', sa.String(length=36), nullable=False),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+            schema=schema
+        )
+    if not _has_table(bind, 'fee_accruals', schema):
+        op.create_table(
+            'fee_accruals',
+            sa.Column('txn_id', sa.String(length=36), primary_key=True),
+            sa.Column('wallet_id', sa.String(length=36), nullable=False),
+            sa.Column('fee_cents', sa.BigInteger(), nullable=False),
+            sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+            schema=schema
+        )
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table in ('fee_accruals', 'system_accounts'):
+        if _has_table(bind, table, schema):
+            op.drop_table(table, schema=schema)
@@ -0,0 +1,85 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+
+# revision identifiers, used by Alembic.
+revision = '0015_scheduled_jobs'
+down_revision = '0014_system_accounts'
+branch_labels = None
+depends_on = None
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_column(bind, table: str, column: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        cols = insp.get_columns(table, schema=schema)
+        return any(c.get('name') == column for c in cols)
+    except Exception:
+        return False
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'scheduled_jobs', schema):
+        op.create_table(
+            'scheduled_jobs',
+            sa.Column('name', sa.String(length=64), primary_key=True),
+            sa.Column('lease_owner', sa.String(length=64), nullable=True),
+            sa.Column('lease_until', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('period', sa.String(length=16), nullable=True),
+            sa.Column('last_period', sa.String(length=16), nullable=True),
+            sa.Column('cursor', sa.String(length=128), nullable=True),
+            sa.Column('processed', sa.BigInteger(), nullable=True),
+            sa.Column('batches', sa.Integer(), nullable=True),
+            sa.Column('runs', sa.BigInteger(), nullable=True),
+            sa.Column('last_status', sa.String(length=16), nullable=True),
+            sa.Column('last_error', sa.String(length=255), nullable=True),
+            sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+            schema=schema
+        )
+    if _has_table(bind, 'bill_payments', schema):
+        for col, col_type in (
+            ('scheduled_for', sa.DateTime(timezone=True)),
+            ('error', sa.String(length=64)),
+        ):
+            if not _has_column(bind, 'bill_payments', col, schema):
+                op.add_column('bill_payments', sa.Column(col, col_type, nullable=True), schema=schema)
+        if not _has_index(bind, 'bill_payments', 'ix_bill_payments_status_sched', schema):
+            op.create_index('ix_bill_payments_status_sched', 'bill_payments', ['status', 'scheduled_for'], unique=False, schema=schema)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'bill_payments', schema):
+        if _has_index(bind, 'bill_payments', 'ix_bill_payments_status_sched', schema):
+            op.drop_index('ix_bill_payments_status_sched', table_name='bill_payments', schema=schema)
+        for col in ('error', 'scheduled_for'):
+            if _has_column(bind, 'bill_payments', col, schema):
+                op.drop_column('bill_payments', col, schema=schema)
+    if _has_table(bind, 'scheduled_jobs', schema):
+        op.drop_table('scheduled_jobs', schema=schema)
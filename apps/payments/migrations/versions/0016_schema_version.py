@@ -0,0 +1,61 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+from datetime import datetime, timezone
+
+# revision identifiers, used by Alembic.
+revision = '0016_schema_version'
+down_revision = '0015_scheduled_jobs'
+branch_labels = None
+depends_on = None
+
+# Schema version at this revision; later revisions stamp their own
+SCHEMA_VERSION = 16
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if not _has_table(bind, 'schema_version', schema):
+        op.create_table(
+            'schema_version',
+            sa.Column('component', sa.String(length=64), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+            schema=schema
+        )
+    t = sa.table(
+        'schema_version',
+        sa.column('component', sa.String),
+        sa.column('version', sa.Integer),
+        sa.column('updated_at', sa.DateTime(timezone=True)),
+        schema=schema,
+    )
+    now = datetime.now(timezone.utc)
+    cur = bind.execute(sa.select(t.c.version).where(t.c.component == 'payments')).scalar()
+    if cur is None:
+        bind.execute(t.insert().values(component='payments', version=SCHEMA_VERSION, updated_at=now))
+    elif int(cur) < SCHEMA_VERSION:
+        bind.execute(t.update().where(t.c.component == 'payments').values(version=SCHEMA_VERSION, updated_at=now))
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_table(bind, 'schema_version', schema):
+        t = sa.table('schema_version', sa.column('component', sa.String), schema=schema)
+        # Forces the next startup through the full DDL path
+        bind.execute(t.delete().where(t.c.component == 'payments'))
@@ -0,0 +1,68 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+from datetime import datetime, timezone
+
+# revision identifiers, used by Alembic.
+revision = '0017_velocity_prune_index'
+down_revision = '0016_schema_version'
+branch_labels = None
+depends_on = None
+
+# Schema version at this revision; later revisions stamp their own
+SCHEMA_VERSION = 17
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _has_index(bind, table: str, name: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return any(ix.get('name') == name for ix in insp.get_indexes(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _stamp(bind, schema: str | None, version: int) -> None:
+    if not _has_table(bind, 'schema_version', schema):
+        return
+    t = sa.table(
+        'schema_version',
+        sa.column('component', sa.String),
+        sa.column('version', sa.Integer),
+        sa.column('updated_at', sa.DateTime(timezone=True)),
+        schema=schema,
+    )
+    bind.execute(
+        t.update()
+        .where(t.c.component == 'payments')
+        .values(version=version, updated_at=datetime.now(timezone.utc))
+    )
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    # The expiry sweep prunes expired buckets in chunks by (bucket_secs, bucket_start)
+    if _has_table(bind, 'velocity_counters', schema) and not _has_index(bind, 'velocity_counters', 'ix_velocity_counters_bucket', schema):
+        op.create_index('ix_velocity_counters_bucket', 'velocity_counters', ['bucket_secs', 'bucket_start'], unique=False, schema=schema)
+    _stamp(bind, schema, SCHEMA_VERSION)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if _has_index(bind, 'velocity_counters', 'ix_velocity_counters_bucket', schema):
+        op.drop_index('ix_velocity_counters_bucket', table_name='velocity_counters', schema=schema)
+    _stamp(bind, schema, SCHEMA_VERSION - 1)
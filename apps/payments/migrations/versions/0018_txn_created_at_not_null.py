@@ -0,0 +1,72 @@
+from alembic import op
+import sqlalchemy as sa
+import os
+from datetime import datetime, timezone
+
+# revision identifiers, used by Alembic.
+revision = '0018_txn_created_at_not_null'
+down_revision = '0017_velocity_prune_index'
+branch_labels = None
+depends_on = None
+
+# Keep in sync with PAYMENTS_SCHEMA_VERSION in apps/payments/app/main.py
+SCHEMA_VERSION = 18
+
+# txns / wallet_activity are keyset-paged on created_at; legacy rows
+# without one sort oldest (same value as _CREATED_AT_EPOCH in main.py)
+_TABLES = ['txns', 'wallet_activity']
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _schema():
+    s = (os.getenv("DB_SCHEMA") or "").strip()
+    return s or None
+
+
+def _has_table(bind, table: str, schema: str | None) -> bool:
+    try:
+        insp = sa.inspect(bind)
+        return bool(insp.has_table(table, schema=schema))
+    except Exception:
+        return False
+
+
+def _stamp(bind, schema: str | None, version: int) -> None:
+    if not _has_table(bind, 'schema_version', schema):
+        return
+    t = sa.table(
+        'schema_version',
+        sa.column('component', sa.String),
+        sa.column('version', sa.Integer),
+        sa.column('updated_at', sa.DateTime(timezone=True)),
+        schema=schema,
+    )
+    bind.execute(
+        t.update()
+        .where(t.c.component == 'payments')
+        .values(version=version, updated_at=datetime.now(timezone.utc))
+    )
+
+
+def upgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    for table in _TABLES:
+        if not _has_table(bind, table, schema):
+            continue
+        t = sa.table(table, sa.column('created_at', sa.DateTime(timezone=True)), schema=schema)
+        bind.execute(t.update().where(t.c.created_at.is_(None)).values(created_at=_EPOCH))
+        # SQLite cannot change nullability in place; writers always set it
+        if bind.dialect.name == 'postgresql':
+            op.alter_column(table, 'created_at', existing_type=sa.DateTime(timezone=True), nullable=False, schema=schema)
+    _stamp(bind, schema, SCHEMA_VERSION)
+
+
+def downgrade() -> None:
+    schema = _schema()
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        for table in _TABLES:
+            if _has_table(bind, table, schema):
+                op.alter_column(table, 'created_at', existing_type=sa.DateTime(timezone=True), nullable=True, schema=schema)
+    _stamp(bind, schema, SCHEMA_VERSION - 1)
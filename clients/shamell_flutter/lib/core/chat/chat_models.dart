@@ -375,6 +375,9 @@ class ChatGroupMessage {
   final String? boxB64;
   final String? attachmentB64;
   final String? attachmentMime;
+  // Blob id (sha256) of the attachment; bytes via /chat/blobs/{attachmentId}
+  final String? attachmentId;
+  final int? attachmentSize;
   final int? voiceSecs;
   final double? lat;
   final double? lon;
@@ -393,6 +396,8 @@ class ChatGroupMessage {
     this.boxB64,
     this.attachmentB64,
     this.attachmentMime,
+    this.attachmentId,
+    this.attachmentSize,
     this.voiceSecs,
     this.lat,
     this.lon,
@@ -416,6 +421,8 @@ class ChatGroupMessage {
         boxB64: map['box_b64'] as String?,
         attachmentB64: map['attachment_b64'] as String?,
         attachmentMime: map['attachment_mime'] as String?,
+        attachmentId: map['attachment_id'] as String?,
+        attachmentSize: _parseInt(map['attachment_size']),
         voiceSecs: _parseInt(map['voice_secs']),
         lat: _parseDouble(map['lat']),
         lon: _parseDouble(map['lon']),
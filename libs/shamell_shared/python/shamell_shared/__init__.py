@@ -1,15 +1,25 @@
 from .request_id import RequestIDMiddleware, get_request_id
 from .cors import configure_cors
-from .health import add_standard_health
+from .health import add_standard_health, add_pool_stats_route
 from .logging import setup_json_logging
 from .lifecycle import register_startup, register_shutdown
+from .db import create_service_engine, create_async_service_engine, pool_stats
+from .schema import schema_version, schema_is_current, stamp_schema_version, add_missing_columns
 
 __all__ = [
     "RequestIDMiddleware",
     "get_request_id",
     "configure_cors",
     "add_standard_health",
+    "add_pool_stats_route",
     "setup_json_logging",
     "register_startup",
     "register_shutdown",
+    "create_service_engine",
+    "create_async_service_engine",
+    "pool_stats",
+    "schema_version",
+    "schema_is_current",
+    "stamp_schema_version",
+    "add_missing_columns",
 ]
@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DisconnectionError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Upper bounds (ms) of the checkout wait histogram; the last bucket is open.
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_registry: dict[str, tuple[Engine, "_PoolStats"]] = {}
+_registry_lock = threading.Lock()
+
+
+def _env(name: str | None, key: str) -> str | None:
+    """
+    Read <NAME>_DB_<KEY> first (per-engine override), then DB_<KEY>.
+    """
+    if name:
+        v = os.getenv(f"{name.upper()}_DB_{key}")
+        if v is not None and v.strip() != "":
+            return v.strip()
+    v = os.getenv(f"DB_{key}")
+    if v is not None and v.strip() != "":
+        return v.strip()
+    return None
+
+
+def _env_int(name: str | None, key: str, default: int) -> int:
+    raw = _env(name, key)
+    try:
+        return int(raw) if raw is not None else default
+    except ValueError:
+        return default
+
+
+def _env_bool(name: str | None, key: str, default: bool) -> bool:
+    raw = _env(name, key)
+    if raw is None:
+        return default
+    return raw.lower() in ("1", "true", "yes", "on")
+
+
+class _PoolStats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.pre_pings = 0
+        self.invalidated = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.wait_hist = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record_wait(self, ms: float) -> None:
+        i = 0
+        while i < len(WAIT_BUCKETS_MS) and ms > WAIT_BUCKETS_MS[i]:
+            i += 1
+        with self.lock:
+            self.checkouts += 1
+            self.wait_ms_total += ms
+            if ms > self.wait_ms_max:
+                self.wait_ms_max = ms
+            self.wait_hist[i] += 1
+
+
+class _TimedPoolMixin:
+    """Pool mixin that records how long each checkout waited for a connection."""
+
+    _shamell_stats: _PoolStats | None = None
+
+    def _do_get(self):  # type: ignore[override]
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            if self._shamell_stats is not None:
+                with self._shamell_stats.lock:
+                    self._shamell_stats.timeouts += 1
+            raise
+        finally:
+            if self._shamell_stats is not None:
+                self._shamell_stats.record_wait((time.perf_counter() - t0) * 1000.0)
+
+    def recreate(self):  # type: ignore[override]
+        pool = super().recreate()
+        pool._shamell_stats = self._shamell_stats
+        return pool
+
+
+class _TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class _TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _install_interval_pre_ping(engine: Engine, stats: _PoolStats, interval_secs: int) -> None:
+    """
+    Ping a connection on checkout only if it has not been used for
+    interval_secs, instead of on every checkout (pool_pre_ping=True).
+    """
+
+    @event.listens_for(engine, "checkout")
+    def _checkout(dbapi_conn, record, proxy):  # type: ignore[no-untyped-def]
+        now = time.monotonic()
+        last = record.info.get("shamell_last_used")
+        record.info["shamell_last_used"] = now
+        if last is None or now - last < interval_secs:
+            return
+        with stats.lock:
+            stats.pre_pings += 1
+        cur = dbapi_conn.cursor()
+        try:
+            cur.execute("SELECT 1")
+        except Exception as e:
+            # The pool discards this connection and retries with a fresh one
+            raise DisconnectionError(str(e)) from e
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+    @event.listens_for(engine, "checkin")
+    def _checkin(dbapi_conn, record):  # type: ignore[no-untyped-def]
+        if record is not None:
+            record.info["shamell_last_used"] = time.monotonic()
+
+
+def _pool_options(url: str, name: str) -> dict[str, Any]:
+    """create_engine() keyword arguments for url from the environment."""
+    opts: dict[str, Any] = {"future": True}
+    pre_ping = _env_bool(name, "POOL_PRE_PING", True)
+    if url.startswith("sqlite"):
+        opts["connect_args"] = {"check_same_thread": False}
+        opts["pool_pre_ping"] = pre_ping
+        return opts
+    opts.update(
+        poolclass=_TimedQueuePool,
+        pool_size=_env_int(name, "POOL_SIZE", 5),
+        max_overflow=_env_int(name, "MAX_OVERFLOW", 10),
+        pool_timeout=_env_int(name, "POOL_TIMEOUT", 30),
+        pool_recycle=_env_int(name, "POOL_RECYCLE", 1800),
+        pool_pre_ping=pre_ping and _env_int(name, "PRE_PING_INTERVAL_SECS", 0) <= 0,
+    )
+    return opts
+
+
+def create_service_engine(url: str, name: str | None = None, **kwargs: Any) -> Engine:
+    """
+    Create a SQLAlchemy engine with pool settings taken from the environment.
+
+    Settings (each may be overridden per engine as <NAME>_DB_<KEY>):
+      DB_POOL_SIZE (5), DB_MAX_OVERFLOW (10), DB_POOL_TIMEOUT (30s),
+      DB_POOL_RECYCLE (1800s, -1 disables), DB_POOL_PRE_PING (true),
+      DB_PRE_PING_INTERVAL_SECS (0 = ping on every checkout; >0 = only ping
+      connections idle for longer than this).
+
+    SQLite URLs keep SQLAlchemy's default pool and get check_same_thread=False.
+    The engine is registered under name for pool_stats().
+    """
+    name = name or "default"
+    opts = _pool_options(url, name)
+    opts.update(kwargs)
+    engine = create_engine(url, **opts)
+    _instrument(engine, name)
+    return engine
+
+
+def create_async_service_engine(url: str, name: str | None = None, **kwargs: Any):
+    """
+    Async counterpart of create_service_engine() (same settings and stats).
+
+    Needs the async driver named in url (asyncpg, aiosqlite) to be installed.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    name = name or "default"
+    opts = _pool_options(url, name)
+    if opts.get("poolclass") is _TimedQueuePool:
+        opts["poolclass"] = _TimedAsyncQueuePool
+    opts.pop("future", None)
+    opts.update(kwargs)
+    engine = create_async_engine(url, **opts)
+    _instrument(engine.sync_engine, name)
+    return engine
+
+
+def _instrument(engine: Engine, name: str) -> None:
+    stats = _PoolStats()
+    interval = _env_int(name, "PRE_PING_INTERVAL_SECS", 0)
+    pre_ping = _env_bool(name, "POOL_PRE_PING", True)
+    if isinstance(engine.pool, _TimedPoolMixin):
+        engine.pool._shamell_stats = stats
+        if pre_ping and interval > 0:
+            _install_interval_pre_ping(engine, stats, interval)
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_conn, record):  # type: ignore[no-untyped-def]
+        with stats.lock:
+            stats.connects += 1
+
+    @event.listens_for(engine, "invalidate")
+    def _invalidate(dbapi_conn, record, exc):  # type: ignore[no-untyped-def]
+        with stats.lock:
+            stats.invalidated += 1
+
+    with _registry_lock:
+        _registry[name] = (engine, stats)
+
+
+def pool_stats(name: str | None = None) -> dict[str, dict[str, Any]]:
+    """
+    Live statistics of registered engines (all, or only name), keyed by name.
+    """
+    with _registry_lock:
+        items = [(n, e) for n, e in _registry.items() if name is None or n == name]
+    out: dict[str, dict[str, Any]] = {}
+    for n, (engine, stats) in items:
+        pool = engine.pool
+        row: dict[str, Any] = {"pool": type(pool).__name__, "status": pool.status()}
+        for attr in ("size", "checkedin", "checkedout", "overflow"):
+            fn = getattr(pool, attr, None)
+            if callable(fn):
+                try:
+                    row[attr] = fn()
+                except Exception:
+                    pass
+        with stats.lock:
+            row.update(
+                checkouts=stats.checkouts,
+                timeouts=stats.timeouts,
+                connects=stats.connects,
+                pre_pings=stats.pre_pings,
+                invalidated=stats.invalidated,
+                wait_ms_avg=round(stats.wait_ms_total / stats.checkouts, 3) if stats.checkouts else 0.0,
+                wait_ms_max=round(stats.wait_ms_max, 3),
+                wait_ms_hist={
+                    (f"le_{b}" if i < len(WAIT_BUCKETS_MS) else "inf"): stats.wait_hist[i]
+                    for i, b in enumerate(list(WAIT_BUCKETS_MS) + [None])
+                },
+            )
+        out[n] = row
+    return out
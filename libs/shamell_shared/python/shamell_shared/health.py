@@ -1,6 +1,10 @@
 import os
+from typing import Any, Sequence
+
 from fastapi import FastAPI
 
+from .db import pool_stats
+
 
 def add_standard_health(app: FastAPI, env_key: str = "ENV"):
     @app.get("/health")
@@ -12,3 +16,14 @@ def add_standard_health(app: FastAPI, env_key: str = "ENV"):
             "version": getattr(app, "version", None),
         }
 
+
+def add_pool_stats_route(router: Any, path: str = "/internal/db_pools", dependencies: Sequence[Any] | None = None):
+    """
+    Serve pool_stats() at path on an app or router.
+
+    Engine names, pool sizes and wait histograms are operator data: mount it
+    on a router guarded by the internal secret, or pass an admin dependency.
+    """
+    @router.get(path, dependencies=list(dependencies or []))
+    def _db_pools():
+        return {"db_pools": pool_stats()}
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Iterable
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+
+SCHEMA_VERSION_TABLE = "schema_version"
+
+
+def _version_table(schema: str | None) -> Table:
+    return Table(
+        SCHEMA_VERSION_TABLE,
+        MetaData(schema=schema),
+        Column("component", String(64), primary_key=True),
+        Column("version", Integer, nullable=False),
+        Column("updated_at", DateTime(timezone=True), nullable=True),
+    )
+
+
+def schema_version(engine: Engine, component: str, schema: str | None = None) -> int | None:
+    """
+    Stored schema version of component (one SELECT), or None when the
+    table or the row does not exist yet.
+    """
+    t = _version_table(schema)
+    try:
+        with engine.connect() as conn:
+            v = conn.execute(select(t.c.version).where(t.c.component == component)).scalar()
+    except Exception:
+        return None
+    return int(v) if v is not None else None
+
+
+def schema_is_current(engine: Engine, component: str, version: int, schema: str | None = None) -> bool:
+    """
+    True when the database is at version or newer, i.e. startup can skip
+    all DDL. A newer schema counts as current so that old workers of a
+    rolling deploy do not probe a schema that was already upgraded.
+    """
+    v = schema_version(engine, component, schema)
+    return v is not None and v >= version
+
+
+def stamp_schema_version(engine: Engine, component: str, version: int, schema: str | None = None) -> None:
+    """Record version for component; never moves an existing stamp backwards."""
+    t = _version_table(schema)
+    t.create(engine, checkfirst=True)
+    now = datetime.now(timezone.utc)
+    with engine.begin() as conn:
+        res = conn.execute(
+            update(t).where(t.c.component == component, t.c.version < version).values(version=version, updated_at=now)
+        )
+        if res.rowcount:
+            return
+        if conn.execute(select(t.c.version).where(t.c.component == component)).first() is not None:
+            return
+        try:
+            with conn.begin_nested():
+                conn.execute(t.insert().values(component=component, version=version, updated_at=now))
+        except IntegrityError:
+            # Another worker stamped it concurrently
+            pass
+
+
+def add_missing_columns(
+    engine: Engine,
+    columns: Iterable[tuple[str, str, str]] = (),
+    indexes: Iterable[tuple[str, str, str]] = (),
+    schema: str | None = None,
+) -> list[str]:
+    """
+    Add columns (table, column, type_sql) and indexes (table, name,
+    columns_sql) that the database lacks.
+
+    One inspector pass decides what is missing, so only the needed DDL runs
+    (instead of ALTERs that fail and are swallowed). Tables that do not
+    exist are skipped. Returns the statements that were executed.
+    """
+    insp = inspect(engine)
+    tables = set(insp.get_table_names(schema=schema))
+    col_cache: dict[str, set[str]] = {}
+    idx_cache: dict[str, set[str]] = {}
+
+    def _cols(table: str) -> set[str]:
+        if table not in col_cache:
+            col_cache[table] = {c["name"] for c in insp.get_columns(table, schema=schema)}
+        return col_cache[table]
+
+    def _idx(table: str) -> set[str]:
+        if table not in idx_cache:
+            idx_cache[table] = {ix["name"] for ix in insp.get_indexes(table, schema=schema) if ix.get("name")}
+        return idx_cache[table]
+
+    def _qual(table: str) -> str:
+        return f"{schema}.{table}" if schema else table
+
+    stmts: list[str] = []
+    for table, column, type_sql in columns:
+        if table in tables and column not in _cols(table):
+            stmts.append(f"ALTER TABLE {_qual(table)} ADD COLUMN {column} {type_sql}")
+            _cols(table).add(column)
+    for table, name, cols_sql in indexes:
+        if table in tables and name not in _idx(table):
+            stmts.append(f"CREATE INDEX {name} ON {_qual(table)} ({cols_sql})")
+            _idx(table).add(name)
+    if stmts:
+        with engine.begin() as conn:
+            for sql in stmts:
+                conn.exec_driver_sql(sql)
+    return stmts
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import apps.chat.app.main as chat  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+@pytest.fixture()
+def eng(monkeypatch, tmp_path):
+    engine = create_engine("sqlite+pysqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    chat.Base.metadata.create_all(engine)
+    monkeypatch.setattr(chat, "engine", engine)
+    monkeypatch.setattr(chat, "_stream_hub", chat._StreamHub())  # type: ignore[attr-defined]
+    monkeypatch.setattr(chat, "_fanout_cache", OrderedDict())
+    monkeypatch.setattr(chat, "_notify_group", lambda **kw: None)
+    monkeypatch.setattr(chat, "_blob_store_inst", chat._LocalBlobStore(str(tmp_path)))  # type: ignore[attr-defined]
+    with Session(engine) as s:
+        s.add(chat.Group(id="g1", name="team", creator_id="alice01"))
+        s.add(chat.Group(id="g2", name="other", creator_id="carol01"))
+        for did, gid in (("alice01", "g1"), ("bob0001", "g1"), ("carol01", "g2")):
+            s.add(chat.Device(id=did, public_key="pk-" + did))
+            s.add(chat.GroupMember(group_id=gid, device_id=did, role="member"))
+        s.commit()
+    return engine
+
+
+def _send(eng, gid: str, sender: str, **kw) -> chat.GroupMsgOut:
+    with Session(eng) as s:
+        return chat.send_group_message(gid, _DummyRequest(), chat.GroupSendReq(sender_id=sender, **kw), s=s)
+
+
+def test_attachments_are_stored_once_and_served_with_ranges(eng, tmp_path):
+    data = bytes(range(256)) * 4
+    b64 = base64.b64encode(data).decode()
+    first = _send(eng, "g1", "alice01", attachment_b64=b64, attachment_mime="image/png")
+    again = _send(eng, "g1", "bob0001", attachment_b64=b64, attachment_mime="image/png")
+    digest = hashlib.sha256(data).hexdigest()
+    assert first.attachment_id == again.attachment_id == digest
+    # Rows keep only id and size; attachment_b64 is still served for older clients
+    assert (first.attachment_size, first.attachment_b64) == (len(data), b64)
+    assert os.path.exists(tmp_path / digest[:2] / digest[2:4] / digest)
+    with Session(eng) as s:
+        assert s.scalar(select(func.count()).select_from(chat.ChatBlob)) == 1
+        assert s.execute(select(chat.GroupMessage.attachment_b64)).scalars().all() == [None, None]
+        inbox = chat.group_inbox("g1", _DummyRequest(), device_id="bob0001", s=s)
+        assert {(m.attachment_id, m.attachment_b64) for m in inbox} == {(digest, b64)}
+
+    client = TestClient(chat.app)
+    url = f"/blobs/{digest}?device_id=bob0001"
+    full = client.get(url)
+    assert (full.status_code, full.content, full.headers["content-type"]) == (200, data, "image/png")
+    part = client.get(url, headers={"Range": "bytes=10-19"})
+    assert (part.status_code, part.content) == (206, data[10:20])
+    assert part.headers["content-range"] == f"bytes 10-19/{len(data)}"
+    assert client.get(url, headers={"Range": "bytes=-5"}).content == data[-5:]
+    assert client.get(url, headers={"Range": f"bytes={len(data)}-"}).status_code == 416
+    # Only members of a group the blob was sent to can read it
+    assert client.get(f"/blobs/{digest}?device_id=carol01").status_code == 404
+
+
+def test_raw_upload_is_referenced_by_id(eng):
+    client = TestClient(chat.app)
+    data = b"voice-note" * 100
+    r = client.post("/blobs/upload?device_id=alice01&mime=audio/ogg", content=data, headers={"Content-Type": "application/octet-stream"})
+    assert r.status_code == 200
+    blob_id = r.json()["blob_id"]
+    assert r.json()["size"] == len(data)
+
+    msg = _send(eng, "g1", "alice01", kind="voice", attachment_id=blob_id, voice_secs=3)
+    assert (msg.attachment_id, msg.attachment_mime, msg.attachment_size) == (blob_id, "audio/ogg", len(data))
+    assert client.get(f"/blobs/{blob_id}?device_id=bob0001").content == data
+    with pytest.raises(chat.HTTPException) as exc:
+        _send(eng, "g1", "alice01", attachment_id="0" * 64)
+    assert exc.value.status_code == 404
+
+
+def test_blob_ids_cannot_be_attached_or_read_by_hash_alone(eng, monkeypatch):
+    client = TestClient(chat.app)
+    data = b"private scan" * 50
+    blob_id = client.post("/blobs/upload?device_id=alice01", content=data, headers={"Content-Type": "application/octet-stream"}).json()["blob_id"]
+    # The uploader can read an unsent upload, nobody else can
+    assert client.get(f"/blobs/{blob_id}?device_id=alice01").content == data
+    assert client.get(f"/blobs/{blob_id}?device_id=carol01").status_code == 404
+    with pytest.raises(chat.HTTPException) as exc:
+        _send(eng, "g2", "carol01", attachment_id=blob_id)
+    assert exc.value.status_code == 404
+    assert client.get(f"/blobs/{blob_id}?device_id=carol01").status_code == 404
+
+    # Uploading the same bytes proves possession
+    client.post("/blobs/upload?device_id=carol01", content=data, headers={"Content-Type": "application/octet-stream"})
+    assert _send(eng, "g2", "carol01", attachment_id=blob_id).attachment_id == blob_id
+
+    monkeypatch.setattr(chat, "CHAT_INLINE_ATTACHMENTS", False)
+    assert _send(eng, "g2", "carol01", attachment_id=blob_id).attachment_b64 is None
+
+
+def test_legacy_inline_attachments_are_moved_and_orphans_purged(eng, monkeypatch):
+    legacy = b"legacy attachment bytes"
+    with Session(eng) as s:
+        s.add(chat.GroupMessage(id="old1", group_id="g1", sender_id="alice01", text="", attachment_b64=base64.b64encode(legacy).decode(), attachment_mime="image/jpeg"))
+        s.commit()
+    assert chat._backfill_attachment_blobs() == 1  # type: ignore[attr-defined]
+    digest = hashlib.sha256(legacy).hexdigest()
+    legacy_b64 = base64.b64encode(legacy).decode()
+    with Session(eng) as s:
+        row = s.get(chat.GroupMessage, "old1")
+        # The inline copy stays until the store is known to be durable
+        assert (row.attachment_b64, row.attachment_id, row.attachment_size) == (legacy_b64, digest, len(legacy))
+    assert chat._backfill_attachment_blobs() == 0  # type: ignore[attr-defined]
+
+    # Only rows whose blob is actually in the store lose their copy
+    with Session(eng) as s:
+        s.add(chat.GroupMessage(id="old2", group_id="g1", sender_id="alice01", text="", attachment_b64="bG9zdA==", attachment_id="f" * 64))
+        s.commit()
+    assert chat._clear_inline_attachments() == 1  # type: ignore[attr-defined]
+    with Session(eng) as s:
+        assert s.get(chat.GroupMessage, "old1").attachment_b64 is None
+        assert s.get(chat.GroupMessage, "old2").attachment_b64 == "bG9zdA=="
+        s.delete(s.get(chat.GroupMessage, "old2"))
+        s.commit()
+
+    monkeypatch.setattr(chat, "CHAT_BLOB_GRACE_SECS", 0)
+    orphan = hashlib.sha256(b"never sent").hexdigest()
+    with Session(eng) as s:
+        chat._store_blob(s, b"never sent", None)  # type: ignore[attr-defined]
+        s.commit()
+        past = datetime.now(timezone.utc) - timedelta(minutes=1)
+        s.execute(update(chat.ChatBlob).values(created_at=past))
+        s.commit()
+        assert chat._purge_orphan_blobs(s) == 1  # type: ignore[attr-defined]
+        assert s.get(chat.ChatBlob, orphan) is None
+        assert s.get(chat.ChatBlob, digest) is not None
+    assert chat._blob_store().head(orphan) is None  # type: ignore[attr-defined]
+
+
+def test_blob_dir_defaults_next_to_the_sqlite_file(monkeypatch):
+    monkeypatch.setattr(chat, "DB_URL", "sqlite+pysqlite:////data/chat.db")
+    assert chat._default_blob_dir() == "/data/chat-blobs"  # type: ignore[attr-defined]
+    monkeypatch.setattr(chat, "DB_URL", "postgresql+psycopg://u@db/chat")
+    assert chat._default_blob_dir() == ""  # type: ignore[attr-defined]
+    monkeypatch.setattr(chat, "CHAT_BLOB_DIR", "")
+    monkeypatch.setattr(chat, "_blob_store_inst", None)
+    with pytest.raises(RuntimeError):
+        chat._blob_store()  # type: ignore[attr-defined]
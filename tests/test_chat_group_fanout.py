@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Dict
+
+import pytest
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import apps.chat.app.main as chat  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+@pytest.fixture()
+def eng(monkeypatch):
+    engine = create_engine("sqlite+pysqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    chat.Base.metadata.create_all(engine)
+    monkeypatch.setattr(chat, "engine", engine)
+    monkeypatch.setattr(chat, "_fanout_cache", OrderedDict())
+    return engine
+
+
+def _group(eng, gid: str, n: int) -> list[str]:
+    ids = [f"dev{gid}{i:04d}" for i in range(n)]
+    with Session(eng) as s:
+        s.add(chat.Group(id=gid, name=f"group {gid}", creator_id=ids[0]))
+        for i, did in enumerate(ids):
+            s.add(chat.Device(id=did, public_key="pk-" + did))
+            s.add(chat.GroupMember(group_id=gid, device_id=did, role="admin" if i == 0 else "member"))
+            s.add(chat.PushToken(device_id=did, token=f"tok-{did}"))
+        s.commit()
+    return ids
+
+
+class _Statements:
+    def __init__(self, eng):
+        self.n = 0
+        event.listen(eng, "before_cursor_execute", self._count)
+
+    def _count(self, *a, **kw):
+        self.n += 1
+
+
+def _targets(eng, gid: str, sender: str) -> set[str]:
+    job = chat.PushOutbox(message_id="m1", group_id=gid, sender_id=sender)
+    with Session(eng) as s:
+        return {p[1]["device_id"] for p in chat._push_targets(s, job)}  # type: ignore[attr-defined]
+
+
+def test_resolution_cost_does_not_grow_with_group_size(eng):
+    small = _group(eng, "s", 3)
+    large = _group(eng, "l", 200)
+    stmts = _Statements(eng)
+    counts = []
+    for gid, ids in (("s", small), ("l", large)):
+        stmts.n = 0
+        assert _targets(eng, gid, ids[0]) == set(ids[1:])
+        counts.append(stmts.n)
+    assert counts[0] == counts[1] == 2
+
+    # Cached: only the version probe runs
+    stmts.n = 0
+    with Session(eng) as s:
+        name, snap = chat._group_fanout(s, "l")  # type: ignore[attr-defined]
+    assert stmts.n == 1
+    assert name == "group l" and len(snap.members) == 200
+
+
+def test_snapshot_is_invalidated_by_membership_and_filter_changes(eng):
+    ids = _group(eng, "g", 4)
+    admin, bob, carol, dave = ids
+    with Session(eng) as s:
+        s.add(chat.Device(id="erin0001", public_key="pk-erin"))
+        s.commit()
+    assert _targets(eng, "g", admin) == {bob, carol, dave}
+
+    with Session(eng) as s:
+        chat.invite_members("g", _DummyRequest(), chat.GroupInviteReq(inviter_id=admin, member_ids=["erin0001"]), s=s)
+        chat.register_push_token("erin0001", _DummyRequest(), chat.PushTokenReq(token="tok-erin-1"), s=s)
+    assert _targets(eng, "g", admin) == {bob, carol, dave, "erin0001"}
+
+    with Session(eng) as s:
+        chat.leave_group("g", _DummyRequest(), chat.GroupLeaveReq(device_id=bob), s=s)
+        chat.set_group_prefs(carol, _DummyRequest(), chat.GroupPrefsReq(group_id="g", muted=True), s=s)
+        chat.set_block(dave, _DummyRequest(), chat.ContactRuleReq(peer_id=admin, blocked=True), s=s)
+    assert _targets(eng, "g", admin) == {"erin0001"}
+    # Dave only blocked the admin
+    assert _targets(eng, "g", "erin0001") == {admin, dave}
+
+    # A token moving to another device drops it from its previous owner
+    with Session(eng) as s:
+        chat.register_push_token(admin, _DummyRequest(), chat.PushTokenReq(token="tok-erin-1"), s=s)
+        _, snap = chat._group_fanout(s, "g")  # type: ignore[attr-defined]
+    assert "tok-erin-1" not in snap.tokens.get("erin0001", [])
+    assert "tok-erin-1" in snap.tokens[admin]
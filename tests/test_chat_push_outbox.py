@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+import pytest
+from fastapi import Request
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import apps.chat.app.main as chat  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+class _StubFCM:
+    """Local stand-in for the FCM legacy endpoint; answers with queued status codes."""
+
+    def __init__(self) -> None:
+        self.requests: list[dict] = []
+        self.statuses: list[int] = []
+        self.answers: list[tuple[str, int]] = []  # (token, status code)
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_POST(self):  # noqa: N802
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append(body)
+                code = stub.statuses.pop(0) if stub.statuses else 200
+                stub.answers.append((body["to"], code))
+                self.send_response(code)
+                self.end_headers()
+                self.wfile.write(b"{}")
+
+            def log_message(self, *a):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/fcm/send"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+@pytest.fixture()
+def fcm(monkeypatch):
+    stub = _StubFCM()
+    engine = create_engine("sqlite+pysqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    chat.Base.metadata.create_all(engine)
+    monkeypatch.setattr(chat, "engine", engine)
+    monkeypatch.setattr(chat, "FCM_SERVER_KEY", "test-key")
+    monkeypatch.setattr(chat, "FCM_ENDPOINT", stub.url)
+    monkeypatch.setattr(chat, "_stream_hub", chat._StreamHub())  # type: ignore[attr-defined]
+    monkeypatch.setattr(chat, "_fanout_cache", OrderedDict())
+    with Session(engine) as s:
+        for did in ("alice01", "bob0001", "carol01", "dave001"):
+            s.add(chat.Device(id=did, public_key="pk-" + did))
+        s.add(chat.PushToken(device_id="bob0001", token="tok-bob-phone"))
+        s.add(chat.PushToken(device_id="bob0001", token="tok-bob-tablet"))
+        s.add(chat.PushToken(device_id="carol01", token="tok-carol"))
+        s.add(chat.PushToken(device_id="dave001", token="tok-dave"))
+        s.commit()
+    yield stub, engine
+    stub.close()
+
+
+def _send(eng, sender: str, recipient: str, box: str) -> str:
+    req = chat.SendReq(sender_id=sender, recipient_id=recipient, sender_pubkey_b64="p" * 44, nonce_b64=f"nonce-{box}", box_b64=f"ciphertext-{box:>8}")
+    with Session(eng) as s:
+        return chat.send_message(_DummyRequest(), req, s=s).id
+
+
+def test_send_path_only_enqueues_and_pushes_are_coalesced(fcm, monkeypatch):
+    stub, eng = fcm
+
+    def _no_http(*a, **kw):
+        raise AssertionError("send path must not call FCM")
+
+    monkeypatch.setattr(chat.httpx, "post", _no_http)
+    mids = [_send(eng, "alice01", "bob0001", f"m{i}") for i in range(3)]
+    assert stub.requests == []
+
+    out = chat._dispatch_push_batch()  # type: ignore[attr-defined]
+    assert (out["jobs"], out["pushes"], out["sent"]) == (3, 2, 2)
+    assert {r["to"] for r in stub.requests} == {"tok-bob-phone", "tok-bob-tablet"}
+    for r in stub.requests:
+        assert r["data"]["mid"] == mids[-1] and r["data"]["count"] == "3"
+    with Session(eng) as s:
+        assert s.execute(select(chat.PushOutbox)).scalars().all() == []
+
+
+def test_group_fanout_skips_sender_muted_and_blocking_members(fcm):
+    stub, eng = fcm
+    with Session(eng) as s:
+        s.add(chat.Group(id="g1", name="team", creator_id="alice01"))
+        for did in ("alice01", "bob0001", "carol01", "dave001"):
+            s.add(chat.GroupMember(group_id="g1", device_id=did, role="member"))
+        s.add(chat.GroupPrefs(device_id="carol01", group_id="g1", muted=True))
+        s.add(chat.ContactRule(device_id="dave001", peer_id="alice01", blocked=True))
+        s.commit()
+    with Session(eng) as s:
+        chat.send_group_message("g1", _DummyRequest(), chat.GroupSendReq(sender_id="alice01", text="hi"), s=s)
+
+    chat._dispatch_push_batch()  # type: ignore[attr-defined]
+    assert {r["to"] for r in stub.requests} == {"tok-bob-phone", "tok-bob-tablet"}
+    assert stub.requests[0]["data"]["group_name"] == "team"
+
+
+def test_transient_errors_back_off_and_permanent_ones_drop(fcm, monkeypatch):
+    stub, eng = fcm
+    monkeypatch.setattr(chat, "CHAT_PUSH_MAX_ATTEMPTS", 2)
+    _send(eng, "alice01", "carol01", "retry")
+    stub.statuses = [503]
+    out = chat._dispatch_push_batch()  # type: ignore[attr-defined]
+    assert (out["sent"], out["retried"]) == (0, 1)
+    with Session(eng) as s:
+        job = s.execute(select(chat.PushOutbox)).scalars().one()
+        assert (job.status, job.attempts, job.last_error) == ("pending", 1, "retry:http_503")
+        assert job.next_attempt_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+
+    # Not due yet: nothing is claimed
+    assert chat._dispatch_push_batch()["jobs"] == 0  # type: ignore[attr-defined]
+    with Session(eng) as s:
+        s.execute(update(chat.PushOutbox).values(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+        s.commit()
+    stub.statuses = [500]
+    assert chat._dispatch_push_batch()["failed"] == 1  # type: ignore[attr-defined]
+    with Session(eng) as s:
+        assert s.execute(select(chat.PushOutbox.status)).scalar() == "failed"
+
+    _send(eng, "alice01", "dave001", "badtoken")
+    stub.statuses = [400]
+    out = chat._dispatch_push_batch()  # type: ignore[attr-defined]
+    assert (out["jobs"], out["dropped"]) == (1, 1)
+
+
+def test_retry_only_resends_to_the_tokens_that_failed(fcm):
+    stub, eng = fcm
+    with Session(eng) as s:
+        s.add(chat.Group(id="g2", name="crew", creator_id="alice01"))
+        for did in ("alice01", "bob0001", "carol01", "dave001"):
+            s.add(chat.GroupMember(group_id="g2", device_id=did, role="member"))
+        s.commit()
+    with Session(eng) as s:
+        chat.send_group_message("g2", _DummyRequest(), chat.GroupSendReq(sender_id="alice01", text="hi"), s=s)
+
+    stub.statuses = [503]
+    out = chat._dispatch_push_batch()  # type: ignore[attr-defined]
+    assert (out["pushes"], out["sent"], out["retried"]) == (4, 3, 1)
+    failed = [tok for tok, code in stub.answers if code == 503]
+    assert len(failed) == 1
+
+    with Session(eng) as s:
+        s.execute(update(chat.PushOutbox).values(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+        s.commit()
+    stub.answers.clear()
+    out = chat._dispatch_push_batch()  # type: ignore[attr-defined]
+    assert (out["pushes"], out["sent"]) == (1, 1)
+    assert stub.answers == [(failed[0], 200)]
+    with Session(eng) as s:
+        assert s.execute(select(chat.PushOutbox)).scalars().all() == []
@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+from typing import Dict
+
+import pytest
+from fastapi import Request
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import apps.chat.app.main as chat  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+@pytest.fixture()
+def eng(monkeypatch):
+    engine = create_engine("sqlite+pysqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    chat.Base.metadata.create_all(engine)
+    monkeypatch.setattr(chat, "engine", engine)
+    monkeypatch.setattr(chat, "_stream_hub", chat._StreamHub())  # type: ignore[attr-defined]
+    monkeypatch.setattr(chat, "_notify_recipient", lambda **kw: None)
+    with Session(engine) as s:
+        s.add(chat.Device(id="alice01", public_key="pk-alice"))
+        s.add(chat.Device(id="bob0001", public_key="pk-bob"))
+        s.commit()
+    return engine
+
+
+def _req(box: str, nonce: str = "nonce-001", key: str | None = None) -> chat.SendReq:
+    return chat.SendReq(sender_id="alice01", recipient_id="bob0001", sender_pubkey_b64="p" * 44, nonce_b64=nonce, box_b64=f"ciphertext-{box:>8}", idempotency_key=key)
+
+
+def _count(eng) -> int:
+    with Session(eng) as s:
+        return int(s.scalar(select(func.count()).select_from(chat.Message)) or 0)
+
+
+def test_retries_are_deduplicated_by_key_or_nonce(eng):
+    with Session(eng) as s:
+        first = chat.send_message(_DummyRequest(), _req("a"), s=s)
+        # Same nonce: a retry, whatever the ciphertext
+        assert chat.send_message(_DummyRequest(), _req("a"), s=s).id == first.id
+        keyed = chat.send_message(_DummyRequest(), _req("b", nonce="nonce-002", key="client-1"), s=s)
+        # The client key wins over the nonce
+        assert chat.send_message(_DummyRequest(), _req("b", nonce="nonce-003", key="client-1"), s=s).id == keyed.id
+        assert chat.send_message(_DummyRequest(), _req("b", nonce="nonce-002", key="client-2"), s=s).id != keyed.id
+    assert _count(eng) == 3
+    with Session(eng) as s:
+        assert len(s.get(chat.Message, first.id).send_key) == 64
+
+
+def test_conflicting_insert_returns_the_original(eng, monkeypatch):
+    with Session(eng) as s:
+        first = chat.send_message(_DummyRequest(), _req("a"), s=s)
+
+    # Simulate a concurrent retry that misses the probe and hits the unique index
+    real_execute = Session.execute
+    probes = {"n": 0}
+
+    def _miss_first_probe(self, stmt, *a, **kw):
+        res = real_execute(self, stmt, *a, **kw)
+        if "send_key" in str(stmt) and probes["n"] == 0:
+            probes["n"] += 1
+            return real_execute(self, select(chat.Message).where(text("1 = 0")))
+        return res
+
+    monkeypatch.setattr(Session, "execute", _miss_first_probe)
+    with Session(eng) as s:
+        assert chat.send_message(_DummyRequest(), _req("a"), s=s).id == first.id
+    assert _count(eng) == 1
+
+
+def test_backfill_keys_legacy_rows_before_the_unique_index(eng):
+    with eng.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ux_messages_send_key")
+    with Session(eng) as s:
+        for mid in ("m1", "m2", "m3"):
+            nonce = "nonce-dup" if mid != "m3" else "nonce-003"
+            s.add(chat.Message(id=mid, sender_id="alice01", recipient_id="bob0001", sender_pubkey="p", nonce_b64=nonce, box_b64="x" * 16))
+        s.commit()
+
+    chat._prepare_schema()  # type: ignore[attr-defined]
+    assert "ux_messages_send_key" in {ix["name"] for ix in inspect(eng).get_indexes("messages")}
+    with Session(eng) as s:
+        keys = {m.id: m.send_key for m in s.execute(select(chat.Message)).scalars()}
+        assert keys["m1"] and keys["m3"] and keys["m2"] is None
+        # A retry of a legacy message is answered from the backfilled key
+        assert chat.send_message(_DummyRequest(), _req("a", nonce="nonce-dup"), s=s).id == "m1"
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+import pytest
+from fastapi import Request
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+import apps.chat.app.main as chat  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+@pytest.fixture()
+def eng(monkeypatch):
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    chat.Base.metadata.create_all(engine)
+    monkeypatch.setattr(chat, "engine", engine)
+    monkeypatch.setattr(chat, "_stream_hub", chat._StreamHub())  # type: ignore[attr-defined]
+    monkeypatch.setattr(chat, "_fanout_cache", OrderedDict())
+    monkeypatch.setattr(chat, "CHAT_STREAM_KEEPALIVE_SECS", 0.05)
+    with Session(engine) as s:
+        for did in ("alice01", "bob0001", "carol01"):
+            s.add(chat.Device(id=did, public_key="pk-" + did))
+        s.commit()
+    return engine
+
+
+def _send(eng, sender: str, recipient: str, box: str) -> str:
+    req = chat.SendReq(sender_id=sender, recipient_id=recipient, sender_pubkey_b64="p" * 44, nonce_b64=f"nonce-{box}", box_b64=f"ciphertext-{box:>8}")
+    with Session(eng) as s:
+        return chat.send_message(_DummyRequest(), req, s=s).id
+
+
+def test_idle_stream_holds_no_session_and_wakes_on_send(eng, monkeypatch):
+    fetches = []
+    real_fetch = chat._stream_fetch  # type: ignore[attr-defined]
+
+    def _counting(*a, **kw):
+        fetches.append(1)
+        return real_fetch(*a, **kw)
+
+    monkeypatch.setattr(chat, "_stream_fetch", _counting)
+    gen = chat._stream_events("bob0001", True)  # type: ignore[attr-defined]
+    # Idle: keepalives only, no DB work
+    assert next(gen) == ": keepalive\n\n"
+    assert next(gen) == ": keepalive\n\n"
+    assert fetches == []
+    assert chat._stream_hub.stats()["subscribers"] == 1  # type: ignore[attr-defined]
+
+    _send(eng, "carol01", "alice01", "not-for-bob")
+    mid = _send(eng, "alice01", "bob0001", "hello")
+    chunk = next(gen)
+    assert chunk.startswith("data: ") and f'"id": "{mid}"' in chunk
+    assert fetches == [1]
+    with Session(eng) as s:
+        assert s.get(chat.Message, mid).delivered_at is not None
+
+    gen.close()
+    assert chat._stream_hub.stats()["subscribers"] == 0  # type: ignore[attr-defined]
+
+
+def test_hidden_sender_is_filtered_and_group_sends_announce(eng):
+    with Session(eng) as s:
+        s.add(chat.Group(id="g1", name="team", creator_id="alice01"))
+        for did in ("alice01", "bob0001"):
+            s.add(chat.GroupMember(group_id="g1", device_id=did, role="member"))
+        s.add(chat.ContactRule(device_id="bob0001", peer_id="carol01", hidden=True))
+        s.commit()
+
+    gen = chat._stream_events("bob0001", True)  # type: ignore[attr-defined]
+    assert next(gen) == ": keepalive\n\n"
+    sub = next(iter(chat._stream_hub.subs["bob0001"]))  # type: ignore[attr-defined]
+    # carol is hidden: announced, but filtered out when loaded
+    _send(eng, "carol01", "bob0001", "from-carol")
+    assert next(gen) == ": keepalive\n\n"
+
+    with Session(eng) as s:
+        out = chat.send_group_message("g1", _DummyRequest(), chat.GroupSendReq(sender_id="alice01", text="hi all"), s=s)
+    chunk = next(gen)
+    assert chunk.startswith("event: group\n") and out.id in chunk and '"group_id": "g1"' in chunk
+    assert not sub.items
+    gen.close()
+
+
+def test_lagged_subscriber_catches_up_from_undelivered(eng, monkeypatch):
+    monkeypatch.setattr(chat, "CHAT_STREAM_QUEUE_MAX", 1)
+    gen = chat._stream_events("bob0001", True)  # type: ignore[attr-defined]
+    assert next(gen) == ": keepalive\n\n"
+    ids = [_send(eng, "alice01", "bob0001", f"m{i}") for i in range(3)]
+    assert chat._stream_hub.stats()["dropped"] == 2  # type: ignore[attr-defined]
+    got = [next(gen) for _ in range(3)]
+    assert all(any(f'"id": "{mid}"' in c for c in got) for mid in ids)
+    gen.close()
+
+
+def test_waiting_stream_thread_is_woken_by_send(eng, monkeypatch):
+    gen = chat._stream_events("bob0001", True)  # type: ignore[attr-defined]
+    assert next(gen) == ": keepalive\n\n"
+    monkeypatch.setattr(chat, "CHAT_STREAM_KEEPALIVE_SECS", 5.0)
+    out: list[str] = []
+    t = threading.Thread(target=lambda: out.append(next(gen)))
+    t.start()
+    mid = _send(eng, "alice01", "bob0001", "wake")
+    t.join()
+    assert out and mid in out[0]
+    gen.close()
+
+
+def test_burst_larger_than_one_page_is_streamed_completely(eng):
+    gen = chat._stream_events("bob0001", True)  # type: ignore[attr-defined]
+    assert next(gen) == ": keepalive\n\n"
+    ids = [_send(eng, "alice01", "bob0001", f"b{i:03d}") for i in range(150)]
+    got = [next(gen) for _ in range(150)]
+    assert sorted(c.split('"id": "')[1].split('"')[0] for c in got) == sorted(ids)
+    with Session(eng) as s:
+        assert all(s.get(chat.Message, mid).delivered_at is not None for mid in ids)
+    gen.close()
+
+
+def test_lagged_backlog_larger_than_one_page_is_drained(eng, monkeypatch):
+    monkeypatch.setattr(chat, "CHAT_STREAM_QUEUE_MAX", 1)
+    gen = chat._stream_events("bob0001", True)  # type: ignore[attr-defined]
+    assert next(gen) == ": keepalive\n\n"
+    ids = [_send(eng, "alice01", "bob0001", f"l{i:03d}") for i in range(120)]
+    got = [next(gen) for _ in range(120)]
+    assert sorted(c.split('"id": "')[1].split('"')[0] for c in got) == sorted(ids)
+    gen.close()
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import uuid
+from typing import Dict
+
+import pytest
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> tuple[str, str]:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return u.id, w.id
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache(monkeypatch):
+    monkeypatch.setattr(pay, "_alias_cache", pay._AliasCache())  # type: ignore[attr-defined]
+    # Only re-read the generation row when a test asks for it
+    monkeypatch.setattr(pay, "ALIAS_CACHE_REFRESH_SECS", 3600.0)
+
+
+def _register(s: Session, handle: str, user_id: str) -> None:
+    code = pay.alias_request(pay.AliasRequest(handle=handle, user_id=user_id), s=s)["code"]
+    pay.alias_verify(pay.AliasVerifyReq(handle=handle, code=code), s=s)
+
+
+def test_resolve_hits_cache_and_caches_unknown_handles():
+    eng = _engine()
+    with Session(eng) as s:
+        uid, wid = _create_wallet(s, "+491700008000", 0)
+        _register(s, "shop", uid)
+
+    with Session(eng) as s:
+        for _ in range(3):
+            assert pay.alias_resolve("@shop", s=s).wallet_id == wid
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                pay.alias_resolve("ghost", s=s)
+            assert exc.value.status_code == 404
+
+    st = pay._alias_cache.stats()  # type: ignore[attr-defined]
+    assert (st["misses"], st["hits"], st["negative_hits"]) == (2, 2, 1)
+    assert st["size"] == 2
+
+
+def test_verify_and_block_invalidate_the_binding():
+    eng = _engine()
+    with Session(eng) as s:
+        uid, wid = _create_wallet(s, "+491700008100", 0)
+        code = pay.alias_request(pay.AliasRequest(handle="cafe", user_id=uid), s=s)["code"]
+        # Pending handles are not resolvable and the miss is cached...
+        with pytest.raises(HTTPException):
+            pay.alias_resolve("cafe", s=s)
+        # ...until verify drops the negative entry
+        pay.alias_verify(pay.AliasVerifyReq(handle="cafe", code=code), s=s)
+        assert pay.alias_resolve("cafe", s=s).wallet_id == wid
+
+        pay.admin_alias_block(pay.AliasBlockReq(handle="cafe"), s=s, admin_ok=True)
+        with pytest.raises(HTTPException):
+            pay.alias_resolve("cafe", s=s)
+
+
+def test_rename_moves_the_cached_binding():
+    eng = _engine()
+    with Session(eng) as s:
+        uid, wid = _create_wallet(s, "+491700008200", 0)
+        _register(s, "oldname", uid)
+        assert pay.alias_resolve("oldname", s=s).wallet_id == wid
+        with pytest.raises(HTTPException):
+            pay.alias_resolve("newname", s=s)
+
+        pay.admin_alias_rename(pay.AliasRenameReq(from_handle="oldname", to_handle="newname"), s=s, admin_ok=True)
+        assert pay.alias_resolve("newname", s=s).wallet_id == wid
+        with pytest.raises(HTTPException):
+            pay.alias_resolve("oldname", s=s)
+
+
+def test_generation_bump_from_another_worker_drops_cache(monkeypatch):
+    eng = _engine()
+    with Session(eng) as s:
+        uid, wid = _create_wallet(s, "+491700008300", 0)
+        _, other = _create_wallet(s, "+491700008301", 0)
+        _register(s, "bakery", uid)
+        assert pay.alias_resolve("bakery", s=s).wallet_id == wid
+
+    # Another worker rebinds the handle behind this process' back
+    with Session(eng) as s:
+        s.execute(update(pay.Alias).where(pay.Alias.handle == "bakery").values(wallet_id=other))
+        s.commit()
+    with Session(eng) as s:
+        assert pay.alias_resolve("bakery", s=s).wallet_id == wid
+        pay._bump_generation(s, "aliases")  # type: ignore[attr-defined]
+        s.commit()
+
+    monkeypatch.setattr(pay, "ALIAS_CACHE_REFRESH_SECS", 0.0)
+    with Session(eng) as s:
+        assert pay.alias_resolve("bakery", s=s).wallet_id == other
+
+
+def test_lru_evicts_oldest_and_transfer_uses_cache(monkeypatch):
+    monkeypatch.setattr(pay, "ALIAS_CACHE_MAX", 2)
+    eng = _engine()
+    with Session(eng) as s:
+        _, payer = _create_wallet(s, "+491700008400", 10_000)
+        uid, wid = _create_wallet(s, "+491700008401", 0)
+        _register(s, "kiosk", uid)
+        for h in ("aaa", "bbb", "kiosk"):
+            try:
+                pay.alias_resolve(h, s=s)
+            except HTTPException:
+                pass
+        st = pay._alias_cache.stats()  # type: ignore[attr-defined]
+        assert st["size"] == 2 and st["evictions"] == 1
+
+        pay.transfer(pay.TransferReq(from_wallet_id=payer, to_alias="@kiosk", amount_cents=100), request=_DummyRequest(), s=s)
+        assert pay._alias_cache.stats()["hits"] == 1  # type: ignore[attr-defined]
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _id() -> str:
+    return str(uuid.uuid4())
+
+
+def _raw_fees(s: Session, start, end) -> int:
+    q = select(func.coalesce(func.sum(pay.Txn.fee_cents), 0))
+    if start:
+        q = q.where(pay.Txn.created_at >= start)
+    if end:
+        q = q.where(pay.Txn.created_at <= end)
+    return int(s.execute(q).scalar() or 0)
+
+
+def test_fees_and_volume_match_raw_sums_across_buckets_edges_and_tail():
+    eng = _engine()
+    now = datetime.now(timezone.utc)
+    with Session(eng) as s:
+        for i in range(60):
+            # Spread over ~5 days, every ~2h, including the unfolded last hour
+            at = now - timedelta(minutes=7 * 17 * i + 3)
+            s.add(pay.Txn(id=_id(), from_wallet_id="a", to_wallet_id="b", amount_cents=100 + i, fee_cents=i % 7, kind="transfer" if i % 3 else "topup", created_at=at))
+        s.commit()
+        assert pay.fold_rollups(s)["advanced"] is True
+        # Written after the fold: only visible through the raw tail
+        s.add(pay.Txn(id=_id(), from_wallet_id="a", to_wallet_id="b", amount_cents=5, fee_cents=11, kind="transfer", created_at=now - timedelta(seconds=30)))
+        s.commit()
+
+        ranges = [
+            (None, None),
+            (now - timedelta(days=3, minutes=13), None),
+            (now - timedelta(days=4, hours=5, minutes=1), now - timedelta(hours=26, minutes=41)),
+            (now - timedelta(minutes=50), now),
+            (now - timedelta(hours=30), now - timedelta(hours=29, minutes=10)),
+        ]
+        for start, end in ranges:
+            out = pay.fees_summary(
+                from_iso=start.isoformat() if start else None,
+                to_iso=end.isoformat() if end else None,
+                s=s,
+                admin_ok=True,
+            )
+            assert out.total_fee_cents == _raw_fees(s, start, end), (start, end)
+
+        vol = {v.kind: v for v in pay.admin_txns_volume(s=s, admin_ok=True)}
+        raw = dict(s.execute(select(pay.Txn.kind, func.count()).group_by(pay.Txn.kind)).all())
+        assert {k: v.count for k, v in vol.items()} == raw
+        # The fold reads only the buckets; source rows are not rescanned
+        assert s.execute(select(func.count()).select_from(pay.AnalyticsRollup).where(pay.AnalyticsRollup.bucket_secs == 86400)).scalar() >= 5
+
+
+def test_fold_is_incremental_and_full_rebuild_is_equivalent():
+    eng = _engine()
+    now = datetime.now(timezone.utc)
+    with Session(eng) as s:
+        s.add(pay.Txn(id=_id(), from_wallet_id="a", to_wallet_id="b", amount_cents=10, fee_cents=1, kind="transfer", created_at=now - timedelta(days=2)))
+        s.commit()
+        pay.fold_rollups(s)
+        assert pay.fold_rollups(s)["advanced"] is False
+        before = {(r.metric, r.dim, r.bucket_secs, r.bucket_start, r.event_count) for r in s.execute(select(pay.AnalyticsRollup)).scalars()}
+        pay.fold_rollups(s, full=True)
+        after = {(r.metric, r.dim, r.bucket_secs, r.bucket_start, r.event_count) for r in s.execute(select(pay.AnalyticsRollup)).scalars()}
+        assert before == after
+
+
+def test_campaign_and_risk_metrics_from_rollups():
+    eng = _engine()
+    now = datetime.now(timezone.utc)
+    with Session(eng) as s:
+        for i, gid in enumerate(["camp1", "campaign:camp1", "other"]):
+            rid = _id()
+            s.add(pay.RedPacket(id=rid, creator_wallet_id=f"c{i % 2}", group_id=gid, total_amount_cents=1_000, remaining_amount_cents=0, total_count=2, claimed_count=2, mode="fixed", status="exhausted", currency="SYP", created_at=now - timedelta(days=1, hours=i)))
+            for w in ("w1", f"w{i + 2}"):
+                s.add(pay.RedPacketClaim(id=_id(), redpacket_id=rid, wallet_id=w, amount_cents=500, claim_index=1, claimed_at=now - timedelta(hours=20 - i)))
+        for dev, n in (("d1", 3), ("d2", 1)):
+            for k in range(n):
+                s.add(pay.AliasDeviceEvent(id=_id(), to_wallet_id="r1", device_id=dev, ip="10.0.0.1", created_at=now - timedelta(hours=3, minutes=k)))
+        s.commit()
+        pay.fold_rollups(s)
+
+        st = pay.redpacket_campaign_payments_analytics(campaign_id="camp1", s=s, admin_ok=True)
+        assert (st.total_packets_issued, st.total_amount_cents) == (2, 2_000)
+        assert (st.total_packets_claimed, st.claimed_amount_cents) == (4, 2_000)
+        assert (st.unique_creators, st.unique_claimants) == (2, 3)
+
+        m = pay.admin_risk_metrics(minutes=300, top=1, s=s, admin_ok=True)
+        assert m["top_devices"] == [{"device_id": "d1", "count": 3}]
+        assert m["top_receivers"] == [{"to_wallet_id": "r1", "count": 4}]
+        assert pay.admin_risk_metrics(minutes=60, s=s, admin_ok=True)["top_devices"] == []
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+
+from fastapi import APIRouter
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def test_async_db_url_maps_drivers():
+    assert pay._async_db_url("postgresql+psycopg2://u:p@db/pay") == "postgresql+asyncpg://u:p@db/pay"  # type: ignore[attr-defined]
+    assert pay._async_db_url("postgresql://u@db/pay") == "postgresql+asyncpg://u@db/pay"  # type: ignore[attr-defined]
+    assert pay._async_db_url("sqlite+pysqlite:////tmp/p.db") == "sqlite+aiosqlite:////tmp/p.db"  # type: ignore[attr-defined]
+
+
+def test_use_async_routes_swaps_hot_endpoints_in_place():
+    r = APIRouter()
+    r.add_api_route("/wallets/{wallet_id}", pay.get_wallet, methods=["GET"], response_model=pay.WalletResp)
+    r.add_api_route("/fees", lambda: {}, methods=["GET"])
+    r.add_api_route("/transfer", pay.transfer, methods=["POST"], response_model=pay.WalletResp)
+    pay._use_async_routes(r)  # type: ignore[attr-defined]
+    assert [route.path for route in r.routes] == ["/wallets/{wallet_id}", "/fees", "/transfer"]
+    assert r.routes[0].endpoint is pay.get_wallet_async
+    assert r.routes[2].endpoint is pay.transfer_async
+    assert r.routes[2].response_model is pay.WalletResp
+
+
+def test_async_session_runs_transfer(tmp_path, monkeypatch):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    url = f"sqlite+pysqlite:///{tmp_path / 'pay.db'}"
+    sync_eng = pay.create_service_engine(url, name="payments_async_test")
+    pay.Base.metadata.create_all(sync_eng)
+    with Session(sync_eng) as s:
+        ids = []
+        for phone, bal in (("+491700011000", 10_000), ("+491700011001", 0)):
+            u = pay.User(id=str(uuid.uuid4()), phone=phone)
+            w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=bal, currency=pay.DEFAULT_CURRENCY)
+            s.add(u); s.add(w); s.commit()
+            ids.append(w.id)
+
+    class _Req:
+        headers: dict = {}
+
+    async def _run():
+        eng = create_async_engine(pay._async_db_url(url))  # type: ignore[attr-defined]
+        async with AsyncSession(eng) as s:
+            await pay.transfer_async(pay.TransferReq(from_wallet_id=ids[0], to_wallet_id=ids[1], amount_cents=1_000), _Req(), s=s)
+        async with AsyncSession(eng) as s:
+            w = await pay.get_wallet_async(ids[0], s=s)
+        await eng.dispose()
+        return w
+
+    assert asyncio.run(_run()).balance_cents == 9_000
+
+
+def test_async_idempotency_status_matches_sync(tmp_path):
+    from datetime import datetime, timedelta, timezone
+
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    url = f"sqlite+pysqlite:///{tmp_path / 'pay.db'}"
+    sync_eng = pay.create_service_engine(url, name="payments_async_idem_test")
+    pay.Base.metadata.create_all(sync_eng)
+    now = datetime.now(timezone.utc)
+    with Session(sync_eng) as s:
+        for ikey, exp in (("live", now + timedelta(hours=1)), ("stale", now - timedelta(seconds=1))):
+            s.add(pay.IdempotencyKey(key_hash=pay._idem_hash(ikey, "transfer", "w1"), route="transfer", txn_id=f"t-{ikey}", response="{}", created_at=now, expires_at=exp))  # type: ignore[attr-defined]
+        s.commit()
+
+    async def _run():
+        eng = create_async_engine(pay._async_db_url(url))  # type: ignore[attr-defined]
+        out = {}
+        for ikey in ("live", "stale"):
+            async with AsyncSession(eng) as s:
+                out[ikey] = await pay.idempotency_status_async(ikey, route="transfer", wallet_id="w1", s=s)
+        await eng.dispose()
+        return out
+
+    got = asyncio.run(_run())
+    with Session(sync_eng) as s:
+        for ikey in ("live", "stale"):
+            assert got[ikey] == pay.idempotency_status(ikey, route="transfer", wallet_id="w1", s=s)
+    assert got["live"]["txn_id"] == "t-live" and got["stale"] == {"exists": False}
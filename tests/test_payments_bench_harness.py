@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+
+_SCRIPT = Path(__file__).resolve().parents[1] / "scripts" / "bench_payments.py"
+
+
+def _load():
+    spec = importlib.util.spec_from_file_location("bench_payments", _SCRIPT)
+    mod = importlib.util.module_from_spec(spec)
+    assert spec and spec.loader
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def test_bench_report_is_comparable_json(tmp_path):
+    bench = _load()
+    report = bench.run_benchmark(
+        f"sqlite+pysqlite:///{tmp_path / 'bench.db'}",
+        users=6,
+        ops=8,
+        concurrency=2,
+        scenarios=("transfer", "swap", "voucher_redeem", "history"),
+    )
+    report = json.loads(json.dumps(report))
+    assert report["meta"]["dialect"] == "sqlite"
+    for name in ("transfer", "swap", "voucher_redeem", "history"):
+        res = report["scenarios"][name]
+        assert res["ok"] == 8, res["errors"]
+        lat = res["latency_ms"]
+        assert 0 < lat["p50"] <= lat["p95"] <= lat["p99"] <= lat["max"]
+        assert "lock_errors" in res["lock_waits"]
+
+    diff = bench.compare(report, report)
+    assert diff["scenarios"]["transfer"]["p99_ms_pct"] == 0.0
+
+
+def test_percentile_is_nearest_rank():
+    bench = _load()
+    xs = [float(i) for i in range(1, 101)]
+    assert (bench._percentile(xs, 50), bench._percentile(xs, 99), bench._percentile([], 50)) == (50.0, 99.0, 0.0)
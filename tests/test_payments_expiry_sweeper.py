@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import pytest
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+def _id() -> str:
+    return str(uuid.uuid4())
+
+
+def test_sweep_expires_and_purges_in_chunks():
+    eng = _engine()
+    now = datetime.now(timezone.utc)
+    past, future, ancient = now - timedelta(minutes=5), now + timedelta(hours=1), now - timedelta(days=400)
+    with Session(eng) as s:
+        funder = _create_wallet(s, "+491700009000", 0)
+        for i in range(5):
+            s.add(pay.PaymentRequest(id=_id(), from_wallet_id="a", to_wallet_id="b", amount_cents=100, status="pending", expires_at=past))
+        s.add(pay.PaymentRequest(id=_id(), from_wallet_id="a", to_wallet_id="b", amount_cents=100, status="pending", expires_at=future))
+        s.add(pay.SonicToken(id=_id(), token_hash="h1", from_wallet_id="a", amount_cents=100, status="reserved", expires_at=past, nonce="n"))
+        s.add(pay.SonicToken(id=_id(), token_hash="h2", from_wallet_id="a", amount_cents=100, status="redeemed", expires_at=ancient, nonce="n"))
+        s.add(pay.CashMandate(id=_id(), code="00000001", secret_hash="x", amount_cents=100, from_wallet_id="a", status="reserved", expires_at=past))
+        for i in range(3):
+            s.add(pay.TopupVoucher(id=_id(), code=f"V{i}", amount_cents=1_000, batch_id="b", status="reserved", funding_wallet_id=funder, expires_at=past))
+        s.add(pay.Idempotency(id=_id(), ikey="old", endpoint="transfer", created_at=ancient))
+        s.add(pay.Idempotency(id=_id(), ikey="new", endpoint="transfer"))
+        s.commit()
+
+    with Session(eng) as s:
+        out = pay.sweep_expired(s, batch=2)
+    assert out == {
+        "payment_requests_expired": 5,
+        "sonic_tokens_expired": 1,
+        "cash_mandates_expired": 1,
+        "vouchers_expired": 3,
+        "sonic_tokens_deleted": 1,
+        "cash_mandates_deleted": 0,
+        "idempotency_deleted": 1,
+        "idempotency_keys_deleted": 0,
+        "velocity_counters_pruned": 0,
+    }
+
+    with Session(eng) as s:
+        statuses = s.execute(select(pay.PaymentRequest.status, func.count()).group_by(pay.PaymentRequest.status)).all()
+        assert dict(statuses) == {"expired": 5, "pending": 1}
+        assert s.get(pay.Wallet, funder).balance_cents == 3_000
+        assert [i.ikey for i in s.execute(select(pay.Idempotency)).scalars()] == ["new"]
+        # Nothing left to do on the next run
+        assert sum(pay.sweep_expired(s).values()) == 0
+
+
+def test_sweep_respects_max_batches():
+    eng = _engine()
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    with Session(eng) as s:
+        for _ in range(5):
+            s.add(pay.PaymentRequest(id=_id(), from_wallet_id="a", to_wallet_id="b", amount_cents=1, status="pending", expires_at=past))
+        s.commit()
+        assert pay.sweep_expired(s, batch=2, max_batches=1)["payment_requests_expired"] == 2
+        assert pay.sweep_expired(s, batch=2, max_batches=5)["payment_requests_expired"] == 3
+
+
+def test_sweep_prunes_expired_velocity_counters():
+    eng = _engine()
+    now = datetime.now(timezone.utc)
+    win = pay.VELOCITY_BUCKET_SECS
+    fresh_win = pay._velocity_bucket(now, win)  # type: ignore[attr-defined]
+    old_win = fresh_win - pay.VELOCITY_WINDOW_RETENTION_SECS - win
+    fresh_day = pay._velocity_bucket(now, 86_400)  # type: ignore[attr-defined]
+    old_day = fresh_day - (pay.VELOCITY_DAY_RETENTION_DAYS + 1) * 86_400
+    with Session(eng) as s:
+        for i in range(5):
+            for secs, start in ((win, old_win), (win, fresh_win), (86_400, old_day), (86_400, fresh_day)):
+                s.add(pay.VelocityCounter(scope="wallet_out", subject=f"w{i}", bucket_secs=secs, bucket_start=start, txn_count=1, amount_cents=100))
+        s.commit()
+        # Chunked per kind: 2 + 2 window rows and 2 + 2 day rows on the first run
+        assert pay.sweep_expired(s, batch=2, max_batches=2)["velocity_counters_pruned"] == 8
+        assert pay.sweep_expired(s, batch=2, max_batches=2)["velocity_counters_pruned"] == 2
+        left = s.execute(select(pay.VelocityCounter.bucket_start)).scalars().all()
+    assert sorted(set(left)) == sorted({fresh_win, fresh_day}) and len(left) == 10
+
+
+def test_redeem_after_sweep_does_not_refund_again():
+    eng = _engine()
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    with Session(eng) as s:
+        funder = _create_wallet(s, "+491700009100", 0)
+        target = _create_wallet(s, "+491700009101", 0)
+        s.add(pay.TopupVoucher(id=_id(), code="VSWEPT", amount_cents=1_000, batch_id="b", status="reserved", funding_wallet_id=funder, expires_at=past))
+        s.commit()
+        assert pay.sweep_expired(s)["vouchers_expired"] == 1
+        assert s.get(pay.Wallet, funder).balance_cents == 1_000
+
+    req = pay.TopupRedeemReq(code="VSWEPT", amount_cents=1_000, sig="x", to_wallet_id=target)
+    for _ in range(2):
+        with Session(eng) as s:
+            with pytest.raises(HTTPException) as exc:
+                pay.topup_redeem(req, request=_DummyRequest(), s=s)
+            assert (exc.value.status_code, exc.value.detail) == (400, "Cannot redeem: expired")
+    with Session(eng) as s:
+        assert s.get(pay.Wallet, funder).balance_cents == 1_000
+        assert s.get(pay.Wallet, target).balance_cents == 0
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine(tmp_path):
+    # File-backed: export pages open their own sessions from the response thread
+    engine = create_engine(
+        f"sqlite+pysqlite:///{tmp_path / 'payments.db'}",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _body(resp) -> str:
+    async def _collect():
+        out = []
+        async for chunk in resp.body_iterator:
+            out.append(chunk if isinstance(chunk, str) else chunk.decode())
+        return "".join(out)
+
+    return asyncio.run(_collect())
+
+
+def _seed(s: Session, n: int) -> list[str]:
+    base = datetime(2026, 1, 31, 12, 0, tzinfo=timezone.utc)
+    ids = []
+    for i in range(n):
+        tid = f"t{i:03d}"
+        # Pairs share a timestamp so the id tie-breaker is exercised
+        s.add(pay.Txn(id=tid, from_wallet_id="wa", to_wallet_id="wb", amount_cents=100 + i, kind="transfer", fee_cents=0, created_at=base + timedelta(seconds=i // 2)))
+        s.add(pay.LedgerEntry(id=str(uuid.uuid4()), wallet_id="wa", amount_cents=-(100 + i), txn_id=tid, description=f"transfer_debit m={'shop' if i % 3 == 0 else 'other'}"))
+        s.add(pay.LedgerEntry(id=str(uuid.uuid4()), wallet_id="wb", amount_cents=100 + i, txn_id=tid, description=f"transfer_credit m={'shop' if i % 3 == 0 else 'other'}"))
+        ids.append(tid)
+    s.commit()
+    return ids
+
+
+def test_txns_export_pages_by_keyset_and_resumes_from_cursor(monkeypatch, tmp_path):
+    monkeypatch.setattr(pay, "EXPORT_PAGE_SIZE", 4)
+    eng = _engine(tmp_path)
+    with Session(eng) as s:
+        ids = _seed(s, 11)
+        expected = sorted(ids, reverse=True)  # created_at desc, id desc
+
+        rows = list(csv.reader(io.StringIO(_body(pay.admin_txns_export(s=s, admin_ok=True)))))
+        assert rows[0][-1] == "cursor"
+        assert [r[0] for r in rows[1:]] == expected
+
+        # Simulate a dropped connection after the 6th row
+        resumed = _body(pay.admin_txns_export(cursor=rows[6][-1], fmt="ndjson", s=s, admin_ok=True))
+        recs = [json.loads(line) for line in resumed.splitlines()]
+        assert [r["id"] for r in recs] == expected[6:]
+
+        capped = list(csv.reader(io.StringIO(_body(pay.admin_txns_export(limit=5, offset=2, s=s, admin_ok=True)))))
+        assert [r[0] for r in capped[1:]] == expected[2:7]
+
+
+def test_merchant_export_uses_backfilled_columns_one_row_per_txn(monkeypatch, tmp_path):
+    monkeypatch.setattr(pay, "EXPORT_PAGE_SIZE", 2)
+    eng = _engine(tmp_path)
+    with Session(eng) as s:
+        ids = _seed(s, 9)
+        # Legacy rows only carry the tags in their description
+        stats = pay.backfill_merchant_refs(s, batch=4)
+        assert stats == {"ledger_entries": 18, "txns": 9}
+        assert s.get(pay.Txn, ids[0]).merchant_id == "shop"
+        rows = list(csv.reader(io.StringIO(_body(pay.admin_txns_export_by_merchant(merchant="SHOP", s=s, admin_ok=True)))))
+        assert [r[0] for r in rows[1:]] == sorted([t for i, t in enumerate(ids) if i % 3 == 0], reverse=True)
+        assert all(r[7].startswith("transfer_debit") and "m=shop" in r[7] for r in rows[1:])
+
+
+def test_parse_ledger_meta():
+    assert pay._parse_ledger_meta("transfer_debit m=Shop-1 ref=INV-9 batch=x") == ("shop-1", "INV-9")  # type: ignore[attr-defined]
+    assert pay._parse_ledger_meta("bill_debit;bill:EL ref=42") == (None, "42")  # type: ignore[attr-defined]
+    assert pay._parse_ledger_meta("alarm=1") == (None, None)  # type: ignore[attr-defined]
+
+
+def test_wallets_export_streams_all_wallets(monkeypatch, tmp_path):
+    monkeypatch.setattr(pay, "EXPORT_PAGE_SIZE", 2)
+    eng = _engine(tmp_path)
+    with Session(eng) as s:
+        for i in range(5):
+            u = pay.User(id=str(uuid.uuid4()), phone=f"+4917000080{i:02d}")
+            s.add(u); s.add(pay.Wallet(id=f"w{i}", user_id=u.id, balance_cents=i, currency=pay.DEFAULT_CURRENCY))
+        s.commit()
+        recs = [json.loads(line) for line in _body(pay.admin_wallets_export(fmt="ndjson", s=s, admin_ok=True)).splitlines()]
+        assert [r["wallet_id"] for r in recs] == ["w4", "w3", "w2", "w1", "w0"]
+
+
+def test_legacy_rows_without_created_at_are_backfilled_and_paged(monkeypatch, tmp_path):
+    monkeypatch.setattr(pay, "EXPORT_PAGE_SIZE", 2)
+    eng = _engine(tmp_path)
+    with Session(eng) as s:
+        ids = _seed(s, 3)
+        for i in range(3):
+            s.add(pay.Txn(id=f"legacy{i}", from_wallet_id="wa", to_wallet_id="wb", amount_cents=1, kind="transfer", fee_cents=0))
+        s.commit()
+        s.execute(pay.sa_update(pay.Txn).where(pay.Txn.id.like("legacy%")).values(created_at=None))
+        s.commit()
+        pay.backfill_wallet_activity(s)
+
+        assert pay.backfill_txn_created_at(s) == {"txns": 3, "wallet_activity": 6}
+        expected = sorted(ids, reverse=True) + ["legacy2", "legacy1", "legacy0"]
+        rows = list(csv.reader(io.StringIO(_body(pay.admin_txns_export(s=s, admin_ok=True)))))
+        assert [r[0] for r in rows[1:]] == expected
+
+        seen, cursor = [], None
+        while True:
+            page = pay.list_txns("wb", limit=2, cursor=cursor, s=s)
+            if not page:
+                break
+            seen += [t.id for t in page]
+            cursor = page[-1].cursor
+        assert seen == expected
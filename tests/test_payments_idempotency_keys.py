@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import pytest
+from fastapi import Request
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+def _txn_count(s: Session) -> int:
+    return int(s.scalar(select(func.count()).select_from(pay.Txn)) or 0)
+
+
+def test_transfer_replays_stored_body_without_touching_wallets(monkeypatch):
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700009000", 10_000)
+        b = _create_wallet(s, "+491700009001", 0)
+
+    req = pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=1_000)
+    with Session(eng) as s:
+        first = pay.transfer(req, request=_DummyRequest({"Idempotency-Key": "k-1"}), s=s)
+
+    with Session(eng) as s:
+        rec = s.execute(select(pay.IdempotencyKey)).scalars().one()
+        assert len(rec.key_hash) == 64 and "k-1" not in rec.key_hash
+        assert rec.route == "transfer"
+
+    def _no_locks(*a, **kw):
+        raise AssertionError("replay must not lock wallets")
+
+    monkeypatch.setattr(pay, "_lock_wallets", _no_locks)
+    with Session(eng) as s:
+        again = pay.transfer(req, request=_DummyRequest({"Idempotency-Key": "k-1"}), s=s)
+        assert again == first
+        assert _txn_count(s) == 1
+        assert pay.idempotency_status("k-1", route="transfer", wallet_id=a, s=s)["exists"] is True
+        # Keys are scoped to the sender wallet
+        assert pay._idem_lookup(s, "k-1", "transfer", b) is None  # type: ignore[attr-defined]
+
+
+def test_expired_keys_are_not_replayed_and_get_purged():
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700009100", 10_000)
+        b = _create_wallet(s, "+491700009101", 0)
+        req = pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=1_000)
+        pay.transfer(req, request=_DummyRequest({"Idempotency-Key": "k-2"}), s=s)
+        rec = s.execute(select(pay.IdempotencyKey)).scalars().one()
+        rec.expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+        s.commit()
+
+        # An expired, not yet purged key is treated as new and overwritten
+        pay.transfer(req, request=_DummyRequest({"Idempotency-Key": "k-2"}), s=s)
+        assert _txn_count(s) == 2
+        assert len(s.execute(select(pay.IdempotencyKey)).scalars().all()) == 1
+
+        for i in range(5):
+            pay._idem_remember(s, f"old-{i}", "transfer", a, None, {"x": i})  # type: ignore[attr-defined]
+        s.commit()
+        for rec in s.execute(select(pay.IdempotencyKey).where(pay.IdempotencyKey.key_hash != pay._idem_hash("k-2", "transfer", a))).scalars():  # type: ignore[attr-defined]
+            rec.expires_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+        s.commit()
+
+        out = pay.sweep_expired(s, batch=2)
+        assert out["idempotency_keys_deleted"] == 5
+        assert len(s.execute(select(pay.IdempotencyKey)).scalars().all()) == 1
+
+
+def test_backfill_carries_recent_legacy_transfer_keys():
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700009200", 10_000)
+        b = _create_wallet(s, "+491700009201", 0)
+        txn_id = str(uuid.uuid4())
+        s.add(pay.Txn(id=txn_id, from_wallet_id=a, to_wallet_id=b, amount_cents=500, kind="transfer", fee_cents=0))
+        s.add(pay.Idempotency(id=str(uuid.uuid4()), ikey="legacy", endpoint="transfer", txn_id=txn_id, amount_cents=500, currency="SYP", wallet_id=b, balance_cents=500))
+        s.commit()
+
+        assert pay.backfill_idempotency_keys(s) == 1
+        resp = pay.transfer(
+            pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=500),
+            request=_DummyRequest({"Idempotency-Key": "legacy"}),
+            s=s,
+        )
+        assert (resp.wallet_id, resp.balance_cents) == (b, 500)
+        assert _txn_count(s) == 1
+
+
+def test_duplicate_that_waited_on_the_lock_replays_instead_of_debiting(monkeypatch):
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700009300", 10_000)
+        b = _create_wallet(s, "+491700009301", 0)
+    req = pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=1_000)
+    with Session(eng) as s:
+        first = pay.transfer(req, request=_DummyRequest({"Idempotency-Key": "k-race"}), s=s)
+
+    # The duplicate missed the key before locking (the first one had not committed yet)
+    real = pay._idem_lookup  # type: ignore[attr-defined]
+    calls = {"n": 0}
+
+    def _miss_first(*a, **kw):
+        calls["n"] += 1
+        return None if calls["n"] == 1 else real(*a, **kw)
+
+    monkeypatch.setattr(pay, "_idem_lookup", _miss_first)
+    with Session(eng) as s:
+        assert pay.transfer(req, request=_DummyRequest({"Idempotency-Key": "k-race"}), s=s) == first
+        assert s.get(pay.Wallet, a).balance_cents == 9_000
+        assert _txn_count(s) == 1
+
+
+def test_live_key_is_never_overwritten():
+    eng = _engine()
+    with Session(eng) as s:
+        pay._idem_remember(s, "k-live", "transfer", "w1", "t1", {"x": 1})  # type: ignore[attr-defined]
+        s.commit()
+    with Session(eng) as s:
+        # A second writer that did not see the row fails instead of upserting
+        with pytest.raises(IntegrityError):
+            pay._idem_remember(s, "k-live", "transfer", "w1", "t2", {"x": 2})  # type: ignore[attr-defined]
+    with Session(eng) as s:
+        assert pay._idem_lookup(s, "k-live", "transfer", "w1").txn_id == "t1"  # type: ignore[attr-defined]
+        # An expired row is replaced
+        s.get(pay.IdempotencyKey, pay._idem_hash("k-live", "transfer", "w1")).expires_at = datetime.now(timezone.utc) - timedelta(seconds=1)  # type: ignore[attr-defined]
+        s.commit()
+        pay._idem_remember(s, "k-live", "transfer", "w1", "t3", {"x": 3})  # type: ignore[attr-defined]
+        s.commit()
+        assert pay._idem_lookup(s, "k-live", "transfer", "w1").txn_id == "t3"  # type: ignore[attr-defined]
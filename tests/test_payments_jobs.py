@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+def _savings(s: Session, n: int, balance_cents: int) -> list[str]:
+    ids = []
+    for i in range(n):
+        wid = _create_wallet(s, f"+4917000110{i:02d}", 0)
+        acct = pay.SavingsAccount(id=f"sa-{i:03d}", wallet_id=wid, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+        s.add(acct)
+        ids.append(acct.id)
+    s.commit()
+    return ids
+
+
+def test_lease_is_exclusive_until_it_expires():
+    eng = _engine()
+    now = datetime.now(timezone.utc)
+    with Session(eng) as s:
+        assert pay._acquire_job_lease(s, "savings_interest", "w1", now) is True  # type: ignore[attr-defined]
+        assert pay._acquire_job_lease(s, "savings_interest", "w2", now) is False  # type: ignore[attr-defined]
+        # Renewing your own lease is fine
+        assert pay._acquire_job_lease(s, "savings_interest", "w1", now) is True  # type: ignore[attr-defined]
+        later = now + timedelta(seconds=pay.JOB_LEASE_SECS + 1)
+        assert pay._acquire_job_lease(s, "savings_interest", "w2", later) is True  # type: ignore[attr-defined]
+        assert pay.run_job(s, "savings_interest", owner="w1")["status"] == "busy"
+
+
+def test_savings_interest_runs_in_batches_once_per_month(monkeypatch):
+    monkeypatch.setattr(pay, "SAVINGS_INTEREST_BPS", 1_200)  # 1% per month
+    monkeypatch.setattr(pay, "JOB_BATCH", 2)
+    eng = _engine()
+    with Session(eng) as s:
+        ids = _savings(s, 5, 10_000)
+
+    with Session(eng) as s:
+        out = pay.run_job(s, "savings_interest")
+        assert (out["status"], out["rows"]) == ("ok", 5)
+        job = s.get(pay.ScheduledJob, "savings_interest")
+        assert (job.batches, job.processed, job.cursor, job.lease_owner) == (3, 5, None, None)
+        assert job.last_period == datetime.now(timezone.utc).strftime("%Y-%m")
+
+    with Session(eng) as s:
+        assert {a.balance_cents for a in s.execute(select(pay.SavingsAccount)).scalars()} == {10_100}
+        assert s.scalar(select(func.count()).select_from(pay.Txn).where(pay.Txn.kind == "savings_interest")) == 5
+        # Ledger stays balanced: reserve credits vs. one external debit per batch
+        assert s.scalar(select(func.sum(pay.LedgerEntry.amount_cents))) == 0
+        # Second run in the same month is a no-op
+        assert pay.run_job(s, "savings_interest")["status"] == "idle"
+        assert s.get(pay.SavingsAccount, ids[0]).balance_cents == 10_100
+
+
+def test_interrupted_run_resumes_from_cursor(monkeypatch):
+    monkeypatch.setattr(pay, "SAVINGS_INTEREST_BPS", 1_200)
+    monkeypatch.setattr(pay, "JOB_BATCH", 2)
+    eng = _engine()
+    with Session(eng) as s:
+        _savings(s, 5, 10_000)
+
+    real = pay._job_checkpoint  # type: ignore[attr-defined]
+    calls = {"n": 0}
+
+    def _crash_after_first(s, name, owner, cursor, n):
+        real(s, name, owner, cursor, n)
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise RuntimeError("worker died")
+
+    monkeypatch.setattr(pay, "_job_checkpoint", _crash_after_first)
+    with Session(eng) as s:
+        out = pay.run_job(s, "savings_interest")
+        assert out["status"] == "error"
+        assert s.get(pay.ScheduledJob, "savings_interest").cursor == "sa-001"
+
+    monkeypatch.setattr(pay, "_job_checkpoint", real)
+    with Session(eng) as s:
+        out = pay.run_job(s, "savings_interest")
+        assert (out["status"], out["rows"]) == ("ok", 3)
+        # Every account got exactly one month of interest
+        assert {a.balance_cents for a in s.execute(select(pay.SavingsAccount)).scalars()} == {10_100}
+
+
+def test_scheduled_bills_settle_when_due():
+    eng = _engine()
+    with Session(eng) as s:
+        payer = _create_wallet(s, "+491700011100", 5_000)
+        biller = _create_wallet(s, "+491700011101", 0)
+    past = datetime.now(timezone.utc) - timedelta(minutes=1)
+    future = datetime.now(timezone.utc) + timedelta(days=1)
+    with Session(eng) as s:
+        due = pay.bills_schedule(pay.BillScheduleReq(from_wallet_id=payer, to_wallet_id=biller, biller_code="ELEC", amount_cents=3_000, scheduled_for=past), s=s)
+        broke = pay.bills_schedule(pay.BillScheduleReq(from_wallet_id=payer, to_wallet_id=biller, biller_code="GAS", amount_cents=3_000, scheduled_for=past + timedelta(seconds=1)), s=s)
+        later = pay.bills_schedule(pay.BillScheduleReq(from_wallet_id=payer, to_wallet_id=biller, biller_code="WATER", amount_cents=100, scheduled_for=future), s=s)
+
+    with Session(eng) as s:
+        out = pay.run_job(s, "bill_settlement")
+        assert (out["status"], out["rows"]) == ("ok", 2)
+
+    with Session(eng) as s:
+        assert s.get(pay.BillPayment, due.id).status == "posted"
+        failed = s.get(pay.BillPayment, broke.id)
+        assert (failed.status, failed.error) == ("failed", "Insufficient funds")
+        assert s.get(pay.BillPayment, later.id).status == "scheduled"
+        assert s.get(pay.Wallet, payer).balance_cents == 2_000
+        assert s.get(pay.Wallet, biller).balance_cents == 3_000
+        assert s.get(pay.Txn, s.get(pay.BillPayment, due.id).txn_id).kind == "bill"
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _wallet(s: Session, phone: str, balance: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance, currency=pay.DEFAULT_CURRENCY)
+    s.add(u); s.add(w); s.commit()
+    return w.id
+
+
+def _entry(s: Session, wallet_id: str, amount: int, age_secs: int) -> None:
+    s.add(pay.LedgerEntry(
+        id=str(uuid.uuid4()), wallet_id=wallet_id, amount_cents=amount, txn_id=None, description="t",
+        created_at=datetime.now(timezone.utc) - timedelta(seconds=age_secs),
+    ))
+    s.commit()
+
+
+def _by_wallet(rows):
+    return {r["wallet_id"]: r for r in rows}
+
+
+def test_reconcile_combines_checkpoints_with_tail(monkeypatch):
+    monkeypatch.setattr(pay, "LEDGER_CHECKPOINT_LAG_SECS", 60)
+    eng = _engine()
+    with Session(eng) as s:
+        a = _wallet(s, "+491700009000", 700)
+        b = _wallet(s, "+491700009001", 50)
+        c = _wallet(s, "+491700009002", 0)
+        _entry(s, a, 500, 3600)
+        _entry(s, a, 200, 10)   # still inside the lag window -> tail
+        _entry(s, b, 100, 3600)
+
+        # No checkpoint yet: one grouped pass over the whole ledger
+        before = _by_wallet(pay.admin_ledger_reconcile_all(s=s, admin_ok=True))
+        assert before[a]["delta_cents"] == 0
+        assert before[b]["delta_cents"] == 50
+        assert before[c]["ledger_sum_cents"] == 0
+
+        res = pay.fold_ledger_checkpoints(s)
+        assert res["advanced"] and res["wallets"] == 2
+        assert s.get(pay.LedgerCheckpoint, a).ledger_sum_cents == 500
+
+        after = _by_wallet(pay.admin_ledger_reconcile_all(s=s, admin_ok=True))
+        assert {k: v["ledger_sum_cents"] for k, v in after.items()} == {k: v["ledger_sum_cents"] for k, v in before.items()}
+        assert [r["wallet_id"] for r in pay.admin_ledger_reconcile_all(only_nonzero=True, s=s, admin_ok=True)] == [b]
+        assert pay.admin_ledger_reconcile(a, s=s, admin_ok=True)["ledger_sum_cents"] == 700
+
+        # Later runs only fold what arrived after the watermark
+        monkeypatch.setattr(pay, "LEDGER_CHECKPOINT_LAG_SECS", 0)
+        _entry(s, b, -40, 1)
+        res2 = pay.fold_ledger_checkpoints(s)
+        assert res2["wallets"] == 2  # a's tail entry and b's new entry
+        assert s.get(pay.LedgerCheckpoint, a).ledger_sum_cents == 700
+        assert s.get(pay.LedgerCheckpoint, b).entry_count == 2
+        assert pay.admin_ledger_reconcile(b, s=s, admin_ok=True)["ledger_sum_cents"] == 60
+
+        full = pay.fold_ledger_checkpoints(s, full=True)
+        assert full["wallets"] == 2
+        assert s.get(pay.LedgerCheckpoint, b).ledger_sum_cents == 60
+
+
+def test_seed_uses_grouped_balances():
+    eng = _engine()
+    with Session(eng) as s:
+        a = _wallet(s, "+491700009100", 300)
+        b = _wallet(s, "+491700009101", 300)
+        _entry(s, b, 300, 5)
+        plan = pay.admin_ledger_seed(dry_run=True, s=s, admin_ok=True)
+        assert [x["wallet_id"] for x in plan["will_seed"]] == [a]
+        assert pay.admin_ledger_seed(dry_run=False, s=s, admin_ok=True)["seeded"] == 1
+        assert pay.admin_ledger_reconcile_all(only_nonzero=True, s=s, admin_ok=True) == []
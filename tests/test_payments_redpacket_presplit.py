@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+@pytest.mark.parametrize("mode", ["fixed", "random"])
+def test_split_covers_amount_with_positive_shares(mode):
+    shares = pay._redpacket_split(1_003, 7, mode)  # type: ignore[attr-defined]
+    assert len(shares) == 7
+    assert sum(shares) == 1_003
+    assert min(shares) >= 1
+
+
+def test_presplit_claims_take_shares_and_exhaust_packet():
+    eng = _engine()
+    with Session(eng) as s:
+        creator = _create_wallet(s, "+491700008000", 10_000)
+        claimers = [_create_wallet(s, f"+49170000810{i}", 0) for i in range(4)]
+
+    with Session(eng) as s:
+        rp = pay.redpacket_issue(pay.RedPacketIssueReq(creator_wallet_id=creator, amount_cents=900, count=3, presplit=True), s=s)
+    with Session(eng) as s:
+        assert len(s.execute(select(pay.RedPacketShare).where(pay.RedPacketShare.redpacket_id == rp.id)).scalars().all()) == 3
+        # The creator's outflow is counted once, at issue
+        assert pay._daily_spent_cents(s, [creator])[creator] == 900  # type: ignore[attr-defined]
+
+    outs = []
+    for w in claimers[:3]:
+        with Session(eng) as s:
+            outs.append(pay.redpacket_claim(pay.RedPacketClaimReq(redpacket_id=rp.id, wallet_id=w), s=s))
+    assert sorted(o.claim_index for o in outs) == [1, 2, 3]
+    assert sum(o.amount_cents for o in outs) == 900
+    assert outs[-1].claimed_count == 3 and outs[-1].status == "exhausted"
+
+    # Re-claiming is idempotent, an extra claimer finds the packet exhausted
+    with Session(eng) as s:
+        again = pay.redpacket_claim(pay.RedPacketClaimReq(redpacket_id=rp.id, wallet_id=claimers[0]), s=s)
+        assert (again.amount_cents, again.claim_index) == (outs[0].amount_cents, outs[0].claim_index)
+    with Session(eng) as s:
+        with pytest.raises(HTTPException) as exc:
+            pay.redpacket_claim(pay.RedPacketClaimReq(redpacket_id=rp.id, wallet_id=claimers[3]), s=s)
+        assert exc.value.status_code == 400
+
+    with Session(eng) as s:
+        for w, o in zip(claimers, outs):
+            assert s.get(pay.Wallet, w).balance_cents == o.amount_cents
+        assert pay._daily_spent_cents(s, [creator])[creator] == 900  # type: ignore[attr-defined]
+        st = pay.redpacket_status(rp.id, s=s)
+        assert (st.claimed_count, st.remaining_amount_cents, st.status) == (3, 0, "exhausted")
+
+
+def test_presplit_requires_a_cent_per_share():
+    eng = _engine()
+    with Session(eng) as s:
+        creator = _create_wallet(s, "+491700008200", 10_000)
+        with pytest.raises(HTTPException) as exc:
+            pay.redpacket_issue(pay.RedPacketIssueReq(creator_wallet_id=creator, amount_cents=2, count=3, presplit=True), s=s)
+        assert exc.value.status_code == 400
+
+
+def test_locked_shares_do_not_exhaust_the_packet(monkeypatch):
+    eng = _engine()
+    with Session(eng) as s:
+        creator = _create_wallet(s, "+491700008300", 10_000)
+        claimer = _create_wallet(s, "+491700008301", 0)
+        rp = pay.redpacket_issue(pay.RedPacketIssueReq(creator_wallet_id=creator, amount_cents=300, count=3, presplit=True), s=s)
+
+    # Postgres path where every free share is locked by an in-flight claim
+    real_execute = Session.execute
+
+    def _all_locked(self, stmt, *a, **kw):
+        if getattr(stmt, "_for_update_arg", None) is not None and "red_packet_shares" in str(stmt):
+            return real_execute(self, select(pay.RedPacketShare).where(pay.RedPacketShare.id.is_(None)))
+        return real_execute(self, stmt, *a, **kw)
+
+    monkeypatch.setattr(Session, "execute", _all_locked)
+    monkeypatch.setattr(eng.dialect, "name", "postgresql")
+    with Session(eng) as s:
+        with pytest.raises(HTTPException) as exc:
+            pay.redpacket_claim(pay.RedPacketClaimReq(redpacket_id=rp.id, wallet_id=claimer), s=s)
+        assert exc.value.status_code == 409
+    monkeypatch.undo()
+
+    with Session(eng) as s:
+        assert s.get(pay.RedPacket, rp.id).status == "active"
+        out = pay.redpacket_claim(pay.RedPacketClaimReq(redpacket_id=rp.id, wallet_id=claimer), s=s)
+        assert out.amount_cents > 0
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def test_prefix_trie_matches_v4_and_v6_prefixes():
+    trie = pay._IpPrefixTrie()  # type: ignore[attr-defined]
+    for net in ("10.1.2.0/24", "192.168.0.0/16", "203.0.113.7", "2001:db8::/32"):
+        trie.insert(pay._parse_ip_network(net))  # type: ignore[attr-defined]
+    assert trie.match("10.1.2.99") == "10.1.2.0/24"
+    assert trie.match("10.1.3.1") is None
+    assert trie.match("192.168.250.1") == "192.168.0.0/16"
+    assert trie.match("203.0.113.7") == "203.0.113.7/32"
+    assert trie.match("203.0.113.8") is None
+    assert trie.match("2001:db8:1::5") == "2001:db8::/32"
+    assert trie.match("2001:db9::1") is None
+    assert trie.match("not-an-ip") is None
+
+
+def test_denylist_recompiles_after_admin_changes(monkeypatch):
+    eng = _engine()
+    monkeypatch.setattr(pay, "RISK_DENY_REFRESH_SECS", 3600.0)
+    pay._invalidate_risk_denylist()  # type: ignore[attr-defined]
+    with Session(eng) as s:
+        assert not pay._risk_denylist(s).ip_blocked("10.9.8.7")  # type: ignore[attr-defined]
+        pay.admin_risk_deny_add(pay.RiskDenyReq(kind="ip", value="10.9.0.0/16"), s=s, admin_ok=True)
+        pay.admin_risk_deny_add(pay.RiskDenyReq(kind="device", value="dev-bad"), s=s, admin_ok=True)
+        deny = pay._risk_denylist(s)  # type: ignore[attr-defined]
+        assert deny.ip_blocked("10.9.8.7")
+        assert "dev-bad" in deny.devices
+        assert deny.generation == 2
+
+    # Another worker bumped the generation: the cached copy is refreshed lazily
+    with Session(eng) as s:
+        s.add(pay.RiskDeny(id="x", kind="ip", value="198.51.100.0/24"))
+        pay._bump_generation(s, pay._RISK_DENY_GENERATION)  # type: ignore[attr-defined]
+        s.commit()
+        monkeypatch.setattr(pay, "RISK_DENY_REFRESH_SECS", 0.0)
+        assert pay._risk_denylist(s).ip_blocked("198.51.100.20")  # type: ignore[attr-defined]
+
+        pay.admin_risk_deny_remove(pay.RiskDenyReq(kind="ip", value="10.9.0.0/16"), s=s, admin_ok=True)
+        assert not pay._risk_denylist(s).ip_blocked("10.9.8.7")  # type: ignore[attr-defined]
+    pay._invalidate_risk_denylist()  # type: ignore[attr-defined]
+
+
+def test_generation_bump_creates_the_row_atomically(monkeypatch):
+    eng = _engine()
+    with Session(eng) as s:
+        pay._bump_generation(s, "race")  # type: ignore[attr-defined]
+        s.commit()
+
+    # A second writer that saw no row when it started must still count
+    real_get = Session.get
+
+    def _stale_get(self, entity, ident, **kw):
+        if entity is pay.CacheGeneration:
+            return None
+        return real_get(self, entity, ident, **kw)
+
+    monkeypatch.setattr(Session, "get", _stale_get)
+    with Session(eng) as s:
+        pay._bump_generation(s, "race")  # type: ignore[attr-defined]
+        s.commit()
+        assert pay._read_generation(s, "race") == 2  # type: ignore[attr-defined]
+
+
+def test_failed_generation_read_keeps_the_transaction():
+    eng = _engine()
+    with eng.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE cache_generations")
+    with Session(eng) as s:
+        s.add(pay.RiskDeny(id="d1", kind="device", value="dev-x"))
+        s.flush()
+        assert pay._read_generation(s, pay._RISK_DENY_GENERATION) is None  # type: ignore[attr-defined]
+        s.commit()
+    with Session(eng) as s:
+        assert s.execute(select(pay.RiskDeny.value)).scalars().all() == ["dev-x"]
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from sqlalchemy import create_engine
+
+import apps.payments.app.main as pay  # type: ignore[import]
+from shamell_shared import schema_version
+
+
+def test_startup_skips_ddl_once_schema_is_stamped(monkeypatch, tmp_path):
+    eng = create_engine(f"sqlite+pysqlite:///{tmp_path / 'pay.db'}", connect_args={"check_same_thread": False})
+    monkeypatch.setattr(pay, "engine", eng)
+    monkeypatch.setattr(pay, "AUTO_CREATE", True)
+    started = []
+    monkeypatch.setattr(pay, "_start_expiry_sweeper", lambda: started.append("sweeper"))
+    monkeypatch.setattr(pay, "_start_periodic", lambda name, *a: started.append(name))
+
+    pay.on_startup()
+    assert schema_version(eng, "payments") == pay.PAYMENTS_SCHEMA_VERSION
+
+    def _no_ddl():
+        raise AssertionError("DDL on a current schema")
+
+    monkeypatch.setattr(pay, "_prepare_schema", _no_ddl)
+    started.clear()
+    pay.on_startup()
+    # Background workers still start on every boot
+    assert "sweeper" in started and "job-runner" in started
+
+
+def test_failed_backfill_is_retried_on_next_startup(monkeypatch, tmp_path):
+    eng = create_engine(f"sqlite+pysqlite:///{tmp_path / 'pay.db'}", connect_args={"check_same_thread": False})
+    monkeypatch.setattr(pay, "engine", eng)
+    monkeypatch.setattr(pay, "AUTO_CREATE", True)
+    monkeypatch.setattr(pay, "_start_expiry_sweeper", lambda: None)
+    monkeypatch.setattr(pay, "_start_periodic", lambda name, *a: None)
+    real_backfill = pay.backfill_wallet_activity
+
+    def _boom(s):
+        raise RuntimeError("backfill interrupted")
+
+    monkeypatch.setattr(pay, "backfill_wallet_activity", _boom)
+    pay.on_startup()
+    assert schema_version(eng, "payments") is None
+
+    ran = []
+    monkeypatch.setattr(pay, "backfill_wallet_activity", lambda s: ran.append(1) or real_backfill(s))
+    pay.on_startup()
+    assert ran == [1]
+    assert schema_version(eng, "payments") == pay.PAYMENTS_SCHEMA_VERSION
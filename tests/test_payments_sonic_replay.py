@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import hashlib
+import time
+import uuid
+from typing import Dict
+
+import pytest
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+class _NoDB:
+    """Stands in for a Session that must not be used."""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"unexpected DB access: {name}")
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+@pytest.fixture(autouse=True)
+def _fresh_filter(monkeypatch):
+    monkeypatch.setattr(pay, "_sonic_replay", pay._SonicReplayFilter())  # type: ignore[attr-defined]
+
+
+def _issue(eng, amt: int = 500) -> tuple[str, str]:
+    with Session(eng) as s:
+        payer = _create_wallet(s, f"+49170001{uuid.uuid4().int % 10**6:06d}", 10_000)
+        payee = _create_wallet(s, f"+49170002{uuid.uuid4().int % 10**6:06d}", 0)
+        token = pay.sonic_issue(pay.SonicIssueReq(from_wallet_id=payer, amount_cents=amt), s=s, admin_ok=True).token  # type: ignore[arg-type]
+    return token, payee
+
+
+def test_replayed_token_is_rejected_without_db():
+    eng = _engine()
+    token, payee = _issue(eng)
+    with Session(eng) as s:
+        pay.sonic_redeem(pay.SonicRedeemReq(token=token, to_wallet_id=payee), request=_DummyRequest(), s=s)
+
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc:
+            pay.sonic_redeem(pay.SonicRedeemReq(token=token, to_wallet_id=payee), request=_DummyRequest(), s=_NoDB())  # type: ignore[arg-type]
+        assert exc.value.detail == "Invalid or used token"
+    assert pay._sonic_replay.stats()["hits"] == 3  # type: ignore[attr-defined]
+
+
+def test_expired_and_forged_tokens_never_reach_db():
+    past = int(time.time()) - 5
+    expired = pay._sonic_encode({"v": 1, "from": "w", "amt": 1, "exp": past, "n": "x"})  # type: ignore[attr-defined]
+    with pytest.raises(HTTPException) as exc:
+        pay.sonic_redeem(pay.SonicRedeemReq(token=expired, to_wallet_id="w2"), request=_DummyRequest(), s=_NoDB())  # type: ignore[arg-type]
+    assert exc.value.detail == "Token expired"
+
+    raw, sig = pay._sonic_encode({"v": 1, "from": "w", "amt": 1, "exp": past + 600, "n": "x"}).split(".")  # type: ignore[attr-defined]
+    with pytest.raises(HTTPException) as exc:
+        pay.sonic_redeem(pay.SonicRedeemReq(token=raw + "." + "0" * len(sig), to_wallet_id="w2"), request=_DummyRequest(), s=_NoDB())  # type: ignore[arg-type]
+    assert exc.value.status_code == 400
+
+
+def test_token_spent_by_another_worker_is_learned_from_db():
+    eng = _engine()
+    token, payee = _issue(eng)
+    with Session(eng) as s:
+        s.execute(update(pay.SonicToken).values(status="redeemed"))
+        s.commit()
+    with Session(eng) as s:
+        with pytest.raises(HTTPException):
+            pay.sonic_redeem(pay.SonicRedeemReq(token=token, to_wallet_id=payee), request=_DummyRequest(), s=s)
+    with pytest.raises(HTTPException):
+        pay.sonic_redeem(pay.SonicRedeemReq(token=token, to_wallet_id=payee), request=_DummyRequest(), s=_NoDB())  # type: ignore[arg-type]
+
+
+def test_bloom_false_positive_falls_through_and_old_windows_expire(monkeypatch):
+    monkeypatch.setattr(pay, "SONIC_REPLAY_BLOOM_BITS", 64)
+    f = pay._SonicReplayFilter()  # type: ignore[attr-defined]
+    now = int(time.time())
+    exp = now + 30
+    spent = [hashlib.sha256(f"t{i}".encode()).hexdigest() for i in range(200)]
+    for th in spent:
+        f.add(th, exp, now)
+    # A saturated 64-bit filter matches everything, yet only exact ids are rejected
+    assert all(f.seen(th, exp) for th in spent)
+    assert f.seen(hashlib.sha256(b"fresh").hexdigest(), exp) is False
+    assert f.stats()["bloom_false_positives"] == 1
+
+    # Once the window has passed the bucket is dropped
+    f.add(hashlib.sha256(b"later").hexdigest(), now + 10 * pay.SONIC_REPLAY_WINDOW_SECS, exp + pay.SONIC_REPLAY_WINDOW_SECS)
+    assert f.stats()["windows"] == 1
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import uuid
+from typing import Dict
+
+import pytest
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+@pytest.fixture(autouse=True)
+def _fresh_registry(monkeypatch):
+    pay._invalidate_system_accounts()  # type: ignore[attr-defined]
+    monkeypatch.setattr(pay, "SYSTEM_ACCOUNTS_REFRESH_SECS", 3600.0)
+    yield
+    pay._invalidate_system_accounts()  # type: ignore[attr-defined]
+
+
+def test_registry_resolves_once_and_reloads_on_admin_change(monkeypatch):
+    eng = _engine()
+    with Session(eng) as s:
+        fee = _create_wallet(s, pay.FEE_WALLET_PHONE, 0)
+        other = _create_wallet(s, "+491700010001", 0)
+        assert pay.seed_system_accounts(s) == {"fee": fee}
+        assert pay._fee_wallet_id(s) == fee  # type: ignore[attr-defined]
+
+    # Resolved ids are served from memory: no further queries
+    def _no_load(s):
+        raise AssertionError("registry reloaded")
+
+    real_load = pay._load_system_accounts  # type: ignore[attr-defined]
+    monkeypatch.setattr(pay, "_load_system_accounts", _no_load)
+    with Session(eng) as s:
+        ids = pay._system_wallets(s)  # type: ignore[attr-defined]
+        assert ids["fee"] == fee
+        with pytest.raises(TypeError):
+            ids["fee"] = other  # type: ignore[index]
+
+    monkeypatch.setattr(pay, "_load_system_accounts", real_load)
+    with Session(eng) as s:
+        pay.admin_system_accounts_set(pay.SystemAccountSetReq(role="fee", wallet_id=other), s=s, admin_ok=True)
+        assert pay.admin_system_accounts(s=s, admin_ok=True)["accounts"] == {"fee": other}
+        # Seeding never overrides an admin choice
+        assert pay.seed_system_accounts(s) == {}
+        with pytest.raises(HTTPException) as exc:
+            pay.admin_system_accounts_set(pay.SystemAccountSetReq(role="bogus", wallet_id=other), s=s, admin_ok=True)
+        assert exc.value.status_code == 400
+
+
+def test_batched_fee_accrual_is_flushed_into_fee_wallet(monkeypatch):
+    monkeypatch.setattr(pay, "FEE_ACCRUAL_BATCHED", True)
+    eng = _engine()
+    with Session(eng) as s:
+        fee = _create_wallet(s, pay.FEE_WALLET_PHONE, 0)
+        a = _create_wallet(s, "+491700010101", 100_000)
+        b = _create_wallet(s, "+491700010102", 0)
+        pay.seed_system_accounts(s)
+
+    for amount in (10_000, 20_000, 30_000):
+        with Session(eng) as s:
+            pay.transfer(pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=amount), request=_DummyRequest(), s=s)
+
+    fees = sum(pay._fee_for(x) for x in (10_000, 20_000, 30_000))  # type: ignore[attr-defined]
+    assert fees > 0
+    with Session(eng) as s:
+        # Ledger is written per transfer, the balance waits for the flush
+        assert s.get(pay.Wallet, fee).balance_cents == 0
+        ledger = s.scalar(select(func.sum(pay.LedgerEntry.amount_cents)).where(pay.LedgerEntry.wallet_id == fee))
+        assert ledger == fees
+        assert pay.flush_fee_accruals(s, batch=2) == {"accruals": 3, "cents": fees}
+        assert s.get(pay.Wallet, fee).balance_cents == fees
+        assert s.scalar(select(func.count()).select_from(pay.FeeAccrual)) == 0
+
+
+def test_direct_fee_credit_by_default():
+    eng = _engine()
+    with Session(eng) as s:
+        fee = _create_wallet(s, pay.FEE_WALLET_PHONE, 0)
+        a = _create_wallet(s, "+491700010201", 100_000)
+        b = _create_wallet(s, "+491700010202", 0)
+        pay.transfer(pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=10_000), request=_DummyRequest(), s=s)
+        assert s.get(pay.Wallet, fee).balance_cents == pay._fee_for(10_000)  # type: ignore[attr-defined]
+        assert s.scalar(select(func.count()).select_from(pay.FeeAccrual)) == 0
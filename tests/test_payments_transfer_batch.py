@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+def _net(amount: int) -> int:
+    return amount - pay._fee_for(amount)  # type: ignore[attr-defined]
+
+
+def test_lock_wallets_returns_rows_in_canonical_order():
+    eng = _engine()
+    with Session(eng) as s:
+        ids = [_create_wallet(s, f"+49170000{i:04d}", 0) for i in range(3)]
+        locked = pay._lock_wallets(s, [ids[2], None, ids[0], ids[2], ids[1]])  # type: ignore[attr-defined]
+        assert list(locked.keys()) == sorted(ids)
+
+
+def test_transfer_batch_per_item_results_and_single_commit():
+    eng = _engine()
+    with Session(eng) as s:
+        payer = _create_wallet(s, "+491700005000", 10_000)
+        a = _create_wallet(s, "+491700005001", 0)
+        b = _create_wallet(s, "+491700005002", 0)
+
+    with Session(eng) as s:
+        req = pay.TransferBatchReq(items=[
+            pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=a, amount_cents=4_000, idempotency_key="pay-a"),
+            pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=b, amount_cents=4_000, idempotency_key="pay-b"),
+            # Exceeds the remaining balance once the first two are booked
+            pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=a, amount_cents=4_000),
+            pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id="missing", amount_cents=100),
+        ])
+        resp = pay.transfer_batch(req, s=s)
+        assert [r.status for r in resp.items] == ["ok", "ok", "error", "error"]
+        assert resp.ok == 2 and resp.failed == 2 and resp.replayed == 0
+        assert resp.items[2].error == "Insufficient funds"
+        assert resp.items[3].error == "Wallet not found"
+
+    with Session(eng) as s:
+        assert s.get(pay.Wallet, payer).balance_cents == 2_000
+        assert s.get(pay.Wallet, a).balance_cents == _net(4_000)
+        assert s.get(pay.Wallet, b).balance_cents == _net(4_000)
+        assert len(s.execute(select(pay.Txn)).scalars().all()) == 2
+
+    # Retrying the same batch only replays the keyed items
+    with Session(eng) as s:
+        retry = pay.TransferBatchReq(items=[
+            pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=a, amount_cents=4_000, idempotency_key="pay-a"),
+            pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=b, amount_cents=4_000, idempotency_key="pay-b"),
+        ])
+        resp2 = pay.transfer_batch(retry, s=s)
+        assert [r.status for r in resp2.items] == ["replayed", "replayed"]
+        assert resp2.items[0].txn_id == resp.items[0].txn_id
+
+    with Session(eng) as s:
+        assert s.get(pay.Wallet, payer).balance_cents == 2_000
+        assert len(s.execute(select(pay.Txn)).scalars().all()) == 2
+
+
+def test_transfer_batch_atomic_rolls_back_on_any_failure():
+    eng = _engine()
+    with Session(eng) as s:
+        payer = _create_wallet(s, "+491700006000", 5_000)
+        a = _create_wallet(s, "+491700006001", 0)
+
+    with Session(eng) as s:
+        req = pay.TransferBatchReq(
+            atomic=True,
+            items=[
+                pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=a, amount_cents=1_000),
+                pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=a, amount_cents=9_000),
+            ],
+        )
+        with pytest.raises(HTTPException) as exc:
+            pay.transfer_batch(req, s=s)
+        assert exc.value.status_code == 400
+
+    with Session(eng) as s:
+        assert s.get(pay.Wallet, payer).balance_cents == 5_000
+        assert s.get(pay.Wallet, a).balance_cents == 0
+        assert s.execute(select(pay.Txn)).scalars().all() == []
+
+
+def test_transfer_batch_writes_structured_merchant_and_ref():
+    eng = _engine()
+    with Session(eng) as s:
+        payer = _create_wallet(s, "+491700006100", 5_000)
+        shop = _create_wallet(s, "+491700006101", 0)
+
+    with Session(eng) as s:
+        req = pay.TransferBatchReq(
+            merchant=" Shop-1 ",
+            items=[pay.TransferBatchItem(from_wallet_id=payer, to_wallet_id=shop, amount_cents=1_000, reference="INV-7")],
+        )
+        txn_id = pay.transfer_batch(req, s=s).items[0].txn_id
+
+    with Session(eng) as s:
+        t = s.get(pay.Txn, txn_id)
+        assert (t.merchant_id, t.ref) == ("shop-1", "INV-7")
+        legs = s.execute(select(pay.LedgerEntry).where(pay.LedgerEntry.txn_id == txn_id, pay.LedgerEntry.wallet_id.in_([payer, shop]))).scalars().all()
+        assert {(le.merchant_id, le.ref) for le in legs} == {("shop-1", "INV-7")}
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import uuid
+from typing import Dict
+
+import pytest
+from fastapi import HTTPException, Request
+from sqlalchemy import create_engine, delete, event, select
+from sqlalchemy.orm import Session
+
+import apps.payments.app.main as pay  # type: ignore[import]
+
+
+class _DummyRequest(Request):
+    def __init__(self, headers: Dict[str, str] | None = None):
+        super().__init__({"type": "http", "headers": []})
+        self._test_headers = dict(headers or {})
+
+    @property  # type: ignore[override]
+    def headers(self) -> Dict[str, str]:
+        return self._test_headers
+
+
+def _engine():
+    engine = create_engine(
+        "sqlite+pysqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        pool_pre_ping=True,
+    )
+    pay.Base.metadata.create_all(engine)
+    return engine
+
+
+def _create_wallet(session: Session, phone: str, balance_cents: int) -> str:
+    u = pay.User(id=str(uuid.uuid4()), phone=phone)
+    w = pay.Wallet(id=str(uuid.uuid4()), user_id=u.id, balance_cents=balance_cents, currency=pay.DEFAULT_CURRENCY)
+    session.add(u); session.add(w); session.commit(); session.refresh(w)
+    return w.id
+
+
+def _counters(s: Session) -> set:
+    rows = s.execute(select(pay.VelocityCounter)).scalars().all()
+    return {(r.scope, r.subject, r.bucket_secs, r.bucket_start, r.txn_count, r.amount_cents) for r in rows}
+
+
+def test_transfers_maintain_counters_and_daily_limit_reads_them(monkeypatch):
+    monkeypatch.setitem(pay.KYC_LIMITS, 0, {"tx_max": 10_000, "daily_max": 4_000})
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700007000", 1_000_000)
+        b = _create_wallet(s, "+491700007001", 0)
+
+    for _ in range(3):
+        with Session(eng) as s:
+            pay.transfer(pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=1_000), request=_DummyRequest(), s=s)
+
+    with Session(eng) as s:
+        assert pay._daily_spent_cents(s, [a, b]) == {a: 3_000, b: 0}  # type: ignore[attr-defined]
+        assert pay._velocity_window(s, "wallet_in", [b], 60)[b] == (3, 3_000)  # type: ignore[attr-defined]
+        # The daily limit is now enforced from the counter row alone
+        s.execute(delete(pay.Txn))
+        s.commit()
+        with pytest.raises(HTTPException) as exc:
+            pay.transfer(pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=2_000), request=_DummyRequest(), s=s)
+        assert "daily limit" in str(exc.value.detail)
+
+
+def test_savings_moves_do_not_count():
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700007100", 10_000)
+        pay._record_txn(s, pay.Txn(id=str(uuid.uuid4()), from_wallet_id=a, to_wallet_id=a, amount_cents=500, kind="savings_deposit", fee_cents=0))  # type: ignore[attr-defined]
+        s.commit()
+        assert _counters(s) == set()
+
+
+def test_alias_velocity_uses_counters(monkeypatch):
+    monkeypatch.setattr(pay, "ALIAS_VELOCITY_MAX_TX", 2)
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700007200", 100_000)
+        b = _create_wallet(s, "+491700007201", 0)
+        s.add(pay.Alias(id=str(uuid.uuid4()), handle="shop", display="shop", user_id="u", wallet_id=b, status="active"))
+        s.commit()
+
+    hdrs = {"X-Device-ID": "dev-1", "User-Agent": "ShamellApp/1.0"}
+    for _ in range(2):
+        with Session(eng) as s:
+            pay.transfer(pay.TransferReq(from_wallet_id=a, to_alias="@shop", amount_cents=100), request=_DummyRequest(hdrs), s=s)
+    with Session(eng) as s:
+        with pytest.raises(HTTPException) as exc:
+            pay.transfer(pay.TransferReq(from_wallet_id=a, to_alias="@shop", amount_cents=100), request=_DummyRequest(hdrs), s=s)
+        assert exc.value.status_code == 429
+        assert pay._velocity_window(s, "device_wallet", [f"{b}|dev-1"], 60)[f"{b}|dev-1"][0] == 2  # type: ignore[attr-defined]
+
+
+def test_rebuild_reproduces_live_counters():
+    eng = _engine()
+    with Session(eng) as s:
+        a = _create_wallet(s, "+491700007300", 50_000)
+        b = _create_wallet(s, "+491700007301", 0)
+    for amount in (1_000, 2_500):
+        with Session(eng) as s:
+            pay.transfer(pay.TransferReq(from_wallet_id=a, to_wallet_id=b, amount_cents=amount), request=_DummyRequest(), s=s)
+
+    with Session(eng) as s:
+        live = _counters(s)
+        s.execute(delete(pay.VelocityCounter))
+        s.commit()
+        stats = pay.rebuild_velocity_counters(s, since_days=1)
+        assert stats["txns"] == 2
+        assert _counters(s) == live
+
+
+def test_rebuild_takes_the_write_lock_before_scanning():
+    eng = _engine()
+    stmts: list[str] = []
+    event.listen(eng, "before_cursor_execute", lambda conn, cur, stmt, *a: stmts.append(stmt.lstrip().upper()))
+    with Session(eng) as s:
+        pay.rebuild_velocity_counters(s, since_days=1)
+    first_delete = next(i for i, q in enumerate(stmts) if q.startswith("DELETE FROM VELOCITY_COUNTERS"))
+    first_scan = next(i for i, q in enumerate(stmts) if q.startswith("SELECT") and "FROM TXNS" in q)
+    # A transfer committing after the scan started would otherwise be lost
+    assert first_delete < first_scan
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from sqlalchemy import text
+
+from shamell_shared import create_service_engine, pool_stats
+from shamell_shared.db import _TimedQueuePool, _pool_options  # type: ignore[attr-defined]
+
+
+def test_pool_options_from_env_with_per_engine_override(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_PRE_PING_INTERVAL_SECS", "30")
+    monkeypatch.setenv("CHATX_DB_POOL_SIZE", "7")
+    opts = _pool_options("postgresql+psycopg://u@h/db", "chatx")
+    assert opts["pool_size"] == 7
+    assert opts["max_overflow"] == 10
+    # Interval pinging replaces the per-checkout pre-ping
+    assert opts["pool_pre_ping"] is False
+    assert _pool_options("postgresql+psycopg://u@h/db", "other")["pool_size"] == 20
+
+
+def test_service_engine_reports_pool_stats(tmp_path):
+    url = f"sqlite+pysqlite:///{tmp_path / 'pool.db'}"
+    # SQLite keeps its default pool unless one is passed explicitly
+    eng = create_service_engine(url, name="pooltest", poolclass=_TimedQueuePool, pool_size=2, max_overflow=1)
+    with eng.connect() as c1, eng.connect() as c2:
+        c1.execute(text("SELECT 1"))
+        c2.execute(text("SELECT 1"))
+        live = pool_stats("pooltest")["pooltest"]
+        assert live["checkedout"] == 2
+    stats = pool_stats("pooltest")["pooltest"]
+    assert stats["checkedout"] == 0
+    assert stats["checkouts"] == 2
+    assert sum(stats["wait_ms_hist"].values()) == 2
+    assert stats["connects"] == 2
+
+
+def test_sqlite_engine_is_thread_tolerant(tmp_path):
+    eng = create_service_engine(f"sqlite+pysqlite:///{tmp_path / 'x.db'}", name="pooltest_sqlite")
+    with eng.connect() as c:
+        assert c.execute(text("SELECT 1")).scalar() == 1
+    assert "pooltest_sqlite" in pool_stats()
+
+
+def test_pool_stats_are_served_behind_the_internal_secret(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import apps.chat.app.main as chat  # type: ignore[import]
+
+    monkeypatch.setattr(chat, "CHAT_REQUIRE_INTERNAL_SECRET", True, raising=False)
+    monkeypatch.setattr(chat, "INTERNAL_API_SECRET", "test-internal-secret", raising=False)
+    client = TestClient(chat.app)
+
+    health = client.get("/health")
+    assert health.status_code == 200
+    assert set(health.json()) == {"status", "env", "service", "version"}
+    assert client.get("/internal/db_pools").status_code == 401
+    ok = client.get("/internal/db_pools", headers={"X-Internal-Secret": "test-internal-secret"})
+    assert ok.status_code == 200
+    assert "chat" in ok.json()["db_pools"]
@@ -0,0 +1,45 @@
+from __future__ import annotations
+
+from sqlalchemy import create_engine, inspect, text
+
+from shamell_shared import add_missing_columns, schema_is_current, schema_version, stamp_schema_version
+
+
+def _engine(tmp_path):
+    return create_engine(f"sqlite+pysqlite:///{tmp_path / 'schema.db'}")
+
+
+def test_stamp_is_monotonic_and_newer_counts_as_current(tmp_path):
+    eng = _engine(tmp_path)
+    # No table yet: not current, no error
+    assert schema_version(eng, "svc") is None
+    assert schema_is_current(eng, "svc", 1) is False
+
+    stamp_schema_version(eng, "svc", 3)
+    assert schema_version(eng, "svc") == 3
+    assert schema_is_current(eng, "svc", 3) is True
+    # Old workers of a rolling deploy see the newer schema as current
+    assert schema_is_current(eng, "svc", 2) is True
+    assert schema_is_current(eng, "svc", 4) is False
+
+    # Never moves backwards; components are independent
+    stamp_schema_version(eng, "svc", 2)
+    stamp_schema_version(eng, "other", 1)
+    assert (schema_version(eng, "svc"), schema_version(eng, "other")) == (3, 1)
+
+
+def test_add_missing_columns_only_issues_needed_ddl(tmp_path):
+    eng = _engine(tmp_path)
+    with eng.begin() as conn:
+        conn.execute(text("CREATE TABLE items (id INTEGER PRIMARY KEY, name VARCHAR(10))"))
+
+    cols = [("items", "name", "VARCHAR(10)"), ("items", "size", "INTEGER DEFAULT 0"), ("ghost", "x", "INTEGER")]
+    idx = [("items", "ix_items_size", "size, id")]
+    done = add_missing_columns(eng, cols, idx)
+    assert done == ["ALTER TABLE items ADD COLUMN size INTEGER DEFAULT 0", "CREATE INDEX ix_items_size ON items (size, id)"]
+
+    insp = inspect(eng)
+    assert {c["name"] for c in insp.get_columns("items")} == {"id", "name", "size"}
+    assert [ix["name"] for ix in insp.get_indexes("items")] == ["ix_items_size"]
+    # Second pass is a no-op
+    assert add_missing_columns(eng, cols, idx) == []